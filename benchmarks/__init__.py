@@ -0,0 +1,12 @@
+"""
+Benchmarks of the Dynamo hot paths on synthetic inventories.
+
+generator  Deterministic synthetic inventory, saved into an in-memory inventory store.
+scenarios  Inventory loading, Detox and Dealer cycles, RLFSM transfer cycle, and web module responses, with local
+           stand-ins for the history databases and the external services.
+run        Command line entry point. Results are printed and written as JSON to compare across commits:
+             python -m benchmarks.run --scale small --output result.json
+
+The inventory content is a function of the generator parameters (its store version is reported). Detox and Dealer
+iterate over sets of inventory objects, so their decision counts can differ slightly between processes.
+"""
@@ -0,0 +1,239 @@
+import random
+
+from dynamo.core.inventory import ObjectRepository
+from dynamo.core.components.impl.memorystore import MemoryInventoryStore
+from dynamo.dataformat import Configuration, Group, Site, SitePartition, Partition, Dataset, Block, File, DatasetReplica, BlockReplica
+from dynamo.policy.condition import Condition
+from dynamo.policy.variables import replica_variables
+
+# Partition definitions in the format of the partition definition file
+PARTITIONS = [
+    ('Physics', 'blockreplica.owner in [AnalysisOps DataOps Junk]'),
+    ('Other', 'blockreplica.owner == Other')
+]
+
+# (name, olevel, weight in the ownership of disk replicas)
+GROUPS = [
+    ('AnalysisOps', Group.OL_BLOCK, 0.5),
+    ('DataOps', Group.OL_DATASET, 0.25),
+    ('Junk', Group.OL_BLOCK, 0.1),
+    ('Other', Group.OL_BLOCK, 0.15)
+]
+
+# Generator parameters of the predefined scales
+SCALES = {
+    'small': {'num_sites': 10, 'num_datasets': 200, 'blocks_per_dataset': (1, 8), 'files_per_block': (2, 20)},
+    'medium': {'num_sites': 30, 'num_datasets': 2000, 'blocks_per_dataset': (1, 10), 'files_per_block': (5, 50)},
+    'large': {'num_sites': 60, 'num_datasets': 10000, 'blocks_per_dataset': (1, 20), 'files_per_block': (10, 100)}
+}
+
+# Fixed reference time (UNIX) - all time stamps are offsets from it
+T0 = 1500000000
+
+def generate(seed = 1, num_sites = 10, num_datasets = 200, blocks_per_dataset = (1, 8), files_per_block = (2, 20),
+        replica_weights = (0.4, 0.3, 0.2, 0.1), partial_fraction = 0.2, tape_fraction = 0.5):
+    """
+    Build a synthetic inventory. The content depends only on the arguments.
+     . Sites: one tape site (T1_US_FNAL_MSS), one T1 disk site, and T2 disk sites, all ready, with gfal2 and xrootd
+       LFN-to-PFN mappings.
+     . Groups AnalysisOps, DataOps, Junk, and Other; partitions Physics (first three groups) and Other.
+     . Datasets with a uniform random number of blocks and files per block and files of 1-4 GB. Some datasets are
+       in production (open, with an open last block).
+     . Disk replicas at random sites, owned by one group each. Some DataOps replicas are growing. A fraction of
+       the replicas is partial: blocks are missing, or the last block replica has half of the files.
+     . Custodial tape replicas of a fraction of the datasets.
+     . Physics quotas that put the disk sites between 50% and 100% occupancy.
+    @param seed                Random seed.
+    @param num_sites           Number of sites including the tape site and the T1 disk site (at least 3).
+    @param num_datasets        Number of datasets.
+    @param blocks_per_dataset  (min, max) number of blocks in a dataset.
+    @param files_per_block     (min, max) number of files in a block.
+    @param replica_weights     Relative weights of 1, 2, ... disk replicas per dataset.
+    @param partial_fraction    Probability for a disk replica to be partial.
+    @param tape_fraction       Probability for a dataset to have a tape replica.
+
+    @return ObjectRepository with object ids set.
+    """
+
+    if num_sites < 3:
+        raise ValueError('At least three sites are needed (tape, T1 disk, and T2).')
+
+    rng = random.Random(seed)
+
+    inventory = ObjectRepository()
+
+    for ipart, (name, condition_text) in enumerate(PARTITIONS):
+        inventory.partitions.add(Partition(name, Condition(condition_text, replica_variables), pid = ipart + 1))
+
+    group_weights = []
+    for igroup, (name, olevel, weight) in enumerate(GROUPS):
+        group = Group(name, olevel = olevel, gid = igroup + 1)
+        inventory.groups.add(group)
+        group_weights.append((group, weight))
+
+    dataops = inventory.groups['DataOps']
+
+    tape_site = None
+    disk_sites = []
+    for isite in xrange(num_sites):
+        if isite == 0:
+            name = 'T1_US_FNAL_MSS'
+            storage_type = Site.TYPE_MSS
+        elif isite == 1:
+            name = 'T1_US_FNAL_Disk'
+            storage_type = Site.TYPE_DISK
+        else:
+            name = 'T2_XX_Site%03d' % isite
+            storage_type = Site.TYPE_DISK
+
+        host = 'se%d.example.org' % isite
+        mapping = {
+            'gfal2': [[('/+store/(.*)', 'gsiftp://%s/data/store/{0}' % host)]],
+            'xrootd': [[('/+store/(.*)', 'root://xrootd.%s//store/{0}' % host)]]
+        }
+
+        site = Site(name, host = host, storage_type = storage_type, backend = host, status = Site.STAT_READY, filename_mapping = mapping, sid = isite + 1)
+        inventory.sites.add(site)
+
+        for partition in inventory.partitions.itervalues():
+            site.partitions[partition] = SitePartition(site, partition)
+
+        if storage_type == Site.TYPE_MSS:
+            tape_site = site
+        else:
+            disk_sites.append(site)
+
+    tiers = ['AOD', 'MINIAOD', 'RAW']
+
+    block_id = 0
+    file_id = 0
+
+    for idataset in xrange(num_datasets):
+        tier = rng.choice(tiers)
+        in_production = rng.random() < 0.05
+        last_update = T0 + rng.randint(0, 10 ** 8)
+
+        dataset = Dataset('/Primary%d/Run2018A-v1/%s' % (idataset, tier), status = Dataset.STAT_PRODUCTION if in_production else Dataset.STAT_VALID,
+            data_type = 'production', software_version = ('CMSSW_10_2_%d' % rng.randint(0, 9),), last_update = last_update,
+            is_open = in_production, did = idataset + 1)
+        inventory.datasets.add(dataset)
+
+        blocks = []
+        num_blocks = rng.randint(*blocks_per_dataset)
+        for iblock in xrange(num_blocks):
+            block_id += 1
+            block = Block(Block.to_internal_name('%08x-0000-0000-0000-%012x' % (idataset, iblock)), dataset,
+                is_open = (in_production and iblock == num_blocks - 1), last_update = last_update - (num_blocks - iblock) * 3600, bid = block_id)
+
+            files = set()
+            for ifile in xrange(rng.randint(*files_per_block)):
+                file_id += 1
+                lfn = '/store/data/Run2018A/Primary%d/%s/v1/%06d/%08x-%04d.root' % (idataset, tier, iblock, idataset, ifile)
+                files.add(File(lfn, block = block, size = rng.randint(1000, 4000) * 10 ** 6, fid = file_id))
+
+            block._files = files
+            block.size = sum(f.size for f in files)
+            block.num_files = len(files)
+
+            dataset.blocks.add(block)
+            blocks.append(block)
+
+        num_copies = _weighted_index(rng, replica_weights) + 1
+        for site in rng.sample(disk_sites, min(num_copies, len(disk_sites))):
+            group = _weighted_choice(rng, group_weights)
+
+            replica_blocks = list(blocks)
+            partial_last = False
+            if rng.random() < partial_fraction:
+                if len(blocks) > 1 and rng.random() < 0.5:
+                    replica_blocks = blocks[:1] + [b for b in blocks[1:] if rng.random() < 0.5]
+                else:
+                    partial_last = True
+
+            growing = (group is dataops and len(replica_blocks) == len(blocks) and rng.random() < 0.5)
+
+            replica = DatasetReplica(dataset, site, growing = growing, group = group if growing else None)
+            dataset.replicas.add(replica)
+
+            for block in replica_blocks:
+                replica_time = block.last_update + rng.randint(0, 10 ** 6)
+                if partial_last and block is replica_blocks[-1]:
+                    files = sorted(block.files, key = lambda f: f.id)
+                    files = files[:max(len(files) / 2, 1)]
+                    block_replica = BlockReplica(block, site, group, size = sum(f.size for f in files), last_update = replica_time,
+                        file_ids = tuple(f.id for f in files))
+                else:
+                    block_replica = BlockReplica(block, site, group, last_update = replica_time)
+
+                replica.block_replicas.add(block_replica)
+                block.replicas.add(block_replica)
+
+            site.add_dataset_replica(replica, add_block_replicas = True)
+
+        if rng.random() < tape_fraction:
+            replica = DatasetReplica(dataset, tape_site)
+            dataset.replicas.add(replica)
+
+            for block in blocks:
+                block_replica = BlockReplica(block, tape_site, dataops, is_custodial = True, last_update = block.last_update + 86400)
+                replica.block_replicas.add(block_replica)
+                block.replicas.add(block_replica)
+
+            tape_site.add_dataset_replica(replica, add_block_replicas = True)
+
+    for site in disk_sites + [tape_site]:
+        for partition in inventory.partitions.itervalues():
+            site_partition = site.partitions[partition]
+            usage = _usage(site_partition)
+
+            if site is tape_site or partition.name != 'Physics':
+                # effectively unlimited
+                quota = max(usage * 10., 1.e+15)
+            else:
+                quota = usage / rng.uniform(0.5, 1.) + 1.e+12
+
+            # the stores keep quotas in integer TB
+            site_partition.set_quota(max(round(quota * 1.e-12), 1.) * 1.e+12)
+
+    return inventory
+
+def make_store(inventory):
+    """
+    @param inventory  ObjectRepository (e.g. returned by generate)
+    @return MemoryInventoryStore filled with the inventory content
+    """
+    store = MemoryInventoryStore(Configuration())
+    store.save_data(inventory)
+    return store
+
+def write_partition_def(path):
+    """
+    Write the partition definition file of the synthetic inventories (passed to DynamoInventory as
+    partition_def_path).
+    """
+    with open(path, 'w') as output:
+        for name, condition_text in PARTITIONS:
+            output.write('%s: %s\n' % (name, condition_text))
+
+def _usage(site_partition):
+    size = 0
+    for replica, block_replicas in site_partition.replicas.iteritems():
+        if block_replicas is None:
+            block_replicas = replica.block_replicas
+
+        size += sum(br.size for br in block_replicas)
+
+    return size
+
+def _weighted_index(rng, weights):
+    x = rng.random() * sum(weights)
+    for index, weight in enumerate(weights):
+        x -= weight
+        if x < 0.:
+            return index
+
+    return len(weights) - 1
+
+def _weighted_choice(rng, items):
+    # items: [(item, weight)]
+    return items[_weighted_index(rng, [w for _, w in items])][0]
@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+import inspect
+import platform
+import subprocess
+import logging
+from argparse import ArgumentParser
+
+from benchmarks.generator import SCALES, generate, make_store
+from benchmarks.scenarios import SCENARIOS, BenchmarkContext
+
+def git_revision():
+    """
+    @return HEAD commit of the source tree, or None if unavailable
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd = os.path.dirname(os.path.abspath(__file__)), stderr = devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv):
+    parser = ArgumentParser(description = 'Run benchmark scenarios on a synthetic inventory and report the timings in JSON.')
+    parser.add_argument('--scale', '-s', metavar = 'SCALE', dest = 'scale', default = 'small', choices = sorted(SCALES.keys()), help = 'Inventory scale (%s).' % ', '.join(sorted(SCALES.keys())))
+    parser.add_argument('--scenario', '-c', metavar = 'NAME', dest = 'scenarios', action = 'append', choices = SCENARIOS.keys(), help = 'Scenario to run (%s). Can be repeated. Default is all.' % ', '.join(SCENARIOS.keys()))
+    parser.add_argument('--repeat', '-n', metavar = 'N', dest = 'repeat', type = int, default = 3, help = 'Number of runs of each scenario. The best time is reported.')
+    parser.add_argument('--seed', metavar = 'SEED', dest = 'seed', type = int, default = 1, help = 'Random seed of the inventory and the scenarios.')
+    parser.add_argument('--sites', metavar = 'N', dest = 'num_sites', type = int, help = 'Number of sites.')
+    parser.add_argument('--datasets', metavar = 'N', dest = 'num_datasets', type = int, help = 'Number of datasets.')
+    parser.add_argument('--blocks', metavar = ('MIN', 'MAX'), dest = 'blocks_per_dataset', type = int, nargs = 2, help = 'Range of the number of blocks per dataset.')
+    parser.add_argument('--files', metavar = ('MIN', 'MAX'), dest = 'files_per_block', type = int, nargs = 2, help = 'Range of the number of files per block.')
+    parser.add_argument('--replica-weights', metavar = 'W', dest = 'replica_weights', type = float, nargs = '+', help = 'Relative weights of 1, 2, ... disk replicas per dataset.')
+    parser.add_argument('--partial-fraction', metavar = 'F', dest = 'partial_fraction', type = float, help = 'Fraction of partial disk replicas.')
+    parser.add_argument('--tape-fraction', metavar = 'F', dest = 'tape_fraction', type = float, help = 'Fraction of datasets with a tape replica.')
+    parser.add_argument('--output', '-o', metavar = 'PATH', dest = 'output', help = 'Write the JSON result to PATH.')
+    parser.add_argument('--log-level', '-l', metavar = 'LEVEL', dest = 'log_level', default = 'ERROR', help = 'Logging level.')
+
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level = getattr(logging, args.log_level.upper()))
+
+    # all parameters of the generator, defaults overridden by the scale and the options
+    spec = inspect.getargspec(generate)
+    parameters = dict(zip(spec.args, spec.defaults))
+    parameters.update(SCALES[args.scale])
+    for key in ['num_sites', 'num_datasets', 'blocks_per_dataset', 'files_per_block', 'replica_weights', 'partial_fraction', 'tape_fraction']:
+        value = getattr(args, key)
+        if value is not None:
+            parameters[key] = tuple(value) if type(value) is list else value
+
+    parameters['seed'] = args.seed
+
+    if args.scenarios is None:
+        scenarios = SCENARIOS.keys()
+    else:
+        scenarios = [name for name in SCENARIOS.iterkeys() if name in args.scenarios]
+
+    start = time.time()
+    store = make_store(generate(**parameters))
+    generation_time = time.time() - start
+
+    sys.stderr.write('Generated inventory %s in %.1f s\n' % (store.version(), generation_time))
+
+    result = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'scale': args.scale,
+        'parameters': parameters,
+        'inventory_version': store.version(),
+        'repeat': args.repeat,
+        'scenarios': {}
+    }
+
+    workdir = tempfile.mkdtemp()
+    try:
+        context = BenchmarkContext(workdir, store, seed = args.seed)
+        # the scenarios read the snapshot
+        del store
+
+        for name in scenarios:
+            metrics = SCENARIOS[name](context, args.repeat)
+            result['scenarios'][name] = metrics
+            sys.stderr.write('%-15s %8.3f s\n' % (name, metrics['seconds']))
+
+    finally:
+        shutil.rmtree(workdir)
+
+    text = json.dumps(result, indent = 2, sort_keys = True)
+    if args.output is None:
+        print text
+    else:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,478 @@
+import os
+import time
+import json
+import random
+import collections
+import logging
+
+from dynamo.core.inventory import DynamoInventory
+from dynamo.dataformat import Configuration, Dataset, Site, HistoryRecord
+from dynamo.detox.main import Detox
+from dynamo.detox.detoxpolicy import DetoxPolicy
+from dynamo.dealer.main import Dealer
+from dynamo.dealer.dealerpolicy import DealerPolicy
+from dynamo.dealer.plugins.base import BaseHandler, DealerRequest
+from dynamo.operation.deletion import DeletionInterface
+from dynamo.operation.copy import CopyInterface
+from dynamo.fileop.rlfsm import RLFSM
+from dynamo.fileop.transfer import FileTransferOperation
+from dynamo.fileop.subscriptions import SubscriptionIndex
+from dynamo.fileop.source import SourceSelector
+from dynamo.web.modules.inventory.datasets import ListDatasets
+from dynamo.web.modules.inventory.sites import ListSites
+from dynamo.web.modules.inventory.blockreplicas import ListBlockReplicas
+from dynamo.web.modules.inventory.stats import TotalSizeListing, ReplicationFactorListing, SiteUsageListing
+from dynamo.web.modules.inventory.lfn2pfn import Lfn2PfnModule
+
+from benchmarks.generator import write_partition_def
+
+LOG = logging.getLogger(__name__)
+
+DETOX_POLICY = '''
+Partition Physics
+On site.name !=~ T1_*_MSS
+When site.occupancy > 0.8
+Until site.occupancy < 0.7
+DeleteBlock blockreplica.owner == Junk
+Protect dataset.num_full_disk_copy == 1
+Dismiss replica.incomplete
+Delete dataset.on_tape == FULL
+Dismiss
+Order increasing replica.last_block_created decreasing replica.size
+'''
+
+def best_of(repeat, function, setup = None):
+    """
+    Run function repeat times and return the shortest wall-clock time with the output of that run.
+    @param repeat    Number of runs.
+    @param function  Function to time.
+    @param setup     If not None, called before each run outside of the timing. Its return value (a tuple) is passed
+                     as the arguments of function.
+
+    @return (seconds, output of function)
+    """
+    best = None
+    for _ in xrange(repeat):
+        if setup is None:
+            args = ()
+        else:
+            args = setup()
+
+        start = time.time()
+        output = function(*args)
+        seconds = time.time() - start
+
+        if best is None or seconds < best[0]:
+            best = (seconds, output)
+
+    return best
+
+
+class BenchmarkContext(object):
+    """
+    Files shared by the scenarios: snapshot of the synthetic inventory store and the partition definition.
+    """
+
+    def __init__(self, workdir, store, seed = 1):
+        """
+        @param workdir  Directory to write the files to.
+        @param store    MemoryInventoryStore with the synthetic inventory.
+        @param seed     Seed of the random choices made in the scenarios.
+        """
+        self.workdir = workdir
+        self.seed = seed
+
+        self.snapshot_path = os.path.join(workdir, 'inventory.pkl')
+        store.write_snapshot(self.snapshot_path)
+
+        self.partition_def_path = os.path.join(workdir, 'partitions.txt')
+        write_partition_def(self.partition_def_path)
+
+    def make_inventory(self):
+        """
+        @return DynamoInventory on a memory store read from the snapshot (not loaded)
+        """
+        store_config = Configuration(module = 'memorystore:MemoryInventoryStore', config = Configuration(snapshot = self.snapshot_path))
+        return DynamoInventory(Configuration(persistency = store_config, partition_def_path = self.partition_def_path))
+
+    def load_inventory(self):
+        inventory = self.make_inventory()
+        inventory.load()
+        return inventory
+
+    def make_proxy(self):
+        """
+        @return Proxy of a freshly loaded inventory, registering updates as in an authorized application.
+        """
+        proxy = self.load_inventory().create_proxy()
+        proxy._update_commands = []
+        return proxy
+
+    def write_file(self, name, content):
+        path = os.path.join(self.workdir, name)
+        with open(path, 'w') as output:
+            output.write(content)
+
+        return path
+
+
+class MemoryHistory(object):
+    """
+    Stand-in for the Detox and Dealer history databases. Cycles and operations are counted in memory.
+    """
+
+    def __init__(self, operation_type):
+        self.operation_type = operation_type
+        self.cycles = []
+        # [HistoryRecord]
+        self.entries = []
+
+    def new_cycle(self, partition, *args, **kwd):
+        self.cycles.append(partition)
+        return len(self.cycles)
+
+    def close_cycle(self, cycle_number):
+        pass
+
+    def save_conditions(self, policy_lines):
+        for iline, line in enumerate(policy_lines):
+            line.condition_id = iline + 1
+
+    def save_cycle_state(self, cycle_number, deleted_list, kept_list, protected_list, quotas):
+        self.num_decisions = (len(deleted_list), len(kept_list), len(protected_list))
+
+    def make_cycle_entry(self, cycle_number, site):
+        record = HistoryRecord(self.operation_type, len(self.entries) + 1, site.name, int(time.time()))
+        self.entries.append(record)
+        return record
+
+    def update_entry(self, record):
+        pass
+
+
+class SingleCopyRequests(BaseHandler):
+    """
+    Dealer plugin requesting an additional copy of every valid dataset with a single full disk copy.
+    """
+
+    def __init__(self):
+        BaseHandler.__init__(self, 'SingleCopyRequests')
+
+    def get_requests(self, inventory, policy): #override
+        requests = []
+        for dataset in sorted(inventory.datasets.itervalues(), key = lambda d: d.name):
+            if dataset.status != Dataset.STAT_VALID:
+                continue
+
+            num_full = sum(1 for r in dataset.replicas if r.site.storage_type == Site.TYPE_DISK and r.is_full())
+            if num_full == 1:
+                requests.append(DealerRequest(dataset))
+
+        return requests
+
+
+class SubscriptionDB(object):
+    """
+    Stand-in for the MySQL interface of RLFSM in read-only mode. Serves the file_subscriptions rows to the
+    subscription index, the failed transfers of the retry subscriptions, and the transfer history of the links
+    (history_db.db of CostSourceSelector).
+    """
+
+    def __init__(self, rows, failures, link_rows):
+        """
+        @param rows       [(id, status, delete, block_id, file_name, site_name, hold_reason, last_update)]
+        @param failures   [(subscription id, source site name, exit code)] ordered by subscription
+        @param link_rows  [(source name, destination name, num done, num failed, bytes, seconds)]
+        """
+        self.rows = rows
+        self.failures = failures
+        self.link_rows = link_rows
+        self.now = int(time.time())
+
+    def query(self, sql, *args):
+        if sql == 'SELECT UNIX_TIMESTAMP()':
+            return [self.now]
+        elif 'FROM `file_pre_subscriptions`' in sql:
+            return []
+        elif sql.startswith('SELECT COUNT(*) FROM `file_subscriptions`'):
+            return [len(self.rows)]
+        else:
+            raise NotImplementedError(sql)
+
+    def xquery(self, sql, *args):
+        if sql.startswith(SubscriptionIndex._columns):
+            return list(self.rows)
+        elif 'FROM `failed_transfers`' in sql:
+            return list(self.failures)
+        elif 'FROM `file_transfers`' in sql:
+            return list(self.link_rows)
+        elif 'FROM `transfer_tasks`' in sql:
+            # read-only: no task is created
+            return []
+        else:
+            raise NotImplementedError(sql)
+
+
+class MappingTransferOperation(FileTransferOperation):
+    """
+    Stand-in for the FTS transfer operation: maps the source and destination PFNs of each task and accepts the
+    task if both can be mapped, without submitting anything.
+    """
+
+    def __init__(self):
+        FileTransferOperation.__init__(self, Configuration())
+
+    def start_transfers(self, batch_id, batch_tasks): #override
+        result = {}
+        for task in batch_tasks:
+            lfn = task.subscription.file.lfn
+            dest_pfn = task.subscription.destination.to_pfn(lfn, 'gfal2')
+            source_pfn = task.source.to_pfn(lfn, 'gfal2')
+            result[task] = (dest_pfn is not None and source_pfn is not None)
+
+        return result
+
+
+class LinkHistory(object):
+    """
+    Stand-in for the history database of RLFSM. CostSourceSelector reads the transfer history through its db.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+
+def make_subscription_db(inventory, seed):
+    """
+    Subscriptions of the files missing from the incomplete block replicas at disk sites. Every fifth subscription
+    is a retry with one failed attempt from one of its sources. Link history covers all pairs of sites.
+    """
+    rng = random.Random(seed)
+
+    rows = []
+    failures = []
+
+    for dataset in sorted(inventory.datasets.itervalues(), key = lambda d: d.name):
+        for block in sorted(dataset.blocks, key = lambda b: b.id):
+            files = None
+            for replica in sorted(block.replicas, key = lambda r: r.site.name):
+                if replica.file_ids is None or replica.site.storage_type != Site.TYPE_DISK:
+                    continue
+
+                if files is None:
+                    files = sorted(block.files, key = lambda f: f.id)
+
+                for lfile in files:
+                    if replica.has_file(lfile):
+                        continue
+
+                    sub_id = len(rows) + 1
+                    if sub_id % 5 == 0:
+                        sources = sorted(r.site.name for r in block.replicas if r.site != replica.site and r.has_file(lfile))
+                        if len(sources) != 0:
+                            failures.append((sub_id, rng.choice(sources), 110))
+                            status = 'retry'
+                        else:
+                            status = 'new'
+                    else:
+                        status = 'new'
+
+                    rows.append((sub_id, status, 0, block.id, lfile.lfn, replica.site.name, None, None))
+
+    link_rows = []
+    site_names = sorted(inventory.sites.iterkeys())
+    for source_name in site_names:
+        for dest_name in site_names:
+            if source_name == dest_name:
+                continue
+
+            num_done = rng.randint(0, 200)
+            nbytes = num_done * 2.5e+9
+            link_rows.append((source_name, dest_name, num_done, rng.randint(0, 20), nbytes, nbytes / rng.uniform(1.e+6, 1.e+8)))
+
+    return SubscriptionDB(rows, failures, link_rows)
+
+def make_rlfsm(db, selector_module):
+    # RLFSM without the DB connections of __init__, read-only so that no task is written
+    rlfsm = RLFSM.__new__(RLFSM)
+    rlfsm.db = db
+    rlfsm.history_db = LinkHistory(db)
+    rlfsm.subscription_index = SubscriptionIndex()
+    rlfsm.source_selector = SourceSelector.get_instance(selector_module, Configuration())
+    rlfsm._batch_learners = {}
+    rlfsm._read_only = True
+    return rlfsm
+
+
+def inventory_load(context, repeat):
+    """
+    DynamoInventory.load from the memory store.
+    """
+    def run(inventory):
+        inventory.load()
+        return inventory
+
+    seconds, inventory = best_of(repeat, run, lambda: (context.make_inventory(),))
+
+    num_dataset_replicas = 0
+    num_block_replicas = 0
+    for dataset in inventory.datasets.itervalues():
+        num_dataset_replicas += len(dataset.replicas)
+        num_block_replicas += sum(len(r.block_replicas) for r in dataset.replicas)
+
+    return {
+        'seconds': seconds,
+        'sites': len(inventory.sites),
+        'datasets': len(inventory.datasets),
+        'dataset_replicas': num_dataset_replicas,
+        'block_replicas': num_block_replicas
+    }
+
+def detox(context, repeat):
+    """
+    Detox.run on the Physics partition with dummy deletions, on a freshly loaded inventory for each run.
+    """
+    policy_path = context.write_file('detox_policy.txt', DETOX_POLICY)
+
+    def setup():
+        app = Detox.__new__(Detox)
+        app.deletion_op = DeletionInterface.get_instance('dummydeletion:DummyDeletionInterface', Configuration())
+        app.history = MemoryHistory(HistoryRecord.OP_DELETE)
+        app.policy = DetoxPolicy(Configuration(policy_file = policy_path, attrs = {}))
+        app.deletion_per_iteration = 0.01
+        app.test_run = False
+        return app, context.make_proxy()
+
+    def run(app, proxy):
+        app.run(proxy, comment = 'benchmark')
+        return app, proxy
+
+    seconds, (app, proxy) = best_of(repeat, run, setup)
+
+    return {
+        'seconds': seconds,
+        'deletion_operations': len(app.history.entries),
+        'deleted_replicas': sum(len(record.replicas) for record in app.history.entries),
+        'deleted_tb': sum(r.size for record in app.history.entries for r in record.replicas) * 1.e-12,
+        'updates': len(proxy._update_commands)
+    }
+
+def dealer(context, repeat):
+    """
+    Dealer.run on the Physics partition with dummy copies, requesting a second copy of single-copy datasets.
+    """
+
+    def setup():
+        proxy = context.make_proxy()
+
+        app = Dealer.__new__(Dealer)
+        app.copy_op = dict((name, CopyInterface.get_instance('dummycopy:DummyCopyInterface', Configuration())) for name in proxy.sites.iterkeys())
+        app.history = MemoryHistory(HistoryRecord.OP_COPY)
+        app.policy = DealerPolicy(Configuration(partition_name = 'Physics', group_name = 'AnalysisOps', target_sites = ['T2_*', 'T1_*_Disk'],
+            target_site_occupancy = 0.9, max_site_pending_fraction = 0.1, max_total_cycle_volume = 200))
+        app._attr_producers = []
+        app._plugin_priorities = {SingleCopyRequests(): 1}
+        app.test_run = False
+
+        # destinations are drawn with the global random
+        random.seed(context.seed)
+
+        return app, proxy
+
+    def run(app, proxy):
+        app.run(proxy, comment = 'benchmark')
+        return app, proxy
+
+    seconds, (app, proxy) = best_of(repeat, run, setup)
+
+    return {
+        'seconds': seconds,
+        'copy_operations': len(app.history.entries),
+        'copied_replicas': sum(len(record.replicas) for record in app.history.entries),
+        'copied_tb': sum(r.size for record in app.history.entries for r in record.replicas) * 1.e-12,
+        'updates': len(proxy._update_commands)
+    }
+
+def rlfsm_cycle(context, repeat):
+    """
+    RLFSM transfer cycle on new and retry subscriptions of missing files: reading the subscriptions against the
+    inventory, source selection (random and cost-based), and batch submission with PFN mapping. The subscription
+    tables are served by a stand-in and nothing is written.
+    """
+    inventory = context.load_inventory()
+    db = make_subscription_db(inventory, context.seed)
+    operation = MappingTransferOperation()
+
+    result = {'subscriptions': len(db.rows), 'retries': len(db.failures)}
+
+    for name, module in [('random', 'randomsource:RandomSourceSelector'), ('cost', 'costsource:CostSourceSelector')]:
+        def setup():
+            random.seed(context.seed)
+            return (make_rlfsm(db, module),)
+
+        def run(manager):
+            stages = {}
+
+            start = time.time()
+            subscriptions = manager.get_subscriptions(inventory, op = 'transfer', status = ['new', 'retry'])
+            stages['get_subscriptions'] = time.time() - start
+
+            start = time.time()
+            tasks = manager._select_source(subscriptions)
+            stages['select_source'] = time.time() - start
+
+            start = time.time()
+            num_success, num_failure = manager._start_transfers(operation, tasks)
+            stages['start_transfers'] = time.time() - start
+
+            return stages, num_success, num_failure
+
+        seconds, (stages, num_success, num_failure) = best_of(repeat, run, setup)
+
+        result[name] = {'seconds': seconds, 'stages': stages, 'tasks': num_success, 'failed': num_failure}
+
+    result['seconds'] = result['random']['seconds'] + result['cost']['seconds']
+
+    return result
+
+def web(context, repeat):
+    """
+    Responses of the inventory web modules, including the JSON serialization.
+    """
+    inventory = context.load_inventory()
+
+    # a file of the first block
+    first_block = min((b for d in inventory.datasets.itervalues() for b in d.blocks), key = lambda b: b.id)
+    lfn = min(f.lfn for f in first_block.files)
+
+    requests = [
+        ('datasets', ListDatasets, {'dataset': '/Primary1*'}),
+        ('sites', ListSites, {}),
+        ('blockreplicas', ListBlockReplicas, {'dataset': '/Primary1*', 'node': 'T2_*'}),
+        ('stats/size', TotalSizeListing, {'list_by': 'site'}),
+        ('stats/replication', ReplicationFactorListing, {'list_by': 'data_type'}),
+        ('stats/usage', SiteUsageListing, {'list_by': 'group'}),
+        ('lfn2pfn', Lfn2PfnModule, {'protocol': 'xrootd', 'node': 'T2_*', 'lfn': lfn})
+    ]
+
+    result = {}
+    total = 0.
+    for name, cls, request in requests:
+        module = cls(Configuration())
+        seconds, response = best_of(repeat, lambda: json.dumps(module.run(None, request, inventory)))
+        result[name] = {'seconds': seconds, 'bytes': len(response)}
+        total += seconds
+
+    result['seconds'] = total
+
+    return result
+
+
+# Scenarios in the order of execution
+SCENARIOS = collections.OrderedDict([
+    ('inventory_load', inventory_load),
+    ('detox', detox),
+    ('dealer', dealer),
+    ('rlfsm', rlfsm_cycle),
+    ('web', web)
+])
@@ -14,6 +14,7 @@ import sqlite3
 from email.mime.text import MIMEText
 
 from dynamo.core.components.appmanager import AppManager
+from dynamo.core.components.eventpipe import EventPipe
 from dynamo.utils.classutil import get_instance
 from dynamo.dataformat.exceptions import ConfigurationError
 
@@ -56,6 +57,15 @@ class AppServer(object):
 
         self._stop_flag = threading.Event()
 
+        ## Set when an application ends or a sequence is started; the scheduler otherwise checks every
+        ## scheduler_poll_interval seconds (applications can also run on other servers).
+        self._scheduler_wakeup = threading.Event()
+        self.scheduler_poll_interval = config.get('scheduler_poll_interval', 10)
+
+        ## Current line of each sequence. {name: row}. Entries are removed after every write to sequence.db.
+        self._sequence_heads = {}
+        self._sequence_heads_lock = threading.Lock()
+
     def start(self):
         """Start a daemon thread that runs the accept loop and return."""
 
@@ -73,8 +83,14 @@ class AppServer(object):
         """Stop the server. Applications should have all terminated by the time this function is called."""
 
         self._stop_flag.set()
+        self._scheduler_wakeup.set()
         self._stop_accepting()
 
+    def wake_scheduler(self):
+        """Make the scheduler check the sequences now."""
+
+        self._scheduler_wakeup.set()
+
     def notify_synch_app(self, app_id, data):
         """
         Notify synchronous app.
@@ -187,6 +203,8 @@ class AppServer(object):
             if mode == 'synch':
                 self.synch_app_queues[app_id] = Queue.Queue()
 
+        self.dynamo_server.event_pipe.notify(EventPipe.APP_SCHEDULED, app_id)
+
         if mode == 'synch':
             msg = self.wait_synch_app_queue(app_id)
 
@@ -301,6 +319,8 @@ class AppServer(object):
             db.commit()
             db.close()
 
+            self._invalidate_sequence_head(name)
+
             restart = (name in sequences_with_restart)
 
             self.dynamo_server.manager.master.register_sequence(name, user, restart = restart)
@@ -340,6 +360,8 @@ class AppServer(object):
             except Exception as ex:
                 return False, 'Failed to delete sequence %s (%s).' % (name, str(ex))
 
+        self._invalidate_sequence_head(name)
+
         return True, ''
 
     def _start_sequence(self, name, user):
@@ -404,6 +426,8 @@ class AppServer(object):
         if not self.dynamo_server.manager.master.update_sequence(name, enabled = True):
             return False, 'Failed to start sequence %s.' % name
 
+        self.wake_scheduler()
+
         return True, ''
 
     def _do_stop_sequence(self, name):
@@ -442,25 +466,23 @@ class AppServer(object):
             if self._stop_flag.is_set():
                 break
 
+            self._scheduler_wakeup.clear()
+
+            # time until the earliest WAIT command expires
+            wait_time = self.scheduler_poll_interval
+
             for sequence_name in self.dynamo_server.manager.master.get_sequences(enabled_only = True):
                 if self._stop_flag.is_set():
                     break
 
                 work_dir = self.scheduler_base + '/' + sequence_name
 
-                db = sqlite3.connect(work_dir + '/sequence.db')
-                cursor = db.cursor()
                 try:
-                    cursor.execute('SELECT `line`, `command`, `title`, `arguments`, `criticality`, `app_id` FROM `sequence` ORDER BY `id` LIMIT 1')
-                    row = cursor.fetchone()
-                    if row is None:
-                        raise RuntimeError('Sequence is empty')
+                    row = self._get_sequence_head(sequence_name)
                 except Exception as ex:
                     LOG.error('[Scheduler] Failed to fetch the current command for sequence %s (%s).', sequence_name, str(ex))
                     continue
 
-                db.close()
-
                 iline, command, title, arguments, criticality, app_id = row
 
                 if command == AppServer.EXECUTE:
@@ -514,12 +536,45 @@ class AppServer(object):
                     # arguments is set to the unix timestamp (string) until when the sequence should wait
                     wait_until = int(arguments)
                     if time.time() < wait_until:
+                        wait_time = min(wait_time, wait_until - time.time())
                         continue
                     else:
                         self._schedule_from_sequence(sequence_name, iline + 1)
+                        # check the next line right away
+                        wait_time = 0
+
+            # all sequences processed; now sleep until woken up
+            self._scheduler_wakeup.wait(wait_time)
 
-            # all sequences processed; now sleep for 10 seconds
-            self._stop_flag.wait(10)
+    def _get_sequence_head(self, sequence_name):
+        """
+        Return (line, command, title, arguments, criticality, app_id) of the current line of the sequence.
+        """
+
+        with self._sequence_heads_lock:
+            try:
+                return self._sequence_heads[sequence_name]
+            except KeyError:
+                pass
+
+            db = sqlite3.connect(self.scheduler_base + '/' + sequence_name + '/sequence.db')
+            try:
+                cursor = db.cursor()
+                cursor.execute('SELECT `line`, `command`, `title`, `arguments`, `criticality`, `app_id` FROM `sequence` ORDER BY `id` LIMIT 1')
+                row = cursor.fetchone()
+            finally:
+                db.close()
+
+            if row is None:
+                raise RuntimeError('Sequence is empty')
+
+            self._sequence_heads[sequence_name] = row
+            return row
+
+    def _invalidate_sequence_head(self, sequence_name):
+        # Call after the changes to sequence.db are committed
+        with self._sequence_heads_lock:
+            self._sequence_heads.pop(sequence_name, None)
 
     def _schedule_from_sequence(self, sequence_name, iline):
         work_dir = self.scheduler_base + '/' + sequence_name
@@ -552,6 +607,8 @@ class AppServer(object):
                 cursor.execute('UPDATE `sequence` SET `app_id` = ? WHERE `id` = ?', (app_id, sid))
                 LOG.info('[Scheduler] Scheduled %s/%s %s (AID %s).', sequence_name, title, arguments, app_id)
 
+                self.dynamo_server.event_pipe.notify(EventPipe.APP_SCHEDULED, app_id)
+
             elif command == AppServer.WAIT:
                 time_wait = int(title)
                 cursor.execute('UPDATE `sequence` SET `arguments` = ? WHERE `id` = ?', (str(int(time.time()) + time_wait), sid))
@@ -571,6 +628,8 @@ class AppServer(object):
                 except:
                     pass
 
+            self._invalidate_sequence_head(sequence_name)
+
     def _parse_sequence_def(self, path, user):
         app_paths = {} # {title: exec path}
         writer_applications = set() # set of titles
@@ -746,6 +805,8 @@ class AppServer(object):
                 except:
                     pass
 
+            self._invalidate_sequence_head(sequence_name)
+
     def _send_failure_notice(self, sequence_name, app):
         if not self.dynamo_server.notification_recipient:
             return
@@ -0,0 +1,78 @@
+import os
+import errno
+import fcntl
+import select
+import struct
+
+class EventPipe(object):
+    """
+    Pipe used to wake up the server main loop. Must be created before the processes that use it are forked
+    (application processes and web server workers inherit it). Any thread or process can notify; only the
+    server main loop waits. Each event is a fixed-size record written atomically. When the pipe is full, the
+    event is dropped - the reader is awake anyway, and callers must not rely on every event arriving (the
+    server always falls back to polling).
+    """
+
+    APP_SCHEDULED, APP_EXITED, UPDATES_SENT = range(1, 4)
+
+    _record = struct.Struct('<Bq')
+
+    def __init__(self):
+        self._read_fd, self._write_fd = os.pipe()
+
+        for fd in (self._read_fd, self._write_fd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+    def notify(self, event, value = 0):
+        """
+        @param event  One of the event constants.
+        @param value  Integer (e.g. application id for APP_EXITED).
+        """
+        try:
+            os.write(self._write_fd, EventPipe._record.pack(event, value))
+        except OSError as err:
+            if err.errno not in (errno.EAGAIN, errno.EPIPE):
+                raise
+
+    def wait(self, timeout):
+        """
+        Wait until at least one event is notified or timeout seconds pass.
+        @return List of (event, value) in the order of notification. Empty list on timeout.
+        """
+        try:
+            readable, _, _ = select.select([self._read_fd], [], [], timeout)
+        except select.error as err:
+            if err.args[0] == errno.EINTR:
+                return []
+            raise
+
+        if len(readable) == 0:
+            return []
+
+        data = ''
+        while True:
+            try:
+                piece = os.read(self._read_fd, 4096)
+            except OSError as err:
+                if err.errno == errno.EAGAIN:
+                    break
+                raise
+
+            if len(piece) == 0:
+                break
+
+            data += piece
+
+        size = EventPipe._record.size
+        return [EventPipe._record.unpack_from(data, pos) for pos in xrange(0, len(data) - len(data) % size, size)]
+
+    def close(self):
+        for fd in (self._read_fd, self._write_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
@@ -2,7 +2,7 @@ class OutOfSyncError(Exception):
     pass
 
 class ServerHost(object):
-    _statuses = ['initial', 'starting', 'online', 'updating', 'outofsync']
+    _statuses = ['initial', 'starting', 'online', 'updating', 'error', 'outofsync']
     STAT_INITIAL, STAT_STARTING, STAT_ONLINE, STAT_UPDATING, STAT_ERROR, STAT_OUTOFSYNC = range(1, 7)
 
     @staticmethod
@@ -0,0 +1,666 @@
+import logging
+import fnmatch
+import hashlib
+import cPickle as pickle
+
+from dynamo.core.components.persistency import InventoryStore
+from dynamo.dataformat import Configuration, Partition, Dataset, Block, File, Site, SitePartition, Group, DatasetReplica, BlockReplica
+
+LOG = logging.getLogger(__name__)
+
+class MemoryTables(object):
+    """
+    Table content of MemoryInventoryStore. Rows are keyed by object ids (or pairs of ids for replicas and quotas),
+    the same way as in the MySQL store, and are shared among the handles of the store.
+    """
+
+    tables = ['partitions', 'groups', 'sites', 'filename_mappings', 'quotas', 'datasets', 'blocks', 'files', 'dataset_replicas', 'block_replicas']
+
+    def __init__(self):
+        self.partitions = {} # {id: name}
+        self.groups = {} # {id: (name, olevel name)}
+        self.sites = {} # {id: (name, host, storage_type, backend, status)}
+        self.filename_mappings = {} # {site_id: {protocol: chains}}
+        self.quotas = {} # {(site_id, partition_id): storage in integer TB, as in the MySQL table}
+        self.datasets = {} # {id: (name, status, data_type, software_version, last_update, is_open)}
+        self.blocks = {} # {id: (dataset_id, internal name, size, num_files, is_open, last_update)}
+        self.files = {} # {id: (block_id, size, lfn, checksum)}
+        self.dataset_replicas = {} # {(dataset_id, site_id): (growing, group_id)}
+        self.block_replicas = {} # {(block_id, site_id): (group_id, is_custodial, last_update, size, file_ids or None if complete)}
+
+        # indices
+        self.ids = dict((table, {}) for table in ['partitions', 'groups', 'sites', 'datasets', 'blocks', 'files']) # {table: {key: id}}
+        self.dataset_blocks = {} # {dataset_id: set(block_id)}
+        self.block_files = {} # {block_id: set(file_id)}
+        self.dataset_sites = {} # {dataset_id: set(site_id)}
+        self.last_id = dict((table, 0) for table in self.ids.iterkeys())
+
+    def new_id(self, table, key):
+        self.last_id[table] += 1
+        self.ids[table][key] = self.last_id[table]
+        return self.last_id[table]
+
+
+class MemoryInventoryStore(InventoryStore):
+    """
+    InventoryStore holding the tables in memory. Used for benchmarks and tests on synthetic inventories.
+    The content can be written to and read from a pickle file, so that several inventories (and processes) can
+    start from the same state.
+    """
+
+    def __init__(self, config):
+        InventoryStore.__init__(self, config)
+
+        snapshot = config.get('snapshot', None)
+        if snapshot is None:
+            self._db = MemoryTables()
+        else:
+            with open(snapshot, 'rb') as source:
+                self._db = pickle.load(source)
+
+    def write_snapshot(self, path):
+        """
+        Write the table content to a pickle file, to be read with the snapshot parameter of the configuration.
+        """
+        with open(path, 'wb') as output:
+            pickle.dump(self._db, output, pickle.HIGHEST_PROTOCOL)
+
+    def check_connection(self): #override
+        return True
+
+    def new_handle(self): #override
+        handle = MemoryInventoryStore(Configuration())
+        handle._db = self._db
+        return handle
+
+    def get_partitions(self, conditions): #override
+        db = self._db
+
+        for name in set(conditions.iterkeys()) - set(db.partitions.itervalues()):
+            LOG.warning('Creating new partition %s defined in the conditions file.', name)
+            db.partitions[db.new_id('partitions', name)] = name
+
+        partitions = {}
+        for part_id, name in db.partitions.iteritems():
+            try:
+                condition = conditions[name]
+            except KeyError:
+                raise RuntimeError('Condition undefined for partition %s', name)
+
+            if type(condition) is list:
+                # this is a superpartition
+                partitions[name] = Partition(name, pid = part_id)
+            else:
+                partitions[name] = Partition(name, condition = condition, pid = part_id)
+
+        # set subpartitions for superpartitions
+        for partition in partitions.itervalues():
+            if partition._condition is not None:
+                continue
+
+            subpartitions = []
+
+            for name in conditions[partition.name]:
+                subp = partitions[name]
+                subp._parent = partition
+                subpartitions.append(subp)
+
+            partition._subpartitions = tuple(subpartitions)
+
+        return partitions.values()
+
+    def get_group_names(self, include = ['*'], exclude = []): #override
+        return self._match_names((name for name, _ in self._db.groups.itervalues()), include, exclude)
+
+    def get_site_names(self, include = ['*'], exclude = []): #override
+        return self._match_names((row[0] for row in self._db.sites.itervalues()), include, exclude)
+
+    def get_dataset_names(self, include = ['*'], exclude = []): #override
+        return self._match_names((row[0] for row in self._db.datasets.itervalues()), include, exclude)
+
+    def _match_names(self, names, include, exclude):
+        matched = []
+
+        for name in names:
+            for filt in include:
+                if fnmatch.fnmatch(name, filt):
+                    break
+            else:
+                # no match
+                continue
+
+            for filt in exclude:
+                if fnmatch.fnmatch(name, filt):
+                    break
+            else:
+                # no match
+                matched.append(name)
+
+        return matched
+
+    def get_files(self, block): #override
+        files = set()
+
+        if block.id == 0:
+            return files
+
+        for file_id in self._db.block_files.get(block.id, ()):
+            _, size, lfn, checksum = self._db.files[file_id]
+            files.add(File(lfn, block = block, size = size, checksum = checksum, fid = file_id))
+
+        return files
+
+    def get_file_id(self, lfn): #override
+        return self._db.ids['files'].get(lfn)
+
+    def find_block_containing(self, lfn): #override
+        db = self._db
+
+        try:
+            file_id = db.ids['files'][lfn]
+        except KeyError:
+            return None
+
+        dataset_id, block_name = db.blocks[db.files[file_id][0]][:2]
+
+        return db.datasets[dataset_id][0], block_name
+
+    def load_data(self, inventory, group_names = None, site_names = None, dataset_names = None): #override
+        db = self._db
+
+        ## Load groups
+        LOG.info('Loading groups.')
+
+        if group_names is not None:
+            group_names = set(group_names)
+
+        id_group_map = {0: inventory.groups[None]}
+        for group_id, (name, olname) in db.groups.iteritems():
+            if group_names is not None and name not in group_names:
+                continue
+
+            group = Group(name, olevel = Group.olevel_val(olname), gid = group_id)
+            inventory.groups.add(group)
+            id_group_map[group_id] = group
+
+        LOG.info('Loaded %d groups.', len(id_group_map))
+
+        ## Load sites
+        LOG.info('Loading sites.')
+
+        if site_names is not None:
+            site_names = set(site_names)
+
+        id_site_map = {}
+        for site_id, (name, host, storage_type, backend, status) in db.sites.iteritems():
+            if site_names is not None and name not in site_names:
+                continue
+
+            site = Site(name, host = host, storage_type = storage_type, backend = backend, status = status,
+                filename_mapping = db.filename_mappings.get(site_id, {}), sid = site_id)
+            inventory.sites.add(site)
+            id_site_map[site_id] = site
+
+            for partition in inventory.partitions.itervalues():
+                site.partitions[partition] = SitePartition(site, partition)
+
+        id_partition_map = dict((p.id, p) for p in inventory.partitions.itervalues())
+        for (site_id, partition_id), storage in db.quotas.iteritems():
+            try:
+                site = id_site_map[site_id]
+                partition = id_partition_map[partition_id]
+            except KeyError:
+                continue
+
+            site.partitions[partition].set_quota(storage * 1.e+12)
+
+        LOG.info('Loaded %d sites.', len(id_site_map))
+
+        ## Load datasets, blocks, and replicas
+        LOG.info('Loading datasets, blocks, and replicas.')
+
+        if dataset_names is not None:
+            dataset_names = set(dataset_names)
+
+        num_block_replicas = 0
+        for dataset_id, (name, status, data_type, software_version, last_update, is_open) in db.datasets.iteritems():
+            if dataset_names is not None and name not in dataset_names:
+                continue
+
+            dataset = Dataset(name, status = status, data_type = data_type, software_version = software_version,
+                last_update = last_update, is_open = is_open, did = dataset_id)
+            inventory.datasets.add(dataset)
+
+            blocks = []
+            for block_id in db.dataset_blocks.get(dataset_id, ()):
+                _, block_name, size, num_files, b_is_open, b_last_update = db.blocks[block_id]
+                block = Block(block_name, dataset, size = size, num_files = num_files, is_open = b_is_open, last_update = b_last_update, bid = block_id)
+                dataset.blocks.add(block)
+                blocks.append(block)
+
+            for site_id in db.dataset_sites.get(dataset_id, ()):
+                try:
+                    site = id_site_map[site_id]
+                except KeyError:
+                    continue
+
+                growing, d_group_id = db.dataset_replicas[(dataset_id, site_id)]
+
+                dataset_replica = DatasetReplica(dataset, site)
+                if growing:
+                    dataset_replica.growing = True
+                    dataset_replica.group = id_group_map.get(d_group_id, Group.null_group)
+
+                for block in blocks:
+                    try:
+                        b_group_id, is_custodial, b_last_update, size, file_ids = db.block_replicas[(block.id, site_id)]
+                    except KeyError:
+                        continue
+
+                    try:
+                        group = id_group_map[b_group_id]
+                    except KeyError:
+                        # group not loaded
+                        continue
+
+                    block_replica = BlockReplica(block, site, group, is_custodial = is_custodial, last_update = b_last_update)
+                    if file_ids is not None:
+                        block_replica.size = size
+                        block_replica.file_ids = file_ids
+
+                    dataset_replica.block_replicas.add(block_replica)
+                    block.replicas.add(block_replica)
+
+                if group_names is not None and len(dataset_replica.block_replicas) == 0:
+                    # no block replica owned by the loaded groups
+                    continue
+
+                num_block_replicas += len(dataset_replica.block_replicas)
+
+                dataset.replicas.add(dataset_replica)
+                site.add_dataset_replica(dataset_replica, add_block_replicas = True)
+
+        LOG.info('Loaded %d datasets and %d block replicas.', len(inventory.datasets), num_block_replicas)
+
+    def _save_partitions(self, partitions): #override
+        db = self._db
+        db.partitions = dict((p.id, p.name) for p in partitions)
+        self._reindex('partitions', ((name, pid) for pid, name in db.partitions.iteritems()))
+
+        return len(db.partitions)
+
+    def _save_groups(self, groups): #override
+        db = self._db
+        db.groups = dict((g.id, (g.name, Group.olevel_name(g.olevel))) for g in groups if g.name is not None)
+        self._reindex('groups', ((row[0], gid) for gid, row in db.groups.iteritems()))
+
+        return len(db.groups)
+
+    def _save_sites(self, sites): #override
+        db = self._db
+        db.sites = {}
+        db.filename_mappings = {}
+        for site in sites:
+            db.sites[site.id] = (site.name, site.host, site.storage_type, site.backend, site.status)
+            if len(site.filename_mapping) != 0:
+                db.filename_mappings[site.id] = dict((protocol, mapping._chains) for protocol, mapping in site.filename_mapping.iteritems())
+
+        self._reindex('sites', ((row[0], sid) for sid, row in db.sites.iteritems()))
+
+        return len(db.sites)
+
+    def _save_sitepartitions(self, sitepartitions): #override
+        # we only save quotas - not interested in superpartitions
+        self._db.quotas = dict(((sp.site.id, sp.partition.id), self._quota_row(sp)) for sp in sitepartitions if sp.partition.subpartitions is None)
+
+        return len(self._db.quotas)
+
+    def _save_datasets(self, datasets): #override
+        db = self._db
+        db.datasets = dict((d.id, self._dataset_row(d)) for d in datasets)
+        self._reindex('datasets', ((row[0], did) for did, row in db.datasets.iteritems()))
+
+        return len(db.datasets)
+
+    def _save_blocks(self, blocks): #override
+        db = self._db
+        db.blocks = {}
+        db.dataset_blocks = {}
+        for block in blocks:
+            db.blocks[block.id] = (block.dataset.id,) + self._block_row(block)
+            db.dataset_blocks.setdefault(block.dataset.id, set()).add(block.id)
+
+        self._reindex('blocks', (((row[0], row[1]), bid) for bid, row in db.blocks.iteritems()))
+
+        return len(db.blocks)
+
+    def _save_files(self, files): #override
+        db = self._db
+        db.files = {}
+        db.block_files = {}
+        for lfile in files:
+            db.files[lfile.id] = (lfile.block.id, lfile.size, lfile.lfn, lfile.checksum)
+            db.block_files.setdefault(lfile.block.id, set()).add(lfile.id)
+
+        self._reindex('files', ((row[2], fid) for fid, row in db.files.iteritems()))
+
+        return len(db.files)
+
+    def _save_dataset_replicas(self, replicas): #override
+        db = self._db
+        db.dataset_replicas = {}
+        db.dataset_sites = {}
+        for replica in replicas:
+            db.dataset_replicas[(replica.dataset.id, replica.site.id)] = self._dataset_replica_row(replica)
+            db.dataset_sites.setdefault(replica.dataset.id, set()).add(replica.site.id)
+
+        return len(db.dataset_replicas)
+
+    def _save_block_replicas(self, replicas): #override
+        self._db.block_replicas = dict(((r.block.id, r.site.id), self._block_replica_row(r)) for r in replicas)
+
+        return len(self._db.block_replicas)
+
+    def _reindex(self, table, items):
+        ids = self._db.ids[table] = dict(items)
+        self._db.last_id[table] = max(ids.itervalues()) if len(ids) != 0 else 0
+
+    def _dataset_row(self, dataset):
+        return (dataset.name, dataset.status, dataset.data_type, dataset.software_version, dataset.last_update, dataset.is_open)
+
+    def _block_row(self, block):
+        return (block.name, block.size, block.num_files, block.is_open, block.last_update)
+
+    def _dataset_replica_row(self, replica):
+        return (replica.growing, replica.group.id if replica.growing else None)
+
+    def _quota_row(self, site_partition):
+        return int(round(site_partition.quota * 1.e-12))
+
+    def _block_replica_row(self, replica):
+        if replica.is_complete() or replica.file_ids is None:
+            file_ids = None
+        elif BlockReplica._use_file_ids:
+            file_ids = tuple(replica.file_ids)
+        else:
+            file_ids = replica.file_ids
+
+        return (replica.group.id, replica.is_custodial, replica.last_update, replica.size, file_ids)
+
+    def save_block(self, block): #override
+        db = self._db
+
+        dataset_id = block.dataset.id
+        if dataset_id == 0:
+            return
+
+        key = (dataset_id, block.name)
+        try:
+            block_id = db.ids['blocks'][key]
+        except KeyError:
+            block_id = db.new_id('blocks', key)
+            db.dataset_blocks.setdefault(dataset_id, set()).add(block_id)
+
+        db.blocks[block_id] = (dataset_id,) + self._block_row(block)
+        block.id = block_id
+
+    def delete_block(self, block): #override
+        db = self._db
+
+        try:
+            block_id = db.ids['blocks'][(block.dataset.id, block.name)]
+        except KeyError:
+            return
+
+        self._delete_block_id(block_id)
+        db.dataset_blocks[block.dataset.id].discard(block_id)
+
+    def _delete_block_id(self, block_id):
+        """
+        Delete the block row, its files, and its replicas. Does not touch the dataset_blocks index.
+        """
+        db = self._db
+
+        dataset_id, block_name = db.blocks.pop(block_id)[:2]
+        db.ids['blocks'].pop((dataset_id, block_name))
+
+        for file_id in db.block_files.pop(block_id, ()):
+            db.ids['files'].pop(db.files.pop(file_id)[2])
+
+        for site_id in db.dataset_sites.get(dataset_id, ()):
+            db.block_replicas.pop((block_id, site_id), None)
+
+    def save_file(self, lfile): #override
+        db = self._db
+
+        if lfile.block.dataset.id == 0:
+            return
+
+        block_id = lfile.block.id
+        if block_id == 0:
+            return
+
+        try:
+            file_id = db.ids['files'][lfile.lfn]
+        except KeyError:
+            file_id = db.new_id('files', lfile.lfn)
+            db.block_files.setdefault(block_id, set()).add(file_id)
+
+        db.files[file_id] = (block_id, lfile.size, lfile.lfn, lfile.checksum)
+        lfile.id = file_id
+
+    def delete_file(self, lfile): #override
+        db = self._db
+
+        try:
+            file_id = db.ids['files'].pop(lfile.lfn)
+        except KeyError:
+            return
+
+        block_id = db.files.pop(file_id)[0]
+        db.block_files[block_id].discard(file_id)
+
+        # remove the file from the incomplete replicas
+        dataset_id = db.blocks[block_id][0]
+        for site_id in db.dataset_sites.get(dataset_id, ()):
+            try:
+                row = db.block_replicas[(block_id, site_id)]
+            except KeyError:
+                continue
+
+            if BlockReplica._use_file_ids and row[4] is not None and file_id in row[4]:
+                db.block_replicas[(block_id, site_id)] = row[:4] + (tuple(f for f in row[4] if f != file_id),)
+
+    def save_blockreplica(self, block_replica): #override
+        block_id = block_replica.block.id
+        if block_id == 0:
+            return
+
+        site_id = block_replica.site.id
+        if site_id == 0:
+            return
+
+        self._db.block_replicas[(block_id, site_id)] = self._block_replica_row(block_replica)
+
+    def delete_blockreplica(self, block_replica): #override
+        db = self._db
+
+        dataset_id = block_replica.block.dataset.id
+        block_id = block_replica.block.id
+        site_id = block_replica.site.id
+        if dataset_id == 0 or block_id == 0 or site_id == 0:
+            return
+
+        db.block_replicas.pop((block_id, site_id), None)
+
+        for other_id in db.dataset_blocks.get(dataset_id, ()):
+            if (other_id, site_id) in db.block_replicas:
+                break
+        else:
+            # last block replica of the dataset at the site
+            db.dataset_replicas.pop((dataset_id, site_id), None)
+            db.dataset_sites.get(dataset_id, set()).discard(site_id)
+
+    def save_dataset(self, dataset): #override
+        db = self._db
+
+        try:
+            dataset_id = db.ids['datasets'][dataset.name]
+        except KeyError:
+            dataset_id = db.new_id('datasets', dataset.name)
+
+        db.datasets[dataset_id] = self._dataset_row(dataset)
+        dataset.id = dataset_id
+
+    def delete_dataset(self, dataset): #override
+        db = self._db
+
+        try:
+            dataset_id = db.ids['datasets'][dataset.name]
+        except KeyError:
+            return
+
+        for block_id in db.dataset_blocks.pop(dataset_id, ()):
+            self._delete_block_id(block_id)
+
+        for site_id in db.dataset_sites.pop(dataset_id, ()):
+            db.dataset_replicas.pop((dataset_id, site_id))
+
+        db.ids['datasets'].pop(dataset.name)
+        db.datasets.pop(dataset_id)
+
+    def save_datasetreplica(self, dataset_replica): #override
+        db = self._db
+
+        dataset_id = dataset_replica.dataset.id
+        if dataset_id == 0:
+            return
+
+        site_id = dataset_replica.site.id
+        if site_id == 0:
+            return
+
+        db.dataset_replicas[(dataset_id, site_id)] = self._dataset_replica_row(dataset_replica)
+        db.dataset_sites.setdefault(dataset_id, set()).add(site_id)
+
+    def delete_datasetreplica(self, dataset_replica): #override
+        db = self._db
+
+        dataset_id = dataset_replica.dataset.id
+        if dataset_id == 0:
+            return
+
+        site_id = dataset_replica.site.id
+        if site_id == 0:
+            return
+
+        for block_id in db.dataset_blocks.get(dataset_id, ()):
+            db.block_replicas.pop((block_id, site_id), None)
+
+        db.dataset_replicas.pop((dataset_id, site_id), None)
+        db.dataset_sites.get(dataset_id, set()).discard(site_id)
+
+    def save_group(self, group): #override
+        db = self._db
+
+        try:
+            group_id = db.ids['groups'][group.name]
+        except KeyError:
+            group_id = db.new_id('groups', group.name)
+
+        db.groups[group_id] = (group.name, Group.olevel_name(group.olevel))
+        group.id = group_id
+
+    def delete_group(self, group): #override
+        db = self._db
+
+        db.ids['groups'].pop(db.groups.pop(group.id)[0])
+
+        for key, row in db.block_replicas.iteritems():
+            if row[0] == group.id:
+                db.block_replicas[key] = (0,) + row[1:]
+
+    def save_partition(self, partition): #override
+        db = self._db
+
+        try:
+            partition_id = db.ids['partitions'][partition.name]
+        except KeyError:
+            partition_id = db.new_id('partitions', partition.name)
+            db.partitions[partition_id] = partition.name
+
+        partition.id = partition_id
+
+    def delete_partition(self, partition): #override
+        db = self._db
+
+        try:
+            partition_id = db.ids['partitions'].pop(partition.name)
+        except KeyError:
+            return
+
+        db.partitions.pop(partition_id)
+
+        for key in [k for k in db.quotas if k[1] == partition_id]:
+            db.quotas.pop(key)
+
+    def save_site(self, site): #override
+        db = self._db
+
+        try:
+            site_id = db.ids['sites'][site.name]
+        except KeyError:
+            site_id = db.new_id('sites', site.name)
+
+        db.sites[site_id] = (site.name, site.host, site.storage_type, site.backend, site.status)
+        db.filename_mappings[site_id] = dict((protocol, mapping._chains) for protocol, mapping in site.filename_mapping.iteritems())
+        site.id = site_id
+
+    def delete_site(self, site): #override
+        db = self._db
+
+        try:
+            site_id = db.ids['sites'].pop(site.name)
+        except KeyError:
+            return
+
+        for dataset_id, site_ids in db.dataset_sites.iteritems():
+            if site_id not in site_ids:
+                continue
+
+            for block_id in db.dataset_blocks.get(dataset_id, ()):
+                db.block_replicas.pop((block_id, site_id), None)
+
+            db.dataset_replicas.pop((dataset_id, site_id))
+            site_ids.remove(site_id)
+
+        for key in [k for k in db.quotas if k[0] == site_id]:
+            db.quotas.pop(key)
+
+        db.filename_mappings.pop(site_id, None)
+        db.sites.pop(site_id)
+
+    def save_sitepartition(self, site_partition): #override
+        # We are only saving quotas. For superpartitions, there is nothing to do.
+        if site_partition.partition.subpartitions is not None:
+            return
+
+        site_id = site_partition.site.id
+        if site_id == 0:
+            return
+
+        partition_id = site_partition.partition.id
+        if partition_id == 0:
+            return
+
+        self._db.quotas[(site_id, partition_id)] = self._quota_row(site_partition)
+
+    def version(self): #override
+        """
+        md5 of the sorted content of all tables.
+        """
+        digest = hashlib.md5()
+        for table in MemoryTables.tables:
+            digest.update(repr(sorted(getattr(self._db, table).iteritems())))
+
+        return digest.hexdigest()
@@ -33,13 +33,25 @@ class MySQLUpdateBoard(UpdateBoard):
         self._mysql.lock_tables(write = ['inventory_updates'])
 
         try:
+            # The table is not transactional. Remove the rows of a failed write before the reader can see them.
+            last_id = self._mysql.query('SELECT IFNULL(MAX(`id`), 0) FROM `inventory_updates`')[0]
+
             sql = 'INSERT INTO `inventory_updates` (`cmd`, `obj`) VALUES (%s, %s)'
 
-            for cmd, sobj in update_commands:
-                if cmd == DynamoInventory.CMD_UPDATE:
-                    self._mysql.query(sql, 'update', sobj)
-                elif cmd == DynamoInventory.CMD_DELETE:
-                    self._mysql.query(sql, 'delete', sobj)
+            try:
+                for cmd, sobj in update_commands:
+                    if cmd == DynamoInventory.CMD_UPDATE:
+                        self._mysql.query(sql, 'update', sobj)
+                    elif cmd == DynamoInventory.CMD_DELETE:
+                        self._mysql.query(sql, 'delete', sobj)
+            except:
+                try:
+                    self._mysql.query('DELETE FROM `inventory_updates` WHERE `id` > %s', last_id)
+                except:
+                    # connection lost; the sender clears the board before retrying
+                    pass
+
+                raise
 
         finally:
             self._mysql.unlock_tables()
@@ -1,11 +1,13 @@
 import time
+import datetime
 import logging
 import fnmatch
 import hashlib
 
 from dynamo.core.components.persistency import InventoryStore
+from dynamo.core.components.shardload import ShardWriter, assemble_shard, load_shards, pack_file_ids
 from dynamo.utils.interface.mysql import MySQL
-from dynamo.dataformat import Configuration, Partition, Dataset, Block, File, Site, SitePartition, Group, DatasetReplica, BlockReplica
+from dynamo.dataformat import Configuration, Partition, Dataset, Block, File, Site, SitePartition, Group, DatasetReplica, BlockReplica, ObjectError
 
 LOG = logging.getLogger(__name__)
 
@@ -17,6 +19,14 @@ class MySQLInventoryStore(InventoryStore):
 
         self._mysql = MySQL(config.db_params)
 
+        # Full saves of large tables write only the differences with respect to the table content, unless
+        # the fraction of differing rows exceeds this value, in which case the table is rebuilt and swapped.
+        self.max_diff_fraction = config.get('max_diff_fraction', 0.3)
+
+        # If > 1, load_data reads datasets, blocks and replicas in this many forked processes, each handling a
+        # shard of dataset ids, and builds the objects from the compact records they pass back.
+        self.load_workers = config.get('load_workers', 0)
+
     def close(self):
         self._mysql.close()
 
@@ -210,6 +220,17 @@ class MySQLInventoryStore(InventoryStore):
 
         LOG.info('Loaded %d sites.', num)
 
+        if self.load_workers > 1:
+            self._load_data_sharded(inventory, id_group_map, id_site_map, group_names, site_names, dataset_names)
+
+            if group_names is not None:
+                self._mysql.drop_tmp_table('groups_load')
+            if site_names is not None:
+                self._mysql.drop_tmp_table('sites_load')
+
+            self._mysql.reuse_connection = reuse_connection_orig
+            return
+
         ## Load datasets
         LOG.info('Loading datasets.')
         start = time.time()
@@ -307,31 +328,7 @@ class MySQLInventoryStore(InventoryStore):
             id_block_map[block.id] = block
 
     def _load_replicas(self, inventory, id_group_map, id_site_map, id_dataset_map, id_block_maps, groups_tmp, sites_tmp, datasets_tmp):
-        sql = 'SELECT dr.`dataset_id`, dr.`site_id`, dr.`growing`, dr.`group_id`, br.`block_id`, br.`group_id`,'
-        sql += ' br.`is_custodial`, UNIX_TIMESTAMP(br.`last_update`),'
-        if BlockReplica._use_file_ids:
-            sql += ' br.`is_complete`, f.`id`, f.`size`'
-        else:
-            sql += ' brf.`num_files`, brf.`size`'
-        sql += ' FROM `dataset_replicas` AS dr'
-        sql += ' INNER JOIN `blocks` AS b ON b.`dataset_id` = dr.`dataset_id`'
-        sql += ' LEFT JOIN `block_replicas` AS br ON (br.`block_id`, br.`site_id`) = (b.`id`, dr.`site_id`)'
-        if BlockReplica._use_file_ids:
-            sql += ' LEFT JOIN `block_replica_files` AS brf ON (brf.`block_id`, brf.`site_id`) = (b.`id`, dr.`site_id`)'
-            sql += ' LEFT JOIN `files` AS f ON f.`id` = brf.`file_id`'
-        else:
-            sql += ' LEFT JOIN `block_replica_sizes` AS brf ON (brf.`block_id`, brf.`site_id`) = (b.`id`, dr.`site_id`)'
-
-        if groups_tmp is not None:
-            sql += ' INNER JOIN `%s`.`%s` AS gt ON gt.`id` = br.`group_id`' % (self._mysql.scratch_db, groups_tmp)
-
-        if sites_tmp is not None:
-            sql += ' INNER JOIN `%s`.`%s` AS st ON st.`id` = dr.`site_id`' % (self._mysql.scratch_db, sites_tmp)
-
-        if datasets_tmp is not None:
-            sql += ' INNER JOIN `%s`.`%s` AS dt ON dt.`id` = dr.`dataset_id`' % (self._mysql.scratch_db, datasets_tmp)
-
-        sql += ' ORDER BY dr.`dataset_id`, dr.`site_id`, b.`id`'
+        sql = self._replicas_query(groups_tmp, sites_tmp, datasets_tmp)
 
         # Blocks are left joined -> there will be (# sites) x (# blocks) x (# block files) entries per dataset
 
@@ -433,6 +430,148 @@ class MySQLInventoryStore(InventoryStore):
             block_replica.size = block_replica_size
             block_replica.file_ids = tuple(file_ids)
 
+    def _replicas_query(self, groups_tmp, sites_tmp, datasets_tmp, shard = None):
+        sql = 'SELECT dr.`dataset_id`, dr.`site_id`, dr.`growing`, dr.`group_id`, br.`block_id`, br.`group_id`,'
+        sql += ' br.`is_custodial`, UNIX_TIMESTAMP(br.`last_update`),'
+        if BlockReplica._use_file_ids:
+            sql += ' br.`is_complete`, f.`id`, f.`size`'
+        else:
+            sql += ' brf.`num_files`, brf.`size`'
+        sql += ' FROM `dataset_replicas` AS dr'
+        sql += ' INNER JOIN `blocks` AS b ON b.`dataset_id` = dr.`dataset_id`'
+        sql += ' LEFT JOIN `block_replicas` AS br ON (br.`block_id`, br.`site_id`) = (b.`id`, dr.`site_id`)'
+        if BlockReplica._use_file_ids:
+            sql += ' LEFT JOIN `block_replica_files` AS brf ON (brf.`block_id`, brf.`site_id`) = (b.`id`, dr.`site_id`)'
+            sql += ' LEFT JOIN `files` AS f ON f.`id` = brf.`file_id`'
+        else:
+            sql += ' LEFT JOIN `block_replica_sizes` AS brf ON (brf.`block_id`, brf.`site_id`) = (b.`id`, dr.`site_id`)'
+
+        if groups_tmp is not None:
+            sql += ' INNER JOIN `%s`.`%s` AS gt ON gt.`id` = br.`group_id`' % (self._mysql.scratch_db, groups_tmp)
+
+        if sites_tmp is not None:
+            sql += ' INNER JOIN `%s`.`%s` AS st ON st.`id` = dr.`site_id`' % (self._mysql.scratch_db, sites_tmp)
+
+        if datasets_tmp is not None:
+            sql += ' INNER JOIN `%s`.`%s` AS dt ON dt.`id` = dr.`dataset_id`' % (self._mysql.scratch_db, datasets_tmp)
+
+        if shard is not None:
+            sql += ' WHERE dr.`dataset_id` MOD %d = %d' % (shard[1], shard[0])
+
+        sql += ' ORDER BY dr.`dataset_id`, dr.`site_id`, b.`id`'
+
+        return sql
+
+    def _load_data_sharded(self, inventory, id_group_map, id_site_map, group_names, site_names, dataset_names):
+        """
+        Load datasets, blocks and replicas using self.load_workers forked processes. Each worker reads the
+        datasets with id % load_workers == index and writes compact records into shared memory; this process
+        creates the objects from the records.
+        """
+        LOG.info('Loading datasets, blocks, and replicas in %d shards.', self.load_workers)
+        start = time.time()
+
+        self._load_software_versions()
+
+        def write_shard(index, writer):
+            self._write_load_shard(writer, (index, self.load_workers), group_names, site_names, dataset_names)
+
+        counts = [0, 0]
+        def consume_shard(chunks):
+            num_datasets, num_blocks = assemble_shard(inventory, chunks, id_group_map, id_site_map)
+            counts[0] += num_datasets
+            counts[1] += num_blocks
+
+        load_shards(self.load_workers, write_shard, consume_shard)
+
+        num_dataset_replicas = 0
+        num_block_replicas = 0
+        for dataset in inventory.datasets.itervalues():
+            num_dataset_replicas += len(dataset.replicas)
+            num_block_replicas += sum(len(r.block_replicas) for r in dataset.replicas)
+
+        LOG.info('Loaded %d datasets, %d blocks, %d dataset replicas and %d block replicas in %.1f seconds.', counts[0], counts[1], num_dataset_replicas, num_block_replicas, time.time() - start)
+
+    def _write_load_shard(self, writer, shard, group_names, site_names, dataset_names):
+        """
+        Worker side of _load_data_sharded. Runs in a forked process and uses its own connection.
+        @param writer  ShardWriter
+        @param shard   (index, number of shards)
+        """
+        store = self.new_handle()
+        mysql = store._mysql
+        mysql.reuse_connection = True
+
+        groups_tmp = sites_tmp = datasets_tmp = None
+        if group_names is not None:
+            groups_tmp = store._setup_constraints('groups', group_names)
+        if site_names is not None:
+            sites_tmp = store._setup_constraints('sites', site_names)
+        if dataset_names is not None:
+            datasets_tmp = store._setup_constraints('datasets', dataset_names)
+
+        for dataset_id, name, status, data_type, sw_version_id, last_update, is_open in mysql.xquery(store._datasets_query(datasets_tmp, shard)):
+            writer.add(ShardWriter.DATASET, (dataset_id, name, int(status), int(data_type), sw_version_id, last_update, is_open))
+
+        for block_id, dataset_id, _, name, size, num_files, is_open, last_update in mysql.xquery(store._blocks_query(datasets_tmp, shard)):
+            writer.add(ShardWriter.BLOCK, (block_id, dataset_id, name, size, num_files, is_open, last_update))
+
+        # Same row structure as in _load_replicas, but collecting records instead of objects
+        def block_replica_record(block_replica, complete, size, file_ids):
+            if BlockReplica._use_file_ids and not complete:
+                block_replica[4] = size
+                block_replica[5] = pack_file_ids(file_ids)
+
+            return tuple(block_replica)
+
+        dataset_replica = None # [dataset_id, site_id, growing, group_id, block replicas]
+        block_replica = None # [block_id, group_id, is_custodial, last_update, size, file_ids]
+        file_ids = []
+        for row in mysql.xquery(store._replicas_query(groups_tmp, sites_tmp, datasets_tmp, shard)):
+            if BlockReplica._use_file_ids:
+                dataset_id, site_id, growing, d_group_id, block_id, b_group_id, b_is_custodial, b_last_update, b_is_complete, file_id, file_size = row
+            else:
+                dataset_id, site_id, growing, d_group_id, block_id, b_group_id, b_is_custodial, b_last_update, b_num_files, b_size = row
+
+            if dataset_replica is None or dataset_id != dataset_replica[0] or site_id != dataset_replica[1]:
+                if block_replica is not None:
+                    dataset_replica[4].append(block_replica_record(block_replica, block_replica_complete, block_replica_size, file_ids))
+                    block_replica = None
+
+                if dataset_replica is not None:
+                    writer.add(ShardWriter.REPLICA, tuple(dataset_replica))
+
+                dataset_replica = [dataset_id, site_id, growing, d_group_id, []]
+
+            if block_id is None:
+                # this dataset replica has no block replicas
+                continue
+
+            if block_replica is None or block_id != block_replica[0]:
+                if block_replica is not None:
+                    dataset_replica[4].append(block_replica_record(block_replica, block_replica_complete, block_replica_size, file_ids))
+
+                # complete unless adjusted later
+                block_replica = [block_id, b_group_id, b_is_custodial, b_last_update, -1, None]
+                block_replica_size = 0
+                file_ids = []
+
+                if BlockReplica._use_file_ids:
+                    block_replica_complete = (b_is_complete == 1)
+                elif b_size is not None:
+                    block_replica[4] = b_size
+                    block_replica[5] = b_num_files
+
+            if BlockReplica._use_file_ids and file_id is not None:
+                block_replica_size += file_size
+                file_ids.append(file_id)
+
+        if block_replica is not None:
+            dataset_replica[4].append(block_replica_record(block_replica, block_replica_complete, block_replica_size, file_ids))
+
+        if dataset_replica is not None:
+            writer.add(ShardWriter.REPLICA, tuple(dataset_replica))
+
     def _setup_constraints(self, table, names):
         tmp_table = table + '_load'
         columns = ['`id` int(11) unsigned NOT NULL', 'PRIMARY KEY (`id`)']
@@ -542,12 +681,8 @@ class MySQLInventoryStore(InventoryStore):
 
         self._mysql.query('CREATE TABLE `software_versions_tmp` LIKE `software_versions`')
 
-        if self._mysql.table_exists('datasets_tmp'):
-            self._mysql.query('DROP TABLE `datasets_tmp`')
-
-        self._mysql.query('CREATE TABLE `datasets_tmp` LIKE `datasets`')
-
         fields = ('id', 'name', 'status', 'data_type', 'software_version_id', 'last_update', 'is_open')
+        select_fields = ('`id`', '`name`', '`status`+0', '`data_type`+0', '`software_version_id`', '`last_update`', '`is_open`')
         mapping = lambda dataset: (dataset.id, dataset.name, dataset.status, dataset.data_type, \
             dataset._software_version_id, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(dataset.last_update)), dataset.is_open)
 
@@ -557,79 +692,40 @@ class MySQLInventoryStore(InventoryStore):
                 software_versions.add(dataset.software_version)
                 yield dataset
 
-        num = self._mysql.insert_many('datasets_tmp', fields, mapping, get_dataset(), do_update = False)
+        num = self._save_table('datasets', fields, 1, select_fields, mapping, get_dataset())
 
         fields = ('id',) + Dataset.SoftwareVersion.field_names
         mapping = lambda v: (v.id,) + v.value
 
         self._mysql.insert_many('software_versions_tmp', fields, mapping, software_versions, do_update = False)
 
-        self._mysql.query('DROP TABLE `datasets`')
-        self._mysql.query('RENAME TABLE `datasets_tmp` TO `datasets`')
-
         self._mysql.query('DROP TABLE `software_versions`')
         self._mysql.query('RENAME TABLE `software_versions_tmp` TO `software_versions`')
 
         return num
 
     def _save_blocks(self, blocks): #override
-        if self._mysql.table_exists('blocks_tmp'):
-            self._mysql.query('DROP TABLE `blocks_tmp`')
-
-        self._mysql.query('CREATE TABLE `blocks_tmp` LIKE `blocks`')
-
         fields = ('id', 'dataset_id', 'name', 'size', 'num_files', 'is_open', 'last_update')
         mapping = lambda block: (block.id, block.dataset.id, block.real_name(), \
             block.size, block.num_files, block.is_open, \
             time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(block.last_update)))
 
-        num = self._mysql.insert_many('blocks_tmp', fields, mapping, blocks, do_update = False)
-
-        self._mysql.query('DROP TABLE `blocks`')
-        self._mysql.query('RENAME TABLE `blocks_tmp` TO `blocks`')
-
-        return num
+        return self._save_table('blocks', fields, 1, fields, mapping, blocks)
 
     def _save_files(self, files): #override
-        if self._mysql.table_exists('files_tmp'):
-            self._mysql.query('DROP TABLE `files_tmp`')
-
-        self._mysql.query('CREATE TABLE `files_tmp` LIKE `files`')
-
         fields = ('id', 'block_id', 'size', 'name') + File.checksum_algorithms
         mapping = lambda lfile: (lfile.id, lfile.block.id, lfile.size, lfile.lfn) + lfile.checksum
 
-        num = self._mysql.insert_many('files_tmp', fields, mapping, files, do_update = False)
-
-        self._mysql.query('DROP TABLE `files`')
-        self._mysql.query('RENAME TABLE `files_tmp` TO `files`')
-
-        return num
+        return self._save_table('files', fields, 1, fields, mapping, files, differential = False)
 
     def _save_dataset_replicas(self, replicas): #override
-        if self._mysql.table_exists('dataset_replicas_tmp'):
-            self._mysql.query('DROP TABLE `dataset_replicas_tmp`')
-
-        self._mysql.query('CREATE TABLE `dataset_replicas_tmp` LIKE `dataset_replicas`')
-
         fields = ('dataset_id', 'site_id', 'growing', 'group_id')
         mapping = lambda replica: (replica.dataset.id, replica.site.id, replica.growing, replica.group.id if replica.growing else None)
 
-        num = self._mysql.insert_many('dataset_replicas_tmp', fields, mapping, replicas, do_update = False)
-
-        self._mysql.query('DROP TABLE `dataset_replicas`')
-        self._mysql.query('RENAME TABLE `dataset_replicas_tmp` TO `dataset_replicas`')
-
-        return num
+        return self._save_table('dataset_replicas', fields, 2, fields, mapping, replicas)
 
     def _save_block_replicas(self, replicas): #override
-        if self._mysql.table_exists('block_replicas_tmp'):
-            self._mysql.query('DROP TABLE `block_replicas_tmp`')
-
-        self._mysql.query('CREATE TABLE `block_replicas_tmp` LIKE `block_replicas`')
-
         if BlockReplica._use_file_ids:
-            # Fill block_replicas_tmp normally
             # is_complete is only used internally to distinguish empty and full replicas when there are no entries in block_replica_files
             fields = ('block_id', 'site_id', 'group_id', 'is_custodial', 'last_update', 'is_complete')
 
@@ -638,30 +734,33 @@ class MySQLInventoryStore(InventoryStore):
                                        time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(replica.last_update)),
                                        replica.is_complete())
 
-            num = self._mysql.insert_many('block_replicas_tmp', fields, mapping, replicas, do_update = False)
+            incomplete_replicas = []
+            def get_replicas():
+                for replica in replicas:
+                    if not replica.is_complete():
+                        incomplete_replicas.append(replica)
 
-            # Fill block_replica_files_tmp
-            if self._mysql.table_exists('block_replica_files_tmp'):
-                self._mysql.query('DROP TABLE `block_replica_files_tmp`')
+                    yield replica
 
-            self._mysql.query('CREATE TABLE `block_replica_files_tmp` LIKE `block_replica_files`')
+            num = self._save_table('block_replicas', fields, 2, fields, mapping, get_replicas())
 
             fields = ('block_id', 'site_id', 'file_id')
     
-            def get_filereplica():
-                for replica in replicas:
-                    if replica.is_complete():
-                        continue
-    
+            def get_filereplicas():
+                for replica in incomplete_replicas:
                     for file_id in replica.file_ids:
                         yield (replica.block.id, replica.site.id, file_id)
     
-            self._mysql.insert_many('block_replica_files_tmp', fields, None, get_filereplicas(), do_update = False)
+            self._save_table('block_replica_files', fields, 3, fields, None, get_filereplicas(), differential = False)
 
-            self._mysql.query('DROP TABLE `block_replica_files`')
-            self._mysql.query('RENAME TABLE `block_replica_files_tmp` TO `block_replica_files`')
+            return num
 
         else:
+            if self._mysql.table_exists('block_replicas_tmp'):
+                self._mysql.query('DROP TABLE `block_replicas_tmp`')
+
+            self._mysql.query('CREATE TABLE `block_replicas_tmp` LIKE `block_replicas`')
+
             # Add a size column to block_replicas_tmp (speed optimization)
             self._mysql.query('ALTER TABLE `block_replicas_tmp` ADD COLUMN `num_files` int(11) NOT NULL, ADD COLUMN `size` bigint(20) NOT NULL')
 
@@ -692,24 +791,209 @@ class MySQLInventoryStore(InventoryStore):
             self._mysql.query('DROP TABLE `block_replica_sizes`')
             self._mysql.query('RENAME TABLE `block_replica_sizes_tmp` TO `block_replica_sizes`')
 
-        self._mysql.query('DROP TABLE `block_replicas`')
-        self._mysql.query('RENAME TABLE `block_replicas_tmp` TO `block_replicas`')
+            self._mysql.query('DROP TABLE `block_replicas`')
+            self._mysql.query('RENAME TABLE `block_replicas_tmp` TO `block_replicas`')
+
+            return num
+
+    def _save_table(self, table, fields, key_length, select_fields, mapping, objects, differential = True):
+        """
+        Save the full content of a table. With differential = True, the objects, sorted by the primary key, are
+        compared with the table content; if the fraction of rows that differ is below max_diff_fraction, only the
+        differences are written. Otherwise the rows are streamed to a new table that replaces the original.
+
+        @param table          Table name.
+        @param fields         Column names. The first key_length columns form the primary key.
+        @param key_length     Number of key columns.
+        @param select_fields  SQL expressions that select the columns in the form returned by mapping.
+        @param mapping        Function from an object to a row. If None, objects are rows.
+        @param objects        Iterable of objects.
+        @param differential   If False, always rebuild the table without holding the objects in memory. Used for
+                              the tables with one row per file.
+
+        @return  Number of saved rows.
+        """
+
+        start = time.time()
+
+        if differential:
+            if mapping is None:
+                row_key = lambda row: tuple(row[:key_length])
+            else:
+                row_key = lambda obj: tuple(mapping(obj)[:key_length])
+
+            # Sort the object references; rows are formed again when they are compared and written
+            objects = list(objects)
+            objects.sort(key = row_key)
+
+            diff = self._diff_table(table, fields, key_length, select_fields, mapping, row_key, objects)
+        else:
+            diff = None
+
+        if diff is None:
+            LOG.info('Rebuilding table %s.', table)
+
+            if self._mysql.table_exists(table + '_tmp'):
+                self._mysql.query('DROP TABLE `%s_tmp`' % table)
+
+            self._mysql.query('CREATE TABLE `{table}_tmp` LIKE `{table}`'.format(table = table))
+
+            num = self._mysql.insert_many(table + '_tmp', fields, mapping, objects, do_update = False)
+
+            self._mysql.query('DROP TABLE `%s`' % table)
+            self._mysql.query('RENAME TABLE `{table}_tmp` TO `{table}`'.format(table = table))
+
+        else:
+            upserts, deletes = diff
+
+            LOG.info('Updating table %s: %d rows upserted, %d rows deleted.', table, len(upserts), len(deletes))
+
+            if len(deletes) != 0:
+                if key_length == 1:
+                    self._mysql.delete_many(table, fields[0], deletes)
+                else:
+                    self._mysql.delete_many(table, fields[:key_length], deletes)
+
+            self._mysql.insert_many(table, fields, mapping, upserts, do_update = True)
+
+            num = len(objects)
+
+        LOG.debug('Saved table %s in %.1f seconds.', table, time.time() - start)
 
         return num
 
-    def _clone_from_common_class(self, source): #override
+    def _diff_table(self, table, fields, key_length, select_fields, mapping, row_key, objects):
+        """
+        Merge-join the objects sorted by row_key with the table content ordered by the key.
+        @return  (objects to insert or update, keys to delete), or None if the difference is too large.
+        """
+
+        def normalize(value):
+            if type(value) is bool:
+                return int(value)
+            elif type(value) is datetime.datetime:
+                return value.strftime('%Y-%m-%d %H:%M:%S')
+            else:
+                return value
+
+        if mapping is None:
+            mapping = lambda row: row
+
+        max_diff = int(len(objects) * self.max_diff_fraction)
+
+        upserts = []
+        deletes = []
+
+        # Objects with a null key (not in the table yet) are always inserted
+        iobj = 0
+        while iobj != len(objects) and 0 in row_key(objects[iobj]):
+            upserts.append(objects[iobj])
+            iobj += 1
+
+        def form_row(iobj):
+            # (row, key) of the object at iobj, (None, None) past the end
+            if iobj == len(objects):
+                return None, None
+
+            row = mapping(objects[iobj])
+            return row, tuple(row[:key_length])
+
+        row, key = form_row(iobj)
+
+        sql = 'SELECT %s FROM `%s`' % (', '.join(select_fields), table)
+        sql += ' ORDER BY ' + ', '.join('`%s`' % f for f in fields[:key_length])
+
+        db_rows = self._mysql.xquery(sql)
+
+        for db_row in db_rows:
+            db_key = tuple(db_row[:key_length])
+
+            while key is not None and key < db_key:
+                # in memory only
+                upserts.append(objects[iobj])
+                iobj += 1
+                row, key = form_row(iobj)
+
+            if key == db_key:
+                # normalize only if the plain comparison fails (e.g. datetime vs string)
+                if row != db_row and tuple(map(normalize, row)) != tuple(map(normalize, db_row)):
+                    upserts.append(objects[iobj])
+                iobj += 1
+                row, key = form_row(iobj)
+            else:
+                # in table only
+                if key_length == 1:
+                    deletes.append(db_key[0])
+                else:
+                    deletes.append(db_key)
+
+            if len(upserts) + len(deletes) > max_diff:
+                # closing the generator releases the cursor and the connection lock
+                db_rows.close()
+                return None
+
+        upserts.extend(objects[iobj:])
+
+        if len(upserts) + len(deletes) > max_diff:
+            return None
+
+        return upserts, deletes
+
+    def _clone_from_common_class(self, source, incremental = False): #override
         # Do the closest thing to INSERT SELECT
 
-        tables = ['partitions', 'groups', 'sites', 'quotas', 'software_versions', 'filename_mappings',
-                  'datasets', 'blocks', 'files', 'dataset_replicas', 'block_replicas', 'block_replica_files', 'block_replica_sizes']
+        # (table, leading key column used to partition the table into ranges for incremental cloning)
+        tables = [('partitions', 'id'), ('groups', 'id'), ('sites', 'id'), ('quotas', 'site_id'), ('software_versions', 'id'),
+                  ('filename_mappings', 'site_id'), ('datasets', 'id'), ('blocks', 'id'), ('files', 'id'), ('dataset_replicas', 'dataset_id'),
+                  ('block_replicas', 'block_id'), ('block_replica_files', 'block_id'), ('block_replica_sizes', 'block_id')]
 
-        for table in tables:
+        for table, key in tables:
             fields = tuple(row[0] for row in self._mysql.query('SHOW COLUMNS FROM `%s`' % table))
-            fields_str = ', '.join('`%s`' % f for f in fields)
-            self._mysql.query('TRUNCATE TABLE `%s`' % table)
-            rows = source._mysql.xquery('SELECT %s FROM `%s`' % (fields_str, table))
+
+            if incremental:
+                start = time.time()
+                num_ranges, num_changed = self._clone_table_ranges(source, table, fields, key)
+                LOG.info('Cloned %d/%d ranges of table %s in %.1f seconds.', num_changed, num_ranges, table, time.time() - start)
+            else:
+                fields_str = ', '.join('`%s`' % f for f in fields)
+                self._mysql.query('TRUNCATE TABLE `%s`' % table)
+                rows = source._mysql.xquery('SELECT %s FROM `%s`' % (fields_str, table))
+                self._mysql.insert_many(table, fields, None, rows, do_update = False)
+
+    def _clone_table_ranges(self, source, table, fields, key, range_size = 10000):
+        """
+        Compare the row count and an order-independent checksum of the table contents in ranges of the key column
+        between the source and this store, and copy the ranges that differ.
+
+        @return (number of ranges, number of ranges copied)
+        """
+
+        fields_str = ', '.join('`%s`' % f for f in fields)
+        row_str = ', '.join('IFNULL(`%s`, \'\\\\N\')' % f for f in fields)
+
+        sql = 'SELECT `{key}` DIV {size}, COUNT(*), BIT_XOR(CRC32(CONCAT_WS(\'#\', {row})))'
+        sql += ' FROM `{table}` GROUP BY 1'
+        sql = sql.format(key = key, size = range_size, row = row_str, table = table)
+
+        local_sums = dict((row[0], row[1:]) for row in self._mysql.xquery(sql))
+        source_sums = dict((row[0], row[1:]) for row in source._mysql.xquery(sql))
+
+        all_ranges = set(local_sums.iterkeys()) | set(source_sums.iterkeys())
+        changed = sorted(r for r in all_ranges if local_sums.get(r) != source_sums.get(r))
+
+        delete_sql = 'DELETE FROM `{table}` WHERE `{key}` >= %s AND `{key}` < %s'.format(table = table, key = key)
+        select_sql = 'SELECT {fields} FROM `{table}` WHERE `{key}` >= %s AND `{key}` < %s'.format(fields = fields_str, table = table, key = key)
+
+        for irange in changed:
+            low = irange * range_size
+            high = low + range_size
+
+            self._mysql.query(delete_sql, low, high)
+            rows = source._mysql.xquery(select_sql, low, high)
             self._mysql.insert_many(table, fields, None, rows, do_update = False)
 
+        return len(all_ranges), len(changed)
+
     def _yield_partitions(self): #override
         sql = 'SELECT `id`, `name` FROM `partitions`'
         for pid, name in self._mysql.xquery(sql):
@@ -780,6 +1064,25 @@ class MySQLInventoryStore(InventoryStore):
 
     def _yield_datasets(self, datasets_tmp = None): #override
         # load software versions first
+        self._load_software_versions()
+
+        sql = self._datasets_query(datasets_tmp)
+
+        for dataset_id, name, status, data_type, sw_version_id, last_update, is_open in self._mysql.xquery(sql):
+            # size and num_files are reset when loading blocks
+            dataset = Dataset(
+                name,
+                status = int(status),
+                data_type = int(data_type),
+                last_update = last_update,
+                is_open = (is_open == 1),
+                did = dataset_id
+            )
+            dataset._software_version_id = sw_version_id
+
+            yield dataset
+
+    def _load_software_versions(self):
         # not COUNT(*) - list can have holes
         maxid = self._mysql.query('SELECT MAX(`id`) FROM `software_versions`')[0]
         if maxid is None: # None: no entries in the table
@@ -799,6 +1102,7 @@ class MySQLInventoryStore(InventoryStore):
             Dataset._software_versions_byid[vid] = version
             Dataset._software_versions_byvalue[value] = version
 
+    def _datasets_query(self, datasets_tmp, shard = None):
         sql = 'SELECT d.`id`, d.`name`, d.`status`+0, d.`data_type`+0,'
         sql += ' d.`software_version_id`, UNIX_TIMESTAMP(d.`last_update`), d.`is_open`'
         sql += ' FROM `datasets` AS d'
@@ -806,28 +1110,13 @@ class MySQLInventoryStore(InventoryStore):
         if datasets_tmp is not None:
             sql += ' INNER JOIN `%s`.`%s` AS t ON t.`id` = d.`id`' % (self._mysql.scratch_db, datasets_tmp)
 
-        for dataset_id, name, status, data_type, sw_version_id, last_update, is_open in self._mysql.xquery(sql):
-            # size and num_files are reset when loading blocks
-            dataset = Dataset(
-                name,
-                status = int(status),
-                data_type = int(data_type),
-                last_update = last_update,
-                is_open = (is_open == 1),
-                did = dataset_id
-            )
-            dataset._software_version_id = sw_version_id
+        if shard is not None:
+            sql += ' WHERE d.`id` MOD %d = %d' % (shard[1], shard[0])
 
-            yield dataset
+        return sql
 
     def _yield_blocks(self, id_dataset_map = None, datasets_tmp = None): #override
-        sql = 'SELECT b.`id`, d.`id`, d.`name`, b.`name`, b.`size`, b.`num_files`, b.`is_open`, UNIX_TIMESTAMP(b.`last_update`) FROM `blocks` AS b'
-        sql += ' INNER JOIN `datasets` AS d ON d.`id` = b.`dataset_id`'
-
-        if datasets_tmp is not None:
-            sql += ' INNER JOIN `%s`.`%s` AS t ON t.`id` = b.`dataset_id`' % (self._mysql.scratch_db, datasets_tmp)
-
-        sql += ' ORDER BY b.`dataset_id`'
+        sql = self._blocks_query(datasets_tmp)
 
         _dataset_id = 0
         dataset = None
@@ -851,6 +1140,20 @@ class MySQLInventoryStore(InventoryStore):
                 bid = block_id
             )
 
+    def _blocks_query(self, datasets_tmp, shard = None):
+        sql = 'SELECT b.`id`, d.`id`, d.`name`, b.`name`, b.`size`, b.`num_files`, b.`is_open`, UNIX_TIMESTAMP(b.`last_update`) FROM `blocks` AS b'
+        sql += ' INNER JOIN `datasets` AS d ON d.`id` = b.`dataset_id`'
+
+        if datasets_tmp is not None:
+            sql += ' INNER JOIN `%s`.`%s` AS t ON t.`id` = b.`dataset_id`' % (self._mysql.scratch_db, datasets_tmp)
+
+        if shard is not None:
+            sql += ' WHERE b.`dataset_id` MOD %d = %d' % (shard[1], shard[0])
+
+        sql += ' ORDER BY b.`dataset_id`'
+
+        return sql
+
     def _yield_files(self): #override
         sql = 'SELECT f.`id`, d.`name`, d.`id`, b.`name`, b.`id`, f.`name`, f.`size`'
         for algo in File.checksum_algorithms:
@@ -1019,6 +1322,125 @@ class MySQLInventoryStore(InventoryStore):
 
             yield block_replica
             
+    def save_many(self, objects): #override
+        if len(objects) == 0:
+            return
+
+        if type(objects[0]) is BlockReplica:
+            self._save_blockreplicas(objects)
+        elif type(objects[0]) is DatasetReplica:
+            self._save_datasetreplicas(objects)
+        else:
+            InventoryStore.save_many(self, objects)
+
+    def delete_many(self, objects): #override
+        if len(objects) == 0:
+            return
+
+        if type(objects[0]) is BlockReplica:
+            self._delete_blockreplicas(objects)
+        else:
+            InventoryStore.delete_many(self, objects)
+
+    def _save_blockreplicas(self, block_replicas):
+        """
+        Bulk version of save_blockreplica.
+        """
+
+        replicas = []
+        for replica in block_replicas:
+            if replica.block.id == 0 or replica.site.id == 0:
+                continue
+
+            if BlockReplica._use_file_ids and replica.file_ids is not None:
+                for fid in replica.file_ids:
+                    try:
+                        fid += 0
+                    except TypeError:
+                        raise ObjectError('Cannot write %s into store because one of the files %s %s is not known yet' % (str(replica), fid, type(fid).__name__))
+
+            replicas.append(replica)
+
+        fields = ('block_id', 'site_id', 'group_id', 'is_custodial', 'last_update', 'is_complete')
+        mapping = lambda replica: (replica.block.id, replica.site.id, \
+                                   replica.group.id, replica.is_custodial, \
+                                   time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(replica.last_update)),
+                                   replica.is_complete())
+
+        self._mysql.insert_many('block_replicas', fields, mapping, replicas)
+
+        complete = []
+        incomplete = []
+        for replica in replicas:
+            if replica.is_complete() or replica.file_ids is None:
+                complete.append((replica.block.id, replica.site.id))
+            else:
+                incomplete.append(replica)
+
+        if BlockReplica._use_file_ids:
+            table = 'block_replica_files'
+        else:
+            table = 'block_replica_sizes'
+
+        if len(complete) != 0:
+            self._mysql.delete_many(table, ('block_id', 'site_id'), complete)
+
+        if BlockReplica._use_file_ids:
+            def get_filereplicas():
+                for replica in incomplete:
+                    for file_id in replica.file_ids:
+                        yield (replica.block.id, replica.site.id, file_id)
+
+            fields = ('block_id', 'site_id', 'file_id')
+            self._mysql.insert_many('block_replica_files', fields, None, get_filereplicas())
+        else:
+            fields = ('block_id', 'site_id', 'num_files', 'size')
+            mapping = lambda replica: (replica.block.id, replica.site.id, replica.file_ids, replica.size)
+            self._mysql.insert_many('block_replica_sizes', fields, mapping, incomplete)
+
+    def _delete_blockreplicas(self, block_replicas):
+        """
+        Bulk version of delete_blockreplica.
+        """
+
+        keys = []
+        dataset_site_keys = set()
+        for replica in block_replicas:
+            dataset_id = replica.block.dataset.id
+            block_id = replica.block.id
+            site_id = replica.site.id
+            if dataset_id == 0 or block_id == 0 or site_id == 0:
+                continue
+
+            keys.append((block_id, site_id))
+            dataset_site_keys.add((dataset_id, site_id))
+
+        if len(keys) == 0:
+            return
+
+        for table in ['block_replicas', 'block_replica_files', 'block_replica_sizes']:
+            self._mysql.delete_many(table, ('block_id', 'site_id'), keys)
+
+        sql = 'SELECT COUNT(*) FROM `block_replicas` AS br'
+        sql += ' INNER JOIN `blocks` AS b ON b.`id` = br.`block_id`'
+        sql += ' WHERE b.`dataset_id` = %s AND br.`site_id` = %s'
+        empty = [key for key in dataset_site_keys if self._mysql.query(sql, *key)[0] == 0]
+
+        if len(empty) != 0:
+            self._mysql.delete_many('dataset_replicas', ('dataset_id', 'site_id'), empty)
+
+    def _save_datasetreplicas(self, dataset_replicas):
+        """
+        Bulk version of save_datasetreplica.
+        """
+
+        fields = ('dataset_id', 'site_id', 'growing', 'group_id')
+        mapping = lambda replica: (replica.dataset.id, replica.site.id, replica.growing, replica.group.id if replica.growing else None)
+
+        replicas = [r for r in dataset_replicas if r.dataset.id != 0 and r.site.id != 0]
+
+        self._mysql.insert_many('dataset_replicas', fields, mapping, replicas)
+
     def save_block(self, block): #override
         dataset_id = block.dataset.id
         if dataset_id == 0:
@@ -216,15 +216,16 @@ class InventoryStore(object):
 
         LOG.info('Saved %d block replicas.', num)
 
-    def clone_from(self, source):
+    def clone_from(self, source, incremental = False):
         """
         Clone the entire store content from another InventoryStore instance.
-        @param source  Source inventory to clone content from.
+        @param source       Source inventory to clone content from.
+        @param incremental  If True and the source is of the same class, only copy the parts that differ.
         """
 
         if type(source) is type(self):
             # special case using class internals
-            self._clone_from_common_class(source)
+            self._clone_from_common_class(source, incremental = incremental)
         else:
             self._clone_from_general(source)
 
@@ -292,6 +293,24 @@ class InventoryStore(object):
 
         LOG.info('Saved %d block replicas.', num)
 
+    def save_many(self, objects):
+        """
+        Save a list of objects of a single type. The default implementation calls write_into of each object;
+        subclasses can override with bulk operations.
+        @param objects  List of objects of the same type.
+        """
+        for obj in objects:
+            obj.write_into(self)
+
+    def delete_many(self, objects):
+        """
+        Delete a list of objects of a single type. The default implementation calls delete_from of each object;
+        subclasses can override with bulk operations.
+        @param objects  List of objects of the same type.
+        """
+        for obj in objects:
+            obj.delete_from(self)
+
     def save_block(self, block):
         raise NotImplementedError('save_block')
 
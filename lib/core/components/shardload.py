@@ -0,0 +1,220 @@
+import os
+import time
+import marshal
+import tempfile
+import logging
+import traceback
+import multiprocessing
+import Queue
+from array import array
+
+from dynamo.dataformat import Dataset, Block, DatasetReplica, BlockReplica
+
+LOG = logging.getLogger(__name__)
+
+class ShardWriter(object):
+    """
+    Writes compact inventory records of one dataset shard into a file in shared memory (/dev/shm if available).
+    Records are plain tuples serialized with marshal in chunks:
+      DATASET: (id, name, status, data_type, software_version_id, last_update, is_open)
+      BLOCK:   (id, dataset_id, name, size, num_files, is_open, last_update)
+      REPLICA: (dataset_id, site_id, growing, group_id, [block replica, ...])
+    with block replica = (block_id, group_id, is_custodial, last_update, size, file_ids), where size is -1 and
+    file_ids is None for a complete replica. If BlockReplica._use_file_ids is True, file_ids of an incomplete
+    replica is the sorted file id array as a byte string, otherwise it is the number of files.
+    """
+
+    DATASET, BLOCK, REPLICA = range(3)
+
+    def __init__(self, path, chunk_size = 10000):
+        self.path = path
+        self.chunk_size = chunk_size
+
+        self._out = open(path, 'wb')
+        self._kind = None
+        self._chunk = []
+
+    def add(self, kind, record):
+        # records of one kind are added together (datasets, then blocks, then replicas)
+        if kind != self._kind:
+            self._write()
+            self._kind = kind
+
+        self._chunk.append(record)
+        if len(self._chunk) == self.chunk_size:
+            self._write()
+
+    def close(self):
+        self._write()
+        self._out.close()
+
+    def _write(self):
+        if len(self._chunk) != 0:
+            marshal.dump((self._kind, self._chunk), self._out, 2)
+            self._chunk = []
+
+
+def read_shard(path):
+    """
+    Generator of (kind, records) chunks in the shard file.
+    """
+    with open(path, 'rb') as source:
+        while True:
+            try:
+                yield marshal.load(source)
+            except EOFError:
+                break
+
+
+def pack_file_ids(file_ids):
+    return BlockReplica.pack_file_ids(file_ids).tostring()
+
+
+def assemble_shard(inventory, chunks, id_group_map, id_site_map):
+    """
+    Create the inventory objects from the shard records. Groups and sites must be loaded already. Chunks of
+    datasets and blocks of a shard must come before the replica chunks.
+
+    @return (number of datasets, number of blocks)
+    """
+    id_dataset_map = {}
+    id_block_map = {}
+
+    for kind, records in chunks:
+        if kind == ShardWriter.DATASET:
+            for dataset_id, name, status, data_type, sw_version_id, last_update, is_open in records:
+                dataset = Dataset(
+                    name,
+                    status = status,
+                    data_type = data_type,
+                    last_update = last_update,
+                    is_open = (is_open == 1),
+                    did = dataset_id
+                )
+                dataset._software_version_id = sw_version_id
+
+                inventory.datasets.add(dataset)
+                id_dataset_map[dataset_id] = dataset
+
+        elif kind == ShardWriter.BLOCK:
+            for block_id, dataset_id, name, size, num_files, is_open, last_update in records:
+                dataset = id_dataset_map[dataset_id]
+                block = Block(
+                    Block.to_internal_name(name),
+                    dataset,
+                    size = size,
+                    num_files = num_files,
+                    is_open = (is_open == 1),
+                    last_update = last_update,
+                    bid = block_id
+                )
+                dataset.blocks.add(block)
+                id_block_map[block_id] = block
+
+        elif kind == ShardWriter.REPLICA:
+            for dataset_id, site_id, growing, group_id, block_replicas in records:
+                dataset = id_dataset_map[dataset_id]
+                site = id_site_map[site_id]
+
+                dataset_replica = DatasetReplica(dataset, site)
+                if growing != 0:
+                    dataset_replica.growing = True
+                    dataset_replica.group = id_group_map[group_id]
+
+                for block_id, b_group_id, is_custodial, last_update, size, file_ids in block_replicas:
+                    block = id_block_map[block_id]
+                    block_replica = BlockReplica(
+                        block,
+                        site,
+                        group = id_group_map[b_group_id],
+                        is_custodial = (is_custodial == 1),
+                        last_update = last_update
+                    )
+
+                    if size >= 0:
+                        block_replica.size = size
+                        if BlockReplica._use_file_ids:
+                            block_replica.file_ids = array('l', file_ids)
+                        else:
+                            block_replica.file_ids = file_ids
+
+                    dataset_replica.block_replicas.add(block_replica)
+                    block.replicas.add(block_replica)
+
+                dataset.replicas.add(dataset_replica)
+                site.add_dataset_replica(dataset_replica, add_block_replicas = True)
+
+    return len(id_dataset_map), len(id_block_map)
+
+
+def load_shards(num_shards, write_shard, consume_shard, shm_dir = '/dev/shm'):
+    """
+    Fork num_shards worker processes, each calling write_shard(index, writer) with a ShardWriter. The shard
+    files are handed to consume_shard(chunks) in the parent in the order in which the workers finish, so that
+    the parent assembles one shard while the others are still being read from the store.
+
+    @param num_shards     Number of workers.
+    @param write_shard    Function run in the worker (the store connection must be created in the worker).
+    @param consume_shard  Function run in the parent with the chunk generator of each shard.
+    @param shm_dir        Directory for the shard files. The system temporary directory is used if it does
+                          not exist.
+    """
+    if not os.path.isdir(shm_dir):
+        shm_dir = None
+
+    workdir = tempfile.mkdtemp(prefix = 'dynamo_load_', dir = shm_dir)
+    done_queue = multiprocessing.Queue()
+
+    def run_worker(index, path):
+        try:
+            writer = ShardWriter(path)
+            write_shard(index, writer)
+            writer.close()
+        except:
+            done_queue.put((index, traceback.format_exc()))
+        else:
+            done_queue.put((index, None))
+
+    workers = []
+    try:
+        for index in xrange(num_shards):
+            path = '%s/shard_%d' % (workdir, index)
+            proc = multiprocessing.Process(target = run_worker, name = 'load_shard_%d' % index, args = (index, path))
+            proc.daemon = True
+            proc.start()
+            workers.append((proc, path))
+
+        for _ in xrange(num_shards):
+            while True:
+                try:
+                    index, error = done_queue.get(timeout = 5)
+                    break
+                except Queue.Empty:
+                    for proc, _ in workers:
+                        if proc.exitcode is not None and proc.exitcode != 0:
+                            raise RuntimeError('Inventory load worker %s died with exit code %d' % (proc.name, proc.exitcode))
+
+            proc, path = workers[index]
+            proc.join()
+
+            if error is not None:
+                raise RuntimeError('Inventory load worker %s failed:\n%s' % (proc.name, error))
+
+            start = time.time()
+            consume_shard(read_shard(path))
+            os.unlink(path)
+
+            LOG.debug('Assembled shard %d in %.1f seconds.', index, time.time() - start)
+
+    finally:
+        for proc, path in workers:
+            if proc.is_alive():
+                proc.terminate()
+                proc.join()
+
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+        os.rmdir(workdir)
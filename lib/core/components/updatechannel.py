@@ -0,0 +1,180 @@
+import mmap
+import struct
+import marshal
+import multiprocessing
+import Queue
+
+from dynamo.dataformat import Configuration
+
+class SharedRingBuffer(object):
+    """
+    Ring of fixed-size slots in anonymous shared memory. Must be created before the processes that use it are
+    forked. Supports one writer and one reader at a time. A message larger than a slot is split over several
+    consecutive slots; each slot starts with the payload length and a continuation flag.
+    """
+
+    _header = struct.Struct('<IB')
+
+    def __init__(self, num_slots, slot_size):
+        self.num_slots = num_slots
+        self.slot_size = slot_size
+        self.payload_size = slot_size - SharedRingBuffer._header.size
+
+        self._buffer = mmap.mmap(-1, num_slots * slot_size)
+        self._free = multiprocessing.Semaphore(num_slots)
+        self._filled = multiprocessing.Semaphore(0)
+        # next slot to write and to read
+        self._head = multiprocessing.RawValue('L', 0)
+        self._tail = multiprocessing.RawValue('L', 0)
+
+    def put(self, data, timeout = None):
+        """
+        Write a message, blocking while the ring is full.
+        @param data     Byte string
+        @param timeout  Raise RuntimeError if no slot frees up for this many seconds.
+        """
+        offset = 0
+        while True:
+            piece = data[offset:offset + self.payload_size]
+            offset += len(piece)
+            more = offset < len(data)
+
+            if not self._free.acquire(True, timeout):
+                raise RuntimeError('Shared ring buffer is not being read')
+
+            start = self._head.value * self.slot_size
+            SharedRingBuffer._header.pack_into(self._buffer, start, len(piece), more)
+            pos = start + SharedRingBuffer._header.size
+            self._buffer[pos:pos + len(piece)] = piece
+            self._head.value = (self._head.value + 1) % self.num_slots
+
+            self._filled.release()
+
+            if not more:
+                break
+
+    def get(self, timeout = None):
+        """
+        Read a message, blocking while the ring is empty.
+        @param timeout  Return None if no data arrives for this many seconds.
+        """
+        pieces = []
+        while True:
+            if not self._filled.acquire(True, timeout):
+                return None
+
+            start = self._tail.value * self.slot_size
+            length, more = SharedRingBuffer._header.unpack_from(self._buffer, start)
+            pos = start + SharedRingBuffer._header.size
+            pieces.append(self._buffer[pos:pos + length])
+            self._tail.value = (self._tail.value + 1) % self.num_slots
+
+            self._free.release()
+
+            if not more:
+                return ''.join(pieces)
+
+    def reset(self):
+        """
+        Discard the content left by a writer that died in the middle of a message. Call from the reader side
+        when no writer is active.
+        """
+        while self._filled.acquire(False):
+            self._free.release()
+
+        self._tail.value = self._head.value
+
+
+class UpdateChannel(object):
+    """
+    Transfer of inventory update commands from a forked application (or the web server) to the server process.
+    Commands are sent in chunks of chunk_size (cmd, objstr) pairs per queue item, and the queue holds at most
+    max_queued_chunks items, so that the sender blocks instead of filling the memory when the server is not
+    reading. Transfers of at least ring_threshold commands go through a shared-memory ring buffer when
+    ring_buffer_size (in MB) is nonzero; the queue then only carries a marker announcing the transfer.
+    The last chunk of every transfer ends with an end-of-message command.
+    """
+
+    RING_MARKER = 'ring'
+
+    def __init__(self, config = Configuration()):
+        self.chunk_size = config.get('chunk_size', 1000)
+
+        self._queue = multiprocessing.JoinableQueue(config.get('max_queued_chunks', 16))
+
+        ring_size = config.get('ring_buffer_size', 0)
+        if ring_size > 0:
+            slot_size = config.get('ring_slot_size', 65536)
+            self._ring = SharedRingBuffer(int(ring_size * 1024 * 1024) / slot_size, slot_size)
+            self.ring_threshold = config.get('ring_threshold', 100000)
+        else:
+            self._ring = None
+
+    def send(self, commands, eom, progress = None, timeout = 60):
+        """
+        Send the commands followed by the end-of-message command and wait until the receiver has read everything.
+        @param commands  List of (cmd, objstr)
+        @param eom       The end-of-message command
+        @param progress  Function called with the number of commands sent after each chunk.
+        @param timeout   Ring buffer only: give up if the receiver stops reading for this many seconds.
+        """
+        if self._ring is not None and len(commands) >= self.ring_threshold:
+            self._queue.put(UpdateChannel.RING_MARKER)
+            put = lambda chunk: self._ring.put(marshal.dumps(chunk, 2), timeout = timeout)
+        else:
+            put = self._queue.put
+
+        num_commands = len(commands)
+        for start in xrange(0, num_commands, self.chunk_size):
+            chunk = commands[start:start + self.chunk_size]
+            if start + self.chunk_size >= num_commands:
+                chunk.append((eom, None))
+
+            put(chunk)
+
+            if progress is not None:
+                progress(start + len(chunk))
+
+        if num_commands == 0:
+            put([(eom, None)])
+
+        # Wait until all messages are received
+        self._queue.join()
+
+    def receive(self, eom, block, timeout = 60):
+        """
+        Generator of received chunks (lists of (cmd, objstr)), up to and including the chunk with the
+        end-of-message command.
+        @param eom      The end-of-message command
+        @param block    If False, raise Queue.Empty immediately when nothing has been sent.
+        @param timeout  Raise Queue.Empty if the sender goes silent for this many seconds in the middle of a
+                        transfer.
+        """
+        item = self._queue.get(block = block, timeout = timeout)
+
+        if item == UpdateChannel.RING_MARKER:
+            try:
+                while True:
+                    data = self._ring.get(timeout = timeout)
+                    if data is None:
+                        self._ring.reset()
+                        raise Queue.Empty()
+
+                    chunk = marshal.loads(data)
+                    yield chunk
+
+                    if chunk[-1][0] == eom:
+                        break
+            finally:
+                # unblocks the sender
+                self._queue.task_done()
+
+        else:
+            while True:
+                self._queue.task_done()
+                yield item
+
+                if item[-1][0] == eom:
+                    break
+
+                item = self._queue.get(block = True, timeout = timeout)
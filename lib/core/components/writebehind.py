@@ -0,0 +1,242 @@
+import os
+import time
+import json
+import logging
+import collections
+
+from dynamo.dataformat import ObjectError
+
+LOG = logging.getLogger(__name__)
+
+class WriteBehindQueue(object):
+    """
+    Write-behind buffer between DynamoInventory and its InventoryStore. Updates and deletions are coalesced per
+    object and written to the store in typed batches (store.save_many / store.delete_many) when the number of
+    pending objects or the age of the oldest pending object exceeds the configured thresholds, or when flush()
+    is called explicitly.
+
+    Within one flush all updates are applied before all deletions. To preserve the ordering of the original
+    commands, an update arriving while deletions are pending triggers a flush first. Updates are applied parents
+    first (partitions -> block replicas), deletions children first.
+
+    Before touching the store, the content of the flush is written to a journal file. The journal is removed
+    after the store writes complete; if the process dies in between, recover() replays the journal into the
+    store on the next startup. Store writes are all upserts or deletions by key, so replaying is idempotent.
+    A journal that was not completely written is never renamed into place, which is consistent since the
+    store is not touched until the journal is in place.
+    """
+
+    CMD_UPDATE, CMD_DELETE = range(2)
+    _cmd_str = ['update', 'delete']
+
+    # Object types in the order of dependency
+    _type_order = ['Partition', 'Group', 'Site', 'SitePartition', 'Dataset', 'Block', 'File', 'DatasetReplica', 'BlockReplica']
+
+    _object_key = {
+        'Partition': lambda o: o.name,
+        'Group': lambda o: o.name,
+        'Site': lambda o: o.name,
+        'SitePartition': lambda o: (o.site.name, o.partition.name),
+        'Dataset': lambda o: o.name,
+        'Block': lambda o: o.full_name(),
+        'File': lambda o: o.lfn,
+        'DatasetReplica': lambda o: (o.dataset.name, o.site.name),
+        'BlockReplica': lambda o: (o.block.full_name(), o.site.name)
+    }
+
+    def __init__(self, store, config):
+        """
+        @param store   InventoryStore to write to.
+        @param config  Configuration with the following (optional) parameters:
+                       journal_path: Path of the journal file.
+                       max_pending:  Flush when this many objects are pending (default 10000).
+                       max_delay:    Flush when the oldest pending object is this many seconds old (default 10).
+        """
+
+        self.store = store
+
+        self.journal_path = config.get('journal_path', '/var/spool/dynamo/inventory_journal')
+        self.max_pending = config.get('max_pending', 10000)
+        self.max_delay = config.get('max_delay', 10.)
+
+        # {type_name: OrderedDict(key: object)}
+        self._updates = collections.defaultdict(collections.OrderedDict)
+        self._deletes = collections.defaultdict(collections.OrderedDict)
+        self._num_pending = 0
+        self._first_pending = 0
+
+    def __len__(self):
+        return self._num_pending
+
+    def update(self, obj):
+        """
+        Queue an update. Obj must be the object embedded in the inventory, as its state at the time of
+        the flush is what is written.
+        """
+
+        if len(self._deletes) != 0:
+            self.flush()
+
+        self._add(self._updates, obj)
+
+    def delete(self, obj):
+        """
+        Queue a deletion. A pending update of the same object is discarded.
+        """
+
+        tname = type(obj).__name__
+        key = WriteBehindQueue._object_key[tname](obj)
+
+        try:
+            self._updates[tname].pop(key)
+        except KeyError:
+            pass
+        else:
+            self._num_pending -= 1
+
+        self._add(self._deletes, obj)
+
+    def flush(self):
+        """
+        Write all pending updates and deletions to the store. Returns when the store is in sync.
+        """
+
+        if self._num_pending == 0:
+            return
+
+        commands = []
+        for tname in WriteBehindQueue._type_order:
+            try:
+                objects = self._updates[tname]
+            except KeyError:
+                continue
+
+            commands.extend((WriteBehindQueue.CMD_UPDATE, obj) for obj in objects.itervalues())
+
+        for tname in reversed(WriteBehindQueue._type_order):
+            try:
+                objects = self._deletes[tname]
+            except KeyError:
+                continue
+
+            commands.extend((WriteBehindQueue.CMD_DELETE, obj) for obj in objects.itervalues())
+
+        LOG.debug('Flushing %d commands to inventory store.', len(commands))
+
+        self._write_journal(commands)
+
+        self._apply(commands)
+
+        self._clear()
+
+        os.unlink(self.journal_path)
+
+    def recover(self, inventory):
+        """
+        Replay the journal left over from an interrupted flush. Objects are embedded into / unlinked from the
+        inventory before being written, so this must be called after the inventory is loaded.
+        @param inventory  ObjectRepository that owns the objects.
+
+        @return Number of commands replayed.
+        """
+
+        commands = self._read_journal()
+        if commands is None:
+            return 0
+
+        LOG.warning('Replaying %d commands from inventory journal %s.', len(commands), self.journal_path)
+
+        # Journal is already in the flush order; apply directly and remove the journal only at the end
+        replay = []
+        for cmd, repstr in commands:
+            obj = inventory.make_object(repstr)
+
+            if cmd == WriteBehindQueue.CMD_UPDATE:
+                replay.append((cmd, obj.embed_into(inventory)))
+            else:
+                try:
+                    deleted_object = obj.unlink_from(inventory)
+                except (KeyError, ObjectError):
+                    # Not in the store any more
+                    deleted_object = None
+
+                if deleted_object is not None:
+                    replay.append((cmd, deleted_object))
+
+        self._apply(replay)
+
+        os.unlink(self.journal_path)
+
+        return len(commands)
+
+    def _add(self, container, obj):
+        tname = type(obj).__name__
+        key = WriteBehindQueue._object_key[tname](obj)
+
+        objects = container[tname]
+
+        if key not in objects:
+            self._num_pending += 1
+            if self._num_pending == 1:
+                self._first_pending = time.time()
+
+        objects[key] = obj
+
+        if self._num_pending >= self.max_pending or time.time() - self._first_pending > self.max_delay:
+            self.flush()
+
+    def _apply(self, commands):
+        # Group consecutive commands with the same type and action into batches
+        batch = []
+        for cmd, obj in commands:
+            if len(batch) != 0 and (cmd != batch_cmd or type(obj) is not batch_type):
+                self._apply_batch(batch_cmd, batch)
+                batch = []
+
+            if len(batch) == 0:
+                batch_cmd = cmd
+                batch_type = type(obj)
+
+            batch.append(obj)
+
+        if len(batch) != 0:
+            self._apply_batch(batch_cmd, batch)
+
+    def _apply_batch(self, cmd, objects):
+        try:
+            if cmd == WriteBehindQueue.CMD_UPDATE:
+                self.store.save_many(objects)
+            else:
+                self.store.delete_many(objects)
+        except:
+            LOG.error('Exception writing %d %s %ss to inventory store', len(objects), WriteBehindQueue._cmd_str[cmd], type(objects[0]).__name__)
+            raise
+
+    def _clear(self):
+        self._updates.clear()
+        self._deletes.clear()
+        self._num_pending = 0
+
+    def _write_journal(self, commands):
+        # Write to a temporary file and rename, so that the journal is either absent or complete.
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w') as journal:
+            for cmd, obj in commands:
+                journal.write(json.dumps([WriteBehindQueue._cmd_str[cmd], repr(obj)]) + '\n')
+
+            journal.flush()
+            os.fsync(journal.fileno())
+
+        os.rename(tmp_path, self.journal_path)
+
+    def _read_journal(self):
+        if not os.path.exists(self.journal_path):
+            return None
+
+        commands = []
+        with open(self.journal_path) as journal:
+            for line in journal:
+                cmd_str, repstr = json.loads(line)
+                commands.append((WriteBehindQueue._cmd_str.index(cmd_str), str(repstr)))
+
+        return commands
@@ -5,6 +5,7 @@ from dynamo.policy.condition import Condition
 from dynamo.policy.variables import replica_variables
 import dynamo.dataformat as df
 from dynamo.core.components.persistency import InventoryStore
+from dynamo.core.components.writebehind import WriteBehindQueue
 
 LOG = logging.getLogger(__name__)
 
@@ -182,6 +183,11 @@ class DynamoInventory(ObjectRepository):
         self._has_store = False
 
         self._store = None
+
+        # Buffer for store writes (None -> write through)
+        self._write_behind_config = config.get('write_behind', None)
+        self._write_queue = None
+
         if 'persistency' in config:
             self._has_store = True
             self.init_store(config.persistency.module, config.persistency.config)
@@ -195,16 +201,27 @@ class DynamoInventory(ObjectRepository):
         self._store = InventoryStore.get_instance(module, config)
         self._store.server_side = True
 
+        if self._write_behind_config is not None:
+            self._write_queue = WriteBehindQueue(self._store, self._write_behind_config)
+
         df.Block.inventory_store = self._store
 
-    def clone_store(self, module, config):
+    def clone_store(self, module, config, incremental = False):
         source = InventoryStore.get_instance(module, config)
-        self._store.clone_from(source)
+        self._store.clone_from(source, incremental = incremental)
         source.close()
 
     def store_version(self):
         return self._store.version()
 
+    def flush(self):
+        """
+        Write all buffered updates and deletions to store. Must be called at the end of each batch of
+        update() / delete() calls.
+        """
+        if self._write_queue is not None:
+            self._write_queue.flush()
+
     def check_store(self):
         """
         Check the connection to store.
@@ -256,6 +273,10 @@ class DynamoInventory(ObjectRepository):
             dataset_names = dataset_names
         )
 
+        if self._write_queue is not None and self._has_store:
+            # Replay store writes that were interrupted by a crash
+            self._write_queue.recover(self)
+
         num_dataset_replicas = 0
         num_block_replicas = 0
 
@@ -379,6 +400,10 @@ class DynamoInventory(ObjectRepository):
         embedded_clone = ObjectRepository.update(self, obj)
 
         if self._has_store:
+            if self._write_queue is not None:
+                self._write_queue.update(embedded_clone)
+                return embedded_clone
+
             try:
                 embedded_clone.write_into(self._store)
             except:
@@ -400,6 +425,10 @@ class DynamoInventory(ObjectRepository):
             return None
 
         if self._has_store:
+            if self._write_queue is not None:
+                self._write_queue.delete(deleted_object)
+                return deleted_object
+
             try:
                 deleted_object.delete_from(self._store)
             except:
@@ -2,6 +2,7 @@ import time
 import threading
 import socket
 import logging
+import traceback
 
 from dynamo.core.components.host import ServerHost, OutOfSyncError
 from dynamo.core.components.master import MasterServer, AppManager
@@ -14,6 +15,10 @@ class ServerManager(object):
     Manager for the application and updates table and the connections to other servers.
     """
 
+    # Bounds of the backoff when waiting for other servers to finish updating (seconds)
+    _min_poll_interval = 0.05
+    _max_poll_interval = 1.
+
     def __init__(self, config):
         # Create a master server interface
         self.master = MasterServer.get_instance(config.master.module, config.master.config)
@@ -42,6 +47,12 @@ class ServerManager(object):
         
         self.status = ServerHost.STAT_INITIAL
 
+        # Sending updates to other servers
+        self.update_send_timeout = config.get('update_send_timeout', 600)
+        self.update_send_retries = config.get('update_send_retries', 2)
+        # Board writes that timed out {hostname: thread}. The thread keeps the board handle it was given.
+        self._abandoned_writes = {}
+
         # Heartbeat is sent in a separate thread
         self.heartbeat = threading.Thread(target = self.send_heartbeat)
         self.heartbeat.daemon = True
@@ -267,6 +278,16 @@ class ServerManager(object):
         """
         Send the list of update commands to all online servers.
 
+        Boards of all online servers are written concurrently, one thread per server. Each server is claimed
+        (status set to updating) under the master lock, which is released during the board writes. Servers
+        that are still processing updates from the previous write process are polled with a backoff, and
+        the polling wait is cut short whenever a board write completes. A failed board write is retried
+        update_send_retries times; the board is cleared before the retry, since the failed write may have
+        left part of the commands. A server whose write fails or takes longer than update_send_timeout
+        seconds is set to out-of-sync. A timed-out write keeps running in its thread with the board handle
+        it was given; the server gets a new handle, and is set to out-of-sync again as long as the old write
+        is running. The first write after the old write finished clears the board.
+
         @param update_commands  List of two-tuples (cmd, obj)
         """
         # Write-enabled process and server start do not happen simultaneously.
@@ -274,46 +295,137 @@ class ServerManager(object):
         # of running servers.
 
         processed = set()
+        # {hostname: (thread, start time, attempt)}
+        sending = {}
+        # [(hostname, thread, None or exception string)], filled by the sender threads
+        results = []
+        done = threading.Condition()
+
+        def write_board(hostname, board, clear):
+            try:
+                if clear:
+                    board.lock()
+                    try:
+                        board.flush()
+                        board.write_updates(update_commands)
+                    finally:
+                        board.unlock()
+                else:
+                    board.write_updates(update_commands)
+            except:
+                result = traceback.format_exc()
+            else:
+                result = None
+
+            with done:
+                results.append((hostname, threading.current_thread(), result))
+                done.notify()
+
+        def start_sending(server, attempt):
+            clear = (attempt != 0)
+
+            if server.hostname in self._abandoned_writes:
+                # checked to be finished; it may have written to the board after the server was resynchronized
+                self._abandoned_writes.pop(server.hostname)
+                clear = True
+
+            if server.board is None:
+                board_conf = self.master.get_board_config(server.hostname)
+                server.board = UpdateBoard.get_instance(board_conf[0], board_conf[1])
+
+            thread = threading.Thread(target = write_board, args = (server.hostname, server.board, clear), name = 'send_updates_' + server.hostname)
+            thread.daemon = True
+            thread.start()
+            sending[server.hostname] = (thread, time.time(), attempt)
+
+        poll_interval = ServerManager._min_poll_interval
 
         while True:
+            with done:
+                finished = list(results)
+                del results[:]
+
+            for hostname, thread, error in finished:
+                if hostname not in sending or sending[hostname][0] is not thread:
+                    # a write abandoned in an earlier call
+                    continue
+
+                thread, start, attempt = sending.pop(hostname)
+                server = self.other_servers.get(hostname)
+
+                if error is None:
+                    LOG.info('Sent %d update commands to %s in %.1f seconds.', len(update_commands), hostname, time.time() - start)
+                    processed.add(hostname)
+                elif attempt < self.update_send_retries and server is not None:
+                    LOG.warning('Error while sending updates to %s (attempt %d). Retrying.\n%s', hostname, attempt + 1, error)
+                    start_sending(server, attempt + 1)
+                else:
+                    LOG.error('Error while sending updates to %s. Setting server state to OUTOFSYNC.\n%s', hostname, error)
+                    self.set_status(ServerHost.STAT_OUTOFSYNC, hostname)
+                    processed.add(hostname)
+
+            for hostname, (thread, start, attempt) in sending.items():
+                if time.time() - start > self.update_send_timeout:
+                    # the thread cannot be stopped, but its result will be ignored
+                    LOG.error('Sending updates to %s timed out. Setting server state to OUTOFSYNC.', hostname)
+                    self.set_status(ServerHost.STAT_OUTOFSYNC, hostname)
+                    sending.pop(hostname)
+                    processed.add(hostname)
+
+                    # the thread keeps using the current board handle
+                    self._abandoned_writes[hostname] = thread
+                    server = self.other_servers.get(hostname)
+                    if server is not None:
+                        server.board = None
+
+            waiting = False
+
             self.master.lock()
 
             try:
                 self.collect_hosts()
-    
-                # update only one server at a time to minimize the time in lock
+
                 for server in self.other_servers.itervalues():
-                    if server.hostname not in processed:
-                        break
-                else:
-                    # all processed, we are done
-                    break
+                    if server.hostname in processed or server.hostname in sending:
+                        continue
 
-                if server.status == ServerHost.STAT_ONLINE:
-                    processed.add(server.hostname)
+                    if server.status == ServerHost.STAT_ONLINE:
+                        abandoned = self._abandoned_writes.get(server.hostname)
+                        if abandoned is not None and abandoned.is_alive():
+                            # cannot write until the timed-out write is over
+                            LOG.error('Sending updates to %s is still in progress from an earlier update. Setting server state to OUTOFSYNC.', server.hostname)
+                            self.set_status(ServerHost.STAT_OUTOFSYNC, server.hostname)
+                            processed.add(server.hostname)
+                            continue
 
-                    self.set_status(ServerHost.STAT_UPDATING, server.hostname)
-                    try:
-                        server.board.write_updates(update_commands)
-                    except:
-                        LOG.error('Error while sending updates to %s. Setting server state to OUTOFSYNC.', server.hostname)
-                        self.set_status(ServerHost.STAT_OUTOFSYNC, server.hostname)
-                    else:
-                        LOG.info('Sent %d update commands to %s.', len(update_commands), server.hostname)
-                        
+                        self.set_status(ServerHost.STAT_UPDATING, server.hostname)
+                        start_sending(server, 0)
 
-                elif server.status == ServerHost.STAT_UPDATING:
-                    # this server is still processing updates from the previous write process
-                    continue
+                    elif server.status == ServerHost.STAT_UPDATING:
+                        # this server is still processing updates from the previous write process
+                        waiting = True
 
-                else:
-                    # any other status means the server is not running
-                    processed.add(server.hostname)
+                    else:
+                        # any other status means the server is not running
+                        processed.add(server.hostname)
 
             finally:
                 self.master.unlock()
 
-            time.sleep(1)
+            if len(sending) == 0 and not waiting:
+                # all processed, we are done
+                break
+
+            if waiting:
+                timeout = poll_interval
+                poll_interval = min(poll_interval * 2, ServerManager._max_poll_interval)
+            else:
+                # only waiting for board writes - wake up at the earliest timeout if nothing completes
+                timeout = min(start for _, start, _ in sending.itervalues()) + self.update_send_timeout - time.time()
+
+            with done:
+                if len(results) == 0:
+                    done.wait(max(timeout, 0.))
 
     def disconnect(self):
         """
@@ -321,5 +433,5 @@ class ServerManager(object):
         """
         self.master.disconnect()
         for server in self.other_servers.itervalues():
-            if server.board:
+            if server.board is not None:
                 server.board.disconnect()
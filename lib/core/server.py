@@ -18,6 +18,8 @@ import dynamo.core.serverutils as serverutils
 from dynamo.core.components.appserver import AppServer
 from dynamo.core.components.host import ServerHost, OutOfSyncError
 from dynamo.core.components.appmanager import AppManager
+from dynamo.core.components.updatechannel import UpdateChannel
+from dynamo.core.components.eventpipe import EventPipe
 from dynamo.web.server import WebServer
 from dynamo.utils.log import log_exception, reset_logger
 from dynamo.utils.signaling import SignalBlocker
@@ -76,8 +78,12 @@ class DynamoServer(object):
     
                 self.inventory_load_opts[objs] = (included, excluded)
 
-        ## Queue to send / receive inventory updates
-        self.inventory_update_queue = multiprocessing.JoinableQueue()
+        ## Channel to send / receive inventory updates
+        self.inventory_update_channel = UpdateChannel(config.get('update_transfer', Configuration()))
+
+        ## Wakes up the main loop when applications are scheduled or exit, or updates are sent
+        ## (poll_interval becomes the fallback for events that happen elsewhere, e.g. submissions to other servers)
+        self.event_pipe = EventPipe()
 
         ## Recipient of error message emails
         self.notification_recipient = config.notification_recipient
@@ -109,9 +115,10 @@ class DynamoServer(object):
                 if version == self.inventory.store_version():
                     LOG.info('Local persistency store is up to date.')
                 else:
-                    # TODO cloning can take hours; need a way to unblock other servers and pool the updates
+                    # Only the id ranges that differ between the stores are copied, but a full clone
+                    # into an empty store can still take hours.
                     LOG.info('Cloning inventory content from persistency store at %s', hostname)
-                    self.inventory.clone_store(module, config)
+                    self.inventory.clone_store(module, config, incremental = True)
             else:
                 # Use this remote store as mine (read-only)
                 self._setup_remote_store(hostname, module, config)
@@ -215,7 +222,7 @@ class DynamoServer(object):
         Step 4: Apply updates sent by other servers.
         Step 5: Collect completed child processes. Get updates from the write-enabled child process if there is one.
         Step 6: Clean up.
-        Step 7: Sleep for N seconds.
+        Step 7: Wait for an event (application scheduled or exited, updates sent) for up to N seconds.
         """
 
         # Start the application collector thread
@@ -254,9 +261,8 @@ class DynamoServer(object):
     
                 ## Step 7 (easier to do here because we use "continue"s)
                 if do_sleep:
-                    # one successful cycle - reset the error counter
-                    LOG.debug('Sleep ' + str(self.poll_interval))
-                    time.sleep(self.poll_interval)
+                    LOG.debug('Wait for events for up to %.1f second(s)', self.poll_interval)
+                    self._wait_for_events(child_processes)
     
                 ## Step 1: Poll
                 LOG.debug('Polling for applications.')
@@ -283,7 +289,7 @@ class DynamoServer(object):
     
                     do_sleep = True
     
-                    LOG.debug('No application found, sleeping for %.1f second(s).' % self.poll_interval)
+                    LOG.debug('No application found, waiting for up to %.1f second(s).' % self.poll_interval)
                     continue
     
                 ## Step 2: If a script is found, check the authorization of the script.
@@ -382,7 +388,7 @@ class DynamoServer(object):
         """
         Infinite-loop main body of the daemon.
         Step 1: Apply updates sent by other servers.
-        Step 2: Sleep for N seconds.
+        Step 2: Wait for an event for up to N seconds.
         """
 
         LOG.info('Start checking for updates.')
@@ -398,7 +404,7 @@ class DynamoServer(object):
                     self._collect_updates_from_web()
     
                 ## Step 2
-                time.sleep(self.poll_interval)
+                self.event_pipe.wait(self.poll_interval)
 
         except KeyboardInterrupt:
             raise
@@ -414,6 +420,16 @@ class DynamoServer(object):
 
             raise
 
+    def _wait_for_events(self, child_processes):
+        events = self.event_pipe.wait(self.poll_interval)
+
+        exited = set(value for event, value in events if event == EventPipe.APP_EXITED)
+        if len(exited) != 0:
+            # Application processes notify right before exiting; join them so that _collect_processes sees them done
+            for app_id, proc, _ in child_processes:
+                if app_id in exited:
+                    proc.join(5)
+
     def _setup_remote_store(self, hostname, module, config):
         LOG.info('Using persistency store at %s', hostname)
         self.manager.register_remote_store(hostname)
@@ -503,6 +519,9 @@ class DynamoServer(object):
 
             self.manager.master.update_application(app_id, status = status, exit_code = proc.exitcode)
 
+            # The application may be a part of a scheduled sequence
+            self.appserver.wake_scheduler()
+
     def _collect_updates(self):
         print_every = 100000
         updates_received = 0
@@ -511,40 +530,37 @@ class DynamoServer(object):
         reading = False
         update_commands = []
 
-        while True:
-            try:
-                # Once we have an item sent, we'll read until the end (EOM).
-                # If the child dies in the middle of messaging, we get out of the while loop by timeout = 60
-                cmd, objstr = self.inventory_update_queue.get(block = reading, timeout = 60)
-            except Queue.Empty:
-                if reading:
-                    # The child process crashed or timed out
-                    return 2, update_commands
-                else:
-                    return 0, update_commands
-            else:
-                self.inventory_update_queue.task_done()
-
-                reading = True # Now we have to read until the end - start blocking queue.get
+        try:
+            # Once we have a chunk sent, we'll read until the end (EOM).
+            # If the child dies in the middle of messaging, we get out of the loop by timeout = 60
+            for chunk in self.inventory_update_channel.receive(DynamoInventory.CMD_EOM, block = False, timeout = 60):
+                reading = True
+
+                for cmd, objstr in chunk:
+                    if LOG.getEffectiveLevel() == logging.DEBUG:
+                        if cmd == DynamoInventory.CMD_UPDATE:
+                            LOG.debug('Update %d from queue: %s', updates_received, objstr)
+                        elif cmd == DynamoInventory.CMD_DELETE:
+                            LOG.debug('Delete %d from queue: %s', deletes_received, objstr)
 
-                if LOG.getEffectiveLevel() == logging.DEBUG:
                     if cmd == DynamoInventory.CMD_UPDATE:
-                        LOG.debug('Update %d from queue: %s', updates_received, objstr)
+                        updates_received += 1
+                        update_commands.append((cmd, objstr))
                     elif cmd == DynamoInventory.CMD_DELETE:
-                        LOG.debug('Delete %d from queue: %s', deletes_received, objstr)
+                        deletes_received += 1
+                        update_commands.append((cmd, objstr))
 
-                if cmd == DynamoInventory.CMD_UPDATE:
-                    updates_received += 1
-                    update_commands.append((cmd, objstr))
-                elif cmd == DynamoInventory.CMD_DELETE:
-                    deletes_received += 1
-                    update_commands.append((cmd, objstr))
+                    if cmd == DynamoInventory.CMD_EOM or len(update_commands) % print_every == 0:
+                        LOG.info('Received %d updates and %d deletes.', updates_received, deletes_received)
 
-                if cmd == DynamoInventory.CMD_EOM or len(update_commands) % print_every == 0:
-                    LOG.info('Received %d updates and %d deletes.', updates_received, deletes_received)
+        except Queue.Empty:
+            if reading:
+                # The child process crashed or timed out
+                return 2, update_commands
+            else:
+                return 0, update_commands
 
-                if cmd == DynamoInventory.CMD_EOM:
-                    return 1, update_commands
+        return 1, update_commands
 
     def _collect_updates_from_web(self):
         if self.manager.master.get_writing_process_id() != 0 or self.manager.master.get_writing_process_host() != self.manager.hostname:
@@ -637,6 +653,9 @@ class DynamoServer(object):
                 if deleted_object is not None:
                     CHANGELOG.info('Deleting %s', str(deleted_object))
 
+        # Write-behind barrier: the store must be in sync before advertising its version
+        self.inventory.flush()
+
         if num_updates + num_deletes != 0:
             if self.inventory.has_store:
                 self.manager.master.advertise_store_version(self.inventory.store_version())
@@ -648,14 +667,20 @@ class DynamoServer(object):
         return num_updates, num_deletes
 
     def _start_subprocess(self, app, is_local):
-        proc_args = (app['path'], app['args'], is_local, app['auth_level'])
+        proc_args = (app['appid'], app['path'], app['args'], is_local, app['auth_level'])
 
-        proc = multiprocessing.Process(target = self.run_script, name = app['title'], args = proc_args)
+        proc = multiprocessing.Process(target = self._run_subprocess, name = app['title'], args = proc_args)
         proc.daemon = True
         proc.start()
 
         return proc
 
+    def _run_subprocess(self, app_id, path, args, is_local, auth_level):
+        try:
+            self.run_script(path, args, is_local, auth_level)
+        finally:
+            self.event_pipe.notify(EventPipe.APP_EXITED, app_id)
+
     def run_script(self, path, args, is_local, auth_level):
         """
         Main function for script execution.
@@ -865,26 +890,24 @@ class DynamoServer(object):
         sys.stderr.write('Sending %d updated objects to the server process.\n' % nobj)
         sys.stderr.flush()
 
-        wm = 0.
-        for iobj, (cmd, objstr) in enumerate(inventory._update_commands):
-            if float(iobj) / nobj * 100. > wm:
-                sys.stderr.write(' %.0f%%..' % (float(iobj) / nobj * 100.))
+        wm = [0.]
+        def progress(nsent):
+            while float(nsent) / nobj * 100. > wm[0] and wm[0] < 100.:
+                sys.stderr.write(' %.0f%%..' % wm[0])
                 sys.stderr.flush()
-                wm += 5.
-    
-            try:
-                self.inventory_update_queue.put((cmd, objstr))
-            except:
-                sys.stderr.write('Exception while sending %s %s\n' % (DynamoInventory._cmd_str[cmd], objstr))
-                sys.stderr.flush()
-                raise
-    
+                wm[0] += 5.
+
+        # The server reads the updates in its main loop
+        self.event_pipe.notify(EventPipe.UPDATES_SENT)
+
+        try:
+            # Chunks of commands followed by end-of-message. Returns when all messages are received
+            self.inventory_update_channel.send(inventory._update_commands, DynamoInventory.CMD_EOM, progress = (progress if nobj != 0 else None))
+        except:
+            sys.stderr.write('Exception while sending updates\n')
+            sys.stderr.flush()
+            raise
+
         if nobj != 0:
             sys.stderr.write(' 100%.\n')
             sys.stderr.flush()
-        
-        # Put end-of-message
-        self.inventory_update_queue.put((DynamoInventory.CMD_EOM, None))
-    
-        # Wait until all messages are received
-        self.inventory_update_queue.join()
@@ -0,0 +1,12 @@
+# Shared name strings for the dataformat objects
+
+def intern_name(name):
+    """
+    Return the interned copy of a name. Objects created from the store, from update strings (make_object)
+    and from application code then share one string per name, and dict lookups by name can succeed on
+    identity. Non-str names (None, unicode) are returned unchanged.
+    """
+    if type(name) is str:
+        return intern(name)
+    else:
+        return name
@@ -180,14 +180,20 @@ class Block(object):
         @param lfn        File name
         @param must_find  Raise an exception if file is not found.
         """
-        try:
-            return next(f for f in self.files if f._lfn == lfn)
+        from lfile import File # lfile imports block
 
-        except StopIteration:
-            if must_find:
-                raise ObjectError('Cannot find file %s' % str(lfn))
-            else:
-                return None
+        # compare the split form instead of reconstructing the LFN of every file
+        prefix_id, suffix = File.split_lfn(lfn, register = False)
+
+        if prefix_id is not None:
+            for lfile in self.files:
+                if lfile._lfn_suffix == suffix and lfile._lfn_prefix_id == prefix_id:
+                    return lfile
+
+        if must_find:
+            raise ObjectError('Cannot find file %s' % str(lfn))
+        else:
+            return None
 
     def add_file(self, lfile):
         """
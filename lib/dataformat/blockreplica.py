@@ -1,5 +1,7 @@
 import logging
 import time
+import bisect
+from array import array
 
 from exceptions import ObjectError
 from block import Block
@@ -11,10 +13,45 @@ class BlockReplica(object):
     """Block placement at a site. Holds an attribute 'group' which can be None.
     BlockReplica size can be different from that of the Block."""
 
-    __slots__ = ['_block', '_site', 'group', 'is_custodial', 'size', 'last_update', 'file_ids']
+    __slots__ = ['_block', '_site', 'group', 'is_custodial', 'size', 'last_update', '_file_ids']
 
     _use_file_ids = True
 
+    @staticmethod
+    def pack_file_ids(file_ids):
+        """
+        Compact form of a file id list. Lists of integer ids are stored as a sorted array('l'), which takes
+        8 bytes per file instead of a boxed int plus a tuple slot, and allows equality tests and lookups
+        without building sets. Lists containing LFNs (files not yet registered) remain tuples.
+        The returned array is shared between replicas and must not be modified in place.
+        """
+        try:
+            return array('l', sorted(file_ids))
+        except TypeError:
+            return tuple(file_ids)
+
+    @staticmethod
+    def covers_block(block, replicas):
+        """
+        Check if the union of the files in the replicas amounts to the full block.
+        @param block     Block object
+        @param replicas  Iterable of BlockReplicas of the block
+
+        @return True if all files of the block are in at least one of the replicas.
+        """
+        replica_files = set()
+        for replica in replicas:
+            if replica.file_ids is None:
+                return True
+
+            replica_files.update(replica.file_ids)
+
+        # replica file ids are a subset of block file ids; counting first avoids loading the block files
+        if len(replica_files) < block.num_files:
+            return False
+
+        return replica_files.issuperset(f.id for f in block.files)
+
     @property
     def block(self):
         return self._block
@@ -23,6 +60,17 @@ class BlockReplica(object):
     def site(self):
         return self._site
 
+    @property
+    def file_ids(self):
+        return self._file_ids
+
+    @file_ids.setter
+    def file_ids(self, value):
+        if BlockReplica._use_file_ids and value is not None and type(value) is not array:
+            value = BlockReplica.pack_file_ids(value)
+
+        self._file_ids = value
+
     @property
     def num_files(self):
         if self.file_ids is None:
@@ -83,7 +131,10 @@ class BlockReplica(object):
         else:
             self.size = size
 
-            if BlockReplica._use_file_ids:
+            if BlockReplica._use_file_ids and type(file_ids) is array:
+                # already packed
+                self.file_ids = file_ids
+            elif BlockReplica._use_file_ids:
                 # some iterable
                 tmplist = []
                 for fid in file_ids:
@@ -91,8 +142,8 @@ class BlockReplica(object):
                         tmplist.append(self._block.find_file(fid, must_find = True).id)
                     else:
                         tmplist.append(fid)
-    
-                self.file_ids = tuple(tmplist)
+
+                self.file_ids = tmplist
             else:
                 # must be an integer
                 self.file_ids = file_ids
@@ -110,7 +161,10 @@ class BlockReplica(object):
             file_ids = None
         else:
             size = self.size
-            file_ids = self.file_ids
+            if self.file_ids is None or not BlockReplica._use_file_ids:
+                file_ids = self.file_ids
+            else:
+                file_ids = tuple(self.file_ids)
 
         return 'BlockReplica(%s,%s,%s,%s,%d,%d,%s)' % \
             (repr(self._block_full_name()), repr(self._site_name()), repr(self._group_name()), \
@@ -123,7 +177,11 @@ class BlockReplica(object):
                (self.file_ids is not None and other.file_ids is None):
                 return False
 
-            file_ids_match = (self.file_ids == other.file_ids) or ((len(self.file_ids) == len(other.file_ids)) and (set(self.file_ids) == set(other.file_ids)))
+            if self.file_ids is None or (type(self.file_ids) is array and type(other.file_ids) is array):
+                # packed arrays are sorted
+                file_ids_match = (self.file_ids == other.file_ids)
+            else:
+                file_ids_match = (len(self.file_ids) == len(other.file_ids)) and (set(self.file_ids) == set(other.file_ids))
         else:
             file_ids_match = self.file_ids == other.file_ids
 
@@ -241,7 +299,7 @@ class BlockReplica(object):
         self._block.replicas.remove(self)
 
     def write_into(self, store):
-        if BlockReplica._use_file_ids and self.file_ids is not None:
+        if BlockReplica._use_file_ids and self.file_ids is not None and type(self.file_ids) is not array:
             for fid in self.file_ids:
                 try:
                     fid += 0
@@ -301,7 +359,7 @@ class BlockReplica(object):
             return False
 
         else:
-            return lfile.id in self.file_ids
+            return self._has_file_id(lfile.id)
 
     def add_file(self, lfile):
         if lfile.block != self.block:
@@ -330,7 +388,7 @@ class BlockReplica(object):
             if self.size == self.block.size and len(file_ids) == self.block.num_files:
                 self.file_ids = None
             else:
-                self.file_ids = tuple(file_ids)
+                self.file_ids = file_ids
 
         else:
             self.file_ids += 1
@@ -361,14 +419,14 @@ class BlockReplica(object):
                 else:                    
                     file_ids = [(f.id if f.id != 0 else f.lfn) for f in self.block.files]
 
-            elif identifier not in self.file_ids:
+            elif not self._has_file_id(identifier):
                 return False
 
             else:
                 file_ids = list(self.file_ids)
 
             file_ids.remove(identifier)
-            self.file_ids = tuple(file_ids)
+            self.file_ids = file_ids
 
         else:
             self.file_ids -= 1
@@ -377,6 +435,18 @@ class BlockReplica(object):
 
         return True
 
+    def _has_file_id(self, fid):
+        file_ids = self.file_ids
+        if type(file_ids) is array:
+            if type(fid) is str:
+                return False
+
+            # sorted -> binary search
+            idx = bisect.bisect_left(file_ids, fid)
+            return idx != len(file_ids) and file_ids[idx] == fid
+        else:
+            return fid in file_ids
+
     def _block_full_name(self):
         if type(self._block) is str:
             return self._block
@@ -422,6 +492,9 @@ class BlockReplica(object):
         if BlockReplica._use_file_ids:
             if other.file_ids is None:
                 self.file_ids = None
+            elif type(other.file_ids) is array:
+                # packed arrays are never modified in place and can be shared
+                self.file_ids = other.file_ids
             else:
                 tmplist = []
                 for fid in other.file_ids:
@@ -438,7 +511,7 @@ class BlockReplica(object):
                     else:
                         tmplist.append(fid)
     
-                self.file_ids = tuple(tmplist)
+                self.file_ids = tmplist
 
         else:
             self.file_ids = other.file_ids
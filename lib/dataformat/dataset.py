@@ -3,6 +3,7 @@ import copy
 import threading
 
 from exceptions import ObjectError
+from _intern import intern_name
 from _namespace import customize_dataset
 
 class Dataset(object):
@@ -100,7 +101,7 @@ class Dataset(object):
         if Dataset.name_pattern is not None and not Dataset.name_pattern.match(name):
             raise ObjectError('Invalid dataset name %s' % name)
             
-        self._name = name
+        self._name = intern_name(name)
         self.status = Dataset.status_val(status)
         self.data_type = Dataset.data_type_val(data_type)
         self.software_version = software_version
@@ -1,4 +1,5 @@
 from exceptions import ObjectError
+from _intern import intern_name
 
 class Group(object):
     """
@@ -34,7 +35,7 @@ class Group(object):
         return self._olevel
 
     def __init__(self, name, olevel = OL_BLOCK, gid = 0):
-        self._name = name
+        self._name = intern_name(name)
         self._olevel = Group.olevel_val(olevel)
 
         self.id = gid
@@ -1,3 +1,5 @@
+import threading
+
 from exceptions import ObjectError
 from block import Block
 from blockreplica import BlockReplica
@@ -6,20 +8,62 @@ from _namespace import customize_file
 class File(object):
     """Represents a file. Atomic unit of data."""
 
-    __slots__ = ['_lfn', '_block', 'id', 'size', 'checksum']
+    __slots__ = ['_lfn_prefix_id', '_lfn_suffix', '_block', 'id', 'size', 'checksum']
 
     checksum_algorithms = tuple() # redefined in _namespace
 
+    # LFNs of a dataset share long directory prefixes. The prefixes are kept once in a shared table and each
+    # file holds the index of its prefix and the remaining part of the name. Prefixes are never removed (the
+    # table does not know which are still in use), so the table is capped: once it holds max_lfn_prefixes
+    # entries, files with a new prefix keep the whole LFN as the suffix of the empty prefix 0.
+    max_lfn_prefixes = 1000000
+    _lfn_prefixes_byid = ['']
+    _lfn_prefixes_byvalue = {'': 0}
+    _lfn_prefix_lock = threading.Lock()
+
+    @staticmethod
+    def split_lfn(lfn, register = True):
+        """
+        @param lfn       File name
+        @param register  Add the prefix to the table if it is not known yet.
+
+        @return (prefix id, suffix). Prefix id is None if register is False and the prefix is unknown (no file
+                can have this LFN). If the table is full, an unknown prefix gives (0, lfn).
+        """
+        delim = lfn.rfind('/') + 1
+        prefix = lfn[:delim]
+
+        try:
+            return File._lfn_prefixes_byvalue[prefix], lfn[delim:]
+        except KeyError:
+            if len(File._lfn_prefixes_byid) >= File.max_lfn_prefixes:
+                return 0, lfn
+            elif not register:
+                return None, lfn[delim:]
+
+        with File._lfn_prefix_lock:
+            try:
+                prefix_id = File._lfn_prefixes_byvalue[prefix]
+            except KeyError:
+                if len(File._lfn_prefixes_byid) >= File.max_lfn_prefixes:
+                    return 0, lfn
+
+                prefix_id = len(File._lfn_prefixes_byid)
+                File._lfn_prefixes_byid.append(prefix)
+                File._lfn_prefixes_byvalue[prefix] = prefix_id
+
+        return prefix_id, lfn[delim:]
+
     @property
     def lfn(self):
-        return self._lfn
+        return File._lfn_prefixes_byid[self._lfn_prefix_id] + self._lfn_suffix
 
     @property
     def block(self):
         return self._block
 
     def __init__(self, lfn, block = None, size = 0, checksum = tuple(), fid = 0):
-        self._lfn = lfn
+        self._lfn_prefix_id, self._lfn_suffix = File.split_lfn(lfn)
         self._block = block
         self.size = size
         self.checksum = checksum
@@ -27,14 +71,14 @@ class File(object):
         self.id = fid
 
     def __str__(self):
-        return 'File %s (block=%s, size=%d, checksum=%s, id=%d)' % (self._lfn, self._block_full_name(), self.size, str(self.checksum), self.id)
+        return 'File %s (block=%s, size=%d, checksum=%s, id=%d)' % (self.lfn, self._block_full_name(), self.size, str(self.checksum), self.id)
 
     def __repr__(self):
-        return 'File(%s,%s,%d,%s,%d)' % (repr(self._lfn), repr(self._block_full_name()), self.size, repr(self.checksum), self.id)
+        return 'File(%s,%s,%d,%s,%d)' % (repr(self.lfn), repr(self._block_full_name()), self.size, repr(self.checksum), self.id)
 
     def __eq__(self, other):
         return self is other or \
-            (self._lfn == other._lfn and self._block_full_name() == other._block_full_name() and \
+            (self._lfn_suffix == other._lfn_suffix and self._lfn_prefix_id == other._lfn_prefix_id and self._block_full_name() == other._block_full_name() and \
              self.size == other.size and self.checksum == other.checksum)
 
     def __ne__(self, other):
@@ -48,7 +92,7 @@ class File(object):
 
     def embed_into(self, inventory, check = False):
         if self._block_name() is None:
-            raise ObjectError('Cannot embed into inventory a stray file %s' % self._lfn)
+            raise ObjectError('Cannot embed into inventory a stray file %s' % self.lfn)
 
         try:
             dataset = inventory.datasets[self._dataset_name()]
@@ -62,13 +106,13 @@ class File(object):
             # so we don't call block.find_file (which triggers an inventory store lookup) but simply
             # return a clone of this file linked to the proper block.
             # Also in this case the function will never be called with check = True
-            return File(self._lfn, block, self.size, self.checksum, self.id)
+            return File(self.lfn, block, self.size, self.checksum, self.id)
 
         # At this point (if there is any change) block must have loaded files as a non-volatile set
-        lfile = block.find_file(self._lfn)
+        lfile = block.find_file(self.lfn)
         updated = False
         if lfile is None:
-            lfile = File(self._lfn, block, self.size, self.checksum, self.id)
+            lfile = File(self.lfn, block, self.size, self.checksum, self.id)
             block.add_file(lfile) # doesn't change the block attributes
 
             updated = True
@@ -99,9 +143,9 @@ class File(object):
             # This is the server-side main inventory which doesn't need a running image of files,
             # so we don't call block.find_file (which triggers an inventory store lookup) but simply
             # return a clone of this file linked to the proper block.
-            return File(self._lfn, block, self.size, self.checksum, self.id)
+            return File(self.lfn, block, self.size, self.checksum, self.id)
 
-        lfile = block.find_file(self._lfn)
+        lfile = block.find_file(self.lfn)
         if lfile is None:
             return None
 
@@ -3,6 +3,7 @@ import re
 
 from exceptions import ObjectError, IntegrityError
 from sitepartition import SitePartition
+from _intern import intern_name
 
 class Site(object):
     """Represents a site. Owns lists of dataset and block replicas, which are organized into partitions."""
@@ -48,6 +49,23 @@ class Site(object):
         return self._name
 
     class FileNameMapping(object):
+        """
+        LFN-to-PFN mapping by chains of regular expression rules. The first chain that goes through returns the PFN.
+        Chains whose rules are all literal prefix substitutions ('^/store/(.*)$' -> 'srm://host/path/store/{0}') are
+        applied by string operations. Since LFNs of a dataset share directories, the outcome of the chains is
+        memoized per directory: which chain decides for all LFNs of the directory and, for a prefix chain, the
+        translated directory. Directories where a regex chain must be evaluated are memoized with the index of that
+        chain, and the chains are walked from there for each LFN.
+        """
+
+        # maximum number of memoized directories
+        memo_size = 10000
+
+        # (literal prefix, pattern) of a regex that is a literal prefix substitution, e.g. ^/store/(.*)$
+        _prefix_re = re.compile(r'\^?((?:[^.^$*+?{}\[\]\\|()]|\\[^A-Za-z0-9])*)\(\.\*\)\$?$')
+        _replacement_re = re.compile(r'([^{}]*)\{0\}$')
+        _unescape_re = re.compile(r'\\(.)')
+
         def __init__(self, chains):
             """
             @param chains  List of chains. A chain is a list of 2-tuples (lfn pattern, pfn replacement)
@@ -58,12 +76,21 @@ class Site(object):
             self._chains = copy.deepcopy(chains)
             # compiled versions for actual use
             self._re_chains = []
+            # [(literal prefix of the first rule, [(prefix, replacement prefix)] or None if not a prefix chain)]
+            self._compiled_chains = []
             for chain in chains:
                 re_chain = []
                 for lfnpat, pfnpat in chain:
                     re_chain.append((re.compile(lfnpat), pfnpat))
 
                 self._re_chains.append(re_chain)
+                self._compiled_chains.append(Site.FileNameMapping._compile_chain(chain))
+
+            # the memo is only useful if some chain is a prefix chain
+            self._use_memo = any(prefix_chain is not None for _, prefix_chain in self._compiled_chains)
+            # {directory: None (no chain maps) or (chain index, translated directory or None)}
+            self._memo = {}
+            self._old_memo = {}
 
         def __eq__(self, other):
             return self._chains == other._chains
@@ -75,23 +102,145 @@ class Site(object):
             return repr(self._chains)
 
         def map(self, lfn):
-            for chain in self._re_chains:
+            if not self._use_memo or '\n' in lfn:
+                # $ and . behave differently around newlines; let re decide
+                return self._map_re(lfn, 0)
+
+            slash = lfn.rfind('/') + 1
+            directory = lfn[:slash]
+
+            try:
+                outcome = self._memo[directory]
+            except KeyError:
+                try:
+                    outcome = self._old_memo[directory]
+                except KeyError:
+                    outcome = self._map_directory(directory)
+
+                if len(self._memo) >= Site.FileNameMapping.memo_size / 2:
+                    self._old_memo = self._memo
+                    self._memo = {}
+
+                self._memo[directory] = outcome
+
+            if outcome is None:
+                return None
+
+            ichain, pfn_directory = outcome
+            if pfn_directory is None:
+                return self._map_re(lfn, ichain)
+            else:
+                return pfn_directory + lfn[slash:]
+
+        def _map_directory(self, directory):
+            """
+            Apply the chains to the directory part of LFNs.
+            @return None if no chain maps any LFN in the directory, (chain index, translated directory) if prefix
+                    chain of the index maps all of them, (chain index, None) if the chain must be evaluated per LFN.
+            """
+            for ichain, (first_prefix, prefix_chain) in enumerate(self._compiled_chains):
+                if len(first_prefix) <= len(directory):
+                    if not directory.startswith(first_prefix):
+                        continue
+                elif not first_prefix.startswith(directory):
+                    continue
+
+                if prefix_chain is None:
+                    return (ichain, None)
+
+                source = directory
+                for prefix, replacement in prefix_chain:
+                    if len(prefix) > len(source):
+                        if prefix.startswith(source):
+                            # depends on the file name
+                            return (ichain, None)
+                        else:
+                            break
+                    elif not source.startswith(prefix):
+                        break
+
+                    source = replacement + source[len(prefix):]
+                else:
+                    return (ichain, source)
+
+            return None
+
+        def _map_re(self, lfn, first_chain):
+            for ichain in xrange(first_chain, len(self._re_chains)):
+                if not lfn.startswith(self._compiled_chains[ichain][0]):
+                    continue
+
                 source = lfn
-                for source_re, dest_pat in chain:
+                for source_re, dest_pat in self._re_chains[ichain]:
                     matches = source_re.match(source)
                     if matches is None:
                         break
 
-                    source = dest_pat.format(*tuple(matches.group(i + 1) for i in xrange(source_re.groups)))
+                    source = dest_pat.format(*matches.groups())
                 else:
                     # could go through the entire chain - source is the mapped pfn
                     return source
 
             return None
 
+        @staticmethod
+        def _compile_chain(chain):
+            """
+            @return (literal prefix of the first rule, [(prefix, replacement prefix)] or None)
+            """
+            cls = Site.FileNameMapping
+
+            prefix_chain = []
+            for lfnpat, pfnpat in chain:
+                pmatch = cls._prefix_re.match(lfnpat)
+                rmatch = cls._replacement_re.match(pfnpat)
+                if pmatch is None or rmatch is None:
+                    prefix_chain = None
+                    break
+
+                prefix_chain.append((cls._unescape_re.sub(r'\1', pmatch.group(1)), rmatch.group(1)))
+
+            if prefix_chain is not None:
+                if len(prefix_chain) == 0:
+                    return '', None
+
+                return prefix_chain[0][0], prefix_chain
+
+            # literal prefix of the first rule, for a quick rejection of LFNs
+            if len(chain) == 0:
+                return '', None
+
+            lfnpat = chain[0][0]
+            literal = []
+            ichar = 1 if lfnpat.startswith('^') else 0
+            while ichar < len(lfnpat):
+                char = lfnpat[ichar]
+                if char == '\\':
+                    if ichar + 1 == len(lfnpat) or lfnpat[ichar + 1].isalnum():
+                        break
+                    char = lfnpat[ichar + 1]
+                    step = 2
+                elif char in '.^$*+?{}[]|()':
+                    break
+                else:
+                    step = 1
+
+                if ichar + step < len(lfnpat) and lfnpat[ichar + step] in '*+?{':
+                    # quantified character - not part of the literal prefix
+                    break
+
+                literal.append(char)
+                ichar += step
+
+            if '|' in lfnpat or '(?' in lfnpat:
+                # alternatives or inline flags (which apply to the whole pattern) can invalidate the prefix
+                return '', None
+
+            return ''.join(literal), None
+
 
     def __init__(self, name, host = '', storage_type = TYPE_DISK, backend = '', status = STAT_UNKNOWN, filename_mapping = {}, sid = 0):
-        self._name = name
+        self._name = intern_name(name)
         self.host = host
         self.storage_type = Site.storage_type_val(storage_type)
         self.backend = backend
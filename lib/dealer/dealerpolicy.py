@@ -133,17 +133,7 @@ class DealerPolicy(object):
                     # no block complete
                     if BlockReplica._use_file_ids:
                         # can determine completion at file level
-                        block_files = set(f.id for f in block.files)
-                        replica_files = set()
-                        for replica in block.replicas:
-                            if replica.file_ids is None:
-                                # can't happen but hey
-                                replica_files = block_files
-                                break
-                            else:
-                                replica_files.update(replica.file_ids)
-
-                        if block_files != replica_files:
+                        if not BlockReplica.covers_block(block, block.replicas):
                             # some files missing
                             return False
                     else:
@@ -157,17 +147,7 @@ class DealerPolicy(object):
                 # no block complete
                 if BlockReplica._use_file_ids:
                     # can determine completion at file level
-                    block_files = set(f.id for f in request.block.files)
-                    replica_files = set()
-                    for replica in request.block.replicas:
-                        if replica.file_ids is None:
-                            # can't happen but hey
-                            replica_files = block_files
-                            break
-                        else:
-                            replica_files.update(replica.file_ids)
-
-                    if block_files != replica_files:
+                    if not BlockReplica.covers_block(request.block, request.block.replicas):
                         # some files missing
                         return False
                 else:
@@ -187,15 +167,10 @@ class DealerPolicy(object):
                 return True
 
             if BlockReplica._use_file_ids:
-                # some blocks missing - go to file level
-                dataset_files = set(f.id for f in request.dataset.files)
-                replica_files = set()
-                for replica in request.dataset.replicas:
-                    for block_replica in replica.block_replicas:
-                        replica_files.update(f.id for f in block_replica.files())
-    
-                if dataset_files != replica_files:
-                    return False
+                # some blocks missing - go to file level, block by block (file ids are unique across blocks)
+                for block in request.dataset.blocks:
+                    if block not in replica_blocks and not BlockReplica.covers_block(block, block.replicas):
+                        return False
             else:
                 return False
 
@@ -0,0 +1,331 @@
+import os
+import json
+import array
+import logging
+
+LOG = logging.getLogger(__name__)
+
+class ColumnarDecisionHistory(object):
+    """
+    Replica decisions of multiple Detox cycles stored column by column in flat binary files (pure python arrays).
+
+    Directory layout:
+      <column>.col    One file per column (site, dataset, size, decision, condition). Rows of a cycle form a
+                      contiguous segment; within a segment rows are ordered by site.
+      sites.txt       Dictionary of site names. Site column holds the line index.
+      datasets.txt    Dictionary of dataset names. Dataset column holds the line index.
+      catalog.json    Number of committed rows, segments [(cycle, partition, first row, number of rows,
+                      {site code: [first row, number of rows]})], and condition texts.
+
+    A query reads only the columns it needs, and for site-specific queries only the row range of the site in
+    each segment. The catalog is replaced atomically after the column files are appended to, so rows beyond the
+    committed row count (left over from an interrupted append) are ignored and overwritten by the next append.
+    """
+
+    # Decision names; decision column holds the index
+    decisions = ['delete', 'keep', 'protect']
+
+    # (name, array typecode). Sizes need 64 bits; fall back to double where long is 32-bit.
+    _columns = [('site', 'H'), ('dataset', 'I'), ('size', 'L' if array.array('L').itemsize == 8 else 'd'), ('decision', 'B'), ('condition', 'I')]
+
+    def __init__(self, path):
+        """
+        @param path  Directory of the store. Created if it does not exist.
+        """
+
+        self.path = path
+
+        try:
+            os.makedirs(self.path)
+        except OSError:
+            pass
+
+        self._typecodes = dict(ColumnarDecisionHistory._columns)
+
+        self._catalog_mtime = None
+        self.refresh()
+
+    def refresh(self):
+        """
+        Reload the catalog and the dictionaries if another process appended to the store.
+        """
+
+        catalog_path = self.path + '/catalog.json'
+
+        try:
+            mtime = os.path.getmtime(catalog_path)
+        except OSError:
+            mtime = None
+
+        if self._catalog_mtime is not None and mtime == self._catalog_mtime:
+            return
+
+        self._catalog_mtime = mtime
+
+        if mtime is not None:
+            with open(catalog_path) as source:
+                catalog = json.load(source)
+
+            self._num_rows = catalog['num_rows']
+            self._segments = []
+            for cycle, partition, first, num_rows, site_ranges in catalog['segments']:
+                self._segments.append((cycle, str(partition), first, num_rows, dict((int(k), v) for k, v in site_ranges.iteritems())))
+
+            self._conditions = dict((int(k), str(v)) for k, v in catalog['conditions'].iteritems())
+        else:
+            self._num_rows = 0
+            self._segments = []
+            self._conditions = {}
+
+        self._segments_by_cycle = dict((s[0], s) for s in self._segments)
+
+        self._site_names = self._read_dictionary('sites')
+        self._site_codes = dict((name, code) for code, name in enumerate(self._site_names))
+
+        # dataset dictionary can be large; loaded on demand
+        self._dataset_names = None
+        self._dataset_codes = None
+
+    def cycles(self, partition = None):
+        """
+        @param partition  If not None, limit to cycles of the partition.
+        @return Sorted list of cycle numbers in the store.
+        """
+
+        return sorted(s[0] for s in self._segments if partition is None or s[1] == partition)
+
+    def has_cycle(self, cycle):
+        return cycle in self._segments_by_cycle
+
+    def append_cycle(self, cycle, partition, replicas, conditions = {}):
+        """
+        Add the decisions of one cycle.
+        @param cycle       Cycle number.
+        @param partition   Partition name.
+        @param replicas    Iterable of (site name, dataset name, size, decision name, condition id).
+        @param conditions  {condition id: text}
+
+        @return  False if the cycle is already in the store, True otherwise.
+        """
+
+        if cycle in self._segments_by_cycle:
+            return False
+
+        self._load_dataset_dictionary()
+
+        num_sites = len(self._site_names)
+        num_datasets = len(self._dataset_names)
+
+        decision_codes = dict((d, i) for i, d in enumerate(ColumnarDecisionHistory.decisions))
+
+        # {site code: [(dataset code, size, decision code, condition)]}
+        by_site = {}
+        for site_name, dataset_name, size, decision, condition in replicas:
+            try:
+                site_code = self._site_codes[site_name]
+            except KeyError:
+                site_code = self._site_codes[site_name] = len(self._site_names)
+                self._site_names.append(site_name)
+
+            try:
+                dataset_code = self._dataset_codes[dataset_name]
+            except KeyError:
+                dataset_code = self._dataset_codes[dataset_name] = len(self._dataset_names)
+                self._dataset_names.append(dataset_name)
+
+            by_site.setdefault(site_code, []).append((dataset_code, size, decision_codes[decision], condition))
+
+        columns = dict((name, array.array(typecode)) for name, typecode in ColumnarDecisionHistory._columns)
+        site_ranges = {}
+        first = self._num_rows
+        row = first
+
+        for site_code in sorted(by_site.iterkeys()):
+            rows = by_site[site_code]
+            site_ranges[site_code] = [row, len(rows)]
+            row += len(rows)
+
+            columns['site'].extend([site_code] * len(rows))
+            for dataset_code, size, decision, condition in rows:
+                columns['dataset'].append(dataset_code)
+                columns['size'].append(size)
+                columns['decision'].append(decision)
+                columns['condition'].append(condition)
+
+        for name, _ in ColumnarDecisionHistory._columns:
+            self._append_column(name, columns[name])
+
+        if len(self._site_names) != num_sites:
+            self._write_dictionary('sites', self._site_names)
+        if len(self._dataset_names) != num_datasets:
+            self._write_dictionary('datasets', self._dataset_names)
+
+        segment = (cycle, partition, first, row - first, site_ranges)
+        self._segments.append(segment)
+        self._segments_by_cycle[cycle] = segment
+        self._num_rows = row
+        self._conditions.update(conditions)
+
+        self._write_catalog()
+        self._catalog_mtime = os.path.getmtime(self.path + '/catalog.json')
+
+        return True
+
+    def deletion_decisions(self, cycle, size_only = True, decisions = None):
+        """
+        Same as DetoxHistoryBase.get_deletion_decisions.
+        @param cycle_number   Cycle number
+        @param size_only      Boolean
+        @param decisions      If a list, limit to specified decisions
+
+        @return If size_only = True: a dict {site: (protect_size, delete_size, keep_size)}
+                If size_only = False: a dict {site: [(dataset, size, decision, condition_id, reason)]}
+        """
+
+        cycle, partition, first, num_rows, site_ranges = self._segments_by_cycle[cycle]
+
+        if type(decisions) is list:
+            decision_codes = set(ColumnarDecisionHistory.decisions.index(d) for d in decisions)
+        else:
+            decision_codes = None
+
+        if size_only:
+            decision_column = self._read_column('decision', first, num_rows)
+            size_column = self._read_column('size', first, num_rows)
+
+            product = {}
+            for site_code, (start, count) in site_ranges.iteritems():
+                sizes = self._sum_sizes(decision_column, size_column, start - first, count, decision_codes)
+                if sizes is not None:
+                    product[self._site_names[site_code]] = sizes
+
+            return product
+
+        else:
+            self._load_dataset_dictionary()
+
+            dataset_column = self._read_column('dataset', first, num_rows)
+            size_column = self._read_column('size', first, num_rows)
+            decision_column = self._read_column('decision', first, num_rows)
+            condition_column = self._read_column('condition', first, num_rows)
+
+            product = {}
+            for site_code, (start, count) in site_ranges.iteritems():
+                current = []
+                for irow in xrange(start - first, start - first + count):
+                    decision = decision_column[irow]
+                    if decision_codes is not None and decision not in decision_codes:
+                        continue
+
+                    condition = condition_column[irow]
+                    current.append((self._dataset_names[dataset_column[irow]], size_column[irow], ColumnarDecisionHistory.decisions[decision], condition, self._conditions.get(condition)))
+
+                if len(current) != 0:
+                    current.sort(key = lambda r: r[1], reverse = True)
+                    product[self._site_names[site_code]] = current
+
+            return product
+
+    def site_trend(self, site_name, cycles = None):
+        """
+        Decision volumes of one site over cycles. Only the decision and size columns in the row range of the site are read.
+        @param site_name  Site name
+        @param cycles     List of cycle numbers. If None, use all cycles in the store.
+
+        @return [(cycle, (protect_size, delete_size, keep_size))] in TB, ordered by cycle
+        """
+
+        if cycles is None:
+            cycles = self.cycles()
+
+        try:
+            site_code = self._site_codes[site_name]
+        except KeyError:
+            return []
+
+        trend = []
+        for cycle in sorted(cycles):
+            try:
+                site_ranges = self._segments_by_cycle[cycle][4]
+            except KeyError:
+                continue
+
+            try:
+                start, count = site_ranges[site_code]
+            except KeyError:
+                trend.append((cycle, (0., 0., 0.)))
+                continue
+
+            decision_column = self._read_column('decision', start, count)
+            size_column = self._read_column('size', start, count)
+
+            trend.append((cycle, self._sum_sizes(decision_column, size_column, 0, count, None)))
+
+        return trend
+
+    def _sum_sizes(self, decision_column, size_column, start, count, decision_codes):
+        # Returns (protect, delete, keep) in TB or None if no row passes the decision filter
+        sums = [0, 0, 0]
+        found = False
+        for irow in xrange(start, start + count):
+            decision = decision_column[irow]
+            if decision_codes is not None and decision not in decision_codes:
+                continue
+
+            sums[decision] += size_column[irow]
+            found = True
+
+        if not found:
+            return None
+
+        delete, keep, protect = sums
+        return (protect * 1.e-12, delete * 1.e-12, keep * 1.e-12)
+
+    def _read_column(self, name, first, count):
+        column = array.array(self._typecodes[name])
+        with open('%s/%s.col' % (self.path, name), 'rb') as source:
+            source.seek(first * column.itemsize)
+            column.fromfile(source, count)
+
+        return column
+
+    def _append_column(self, name, column):
+        path = '%s/%s.col' % (self.path, name)
+        with open(path, 'ab') as out:
+            # discard rows of an interrupted append
+            out.truncate(self._num_rows * column.itemsize)
+            column.tofile(out)
+
+    def _load_dataset_dictionary(self):
+        if self._dataset_names is None:
+            self._dataset_names = self._read_dictionary('datasets')
+            self._dataset_codes = dict((name, code) for code, name in enumerate(self._dataset_names))
+
+    def _read_dictionary(self, name):
+        path = '%s/%s.txt' % (self.path, name)
+        if not os.path.exists(path):
+            return []
+
+        with open(path) as source:
+            return [line.rstrip('\n') for line in source]
+
+    def _write_dictionary(self, name, names):
+        path = '%s/%s.txt' % (self.path, name)
+        with open(path + '.tmp', 'w') as out:
+            for entry in names:
+                out.write(entry + '\n')
+
+        os.rename(path + '.tmp', path)
+
+    def _write_catalog(self):
+        catalog = {
+            'num_rows': self._num_rows,
+            'segments': [list(s) for s in self._segments],
+            'conditions': self._conditions
+        }
+
+        path = self.path + '/catalog.json'
+        with open(path + '.tmp', 'w') as out:
+            json.dump(catalog, out)
+
+        os.rename(path + '.tmp', path)
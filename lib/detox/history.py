@@ -2,14 +2,17 @@ import os
 import re
 import sqlite3
 import lzma
+import sys
 import hashlib
-import signal
+import threading
 import logging
 
 from dynamo.utils.interface.mysql import MySQL
 from dynamo.dataformat import Site
 from dynamo.operation.history import DeletionHistoryDatabase
 from dynamo.dataformat import Configuration
+from dynamo.detox.snapshot import DetoxSnapshotArchive
+from dynamo.detox.columnar import ColumnarDecisionHistory
 
 LOG = logging.getLogger(__name__)
 
@@ -36,6 +39,10 @@ class DetoxHistoryBase(DeletionHistoryDatabase):
         self.snapshots_spool_dir = config.snapshots_spool_dir
         self.snapshots_archive_dir = config.snapshots_archive_dir
 
+        # Optional columnar store of the decisions of all cycles
+        self.columnar_dir = config.get('columnar_dir', None)
+        self._columnar = None
+
     def get_cycles(self, partition, first = -1, last = -1):
         """
         Get a list of deletion cycles in range first <= cycle <= last. If first == -1, pick only the latest before last.
@@ -79,6 +86,24 @@ class DetoxHistoryBase(DeletionHistoryDatabase):
         @return {site_name:  (id, status, quota)}
         """
 
+        archive = self._open_snapshot_archive(cycle_number)
+        if archive is not None:
+            try:
+                site_states = archive.sites(skip_unused = skip_unused)
+            finally:
+                archive.close()
+
+            site_names = self._get_site_names()
+
+            sites_dict = {}
+            for site_id, state in site_states.iteritems():
+                try:
+                    sites_dict[site_names[site_id]] = state
+                except KeyError:
+                    pass
+
+            return sites_dict
+
         self._fill_snapshot_cache('sites', cycle_number)
 
         table_name = 'sites_%d' % cycle_number
@@ -108,6 +133,17 @@ class DetoxHistoryBase(DeletionHistoryDatabase):
                 If size_only = False: a massive dict {site: [(dataset, size, decision, reason)]}
         """
 
+        columnar = self._get_columnar()
+        if columnar is not None and columnar.has_cycle(cycle_number):
+            return columnar.deletion_decisions(cycle_number, size_only = size_only, decisions = decisions)
+
+        archive = self._open_snapshot_archive(cycle_number)
+        if archive is not None:
+            try:
+                return self._get_archived_decisions(archive, size_only, decisions)
+            finally:
+                archive.close()
+
         self._fill_snapshot_cache('replicas', cycle_number)
 
         table_name = 'replicas_%d' % cycle_number
@@ -167,11 +203,45 @@ class DetoxHistoryBase(DeletionHistoryDatabase):
 
             return product
 
+    def get_site_trend(self, site_name, cycles):
+        """
+        @param site_name  Site name
+        @param cycles     List of cycle numbers
+
+        @return [(cycle, (protect_size, delete_size, keep_size))] ordered by cycle
+        """
+
+        columnar = self._get_columnar()
+        if columnar is not None:
+            trend = columnar.site_trend(site_name, cycles)
+            missing = set(cycles) - set(c for c, _ in trend)
+        else:
+            trend = []
+            missing = set(cycles)
+
+        for cycle in missing:
+            trend.append((cycle, self.get_deletion_decisions(cycle, size_only = True).get(site_name, (0., 0., 0.))))
+
+        trend.sort()
+
+        return trend
+
     def get_site_deletion_decisions(self, cycle_number, site_name):
         """
         @return  site-specific version of get_deletion_decisions with size_only = False
         """
 
+        archive = self._open_snapshot_archive(cycle_number)
+        if archive is not None:
+            try:
+                site_id = self.db.query('SELECT `id` FROM `{0}`.`sites` WHERE `name` = %s'.format(self.history_db), site_name)
+                if len(site_id) == 0:
+                    return []
+
+                return self._make_decision_list(archive.replicas(site_ids = site_id)).get(site_name, [])
+            finally:
+                archive.close()
+
         self._fill_snapshot_cache('replicas', cycle_number)
 
         table_name = 'replicas_%d' % cycle_number
@@ -184,6 +254,107 @@ class DetoxHistoryBase(DeletionHistoryDatabase):
 
         return self.db.query(query, site_name)
 
+    def snapshot_archive_path(self, cycle_number):
+        """
+        @return  Path of the block-compressed snapshot archive of the cycle.
+        """
+
+        scycle = '%09d' % cycle_number
+        return '%s/%s/%s/snapshot_%09d.dxs' % (self.snapshots_archive_dir, scycle[:3], scycle[3:6], cycle_number)
+
+    def _get_columnar(self):
+        if self.columnar_dir is None:
+            return None
+
+        if self._columnar is None:
+            self._columnar = ColumnarDecisionHistory(self.columnar_dir)
+        else:
+            self._columnar.refresh()
+
+        return self._columnar
+
+    def _open_snapshot_archive(self, cycle_number):
+        # Returns None if cycle_number is a partition name or if the cycle has no block-compressed archive (old cycles
+        # not converted yet). The MySQL snapshot cache is used in such cases.
+        try:
+            cycle_number += 0
+        except TypeError:
+            return None
+
+        path = self.snapshot_archive_path(cycle_number)
+        if not os.path.exists(path):
+            return None
+
+        return DetoxSnapshotArchive(path)
+
+    def _get_site_names(self):
+        return dict(self.db.xquery('SELECT `id`, `name` FROM `{0}`.`sites`'.format(self.history_db)))
+
+    def _get_archived_decisions(self, archive, size_only, decisions):
+        site_names = self._get_site_names()
+
+        if size_only:
+            if type(decisions) is not list:
+                decisions = ['protect', 'delete', 'keep']
+
+            product = {}
+            for site_id, sizes in archive.sizes(decisions).iteritems():
+                try:
+                    site_name = site_names[site_id]
+                except KeyError:
+                    continue
+
+                product[site_name] = tuple(sizes.get(d, 0) * 1.e-12 for d in ['protect', 'delete', 'keep'])
+
+            return product
+
+        else:
+            if type(decisions) is not list:
+                decisions = None
+
+            return self._make_decision_list(archive.replicas(decisions = decisions), site_names)
+
+    def _make_decision_list(self, replicas, site_names = None):
+        """
+        Convert the output of DetoxSnapshotArchive.replicas to {site_name: [(dataset_name, size, decision, condition_id, reason)]}
+        sorted by size in descending order.
+        """
+
+        if site_names is None:
+            site_names = self._get_site_names()
+
+        # {site_id: [replica]}
+        by_site = {}
+        dataset_ids = set()
+        condition_ids = set()
+        for replica in replicas:
+            by_site.setdefault(replica[0], []).append(replica)
+            dataset_ids.add(replica[1])
+            condition_ids.add(replica[4])
+
+        dataset_names = dict(self.db.select_many(MySQL.bare('`%s`.`datasets`' % self.history_db), ('id', 'name'), 'id', dataset_ids))
+        condition_texts = dict(self.db.select_many(MySQL.bare('`%s`.`policy_conditions`' % self.history_db), ('id', 'text'), 'id', condition_ids))
+
+        product = {}
+        for site_id, site_replicas in by_site.iteritems():
+            try:
+                site_name = site_names[site_id]
+            except KeyError:
+                continue
+
+            current = product[site_name] = []
+
+            site_replicas.sort(key = lambda r: r[2], reverse = True)
+            for _, dataset_id, size, decision, condition in site_replicas:
+                try:
+                    dataset_name = dataset_names[dataset_id]
+                except KeyError:
+                    continue
+
+                current.append((dataset_name, size, decision, condition, condition_texts.get(condition)))
+
+        return product
+
     def _fill_snapshot_cache(self, template, cycle_number):
         self.db.use_db(self.cache_db)
 
@@ -314,6 +485,14 @@ class DetoxHistory(DetoxHistoryBase):
     Class for handling Detox history.
     """
 
+    # Decision names, in the order of the MySQL enum of the cache tables
+    _decisions = ['delete', 'keep', 'protect']
+
+    def __init__(self, config = None):
+        DetoxHistoryBase.__init__(self, config)
+
+        self._archival_thread = None
+
     def new_cycle(self, partition, policy_text, comment = '', test = False):
         """
         Set up a new deletion cycle for the partition.
@@ -350,6 +529,8 @@ class DetoxHistory(DetoxHistoryBase):
         if self._read_only:
             return
 
+        self.wait_archival()
+
         self.db.query('UPDATE `deletion_cycles` SET `time_end` = NOW() WHERE `id` = %s', cycle_number)
 
     def save_policy(self, policy_text):
@@ -396,105 +577,31 @@ class DetoxHistory(DetoxHistoryBase):
 
         Note that in case of block-level operations, one dataset replica can appear
         in multiple of deleted, kept, and protected.
+
+        For numbered cycles, the snapshot is compressed and archived in a background thread. Call wait_archival()
+        (close_cycle does it) to make sure the archive is complete.
         """
 
         if self._read_only:
             return
 
-        self.save_sites([s.name for s in quotas.iterkeys()])
+        # Previous archival must be done before we touch the spool directory
+        self.wait_archival()
 
+        site_names = set(s.name for s in quotas.iterkeys())
         datasets = set()
-        for replica, matches in deleted_list.iteritems():
-            datasets.add(replica.dataset.name)
-        for replica, matches in kept_list.iteritems():
-            datasets.add(replica.dataset.name)
-        for replica, matches in protected_list.iteritems():
-            datasets.add(replica.dataset.name)
-
-        self.save_datasets(datasets)
-    
-        reuse = self.db.reuse_connection
-        self.db.reuse_connection = True
-
-        self.db.use_db(self.cache_db)
-
-        ## Replica state (deletion decisions)
-
-        # Insert full data into a temporary table with site and dataset names
-        tmp_table = 'replicas_tmp'
-        columns = [
-            '`site` varchar(32) CHARACTER SET latin1 COLLATE latin1_general_cs NOT NULL',
-            '`dataset` varchar(512) CHARACTER SET latin1 COLLATE latin1_general_cs NOT NULL',
-            '`size` bigint(20) unsigned NOT NULL',
-            '`decision` enum(\'delete\',\'keep\',\'protect\') CHARACTER SET latin1 COLLATE latin1_general_ci NOT NULL',
-            '`condition` int(10) unsigned NOT NULL',
-            'KEY `site_dataset` (`site`,`dataset`)'
-        ]
-        self.db.create_tmp_table(tmp_table, columns)
-
-        def replica_entry(entries, decision):
-            for replica, matches in entries.iteritems():
-                site_name = replica.site.name
-                dataset_name = replica.dataset.name
-                for condition_id, block_replicas in matches.iteritems():
-                    size = sum(r.size for r in block_replicas)
-                    yield (site_name, dataset_name, size, decision, condition_id)
-
-        fields = ('site', 'dataset', 'size', 'decision', 'condition')
-        self.db.insert_many(tmp_table, fields, None, replica_entry(deleted_list, 'delete'), do_update = False, db = self.db.scratch_db)
-        self.db.insert_many(tmp_table, fields, None, replica_entry(kept_list, 'keep'), do_update = False, db = self.db.scratch_db)
-        self.db.insert_many(tmp_table, fields, None, replica_entry(protected_list, 'protect'), do_update = False, db = self.db.scratch_db)
-
-        # Make a snapshot table
-        replica_table_name = 'replicas_%s' % cycle_number
-
-        if self.db.table_exists(replica_table_name):
-            self.db.query('DROP TABLE `{0}`'.format(replica_table_name))
-
-        self.db.query('CREATE TABLE `{0}` LIKE `replicas`'.format(replica_table_name))
-
-        # Then use insert select join to convert the names to ids
-        sql = 'INSERT INTO `{0}` (`site_id`, `dataset_id`, `size`, `decision`, `condition`)'.format(replica_table_name)
-        sql += ' SELECT s.`id`, d.`id`, r.`size`, r.`decision`, r.`condition` FROM `{0}`.`{1}` AS r'.format(self.db.scratch_db, tmp_table)
-        sql += ' INNER JOIN `{0}`.`sites` AS s ON s.`name` = r.`site`'.format(self.history_db)
-        sql += ' INNER JOIN `{0}`.`datasets` AS d ON d.`name` = r.`dataset`'.format(self.history_db)
-        self.db.query(sql)
-
-        self.db.drop_tmp_table(tmp_table)
+        for entries in (deleted_list, kept_list, protected_list):
+            for replica in entries.iterkeys():
+                site_names.add(replica.site.name)
+                datasets.add(replica.dataset.name)
 
-        ## Site state (status and quotas)
+        site_names = list(site_names)
+        datasets = list(datasets)
 
-        # Insert full data into a temporary table with site info
-        tmp_table = 'sites_tmp'
-        columns = [
-            '`site` varchar(32) CHARACTER SET latin1 COLLATE latin1_general_cs NOT NULL',
-            '`status` enum(\'ready\',\'waitroom\',\'morgue\',\'unknown\') CHARACTER SET latin1 COLLATE latin1_general_ci NOT NULL',
-            '`quota` int(10) NOT NULL',
-            'KEY `site` (`site`)'
-        ]
-        self.db.create_tmp_table(tmp_table, columns)
+        site_ids = dict(zip(site_names, self.save_sites(site_names, get_ids = True)))
+        dataset_ids = dict(zip(datasets, self.save_datasets(datasets, get_ids = True)))
 
-        fields = ('site', 'status', 'quota')
-        mapping = lambda (site, quota): (site.name, site.status, quota)
-        self.db.insert_many(tmp_table, fields, mapping, quotas.iteritems(), do_update = False, db = self.db.scratch_db)
-
-        # Make a snapshot table
-        site_table_name = 'sites_%s' % cycle_number
-
-        if self.db.table_exists(site_table_name):
-            self.db.query('DROP TABLE `{0}`'.format(site_table_name))
-
-        self.db.query('CREATE TABLE `{0}` LIKE `sites`'.format(site_table_name))
-
-        # Then use insert select join to convert the names to ids
-        sql = 'INSERT INTO `{0}` (`site_id`, `status`, `quota`)'.format(site_table_name)
-        sql += ' SELECT s.`id`, t.`status`, t.`quota` FROM `{0}`.`{1}` AS t'.format(self.db.scratch_db, tmp_table)
-        sql += ' INNER JOIN `{0}`.`sites` AS s ON s.`name` = t.`site`'.format(self.history_db)
-        self.db.query(sql)
-
-        self.db.drop_tmp_table(tmp_table)
-
-        ## Now transfer data to an SQLite file
+        ## Write the SQLite file directly from the decisions
         try:
             cycle_number += 0
         except TypeError:
@@ -517,48 +624,22 @@ class DetoxHistory(DetoxHistoryBase):
 
         LOG.info('Creating snapshot SQLite3 DB %s', db_file_name)
 
-        # For some unknown reason, we observed sqlite3.connect hanging - employing alarm mechanism to time out
-        class Timeout(Exception):
-            pass
-
-        def timeout_handler(signum, frame):
-            raise Timeout()
-
-        signal.signal(signal.SIGALRM, timeout_handler)
-
-        signal.alarm(5)
-
-        for att in range(3):
-            try:
-                snapshot_db = sqlite3.connect(db_file_name)
-            except Timeout:
-                continue
-            else:
-                signal.alarm(0)
-                break
-        else:
-            raise RuntimeError('Failed to create %s' % db_file_name)
-
-        snapshot_cursor = snapshot_db.cursor()
-
-        # Make enum mapping tables
-        # Get the decision value to name mapping from MySQL information_schema
-        # This is just a fancy way to arrive at a list [(1, 'delete'), (2, 'keep'), (3, 'protect')]
-        enum = self.db.query('SELECT `COLUMN_TYPE` FROM `information_schema`.`COLUMNS` WHERE `TABLE_SCHEMA` = %s AND `TABLE_NAME` = \'replicas\' AND `COLUMN_NAME` = \'decision\'', self.cache_db)[0]
-        # "enum('delete','keep','protect')" -> ['delete', 'keep', 'protect']
-        values = map(lambda s: s.replace("'", '').replace('"', ''), enum[5:-1].split(','))
-        decision_mapping = []
-        for idec, decision in enumerate(values):
-            # MySQL enum starts at 1
-            decision_mapping.append((idec + 1, decision))
+        snapshot_db = sqlite3.connect(db_file_name)
+        # The file is written once and discarded if anything fails; no need for rollback journal or syncs
+        snapshot_db.execute('PRAGMA journal_mode = OFF')
+        snapshot_db.execute('PRAGMA synchronous = OFF')
 
+        # Enum mapping tables
+        # Decision ids follow the MySQL enum of the cache tables (starts at 1)
         sql = 'CREATE TABLE `decisions` ('
         sql += '`id` TINYINT PRIMARY KEY NOT NULL,'
         sql += '`value` TEXT NOT NULL'
         sql += ')'
         snapshot_db.execute(sql)
-        for value, name in decision_mapping:
-            snapshot_db.execute('INSERT INTO `decisions` VALUES (?, ?)', (value, name))
+        decision_ids = {}
+        for idec, decision in enumerate(DetoxHistory._decisions):
+            decision_ids[decision] = idec + 1
+            snapshot_db.execute('INSERT INTO `decisions` VALUES (?, ?)', (idec + 1, decision))
 
         sql = 'CREATE TABLE `statuses` ('
         sql += '`id` TINYINT PRIMARY KEY NOT NULL,'
@@ -570,7 +651,7 @@ class DetoxHistory(DetoxHistoryBase):
         snapshot_db.execute('INSERT INTO `statuses` VALUES (%d, \'morgue\')' % Site.STAT_MORGUE)
         snapshot_db.execute('INSERT INTO `statuses` VALUES (%d, \'unknown\')' % Site.STAT_UNKNOWN)
 
-        # Fill in the replica states
+        # Replica states
         sql = 'CREATE TABLE `replicas` ('
         sql += '`site_id` SMALLINT NOT NULL,'
         sql += '`dataset_id` INT NOT NULL,'
@@ -579,16 +660,7 @@ class DetoxHistory(DetoxHistoryBase):
         sql += '`condition` MEDIUMINT NOT NULL'
         sql += ')'
         snapshot_db.execute(sql)
-        snapshot_db.execute('CREATE INDEX `site_dataset` ON `replicas` (`site_id`, `dataset_id`)')
-
-        sql = 'INSERT INTO `replicas` VALUES (?, ?, ?, ?, ?)'
 
-        for entry in self.db.xquery('SELECT `site_id`, `dataset_id`, `size`, 0+`decision`, `condition` FROM `{0}`'.format(replica_table_name)):
-            snapshot_cursor.execute(sql, entry)
-
-        snapshot_db.commit()
-
-        # Fill in the site states
         sql = 'CREATE TABLE `sites` ('
         sql += '`site_id` SMALLINT PRIMARY KEY NOT NULL,'
         sql += '`status_id` TINYINT NOT NULL REFERENCES `statuses`(`id`),'
@@ -596,21 +668,82 @@ class DetoxHistory(DetoxHistoryBase):
         sql += ')'
         snapshot_db.execute(sql)
 
-        sql = 'INSERT INTO `sites` VALUES (?, ?, ?)'
+        def replica_entries(entries, decision):
+            decision_id = decision_ids[decision]
+            for replica, matches in entries.iteritems():
+                try:
+                    site_id = site_ids[replica.site.name]
+                    dataset_id = dataset_ids[replica.dataset.name]
+                except KeyError:
+                    continue
+
+                for condition_id, block_replicas in matches.iteritems():
+                    size = sum(r.size for r in block_replicas)
+                    yield (site_id, dataset_id, size, decision_id, condition_id)
+
+        def site_entries():
+            for site, quota in quotas.iteritems():
+                try:
+                    yield (site_ids[site.name], site.status, int(round(quota)))
+                except KeyError:
+                    pass
+
+        # Everything below is one transaction
+        sql = 'INSERT INTO `replicas` VALUES (?, ?, ?, ?, ?)'
+        snapshot_db.executemany(sql, replica_entries(deleted_list, 'delete'))
+        snapshot_db.executemany(sql, replica_entries(kept_list, 'keep'))
+        snapshot_db.executemany(sql, replica_entries(protected_list, 'protect'))
+
+        snapshot_db.executemany('INSERT INTO `sites` VALUES (?, ?, ?)', site_entries())
 
-        for entry in self.db.xquery('SELECT `site_id`, 0+`status`, `quota` FROM `{0}`'.format(site_table_name)):
-            snapshot_cursor.execute(sql, entry)
+        snapshot_db.commit()
 
+        # Index is faster to build after the insertions
+        snapshot_db.execute('CREATE INDEX `site_dataset` ON `replicas` (`site_id`, `dataset_id`)')
         snapshot_db.commit()
 
-        # Close the sqlite file
-        snapshot_cursor.close()
         snapshot_db.close()
 
+        if is_cycle and self.columnar_dir is not None:
+            self._save_columnar(cycle_number, deleted_list, kept_list, protected_list)
+
         if is_cycle:
             # This was a numbered cycle
-            # Archive the sqlite3 file
-    
+            # Archive the sqlite3 file while the caller moves on
+            self._archival_thread = threading.Thread(target = self._archive_snapshot, name = 'SnapshotArchival', args = (cycle_number, db_file_name))
+            self._archival_thread.start()
+
+    def _save_columnar(self, cycle_number, deleted_list, kept_list, protected_list):
+        sql = 'SELECT p.`name` FROM `partitions` AS p INNER JOIN `deletion_cycles` AS r ON r.`partition_id` = p.`id` WHERE r.`id` = %s'
+        partition = self.db.query(sql, cycle_number)[0]
+
+        def replica_entries():
+            for entries, decision in [(deleted_list, 'delete'), (kept_list, 'keep'), (protected_list, 'protect')]:
+                for replica, matches in entries.iteritems():
+                    for condition_id, block_replicas in matches.iteritems():
+                        yield (replica.site.name, replica.dataset.name, sum(r.size for r in block_replicas), decision, condition_id)
+
+        condition_ids = set()
+        for entries in (deleted_list, kept_list, protected_list):
+            for matches in entries.itervalues():
+                condition_ids.update(matches.iterkeys())
+
+        conditions = dict(self.db.select_many('policy_conditions', ('id', 'text'), 'id', condition_ids))
+
+        LOG.info('Adding cycle %d to the columnar decision history', cycle_number)
+        self._get_columnar().append_cycle(cycle_number, partition, replica_entries(), conditions)
+
+    def wait_archival(self):
+        """
+        Wait for the background archival of the last saved cycle to complete.
+        """
+
+        if self._archival_thread is not None:
+            self._archival_thread.join()
+            self._archival_thread = None
+
+    def _archive_snapshot(self, cycle_number, db_file_name):
+        try:
             scycle = '%09d' % cycle_number
             archive_dir_name = '%s/%s/%s' % (self.snapshots_archive_dir, scycle[:3], scycle[3:6])
             xz_file_name = '%s/snapshot_%09d.db.xz' % (archive_dir_name, cycle_number)
@@ -624,13 +757,15 @@ class DetoxHistory(DetoxHistoryBase):
                 with open(xz_file_name, 'wb') as xz_file:
                     xz_file.write(lzma.compress(db_file.read()))
 
-            self._update_cache_usage('replicas', cycle_number)
-            self._update_cache_usage('sites', cycle_number)
+            # Random-access archive used by the get_* functions
+            DetoxSnapshotArchive.convert(db_file_name, self.snapshot_archive_path(cycle_number))
 
-        # Finally restore the history DB
-        self.db.use_db(self.history_db)
+            # Readers use the archives; the spool copy is not needed any more
+            os.unlink(db_file_name)
 
-        self.db.reuse_connection = reuse
+        except:
+            LOG.error('Failed to archive snapshot %s', db_file_name)
+            LOG.error(sys.exc_info()[1])
 
     def make_cycle_entry(self, cycle_number, site):
         history_record = self.make_entry(site.name)
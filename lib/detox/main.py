@@ -2,10 +2,10 @@ import time
 import logging
 import collections
 
-from dynamo.core.inventory import ObjectRepository
-from dynamo.dataformat import Group, Site, Dataset, Block, DatasetReplica, BlockReplica
+from dynamo.dataformat import Group, Site, BlockReplica
 from dynamo.dataformat.history import DeletedReplica
 from dynamo.detox.detoxpolicy import DetoxPolicy
+from dynamo.detox.overlay import PartitionOverlay
 from dynamo.detox.detoxpolicy import Ignore, Protect, Delete, Dismiss, ProtectBlock, DeleteBlock, DismissBlock
 from dynamo.detox.history import DetoxHistory
 from dynamo.operation.deletion import DeletionInterface
@@ -55,20 +55,25 @@ class Detox(object):
             cycle_tag = self.policy.partition_name
             LOG.info('Detox snapshot cycle for %s starting', self.policy.partition_name)
 
-        LOG.info('Building the object repository for the partition.')
-        # Create a full clone of the inventory limited to the partition of the policy
+        LOG.info('Building the partition view of the inventory.')
+        # Restrict the inventory to the partition of the policy. Changes made while applying the policy are
+        # undone when the view is restored and are kept in the overlay as the delta.
         partition_repository = self._build_partition(inventory)
 
-        LOG.info('Loading dataset attributes.')
-        for plugin in self.policy.attr_producers:
-            plugin.load(partition_repository)
+        try:
+            LOG.info('Loading dataset attributes.')
+            for plugin in self.policy.attr_producers:
+                plugin.load(partition_repository)
 
-        LOG.info('Saving policy conditions.')
-        # Sets policy IDs for each lines from the history DB; need to run this before execute_policy
-        self.history.save_conditions(self.policy.policy_lines)
+            LOG.info('Saving policy conditions.')
+            # Sets policy IDs for each lines from the history DB; need to run this before execute_policy
+            self.history.save_conditions(self.policy.policy_lines)
 
-        LOG.info('Applying policy to replicas.')
-        deleted, kept, protected, reowned = self._execute_policy(partition_repository)
+            LOG.info('Applying policy to replicas.')
+            deleted, kept, protected, reowned = self._execute_policy(partition_repository)
+
+        finally:
+            partition_repository.restore()
 
         partition = partition_repository.partitions[self.policy.partition_name]
         quotas = dict((s, s.partitions[partition].quota * 1.e-12) for s in partition_repository.sites.itervalues())
@@ -79,26 +84,21 @@ class Detox(object):
         if create_cycle:
             LOG.info('Committing deletion.')
             comment = 'Dynamo -- Automatic cache release request for %s partition.' % self.policy.partition_name
-            self._commit_deletions(cycle_tag, inventory, deleted, comment)
+            self._commit_deletions(cycle_tag, inventory, partition_repository, deleted, comment)
             comment = 'Dynamo -- Automatic group reassignment for %s partition.' % self.policy.partition_name
-            self._commit_reassignments(inventory, reowned, comment)
+            self._commit_reassignments(inventory, partition_repository, reowned, comment)
 
             self.history.close_cycle(cycle_tag)
 
         LOG.info('Detox cycle completed')
 
     def _build_partition(self, inventory):
-        """Create a mini-inventory consisting only of replicas in the partition."""
-
-        partition_repository = ObjectRepository()
-        partition_repository._store = inventory._store
+        """Create a view of the inventory consisting only of replicas in the partition."""
 
         LOG.info('Identifying target sites.')
 
         partition = inventory.partitions[self.policy.partition_name]
 
-        partition.embed_tree(partition_repository)
-
         # Ask each site if deletion should be triggered.
         target_sites = set() # target sites of this detox cycle
         tape_is_target = False
@@ -116,7 +116,7 @@ class Detox(object):
 
         if len(target_sites) == 0:
             LOG.info('No site matches the target definition.')
-            return partition_repository
+            return PartitionOverlay(inventory, partition, target_sites)
 
         # Safety measure - if there are empty (no block rep) tape replicas, create block replicas with size 0 and
         # add them into the partition. We will not report back to the main process though (i.e. won't call inventory.update).
@@ -134,92 +134,12 @@ class Detox(object):
                     # Add to the site partition
                     site.partitions[partition].replicas[replica] = None
 
-        # Create a copy of the inventory, limiting to the current partition
-        # We will be stripping replicas off the image as we process the policy in iterations
-        LOG.info('Creating a partition image.')
-
-        for group in inventory.groups.itervalues():
-            group.embed_into(partition_repository)
-
-        # Now clone the sites, datasets, and replicas
-        # Basically a copy-paste of various embed_into() functions ommitting the checks
-
-        # make a map to avoid excessive lookups
-        block_to_clone = {}
-        for site in target_sites:
-            site_clone = site.embed_into(partition_repository)
-
-            site_partition = site.partitions[partition]
-            site_partition_clone = site_partition.embed_tree(partition_repository)
-
-            for dataset_replica, block_replica_set in site_partition.replicas.iteritems():
-                dataset = dataset_replica.dataset
-
-                try:
-                    dataset_clone = partition_repository.datasets[dataset.name]
-
-                except KeyError:
-                    dataset_clone = dataset.embed_into(partition_repository)
-
-                    for block in dataset.blocks:
-                        block_clone = Block(
-                            block.name,
-                            dataset_clone,
-                            size = block.size,
-                            num_files = block.num_files,
-                            is_open = block.is_open,
-                            last_update = block.last_update,
-                            bid = block.id
-                        )
-                        dataset_clone.blocks.add(block_clone)
-
-                        block_to_clone[block] = block_clone
-
-                if dataset_replica.group is None:
-                    group = None
-                else:
-                    group = partition_repository.groups[dataset_replica.group.name]
-
-                replica_clone = DatasetReplica(
-                    dataset_clone,
-                    site_clone,
-                    growing = dataset_replica.growing,
-                    group = group
-                )
-                dataset_clone.replicas.add(replica_clone)
-                site_clone.add_dataset_replica(replica_clone, add_block_replicas = False)
-
-                if block_replica_set is None:
-                    # all block reps in partition
-                    block_replica_set = dataset_replica.block_replicas
-                    full_replica = True
-                    site_partition_clone.replicas[replica_clone] = None
-                else:
-                    full_replica = False
-                    block_replica_clone_set = site_partition_clone.replicas[replica_clone] = set()
-
-                for block_replica in block_replica_set:
-                    block_clone = block_to_clone[block_replica.block]
-                    if block_replica.is_complete():
-                        size = -1
-                    else:
-                        size = block_replica.size
-
-                    block_replica_clone = BlockReplica(
-                        block_clone,
-                        site_clone,
-                        partition_repository.groups[block_replica.group.name],
-                        is_custodial = block_replica.is_custodial,
-                        size = size,
-                        last_update = block_replica.last_update,
-                        file_ids = block_replica.file_ids
-                    )
-
-                    replica_clone.block_replicas.add(block_replica_clone)
-                    block_clone.replicas.add(block_replica_clone)
-
-                    if not full_replica:
-                        block_replica_clone_set.add(block_replica_clone)
+        # Overlay the partition on the inventory objects. We will be stripping replicas off the view as we
+        # process the policy in iterations; the inventory is restored afterwards.
+        LOG.info('Creating a partition view.')
+        start = time.time()
+        partition_repository = PartitionOverlay(inventory, partition, target_sites)
+        LOG.info('Partition view with %d datasets created in %.1f seconds.', len(partition_repository.datasets), time.time() - start)
 
         return partition_repository
 
@@ -249,10 +169,9 @@ class Detox(object):
                     triggered_sites.add(site)
                     break
 
-            quotas[site] = site.partitions[partition].quota
+            quotas[site] = site_partition.quota
 
-            for replica in site.dataset_replicas():
-                all_replicas.add(replica)
+            all_replicas.update(site_partition.replicas.iterkeys())
 
         LOG.info('Start deletion. Evaluating %d lines against %d replicas.', len(self.policy.policy_lines), len(all_replicas))
 
@@ -364,7 +283,7 @@ class Detox(object):
                         # as a result of the modification, the dataset replica can become empty
                         if len(replica.block_replicas) == 0:
                             # replica is deleted at dataset level - can no longer be growing
-                            replica.growing = False
+                            repository.set_growing(replica, False)
                             # if all blocks were deleted, take the replica off all_replicas for later iterations
                             # this is the only place where the replica can become empty
                             empty_replicas.add(replica)
@@ -377,7 +296,7 @@ class Detox(object):
                             get_list(keep_candidates, replica, condition_id).update(block_replicas)
 
             for replica in empty_replicas:
-                replica.unlink_from(repository)
+                repository.unlink_dataset_replica(replica)
 
             all_replicas -= empty_replicas
             all_replicas -= ignored_replicas
@@ -458,9 +377,9 @@ class Detox(object):
 
                 if len(replica.block_replicas) == 0:
                     if replica in dataset_level_delete_candidates:
-                        replica.growing = False
+                        repository.set_growing(replica, False)
                     
-                    replica.unlink_from(repository)
+                    repository.unlink_dataset_replica(replica)
                     all_replicas.remove(replica)
 
                 site_partition = site.partitions[partition]
@@ -523,7 +442,7 @@ class Detox(object):
                 LOG.debug('%d blocks to hand over to %s in %s', len(blocks_to_hand_over), dr_owner.name, str(replica))
 
                 for block_replica in blocks_to_hand_over:
-                    block_replica.group = dr_owner
+                    repository.set_group(block_replica, dr_owner)
     
                     # if the change of owner disqualifies this block replica from the partition,
                     # we unlink it from the repository.
@@ -532,7 +451,7 @@ class Detox(object):
 
         if len(blocks_to_unlink) != 0:
             for block_replica in blocks_to_unlink:
-                block_replica.unlink_from(repository)
+                repository.unlink_block_replica(block_replica)
 
             # if this replica was put in reowned list earlier, take it out
             try:
@@ -561,36 +480,34 @@ class Detox(object):
 
         return blocks_to_unlink - blocks_to_hand_over
 
-    def _commit_deletions(self, cycle_number, inventory, deleted, comment):
+    def _commit_deletions(self, cycle_number, inventory, overlay, deleted, comment):
         """
         @param cycle_number  Cycle number.
         @param inventory     Global (original) inventory
+        @param overlay       Restored PartitionOverlay used for the policy execution
         @param deleted       {dataset_replica: {condition_id: set(block_replicas)}}
         @param comment       Comment to be passed to the deletion interface.
         """
 
         signal_blocker = SignalBlocker(logger = LOG)
 
-        # get the original replicas from the inventory and organize them into sites
+        # organize the replicas into sites
         deletions_by_site = collections.defaultdict(list) # {site: [(dataset_replica, block_replicas)]}
 
         for replica, matches in deleted.iteritems():
-            site = inventory.sites[replica.site.name]
-
-            original_replica = inventory.datasets[replica.dataset.name].find_replica(site)
-            original_block_replicas = dict((br.block.name, br) for br in original_replica.block_replicas)
-            
             all_block_replicas = set()
             for block_replicas in matches.itervalues():
-                for block_replica in block_replicas:
-                    all_block_replicas.add(original_block_replicas[block_replica.block.name])
+                all_block_replicas.update(block_replicas)
+
+            # growing flag as set by the policy
+            growing = overlay.growing_changes.get(replica, replica.growing)
 
-            if not replica.growing and all_block_replicas == original_replica.block_replicas:
+            if not growing and all_block_replicas == replica.block_replicas:
                 # if we are deleting all block replicas and the replica is marked as not growing, delete the DatasetReplica
-                deletions_by_site[site].append((original_replica, None))
+                deletions_by_site[replica.site].append((replica, None))
             else:
                 # otherwise delete only the BlockReplicas
-                deletions_by_site[site].append((original_replica, list(all_block_replicas)))
+                deletions_by_site[replica.site].append((replica, list(all_block_replicas)))
 
         # now schedule deletions for each site
         for site in sorted(deletions_by_site.iterkeys(), key = lambda s: s.name):
@@ -636,9 +553,10 @@ class Detox(object):
                 total_size = sum(r.size for r in history_record.replicas)
                 LOG.info('Done deleting %.1f TB from %s.', total_size * 1.e-12, site.name)
 
-    def _commit_reassignments(self, inventory, reowned, comment):
+    def _commit_reassignments(self, inventory, overlay, reowned, comment):
         """
         @param inventory     Global (original) inventory
+        @param overlay       Restored PartitionOverlay used for the policy execution
         @param reowned       {dataset_replica: set([block_replicas])}
         @param comment       Comment to be passed to the copy interface.
         """
@@ -648,32 +566,32 @@ class Detox(object):
         need_operation = hasattr(self.deletion_op, 'schedule_reassignments')
 
         if need_operation:
-            # get the original replicas from the inventory and organize them into sites
+            # organize the replicas into sites
             reown_by_site = collections.defaultdict(list) # {site: [(dataset_replica, block_replicas)]}
 
         for replica, block_replicas in reowned.iteritems():
-            # just do the reassignment in the inventory upfront
-            original_replica = inventory.update(replica)
+            # growing flag as set by the policy
+            growing = overlay.growing_changes.get(replica, replica.growing)
 
-            original_block_replicas = dict((br.block.name, br) for br in original_replica.block_replicas)
+            # just do the reassignment in the inventory upfront
+            replica.growing = growing
+            inventory.register_update(replica)
 
-            all_block_replicas = set()
             for block_replica in block_replicas:
-                original_block_replica = original_block_replicas[block_replica.block.name]
-
-                if original_block_replica != block_replica:
-                    original_block_replica.copy(block_replica)
-                    inventory.register_update(original_block_replica)
+                try:
+                    block_replica.group = overlay.group_changes[block_replica]
+                except KeyError:
+                    continue
 
-                all_block_replicas.add(original_block_replica)
+                inventory.register_update(block_replica)
 
             if need_operation:
-                if replica.growing and all_block_replicas == original_replica.block_replicas:
+                if growing and block_replicas == replica.block_replicas:
                     # if we are reassigning all block replicas and the replica is marked as growing, reassign the DatasetReplica
-                    reown_by_site[original_replica.site].append((original_replica, None))
+                    reown_by_site[replica.site].append((replica, None))
                 else:
                     # otherwise reassign by BlockReplicas
-                    reown_by_site[original_replica.site].append((original_replica, all_block_replicas))
+                    reown_by_site[replica.site].append((replica, set(block_replicas)))
 
         if need_operation:
             for site in sorted(reown_by_site.iterkeys(), key = lambda s: s.name):
@@ -0,0 +1,204 @@
+import logging
+
+from dynamo.core.inventory import ObjectRepository
+
+LOG = logging.getLogger(__name__)
+
+class PartitionOverlay(ObjectRepository):
+    """
+    View of the inventory restricted to the replicas of one partition at the target sites, built on the original
+    inventory objects instead of clones.
+
+    The view is made by temporarily taking the out-of-partition replicas out of dataset.replicas, block.replicas,
+    and dataset_replica.block_replicas. Policy evaluation then modifies the view through unlink_block_replica,
+    unlink_dataset_replica, set_group, and set_growing. Every container and attribute is saved the first time
+    it is modified (copy on write), and restore() puts the inventory back to its original state. The changes
+    made while the view was active remain available after restore() as the delta:
+      group_changes     {block_replica: new group}
+      growing_changes   {dataset_replica: new growing flag}
+
+    Datasets get a private copy of their attr dict for the lifetime of the view, so that attribute producers
+    do not write into the inventory.
+    """
+
+    def __init__(self, inventory, partition, target_sites):
+        """
+        @param inventory     Original inventory
+        @param partition     Partition object of the inventory
+        @param target_sites  Set of sites in the view
+        """
+
+        ObjectRepository.__init__(self)
+
+        self._store = inventory._store
+
+        self.groups.update(inventory.groups)
+        self.partitions.update(inventory.partitions)
+        for site in target_sites:
+            self.sites.add(site)
+
+        self.partition = partition
+
+        # {id(container): (container, saved content)}
+        self._saved_containers = {}
+        # {block_replica: group}
+        self._saved_groups = {}
+        # {dataset_replica: growing}
+        self._saved_growing = {}
+        # {dataset: attr}
+        self._saved_attrs = {}
+
+        self.group_changes = {}
+        self.growing_changes = {}
+
+        self._active = True
+
+        self._restrict(target_sites)
+
+    def _restrict(self, target_sites):
+        """Take replicas that are not in the partition or not at target sites out of the view."""
+
+        partition = self.partition
+
+        def in_view(dataset_replica):
+            site = dataset_replica.site
+            return site in target_sites and dataset_replica in site.partitions[partition].replicas
+
+        for site in target_sites:
+            for dataset_replica, block_replica_set in site.partitions[partition].replicas.iteritems():
+                dataset = dataset_replica.dataset
+
+                if block_replica_set is not None and len(block_replica_set) != len(dataset_replica.block_replicas):
+                    self._save(dataset_replica.block_replicas)
+                    dataset_replica.block_replicas.intersection_update(block_replica_set)
+
+                if dataset.name in self.datasets:
+                    continue
+
+                self.datasets.add(dataset)
+
+                self._saved_attrs[dataset] = dataset.attr
+                dataset.attr = dict(dataset.attr)
+
+                outside = [r for r in dataset.replicas if not in_view(r)]
+                if len(outside) != 0:
+                    self._save(dataset.replicas)
+                    dataset.replicas.difference_update(outside)
+
+        # Block replicas are in the view if their dataset replica is (partial dataset replicas are already trimmed)
+        for dataset in self.datasets.itervalues():
+            for block in dataset.blocks:
+                outside = []
+                for block_replica in block.replicas:
+                    dataset_replica = block_replica.site.find_dataset_replica(dataset)
+                    if dataset_replica not in dataset.replicas or block_replica not in dataset_replica.block_replicas:
+                        outside.append(block_replica)
+
+                if len(outside) != 0:
+                    self._save(block.replicas)
+                    block.replicas.difference_update(outside)
+
+    def unlink_block_replica(self, block_replica):
+        """Take a block replica out of the view. The dataset replica is also unlinked if it becomes empty."""
+
+        dataset_replica = block_replica.site.find_dataset_replica(block_replica.block.dataset)
+        if dataset_replica is None or block_replica not in dataset_replica.block_replicas:
+            # already out of the view
+            return
+
+        if len(dataset_replica.block_replicas) == 1:
+            # BlockReplica.unlink will cascade to the dataset replica
+            self._save_dataset_replica(dataset_replica)
+        else:
+            self._save_site_partitions(dataset_replica)
+            self._save(dataset_replica.block_replicas)
+            self._save(block_replica.block.replicas)
+
+        block_replica.unlink(dataset_replica = dataset_replica)
+
+    def unlink_dataset_replica(self, dataset_replica):
+        """Take a dataset replica and all its block replicas out of the view."""
+
+        if dataset_replica.site.find_dataset_replica(dataset_replica.dataset) is not dataset_replica:
+            # already out of the view
+            return
+
+        self._save_dataset_replica(dataset_replica)
+
+        dataset_replica.unlink()
+
+    def set_group(self, block_replica, group):
+        if block_replica not in self._saved_groups:
+            self._saved_groups[block_replica] = block_replica.group
+
+        block_replica.group = group
+
+    def set_growing(self, dataset_replica, growing):
+        if dataset_replica not in self._saved_growing:
+            self._saved_growing[dataset_replica] = dataset_replica.growing
+
+        dataset_replica.growing = growing
+
+    def restore(self):
+        """Undo all changes to the inventory objects and fill the delta."""
+
+        if not self._active:
+            return
+
+        LOG.info('Restoring %d containers and %d attributes of the partition view.', len(self._saved_containers), len(self._saved_groups) + len(self._saved_growing))
+
+        for block_replica, group in self._saved_groups.iteritems():
+            if block_replica.group != group:
+                self.group_changes[block_replica] = block_replica.group
+            block_replica.group = group
+
+        for dataset_replica, growing in self._saved_growing.iteritems():
+            if dataset_replica.growing != growing:
+                self.growing_changes[dataset_replica] = dataset_replica.growing
+            dataset_replica.growing = growing
+
+        for container, content in self._saved_containers.itervalues():
+            container.clear()
+            container.update(content)
+
+        for dataset, attr in self._saved_attrs.iteritems():
+            dataset.attr = attr
+
+        self._saved_containers = {}
+        self._saved_groups = {}
+        self._saved_growing = {}
+        self._saved_attrs = {}
+
+        self._active = False
+
+    def _save(self, container):
+        if id(container) not in self._saved_containers:
+            if type(container) is dict:
+                content = container.items()
+            else:
+                content = tuple(container)
+
+            self._saved_containers[id(container)] = (container, content)
+
+    def _save_site_partitions(self, dataset_replica):
+        for site_partition in dataset_replica.site.partitions.itervalues():
+            try:
+                block_replicas = site_partition.replicas[dataset_replica]
+            except KeyError:
+                continue
+
+            self._save(site_partition.replicas)
+            if block_replicas is not None:
+                self._save(block_replicas)
+
+    def _save_dataset_replica(self, dataset_replica):
+        # Everything DatasetReplica.unlink touches
+        self._save_site_partitions(dataset_replica)
+        self._save(dataset_replica.site._dataset_replicas)
+        self._save(dataset_replica.dataset.replicas)
+        self._save(dataset_replica.block_replicas)
+        for block_replica in dataset_replica.block_replicas:
+            self._save(block_replica.block.replicas)
+
+        if dataset_replica not in self._saved_growing:
+            self._saved_growing[dataset_replica] = dataset_replica.growing
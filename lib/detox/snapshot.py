@@ -0,0 +1,256 @@
+import os
+import struct
+import zlib
+import json
+import sqlite3
+import logging
+
+LOG = logging.getLogger(__name__)
+
+class DetoxSnapshotArchive(object):
+    """
+    Block-compressed, randomly accessible store of the replica decisions and site states of a Detox cycle.
+
+    File layout:
+      header   MAGIC, offset and length of the index (little endian uint64)
+      chunks   zlib-compressed arrays of (dataset_id, size, decision, condition) records. A chunk holds the
+               replicas of a single site; replicas are ordered by (site, decision, condition).
+      index    zlib-compressed JSON with the decision and status names, the site states, the total size per
+               site and decision, and for each chunk its offset, length, site, decisions and conditions.
+
+    The index is read when the archive is opened; queries by site, decision, or condition decompress only
+    the chunks that can contain matching replicas. Sizes per site and decision are answered from the index alone.
+    """
+
+    MAGIC = 'DXSNAP01'
+    _header = struct.Struct('<8sQQ')
+    # dataset_id, size, decision, condition
+    _record_format = 'IQBI'
+    _record_size = struct.calcsize('<' + _record_format)
+
+    def __init__(self, path):
+        """
+        Open an existing archive.
+        @param path  Archive file name.
+        """
+
+        self.path = path
+        self._file = open(path, 'rb')
+
+        magic, index_offset, index_length = DetoxSnapshotArchive._header.unpack(self._file.read(DetoxSnapshotArchive._header.size))
+        if magic != DetoxSnapshotArchive.MAGIC:
+            self._file.close()
+            raise RuntimeError('%s is not a Detox snapshot archive' % path)
+
+        self._file.seek(index_offset)
+        index = json.loads(zlib.decompress(self._file.read(index_length)))
+
+        self.decisions = [str(d) for d in index['decisions']]
+        self.statuses = dict((int(k), str(v)) for k, v in index['statuses'].iteritems())
+
+        # {site_id: (status_id, quota)}
+        self._sites = dict((site_id, (status_id, quota)) for site_id, status_id, quota in index['sites'])
+        # {site_id: {decision: size}}
+        self._sizes = {}
+        for site_id, decision, size in index['sizes']:
+            self._sizes.setdefault(site_id, {})[self.decisions[decision]] = size
+
+        # [(offset, length, num_records, site_id, decisions, conditions)]
+        self._chunks = [tuple(c) for c in index['chunks']]
+        self._chunks_by_site = {}
+        self._chunks_by_condition = {}
+        for ichunk, chunk in enumerate(self._chunks):
+            self._chunks_by_site.setdefault(chunk[3], []).append(ichunk)
+            for condition in chunk[5]:
+                self._chunks_by_condition.setdefault(condition, []).append(ichunk)
+
+        # number of chunks decompressed so far
+        self.num_chunks_read = 0
+
+    def close(self):
+        self._file.close()
+
+    def sites(self, skip_unused = False):
+        """
+        @param skip_unused   If true, skip sites without replicas.
+        @return {site_id: (status name, quota)}
+        """
+
+        result = {}
+        for site_id, (status_id, quota) in self._sites.iteritems():
+            if skip_unused and site_id not in self._chunks_by_site:
+                continue
+
+            result[site_id] = (self.statuses[status_id], quota)
+
+        return result
+
+    def sizes(self, decisions = None):
+        """
+        @param decisions  If a list, limit to the given decisions.
+        @return {site_id: {decision: total size}}
+        """
+
+        result = {}
+        for site_id, site_sizes in self._sizes.iteritems():
+            if decisions is not None:
+                site_sizes = dict((d, s) for d, s in site_sizes.iteritems() if d in decisions)
+                if len(site_sizes) == 0:
+                    continue
+
+            result[site_id] = dict(site_sizes)
+
+        return result
+
+    def replicas(self, site_ids = None, decisions = None, conditions = None):
+        """
+        Generator of replica decisions. Only the chunks that may contain matching replicas are read.
+        @param site_ids    If not None, limit to the given sites.
+        @param decisions   If not None, limit to the given decision names.
+        @param conditions  If not None, limit to the given condition ids.
+
+        @return (site_id, dataset_id, size, decision name, condition id)
+        """
+
+        if site_ids is None:
+            chunk_ids = set(xrange(len(self._chunks)))
+        else:
+            chunk_ids = set()
+            for site_id in site_ids:
+                chunk_ids.update(self._chunks_by_site.get(site_id, []))
+
+        if conditions is not None:
+            by_condition = set()
+            for condition in conditions:
+                by_condition.update(self._chunks_by_condition.get(condition, []))
+
+            chunk_ids &= by_condition
+            conditions = set(conditions)
+
+        if decisions is not None:
+            decision_ids = set(self.decisions.index(d) for d in decisions if d in self.decisions)
+            chunk_ids = set(c for c in chunk_ids if decision_ids.intersection(self._chunks[c][4]))
+        else:
+            decision_ids = None
+
+        # read in file order
+        for ichunk in sorted(chunk_ids):
+            site_id = self._chunks[ichunk][3]
+            for dataset_id, size, decision, condition in self._read_chunk(ichunk):
+                if decision_ids is not None and decision not in decision_ids:
+                    continue
+                if conditions is not None and condition not in conditions:
+                    continue
+
+                yield (site_id, dataset_id, size, self.decisions[decision], condition)
+
+    def _read_chunk(self, ichunk):
+        offset, length, num_records = self._chunks[ichunk][:3]
+
+        self._file.seek(offset)
+        data = zlib.decompress(self._file.read(length))
+        self.num_chunks_read += 1
+
+        fields = struct.unpack('<' + DetoxSnapshotArchive._record_format * num_records, data)
+        return zip(fields[0::4], fields[1::4], fields[2::4], fields[3::4])
+
+    @staticmethod
+    def write(path, decisions, statuses, sites, replicas, chunk_size = 4096, compression_level = 6):
+        """
+        Write an archive. The file is first written to path + '.tmp' and renamed at the end.
+        @param path         Archive file name.
+        @param decisions    List of decision names. Index in the list is the decision id.
+        @param statuses     {status_id: status name}
+        @param sites        List of (site_id, status_id, quota)
+        @param replicas     Iterable of (site_id, dataset_id, size, decision_id, condition_id), sorted by site_id
+                            (and preferably by decision_id and condition_id within a site).
+        @param chunk_size   Maximum number of records per chunk.
+        """
+
+        tmp_path = path + '.tmp'
+
+        chunks = []
+        # {(site_id, decision_id): size}
+        sizes = {}
+
+        with open(tmp_path, 'wb') as archive:
+            archive.write(DetoxSnapshotArchive._header.pack(DetoxSnapshotArchive.MAGIC, 0, 0))
+
+            def write_chunk(site_id, records):
+                data = zlib.compress(struct.pack('<' + DetoxSnapshotArchive._record_format * (len(records) / 4), *records), compression_level)
+                chunks.append((archive.tell(), len(data), len(records) / 4, site_id, sorted(set(records[2::4])), sorted(set(records[3::4]))))
+                archive.write(data)
+
+            current_site = None
+            written_sites = set()
+            records = []
+
+            for site_id, dataset_id, size, decision, condition in replicas:
+                if site_id != current_site or len(records) == chunk_size * 4:
+                    if len(records) != 0:
+                        write_chunk(current_site, records)
+                        records = []
+
+                    if site_id != current_site:
+                        if site_id in written_sites:
+                            raise ValueError('Replicas are not sorted by site')
+
+                        written_sites.add(site_id)
+                        current_site = site_id
+
+                records.extend((dataset_id, size, decision, condition))
+
+                try:
+                    sizes[(site_id, decision)] += size
+                except KeyError:
+                    sizes[(site_id, decision)] = size
+
+            if len(records) != 0:
+                write_chunk(current_site, records)
+
+            index = {
+                'decisions': list(decisions),
+                'statuses': dict((str(k), v) for k, v in statuses.iteritems()),
+                'sites': [list(s) for s in sites],
+                'sizes': [[site_id, decision, size] for (site_id, decision), size in sizes.iteritems()],
+                'chunks': chunks
+            }
+            index_data = zlib.compress(json.dumps(index), compression_level)
+
+            index_offset = archive.tell()
+            archive.write(index_data)
+
+            archive.seek(0)
+            archive.write(DetoxSnapshotArchive._header.pack(DetoxSnapshotArchive.MAGIC, index_offset, len(index_data)))
+
+        os.rename(tmp_path, path)
+
+    @staticmethod
+    def convert(db_file_name, path, chunk_size = 4096):
+        """
+        Write an archive from a snapshot SQLite3 file (the format written by DetoxHistory.save_cycle_state).
+        @param db_file_name  Snapshot SQLite3 file name.
+        @param path          Archive file name.
+        """
+
+        snapshot_db = sqlite3.connect(db_file_name)
+        snapshot_db.text_factory = str
+
+        try:
+            # SQLite decision ids follow MySQL enums and start at 1
+            decision_rows = snapshot_db.execute('SELECT `id`, `value` FROM `decisions` ORDER BY `id`').fetchall()
+            decisions = [''] * (max(r[0] for r in decision_rows) + 1)
+            for decision_id, name in decision_rows:
+                decisions[decision_id] = name
+
+            statuses = dict(snapshot_db.execute('SELECT `id`, `value` FROM `statuses`'))
+            sites = snapshot_db.execute('SELECT `site_id`, `status_id`, `quota` FROM `sites`').fetchall()
+
+            sql = 'SELECT `site_id`, `dataset_id`, `size`, `decision_id`, `condition` FROM `replicas`'
+            sql += ' ORDER BY `site_id`, `decision_id`, `condition`'
+            replicas = snapshot_db.execute(sql)
+
+            DetoxSnapshotArchive.write(path, decisions, statuses, sites, replicas, chunk_size = chunk_size)
+
+        finally:
+            snapshot_db.close()
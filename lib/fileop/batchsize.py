@@ -0,0 +1,94 @@
+import math
+import collections
+import logging
+
+LOG = logging.getLogger(__name__)
+
+class BatchSizeLearner(object):
+    """
+    Learns the batch size that minimizes the submission time per task of one file operation backend.
+    The latency of accepted submissions is fitted as a + b * n for batch size n. A batch with bad tasks is
+    rejected as a whole and bisected. With the fraction p of bad tasks and k = max(p * n, 1) bad tasks in a
+    rejected batch, bisection takes about 2 * k * (log2(n / k) + 1) submissions that send n * (log2(k) + 2) tasks
+    in total, so the expected time per task is
+      c(n) = (a + b * n + (1 - (1 - p)^n) * (2 * a * k * (log2(n / k) + 1) + b * n * (log2(k) + 2))) / n
+    and the learned size is the n minimizing c(n), searched up to twice the largest size observed (so that the size
+    grows gradually where there is no data).
+    """
+
+    def __init__(self, window = 100, min_samples = 5):
+        """
+        @param window       Number of latency samples kept.
+        @param min_samples  Number of samples needed before a size is proposed.
+        """
+        self.min_samples = min_samples
+
+        # [(batch size, latency)] of accepted submissions
+        self._samples = collections.deque(maxlen = window)
+        self._num_tasks = 0
+        self._num_bad = 0
+
+    def record(self, size, latency):
+        """
+        Record an accepted submission.
+        """
+        self._samples.append((size, latency))
+
+    def record_tasks(self, num_tasks, num_bad):
+        """
+        Record the number of tasks submitted in a round and the number of them isolated as bad.
+        """
+        self._num_tasks += num_tasks
+        self._num_bad += num_bad
+
+    def get_size(self):
+        """
+        @return The learned batch size, or None if there are not enough samples.
+        """
+        if len(self._samples) < self.min_samples:
+            return None
+
+        sizes = [n for n, _ in self._samples]
+        if min(sizes) == max(sizes):
+            return None
+
+        a, b = self._fit()
+        if a <= 0.:
+            # no measurable per-submission overhead - no preference
+            return None
+        if b < 0.:
+            b = 0.
+
+        p = float(self._num_bad) / max(self._num_tasks, 1)
+
+        def cost(n):
+            k = max(p * n, 1.)
+            bisection = 2. * a * k * (math.log(n / k, 2) + 1.) + b * n * (math.log(k, 2) + 2.)
+            return (a + b * n + (1. - (1. - p) ** n) * bisection) / n
+
+        limit = 2 * max(sizes)
+
+        best_n = 1
+        best_cost = cost(1)
+        n = 1.
+        while n < limit:
+            n = min(max(n + 1., n * 1.05), limit)
+            c = cost(int(n))
+            if c < best_cost:
+                best_n = int(n)
+                best_cost = c
+
+        return best_n
+
+    def _fit(self):
+        # least squares of latency = a + b * n
+        num = float(len(self._samples))
+        mean_n = sum(n for n, _ in self._samples) / num
+        mean_t = sum(t for _, t in self._samples) / num
+        var_n = sum((n - mean_n) ** 2 for n, _ in self._samples)
+        cov = sum((n - mean_n) * (t - mean_t) for n, t in self._samples)
+
+        b = cov / var_n
+        a = mean_t - b * mean_n
+
+        return a, b
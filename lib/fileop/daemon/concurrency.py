@@ -0,0 +1,278 @@
+import time
+import errno
+import threading
+import logging
+
+LOG = logging.getLogger(__name__)
+
+class LinkState(object):
+    """
+    Concurrency limit and completion counters of one (source, destination) link.
+    """
+
+    __slots__ = ['limit', 'active', 'succeeded', 'failed', 'congested', 'limited', 'window_start', 'settling', 'rate', 'error_rate', 'last_action']
+
+    def __init__(self, limit, now):
+        self.limit = float(limit)
+        self.active = 0
+        # counters in the current window
+        self.succeeded = 0
+        self.failed = 0
+        self.congested = 0
+        # True if a task was held back by the link limit in the current window
+        self.limited = False
+        self.window_start = now
+        # True in the window after a change of the limit (not used for the next adjustment)
+        self.settling = False
+        # measured in the last closed window
+        self.rate = 0.
+        self.error_rate = 0.
+        self.last_action = ''
+
+
+class LinkConcurrencyController(object):
+    """
+    Adjusts the number of concurrent operations on each link with additive increase, multiplicative decrease (AIMD).
+    The completions of each link are counted in windows of at least interval seconds and at least twice as many
+    finished operations as the current limit. The window right after a change of the limit is discarded, since it contains
+    operations started under the old limit. At the end of a window,
+     . if the fraction of operations failing with a congestion error exceeds error_threshold, the limit is
+       multiplied by decrease;
+     . if the previous increase did not raise the completion rate (the link is saturated), the increase is undone;
+     . otherwise, if tasks were held back by the limit, the limit is raised by increase.
+    Operations are started only when the link, the source and destination sites, and the total are all under
+    their caps. Slots under a shared cap go first to the waiting link with the fewest active operations. The
+    controller is shared by all pool managers and is thread-safe.
+    """
+
+    # Exit codes indicating an overloaded link or endpoint (as opposed to problems of individual files)
+    congestion_errors = set([
+        errno.ETIMEDOUT,
+        errno.ECONNABORTED,
+        errno.ECONNRESET,
+        errno.ECONNREFUSED,
+        errno.EHOSTUNREACH,
+        errno.EREMOTEIO,
+        errno.EMFILE,
+        errno.EAGAIN,
+        errno.EBUSY,
+        errno.EPIPE
+    ])
+
+    # An increase of the limit from n to n + k is useful if the rate grows by at least this fraction of k / n
+    min_gain = 0.5
+
+    def __init__(self, config):
+        """
+        @param config  Configuration with optional parameters
+                         initial: initial limit of each link
+                         min_per_link, max_per_link: bounds of the link limits
+                         max_total: cap on the total number of operations (0 = no cap)
+                         max_per_site: cap on the operations from or to a site (0 = no cap)
+                         site_caps: {site: cap} overriding max_per_site
+                         increase, decrease: AIMD parameters
+                         interval: minimum window length in seconds
+                         error_threshold: fraction of congestion errors that triggers a decrease
+        """
+        self.max_per_link = config.get('max_per_link', 10)
+        self.min_per_link = config.get('min_per_link', 1)
+        self.initial = config.get('initial', self.max_per_link)
+        self.max_total = config.get('max_total', 0)
+        self.max_per_site = config.get('max_per_site', 0)
+        self.site_caps = dict(config.get('site_caps', {}))
+        self.increase = config.get('increase', 1.)
+        self.decrease = config.get('decrease', 0.5)
+        self.interval = config.get('interval', 60.)
+        self.error_threshold = config.get('error_threshold', 0.2)
+
+        # {(source, destination): LinkState}
+        self._links = {}
+        # {site: number of active operations}
+        self._site_active = {}
+        self._total_active = 0
+
+        # events of the pool managers waiting for a free slot
+        self._waiters = set()
+        # {link: time} links held back by a shared (site or total) cap
+        self._blocked = {}
+
+        self._lock = threading.Lock()
+
+    def acquire(self, link, waiter = None, now = None):
+        """
+        Reserve a slot for one operation on the link.
+        @param link    (source, destination)
+        @param waiter  threading.Event to set when a slot may have become free.
+        @param now     Current time (for testing)
+        @return True if the operation can start.
+        """
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            state = self._get_state(link, now)
+            if state.active == 0 and state.succeeded + state.failed == 0:
+                # idle link - do not count the idle time in the rate
+                state.window_start = now
+
+            self._adjust(link, state, now)
+
+            if state.active >= int(state.limit):
+                state.limited = True
+            elif self._under_caps(link) and not self._other_has_precedence(link, state, now):
+                state.active += 1
+                self._total_active += 1
+                for site in set(link):
+                    self._site_active[site] = self._site_active.get(site, 0) + 1
+
+                self._blocked.pop(link, None)
+
+                return True
+            else:
+                self._blocked[link] = now
+
+            if waiter is not None:
+                self._waiters.add(waiter)
+
+            return False
+
+    def release(self, link, exitcode, now = None):
+        """
+        Free the slot of a finished operation.
+        @param link      (source, destination)
+        @param exitcode  0 for success, -1 for cancelled, None for unknown failure.
+        @param now       Current time (for testing)
+        """
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            state = self._get_state(link, now)
+
+            state.active -= 1
+            self._total_active -= 1
+            for site in set(link):
+                self._site_active[site] -= 1
+
+            if exitcode == 0:
+                state.succeeded += 1
+            elif exitcode != -1:
+                state.failed += 1
+                if exitcode in LinkConcurrencyController.congestion_errors:
+                    state.congested += 1
+
+            self._adjust(link, state, now)
+
+            waiters = self._waiters
+            self._waiters = set()
+
+        for waiter in waiters:
+            waiter.set()
+
+    def get_limit(self, link):
+        with self._lock:
+            try:
+                return int(self._links[link].limit)
+            except KeyError:
+                return int(self.initial)
+
+    def snapshot(self):
+        """
+        @return List of (source, destination, limit, active, rate, error_rate, last_action), with rate in
+                completions per second and error_rate the fraction of congestion errors, of the last window.
+        """
+        with self._lock:
+            return [(src, dest, int(s.limit), s.active, s.rate, s.error_rate, s.last_action) for (src, dest), s in sorted(self._links.iteritems())]
+
+    def _get_state(self, link, now):
+        try:
+            return self._links[link]
+        except KeyError:
+            state = self._links[link] = LinkState(min(max(self.initial, self.min_per_link), self.max_per_link), now)
+            return state
+
+    def _under_caps(self, link):
+        if self.max_total != 0 and self._total_active >= self.max_total:
+            return False
+
+        return all(self._site_active.get(site, 0) < self._site_cap(site) for site in set(link))
+
+    def _other_has_precedence(self, link, state, now):
+        """
+        Check if another link competing for the same caps was held back recently and has fewer active operations.
+        """
+        for other, blocked_time in self._blocked.items():
+            if now - blocked_time > self.interval:
+                # the other link is not asking any more
+                self._blocked.pop(other)
+                continue
+
+            if other == link:
+                continue
+
+            if self.max_total == 0 and len(set(link) & set(other)) == 0:
+                continue
+
+            if self._links[other].active < state.active:
+                return True
+
+        return False
+
+    def _site_cap(self, site):
+        cap = self.site_caps.get(site, self.max_per_site)
+        if cap == 0:
+            return self.max_total if self.max_total != 0 else float('inf')
+        else:
+            return cap
+
+    def _adjust(self, link, state, now):
+        num_finished = state.succeeded + state.failed
+        elapsed = now - state.window_start
+        if elapsed < self.interval or num_finished < 2 * int(state.limit):
+            return
+
+        if state.settling:
+            state.settling = False
+            action = state.last_action
+            limit = state.limit
+            rate = state.rate
+            error_rate = state.error_rate
+        else:
+            action, limit, rate, error_rate = self._next_limit(link, state, elapsed, num_finished)
+            state.settling = (int(limit) != int(state.limit))
+
+        state.limit = limit
+        state.rate = rate
+        state.error_rate = error_rate
+        state.last_action = action
+
+        state.succeeded = 0
+        state.failed = 0
+        state.congested = 0
+        state.limited = False
+        state.window_start = now
+
+    def _next_limit(self, link, state, elapsed, num_finished):
+        rate = state.succeeded / elapsed
+        error_rate = float(state.congested) / num_finished
+
+        limit = state.limit
+
+        if error_rate > self.error_threshold:
+            action = 'decrease'
+            limit = max(self.min_per_link, limit * self.decrease)
+        elif state.last_action == 'increase' and \
+                rate < state.rate * (1. + LinkConcurrencyController.min_gain * self.increase / (limit - self.increase)):
+            # more concurrency did not help
+            action = 'saturated'
+            limit = max(self.min_per_link, limit - self.increase)
+        elif state.limited and limit < self.max_per_link:
+            action = 'increase'
+            limit = min(self.max_per_link, limit + self.increase)
+        else:
+            action = ''
+
+        if int(limit) != int(state.limit):
+            LOG.info('Link %s -> %s: concurrency %d -> %d (%.2f files/s, %.0f%% congestion errors)', link[0], link[1], int(state.limit), int(limit), rate, error_rate * 100.)
+
+        return action, limit, rate, error_rate
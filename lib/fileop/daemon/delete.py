@@ -54,7 +54,7 @@ def unmanaged_delete(task_id, url):
     else:
         result = gfal_exec('unlink', (url,))
 
-    return (0,) + rmdir_result[1:]
+    return (0,) + result[1:]
 
 
 class UnmanagedDeletionPoolManager(PoolManager):
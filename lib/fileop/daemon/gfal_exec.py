@@ -26,7 +26,8 @@ def gfal_exec(method, args, nonerrors = {}, return_value = False):
     for attempt in xrange(5):
         # gfal2 knows to write to the logger. Redirect to StringIO and dump the full log at the end.
         stream = cStringIO.StringIO()
-        LOG.handlers.pop()
+        if len(LOG.handlers) != 0:
+            LOG.handlers.pop()
         handler = logging.StreamHandler(stream)
         handler.setFormatter(logging.Formatter(fmt = '%(asctime)s: %(message)s'))
         LOG.addHandler(handler)
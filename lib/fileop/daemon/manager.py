@@ -1,20 +1,32 @@
 import os
+import collections
 import threading
 import signal
 import multiprocessing
 import logging
 
+from dynamo.utils.interface.mysql import MySQL
+
 LOG = logging.getLogger(__name__)
 
 class PoolManager(object):
     """
     Base class for managing one task pool. Asynchronous results of the tasks are collected
     in collect_results() running as a separate thread, automatically started when the first
-    task is added to the pool
+    task is added to the pool. The collector is woken up by the pool when a task completes and
+    processes all completed tasks at once.
+    Managers of a link (self.link is set) hold the tasks back and submit them to the pool only
+    when the concurrency controller gives a slot, if a controller is set.
     """
 
     db = None
     stop_flag = None
+    ## WakeupSocket of the daemon main loop (optional)
+    wakeup = None
+    ## Tasks that fail with an exception do not wake up the collector; it checks at least this often
+    collect_interval = 5
+    ## LinkConcurrencyController shared by the managers of links (optional)
+    controller = None
     ## Need to have a global signal converter that subprocesses can unset blocking
     signal_converter = None
 
@@ -34,8 +46,13 @@ class PoolManager(object):
         self.opformat = opformat
         self.proxy = proxy
 
+        # (source, destination) for managers controlled by the link concurrency controller
+        self.link = None
+
         self._pool = multiprocessing.Pool(max_concurrent, initializer = self._pre_exec)
+        self._pending = collections.deque()
         self._results = []
+        self._ready = threading.Event()
         self._collector_thread = None
         self._closed = False
 
@@ -54,8 +71,12 @@ class PoolManager(object):
         LOG.info('%s: %s %s', self.name, self.optype, opstring)
 
         proc_args = (tid,) + args
-        async_result = self._pool.apply_async(self.task, proc_args)
-        self._results.append((tid, async_result) + args)
+        if self._is_controlled():
+            # collector submits the task when a slot is given
+            self._pending.append(proc_args)
+            self._ready.set()
+        else:
+            self._submit(proc_args)
 
         if self._collector_thread is None or not self._collector_thread.is_alive():
             self.start_collector()
@@ -66,6 +87,13 @@ class PoolManager(object):
         """
         pass
 
+    def process_results(self, result_tuples):
+        """
+        Process the results of completed tasks. Override to process them in bulk.
+        """
+        for result_tuple in result_tuples:
+            self.process_result(result_tuple)
+
     def ready_for_recycle(self):
         """
         Check if this pool manager can be shut down. Managers should be shut down whenever
@@ -76,7 +104,7 @@ class PoolManager(object):
         if self._closed:
             return True
 
-        if len(self._results) != 0:
+        if len(self._results) != 0 or len(self._pending) != 0:
             return False
 
         if self._collector_thread is None:
@@ -106,21 +134,54 @@ class PoolManager(object):
         self._collector_thread.start()
 
     def collect_results(self):
-        while len(self._results) != 0:
+        controlled = self._is_controlled()
+
+        while len(self._results) != 0 or len(self._pending) != 0:
+            if PoolManager.stop_flag.is_set():
+                return
+
+            # clear before checking the results so that a task completing in between sets the flag again
+            self._ready.clear()
+
+            if controlled:
+                while len(self._pending) != 0 and PoolManager.controller.acquire(self.link, self._ready):
+                    self._submit(self._pending.popleft())
+
+            ready = []
             ir = 0
             while ir != len(self._results):
-                if PoolManager.stop_flag.is_set():
-                    return
-    
-                if not self._results[ir][1].ready():
+                if self._results[ir][1].ready():
+                    ready.append(self._results.pop(ir))
+                else:
                     ir += 1
-                    continue
-    
-                self.process_result(self._results.pop(ir))
-    
-            is_set = PoolManager.stop_flag.wait(5)
-            if is_set: # True if Python 2.7 + flag is set
-                return
+
+            if len(ready) != 0:
+                if controlled:
+                    for result_tuple in ready:
+                        PoolManager.controller.release(self.link, self._get_exitcode(result_tuple[1]))
+
+                self.process_results(ready)
+                continue
+
+            self._ready.wait(PoolManager.collect_interval)
+
+    def _is_controlled(self):
+        return self.link is not None and PoolManager.controller is not None
+
+    def _submit(self, proc_args):
+        async_result = self._pool.apply_async(self.task, proc_args, callback = self._set_ready)
+        self._results.append((proc_args[0], async_result) + proc_args[1:])
+
+    def _get_exitcode(self, async_result):
+        # tasks of controlled managers return (exit code, ...)
+        try:
+            return async_result.get()[0]
+        except:
+            return None
+
+    def _set_ready(self, result):
+        # called in the result handler thread of the pool
+        self._ready.set()
 
     def _pre_exec(self):
         PoolManager.signal_converter.unset(signal.SIGTERM)
@@ -143,34 +204,58 @@ class StatefulPoolManager(PoolManager):
         Process the result of a completed task.
         """
 
+        self.process_results([result_tuple])
+
+    def process_results(self, result_tuples):
+        """
+        Process the results of completed tasks. Results are written back to the task table in one query.
+        """
+
         delim = '--------------'
 
-        tid, result = result_tuple[:2]
-        args = result_tuple[2:]
+        def from_unixtime(t):
+            if t is None:
+                return None
+            else:
+                return MySQL.bare('FROM_UNIXTIME(%d)' % t)
 
-        exitcode, start_time, finish_time, msg, log = result.get()
+        updates = []
 
-        if finish_time is not None and start_time is not None:
-            optime = finish_time - start_time
-        else:
-            optime = '-'
-        opstring = self.opformat.format(*args)
+        for result_tuple in result_tuples:
+            tid, result = result_tuple[:2]
+            args = result_tuple[2:]
 
-        if exitcode == -1:
-            LOG.info('%s: cancelled %s %s', self.name, self.optype, opstring)
-            status = 'cancelled'
-        elif exitcode == 0:
-            LOG.info('%s: succeeded %s (%s s) %s\n%s\n%s%s', self.name, self.optype, optime, opstring, delim, log, delim)
-            status = 'done'
-        else:
-            LOG.info('%s: failed %s (%s s, %d: %s) %s\n%s\n%s%s', self.name, self.optype, optime, exitcode, msg, opstring, delim, log, delim)
-            status = 'failed'
+            opstring = self.opformat.format(*args)
+
+            try:
+                exitcode, start_time, finish_time, msg, log = result.get()
+            except Exception as exc:
+                # exception in the task function itself
+                LOG.error('%s: failed %s (%s) %s', self.name, self.optype, str(exc), opstring)
+                updates.append((tid, 'failed', -1, str(exc), None, None))
+                continue
+
+            if finish_time is not None and start_time is not None:
+                optime = finish_time - start_time
+            else:
+                optime = '-'
+
+            if exitcode == -1:
+                LOG.info('%s: cancelled %s %s', self.name, self.optype, opstring)
+                status = 'cancelled'
+            elif exitcode == 0:
+                LOG.info('%s: succeeded %s (%s s) %s\n%s\n%s%s', self.name, self.optype, optime, opstring, delim, log, delim)
+                status = 'done'
+            else:
+                LOG.info('%s: failed %s (%s s, %d: %s) %s\n%s\n%s%s', self.name, self.optype, optime, exitcode, msg, opstring, delim, log, delim)
+                status = 'failed'
 
-        sql = 'UPDATE `standalone_{op}_tasks` SET `status` = %s, `exitcode` = %s, `message` = %s, `start_time` = FROM_UNIXTIME(%s), `finish_time` = FROM_UNIXTIME(%s) WHERE `id` = %s'.format(op = self.optype)
+            updates.append((tid, status, exitcode, msg, from_unixtime(start_time), from_unixtime(finish_time)))
 
-        PoolManager.db.query(sql, status, exitcode, msg, start_time, finish_time, tid)
+        fields = ('status', 'exitcode', 'message', 'start_time', 'finish_time')
+        PoolManager.db.update_many('standalone_{op}_tasks'.format(op = self.optype), 'id', fields, updates)
 
     def _set_queued(self, task_id):
         sql = 'UPDATE `standalone_{op}_tasks` SET `status` = \'queued\' WHERE `id` = %s'.format(op = self.optype)
-        updated = PoolManager.db.query(sql, tid)
+        updated = PoolManager.db.query(sql, task_id)
         return updated != 0
@@ -24,21 +24,31 @@ class StagingPoolManager(PoolManager):
         opformat = '{0}'
         PoolManager.__init__(self, site, 'staging', opformat, stage, max_concurrent, proxy)
 
-    def process_result(self, result_tuple):
-        delim = '--------------'
+    def process_results(self, result_tuples):
+        staged_ids = []
 
-        tid, result = result_tuple[:2]
-        args = result_tuple[2:]
+        for result_tuple in result_tuples:
+            tid, result = result_tuple[:2]
+            args = result_tuple[2:]
 
-        staged = result.get()
+            try:
+                staged = result.get()
+            except Exception as exc:
+                LOG.error('%s: staging poll failed (%s)', self.name, str(exc))
+                continue
 
-        opstring = self.opformat.format(*args)
+            if not staged:
+                continue
 
-        if not staged:
-            return
+            LOG.info('%s: staged %s', self.name, self.opformat.format(*args))
+            staged_ids.append(tid)
 
-        LOG.info('%s: staged %s', self.name, opstring)
+        if len(staged_ids) == 0:
+            return
 
-        sql = 'UPDATE `standalone_transfer_tasks` SET `status` = \'staged\' WHERE `id` = %s'
+        sql = 'UPDATE `standalone_transfer_tasks` SET `status` = \'staged\''
+        PoolManager.db.execute_many(sql, 'id', staged_ids)
 
-        PoolManager.db.query(sql, tid)
+        # staged files can be transferred now
+        if PoolManager.wakeup is not None:
+            PoolManager.wakeup.notify('staged')
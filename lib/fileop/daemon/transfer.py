@@ -54,3 +54,5 @@ class TransferPoolManager(StatefulPoolManager):
         name = '%s-%s' % (src, dest)
         opformat = '{0} -> {1}'
         PoolManager.__init__(self, name, 'transfer', opformat, transfer, max_concurrent, proxy)
+
+        self.link = (src, dest)
@@ -0,0 +1,84 @@
+import os
+import errno
+import select
+import socket
+
+# Path of the socket when not configured. The daemon and the Dynamo server must run on the same host for the
+# notifications to arrive; otherwise the daemon only polls.
+DEFAULT_SOCKET_PATH = '/tmp/dynamo-fileopd.sock'
+
+class WakeupSocket(object):
+    """
+    Unix datagram socket on which dynamo-fileopd waits for notifications of new tasks. A notification is only a
+    hint to look at the task tables now; nothing is lost if it does not arrive (the daemon also polls).
+    """
+
+    def __init__(self, path = DEFAULT_SOCKET_PATH):
+        self.path = path
+
+        try:
+            os.unlink(path)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(path)
+        self._socket.setblocking(False)
+
+    def wait(self, timeout):
+        """
+        Wait until at least one notification arrives or timeout seconds pass.
+        @return List of messages in the order of arrival. Empty list on timeout.
+        """
+        try:
+            readable, _, _ = select.select([self._socket], [], [], timeout)
+        except select.error as err:
+            if err.args[0] == errno.EINTR:
+                return []
+            raise
+
+        messages = []
+        if len(readable) == 0:
+            return messages
+
+        while True:
+            try:
+                messages.append(self._socket.recv(256))
+            except socket.error as err:
+                if err.errno == errno.EAGAIN:
+                    break
+                raise
+
+        return messages
+
+    def notify(self, message):
+        notify(message, self.path)
+
+    def close(self):
+        self._socket.close()
+
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def notify(message, path = DEFAULT_SOCKET_PATH):
+    """
+    Send a notification to the daemon. Never blocks and never fails.
+    @param message  Short string (e.g. 'transfer', 'deletion').
+    @param path     Socket path.
+    @return  True if the message was sent.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    try:
+        sock.sendto(message, path)
+    except socket.error:
+        # daemon not running, not listening on this host, or its buffer is full (it will wake up anyway)
+        return False
+    finally:
+        sock.close()
+
+    return True
@@ -65,6 +65,14 @@ class FileDeletionQuery(FileQuery):
     def __init__(self, config):
         FileQuery.__init__(self, config)
 
+    def prepare_deletion_status(self, batch_ids):
+        """
+        Called before a sweep of get_deletion_status over the batches. Plugins can fetch the statuses of all
+        batches at once here. Default implementation does nothing.
+        @param batch_ids  List of integer ids of the deletion task batches.
+        """
+        pass
+
     def get_deletion_status(self, batch_id):
         """
         Query the external agent about tasks in the given batch id.
@@ -0,0 +1,131 @@
+import time
+import random
+import logging
+
+from dynamo.fileop.source import SourceSelector
+
+LOG = logging.getLogger(__name__)
+
+class LinkStats(object):
+    """
+    Transfer history of one (source, destination) link in the window.
+    """
+
+    __slots__ = ['num_done', 'num_failed', 'bytes', 'seconds']
+
+    def __init__(self, num_done = 0, num_failed = 0, bytes = 0, seconds = 0.):
+        self.num_done = num_done
+        self.num_failed = num_failed
+        # volume and summed duration of successful transfers with known start and finish times
+        self.bytes = bytes
+        self.seconds = seconds
+
+
+class CostSourceSelector(SourceSelector):
+    """
+    Chooses the source with the lowest expected time to complete the transfer:
+      cost = max(queue time at the source, transfer time on the link) / success probability of the link
+    multiplied by (1 + number of failures of the subscription from the source).
+     . Transfer time is the file size over the per-transfer rate of the link in the last history_window seconds,
+       with a prior of default_rate weighted as prior_time seconds of transfers.
+     . Queue time is the volume in flight from the source (transfer tasks in the DB plus the ones assigned in this
+       cycle) over the throughput of the source, taken as the larger of its throughput in the window and
+       default_source_rate (so that idle sources are not assumed to be slow).
+     . Success probability is (succeeded + 1) / (all + 2) in the window.
+    The statistics are read once per cycle in start_cycle.
+    """
+
+    def __init__(self, config):
+        SourceSelector.__init__(self, config)
+
+        self.history_window = config.get('history_window', 6 * 3600.)
+        # bytes/s of a single transfer
+        self.default_rate = config.get('default_rate', 1.e+7)
+        # bytes/s of all transfers from a site
+        self.default_source_rate = config.get('default_source_rate', 2.e+8)
+        self.prior_time = config.get('prior_time', 60.)
+
+        # {(source_name, destination_name): LinkStats}
+        self._link_stats = {}
+        # {source_name: bytes/s}
+        self._source_rates = {}
+        # {source_name: bytes in flight}
+        self._inflight = {}
+
+    def start_cycle(self, db, history_db): #override
+        self._link_stats = self._query_history(history_db)
+
+        self._source_rates = {}
+        for (source_name, _), stats in self._link_stats.iteritems():
+            self._source_rates[source_name] = self._source_rates.get(source_name, 0.) + stats.bytes / self.history_window
+
+        self._inflight = self._query_inflight(db)
+
+        LOG.debug('Loaded statistics of %d links and %d sources with transfers in flight.', len(self._link_stats), len(self._inflight))
+
+    def select(self, subscription, candidates): #override
+        costs = [(self.get_cost(subscription, site), random.random(), site) for site in candidates]
+        cost, _, source = min(costs)
+
+        LOG.debug('Source %s for %s (expected %.0f s)', source.name, subscription.file.lfn, cost)
+
+        # count the assignment in the load of the source for the rest of the cycle
+        self._inflight[source.name] = self._inflight.get(source.name, 0) + subscription.file.size
+
+        return source
+
+    def get_cost(self, subscription, source):
+        size = subscription.file.size
+        dest_name = subscription.destination.name
+
+        try:
+            stats = self._link_stats[(source.name, dest_name)]
+        except KeyError:
+            stats = LinkStats()
+
+        rate = (stats.bytes + self.default_rate * self.prior_time) / (stats.seconds + self.prior_time)
+        transfer_time = size / rate
+
+        source_rate = max(self._source_rates.get(source.name, 0.), self.default_source_rate)
+        queue_time = (self._inflight.get(source.name, 0) + size) / source_rate
+
+        success = (stats.num_done + 1.) / (stats.num_done + stats.num_failed + 2.)
+
+        cost = max(queue_time, transfer_time) / success
+
+        if subscription.failed_sources is not None:
+            cost *= 1 + len(subscription.failed_sources.get(source, []))
+
+        return cost
+
+    def _query_history(self, history_db):
+        """
+        @return {(source_name, destination_name): LinkStats}
+        """
+        sql = 'SELECT ss.`name`, sd.`name`, SUM(t.`exitcode` = 0), SUM(t.`exitcode` != 0),'
+        sql += ' SUM(IF(t.`exitcode` = 0 AND t.`started` IS NOT NULL AND t.`finished` IS NOT NULL, f.`size`, 0)),'
+        sql += ' SUM(IF(t.`exitcode` = 0 AND t.`started` IS NOT NULL AND t.`finished` IS NOT NULL, UNIX_TIMESTAMP(t.`finished`) - UNIX_TIMESTAMP(t.`started`), 0))'
+        sql += ' FROM `file_transfers` AS t'
+        sql += ' INNER JOIN `sites` AS ss ON ss.`id` = t.`source_id`'
+        sql += ' INNER JOIN `sites` AS sd ON sd.`id` = t.`destination_id`'
+        sql += ' INNER JOIN `files` AS f ON f.`id` = t.`file_id`'
+        sql += ' WHERE t.`created` > FROM_UNIXTIME(%s)'
+        sql += ' GROUP BY t.`source_id`, t.`destination_id`'
+
+        link_stats = {}
+        for source_name, dest_name, num_done, num_failed, nbytes, seconds in history_db.db.xquery(sql, int(time.time() - self.history_window)):
+            link_stats[(source_name, dest_name)] = LinkStats(int(num_done), int(num_failed), float(nbytes), float(seconds))
+
+        return link_stats
+
+    def _query_inflight(self, db):
+        """
+        @return {source_name: bytes}
+        """
+        sql = 'SELECT s.`name`, SUM(f.`size`) FROM `transfer_tasks` AS q'
+        sql += ' INNER JOIN `sites` AS s ON s.`id` = q.`source_id`'
+        sql += ' INNER JOIN `file_subscriptions` AS u ON u.`id` = q.`subscription_id`'
+        sql += ' INNER JOIN `files` AS f ON f.`id` = u.`file_id`'
+        sql += ' GROUP BY q.`source_id`'
+
+        return dict((source_name, int(nbytes)) for source_name, nbytes in db.xquery(sql))
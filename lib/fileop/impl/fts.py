@@ -6,6 +6,7 @@ import collections
 import json
 import logging
 import errno
+import threading
 
 import fts3.rest.client.easy as fts3
 from fts3.rest.client.request import Request
@@ -15,6 +16,7 @@ from dynamo.fileop.base import FileQuery
 from dynamo.fileop.transfer import FileTransferOperation, FileTransferQuery
 from dynamo.fileop.deletion import FileDeletionOperation, FileDeletionQuery
 from dynamo.fileop.errors import find_msg_code
+from dynamo.fileop.poller import JobStatusPoller
 from dynamo.utils.interface.mysql import MySQL
 from dynamo.dataformat import Site
 
@@ -53,9 +55,36 @@ class FTSFileOperation(FileTransferOperation, FileTransferQuery, FileDeletionOpe
         # Bookkeeping device
         self.db = MySQL(config.db_params)
 
-        # Reuse the context object
+        # Reuse the context object (one per thread)
         self.keep_context = config.get('keep_context', True)
-        self._context = None
+        self._contexts = threading.local()
+
+        # Job statuses are fetched concurrently and only when due (see JobStatusPoller). Transfer (including
+        # staging) and deletion jobs are polled in separate sweeps.
+        self._pollers = {}
+        for optype in ('transfer', 'deletion'):
+            self._pollers[optype] = JobStatusPoller(
+                self._get_job_status,
+                lambda result: (result['job_state'], tuple(f['file_state'] for f in FTSFileOperation._job_files(result))),
+                lambda result: result['job_state'] in FTSFileOperation._terminal_job_states,
+                num_threads = config.get('status_poll_threads', 8),
+                min_interval = config.get('status_poll_min_interval', 60),
+                max_interval = config.get('status_poll_max_interval', 1800)
+            )
+
+        # {(optype, batch_id): [(job_id, {fts_file_id: task_id})]} filled by _prefetch_status
+        self._batch_jobs = {}
+        # {'transfer' or 'deletion': {job_id: job status}} from the last poll
+        self._job_results = {'transfer': {}, 'deletion': {}}
+
+    _terminal_job_states = ('FINISHED', 'FINISHEDDIRTY', 'FAILED', 'CANCELED')
+
+    @staticmethod
+    def _job_files(result):
+        try:
+            return result['files']
+        except KeyError:
+            return result['dm']
 
     def num_pending_transfers(self): #override
         # Check the number of files in queue
@@ -249,6 +278,12 @@ class FTSFileOperation(FileTransferOperation, FileTransferQuery, FileDeletionOpe
         sql += ' WHERE f.`id` IS NULL'
         self.db.query(sql)
 
+    def prepare_transfer_status(self, batch_ids): #override
+        if self.server_id == 0:
+            self._set_server_id()
+
+        self._prefetch_status(batch_ids, 'transfer')
+
     def get_transfer_status(self, batch_id): #override
         if self.server_id == 0:
             self._set_server_id()
@@ -285,6 +320,12 @@ class FTSFileOperation(FileTransferOperation, FileTransferQuery, FileDeletionOpe
 
         return results
 
+    def prepare_deletion_status(self, batch_ids): #override
+        if self.server_id == 0:
+            self._set_server_id()
+
+        self._prefetch_status(batch_ids, 'deletion')
+
     def get_deletion_status(self, batch_id): #override
         if self.server_id == 0:
             self._set_server_id()
@@ -317,7 +358,8 @@ class FTSFileOperation(FileTransferOperation, FileTransferQuery, FileDeletionOpe
         return self._do_ftscall(url = url)
 
     def _do_ftscall(self, binding = None, url = None):
-        if self._context is None:
+        context = getattr(self._contexts, 'context', None)
+        if context is None:
             # request_class = Request -> use "requests"-based https call (instead of default PyCURL,
             # which may not be able to handle proxy certificates depending on the cURL installation)
             # verify = False -> do not verify the server certificate
@@ -325,9 +367,7 @@ class FTSFileOperation(FileTransferOperation, FileTransferQuery, FileDeletionOpe
                                    request_class = Request, verify = False)
 
             if self.keep_context:
-                self._context = context
-        else:
-            context = self._context
+                self._contexts.context = context
 
         if binding is not None:
             reqstring = binding[0]
@@ -430,38 +470,79 @@ class FTSFileOperation(FileTransferOperation, FileTransferQuery, FileDeletionOpe
                 except:
                     LOG.error('Failed to cancel FTS job %s', job_id)
     
+    def _get_job_status(self, job_id):
+        LOG.debug('Checking status of FTS job %s', job_id)
+        return self._ftscall('get_job_status', job_id = job_id, list_files = True)
+
+    def _prefetch_status(self, batch_ids, optype):
+        """
+        Look up the FTS jobs and files of all batches in one query and poll the job statuses.
+        @param batch_ids  List of batch ids
+        @param optype     'transfer' (includes staging) or 'deletion'
+        """
+        self._batch_jobs = self._lookup_batch_jobs(batch_ids, optype)
+
+        job_ids = set(job_id for jobs in self._batch_jobs.itervalues() for job_id, _ in jobs)
+
+        self._job_results[optype] = self._pollers[optype].poll(job_ids)
+
+    def _lookup_batch_jobs(self, batch_ids, optype):
+        """
+        @return {(optype or 'staging', batch_id): [(job_id, {fts_file_id: task_id})]}
+        """
+        if optype == 'transfer':
+            optypes = ('transfer', 'staging')
+            sql = 'SELECT b.`batch_id`, b.`task_type`, b.`job_id`, t.`fts_file_id`, t.`id` FROM `fts_transfer_batches` AS b'
+            sql += ' INNER JOIN `fts_transfer_tasks` AS t ON t.`fts_batch_id` = b.`id`'
+        else:
+            optypes = ('deletion',)
+            sql = 'SELECT b.`batch_id`, \'deletion\', b.`job_id`, t.`fts_file_id`, t.`id` FROM `fts_deletion_batches` AS b'
+            sql += ' INNER JOIN `fts_deletion_tasks` AS t ON t.`fts_batch_id` = b.`id`'
+
+        # {(optype, batch_id): {job_id: {fts_file_id: task_id}}}
+        file_maps = collections.defaultdict(lambda: collections.defaultdict(dict))
+
+        condition = 'b.`fts_server_id` = %d' % self.server_id
+        for batch_id, task_type, job_id, fts_file_id, task_id in self.db.execute_many(sql, MySQL.bare('b.`batch_id`'), batch_ids, additional_conditions = [condition]):
+            file_maps[(task_type, batch_id)][job_id][fts_file_id] = task_id
+
+        batch_jobs = {}
+        for batch_id in batch_ids:
+            for op in optypes:
+                batch_jobs[(op, batch_id)] = file_maps[(op, batch_id)].items()
+
+        return batch_jobs
+
     def _get_status(self, batch_id, optype):
-        if optype == 'transfer' or optype == 'staging':
-            sql = 'SELECT `id`, `job_id` FROM `fts_transfer_batches`'
-            sql += ' WHERE `task_type` = %s AND `fts_server_id` = %s AND `batch_id` = %s'
-            batch_data = self.db.query(sql, optype, self.server_id, batch_id)
-            task_table_name = 'fts_transfer_tasks'
+        if optype == 'deletion':
+            poll_type = 'deletion'
         else:
-            sql = 'SELECT `id`, `job_id` FROM `fts_deletion_batches`'
-            sql += ' WHERE `fts_server_id` = %s AND `batch_id` = %s'
-            batch_data = self.db.query(sql, self.server_id, batch_id)
-            task_table_name = 'fts_deletion_tasks'
+            poll_type = 'transfer'
+
+        try:
+            batch_jobs = self._batch_jobs.pop((optype, batch_id))
+            job_results = self._job_results[poll_type]
+        except KeyError:
+            # prepare_*_status was not called for this batch - fetch directly
+            batch_jobs = self._lookup_batch_jobs([batch_id], poll_type)[(optype, batch_id)]
+            job_results = {}
+            for job_id, _ in batch_jobs:
+                try:
+                    job_results[job_id] = self._get_job_status(job_id)
+                except:
+                    pass
 
         message_pattern = re.compile('(?:DESTINATION|SOURCE|TRANSFER|DELETION) \[([0-9]+)\] (.*)')
 
         results = []
 
-        for fts_batch_id, job_id in batch_data:
-            LOG.debug('Checking status of FTS %s batch %s', optype, job_id)
-
-            sql = 'SELECT `fts_file_id`, `id` FROM `{table}` WHERE `fts_batch_id` = %s'.format(table = task_table_name)
-            fts_to_task = dict(self.db.xquery(sql, fts_batch_id))
-
-            try:
-                result = self._ftscall('get_job_status', job_id = job_id, list_files = True)
-            except:
+        for job_id, fts_to_task in batch_jobs:
+            result = job_results.get(job_id)
+            if result is None:
                 LOG.error('Failed to get job status for FTS job %s', job_id)
                 continue
-    
-            if optype == 'transfer' or optype == 'staging':
-                fts_files = result['files']
-            else:
-                fts_files = result['dm']
+
+            fts_files = FTSFileOperation._job_files(result)
 
             for fts_file in fts_files:
                 try:
@@ -0,0 +1,25 @@
+import random
+import logging
+
+from dynamo.fileop.source import SourceSelector
+
+LOG = logging.getLogger(__name__)
+
+class RandomSourceSelector(SourceSelector):
+    """
+    Random choice among the sites not tried yet. When all candidates were tried, the site with the fewest failures.
+    """
+
+    def __init__(self, config):
+        SourceSelector.__init__(self, config)
+
+    def select(self, subscription, candidates): #override
+        failed_sources = subscription.failed_sources
+        if failed_sources is not None and all(site in failed_sources for site in candidates):
+            # select the least failed site
+            by_failure = sorted(candidates, key = lambda s: len(failed_sources[s]))
+            LOG.debug('%s has the least failures', by_failure[0].name)
+            return by_failure[0]
+        else:
+            LOG.debug('Selecting randomly')
+            return random.choice(candidates)
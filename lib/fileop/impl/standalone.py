@@ -5,6 +5,7 @@ import logging
 from dynamo.fileop.base import FileQuery
 from dynamo.fileop.transfer import FileTransferOperation, FileTransferQuery
 from dynamo.fileop.deletion import FileDeletionOperation, FileDeletionQuery
+from dynamo.fileop.daemon import wakeup
 from dynamo.utils.interface.mysql import MySQL
 from dynamo.dataformat import File
 
@@ -23,6 +24,9 @@ class StandaloneFileOperation(FileTransferOperation, FileTransferQuery, FileDele
 
         self.db = MySQL(config.db_params)
 
+        # Socket of dynamo-fileopd to notify of new tasks (empty: daemon polls only)
+        self.daemon_socket = config.get('daemon_socket', wakeup.DEFAULT_SOCKET_PATH)
+
     def num_pending_transfers(self): #override
         # FOD can throttle itself.
         return 0
@@ -86,6 +90,7 @@ class StandaloneFileOperation(FileTransferOperation, FileTransferQuery, FileDele
             sql = 'INSERT INTO `standalone_transfer_batches` (`batch_id`, `source_site`, `destination_site`) VALUES (%s, %s, %s)'
             self.db.query(sql, batch_id, source.name, destination.name)
             self.db.insert_many('standalone_transfer_tasks', fields, None, yield_task_entry())
+            self._notify_daemon('transfer')
 
         LOG.debug('Inserted %d entries to standalone_transfer_tasks for batch %d.', len(batch_tasks), batch_id)
 
@@ -119,6 +124,7 @@ class StandaloneFileOperation(FileTransferOperation, FileTransferQuery, FileDele
             sql = 'INSERT INTO `standalone_deletion_batches` (`batch_id`, `site`) VALUES (%s, %s)'
             self.db.query(sql, batch_id, site.name)
             self.db.insert_many('standalone_deletion_tasks', fields, None, yield_task_entry())
+            self._notify_daemon('deletion')
 
         LOG.debug('Inserted %d entries to standalone_deletion_tasks for batch %d.', len(batch_tasks), batch_id)
 
@@ -178,6 +184,10 @@ class StandaloneFileOperation(FileTransferOperation, FileTransferQuery, FileDele
         sql = 'UPDATE `standalone_{op}_tasks` SET `status` = \'cancelled\''.format(op = optype)
         self.db.execute_many(sql, 'id', task_ids, ['`status` IN (\'new\', \'queued\')'])
 
+    def _notify_daemon(self, optype):
+        if self.daemon_socket:
+            wakeup.notify(optype, self.daemon_socket)
+
     def _get_status(self, batch_id, optype):
         sql = 'SELECT q.`id`, a.`status`, a.`exitcode`, a.`message`, UNIX_TIMESTAMP(a.`start_time`), UNIX_TIMESTAMP(a.`finish_time`) FROM `standalone_{op}_tasks` AS a'
         sql += ' INNER JOIN `{op}_tasks` AS q ON q.`id` = a.`id`'
@@ -0,0 +1,124 @@
+import time
+import threading
+import logging
+import Queue
+
+LOG = logging.getLogger(__name__)
+
+class JobStatusPoller(object):
+    """
+    Concurrent status poller for jobs of an external file operation service. Job statuses are fetched by a
+    fixed number of persistent worker threads (so that per-thread connections can be reused). A job is fetched
+    again only when it is due:
+     . Jobs in a terminal state are never fetched again.
+     . Jobs whose state changed at the last fetch are fetched at the next poll.
+     . Jobs whose state did not change back off exponentially from min_interval, up to max_interval and at
+       most a fraction of the job age (young jobs are checked more often than old ones).
+    The last fetched result of each job is returned for jobs that are not due.
+    """
+
+    # Back-off interval is limited to this fraction of the time since the job was first seen
+    age_fraction = 0.25
+
+    def __init__(self, fetch, get_state, is_terminal, num_threads = 8, min_interval = 60., max_interval = 1800.):
+        """
+        @param fetch         fetch(job_id) -> result. Called in the worker threads; may raise.
+        @param get_state     get_state(result) -> hashable summary used to detect changes.
+        @param is_terminal   is_terminal(result) -> True if the job will not change any more.
+        @param num_threads   Number of worker threads.
+        @param min_interval  Minimum back-off interval in seconds.
+        @param max_interval  Maximum back-off interval in seconds.
+        """
+        self._fetch = fetch
+        self._get_state = get_state
+        self._is_terminal = is_terminal
+
+        self.num_threads = num_threads
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        # {job_id: [result, state, first seen, last fetch, interval, terminal]}
+        self._jobs = {}
+
+        self._requests = Queue.Queue()
+        self._workers = []
+
+    def poll(self, job_ids, now = None):
+        """
+        Fetch the statuses of the due jobs and return the latest known result of all jobs. Jobs not in
+        job_ids are forgotten.
+        @param job_ids  Iterable of job ids
+        @param now      Current time (for testing)
+        @return {job_id: result}. Result is None if the job status was never fetched successfully.
+        """
+        if now is None:
+            now = time.time()
+
+        job_ids = set(job_ids)
+
+        for job_id in set(self._jobs.iterkeys()) - job_ids:
+            self._jobs.pop(job_id)
+
+        due = []
+        for job_id in job_ids:
+            try:
+                job = self._jobs[job_id]
+            except KeyError:
+                job = self._jobs[job_id] = [None, None, now, 0., 0., False]
+
+            result, state, first_seen, last_fetch, interval, terminal = job
+            if not terminal and now >= last_fetch + interval:
+                due.append(job_id)
+
+        for job_id, result, error in self._fetch_all(due):
+            job = self._jobs[job_id]
+
+            if error is not None:
+                LOG.error('Failed to get the status of job %s: %s', job_id, error)
+                # try again at the next poll
+                continue
+
+            state = self._get_state(result)
+
+            if self._is_terminal(result):
+                job[5] = True
+            elif state != job[1]:
+                job[4] = 0.
+            else:
+                age_limit = max(self.min_interval, (now - job[2]) * JobStatusPoller.age_fraction)
+                job[4] = min(max(job[4] * 2., self.min_interval), self.max_interval, age_limit)
+
+            job[0] = result
+            job[1] = state
+            job[3] = now
+
+        LOG.debug('Fetched %d of %d job statuses.', len(due), len(job_ids))
+
+        return dict((job_id, self._jobs[job_id][0]) for job_id in job_ids)
+
+    def _fetch_all(self, job_ids):
+        if len(job_ids) == 0:
+            return []
+
+        while len(self._workers) < min(self.num_threads, len(job_ids)):
+            thread = threading.Thread(target = self._run_worker, name = 'JobStatusPoller-%d' % len(self._workers))
+            thread.daemon = True
+            thread.start()
+            self._workers.append(thread)
+
+        responses = Queue.Queue()
+        for job_id in job_ids:
+            self._requests.put((job_id, responses))
+
+        return [responses.get() for _ in xrange(len(job_ids))]
+
+    def _run_worker(self):
+        while True:
+            job_id, responses = self._requests.get()
+
+            try:
+                result = self._fetch(job_id)
+            except Exception as ex:
+                responses.put((job_id, None, '%s (%s)' % (type(ex).__name__, str(ex))))
+            else:
+                responses.put((job_id, result, None))
@@ -1,6 +1,6 @@
 import os
+import math
 import collections
-import random
 import time
 import datetime
 import threading
@@ -10,6 +10,9 @@ from dynamo.fileop.base import FileQuery
 from dynamo.fileop.transfer import FileTransferOperation, FileTransferQuery
 from dynamo.fileop.deletion import FileDeletionOperation, FileDeletionQuery, DirDeletionOperation
 from dynamo.fileop.errors import irrecoverable_errors
+from dynamo.fileop.subscriptions import SubscriptionIndex
+from dynamo.fileop.source import SourceSelector
+from dynamo.fileop.batchsize import BatchSizeLearner
 from dynamo.dataformat import Configuration, Block, Site, BlockReplica
 from dynamo.history.history import HistoryDatabase
 from dynamo.utils.interface.mysql import MySQL
@@ -125,8 +128,20 @@ class RLFSM(object):
         else:
             self.deletion_queries = self.deletion_operations
 
+        # Source selection policy
+        if 'source_selector' in config:
+            self.source_selector = SourceSelector.get_instance(config.source_selector.module, config.source_selector.config)
+        else:
+            self.source_selector = SourceSelector.get_instance('randomsource:RandomSourceSelector', Configuration())
+
+        # {operation: BatchSizeLearner}
+        self._batch_learners = {}
+
         self.sites_in_downtime = []
 
+        # Schedulable subscriptions, read incrementally from the DB
+        self.subscription_index = SubscriptionIndex(config.get('retry_delay', 0.), config.get('full_sync_interval', 3600.))
+
         # Cycle thread
         self.main_cycle = None
         self.cycle_stop = threading.Event()
@@ -209,7 +224,7 @@ class RLFSM(object):
         LOG.debug('Filtering out transfers to unavailable destinations.')
         if not self._read_only:
             for site in self.sites_in_downtime:
-                self.db.query('UPDATE `file_subscriptions` SET `status` = \'held\', `hold_reason` = \'site_unavailable\' WHERE `site_id` = (SELECT `id` FROM `sites` WHERE `name` = %s)', site.name)
+                self.db.query('UPDATE `file_subscriptions` SET `status` = \'held\', `hold_reason` = \'site_unavailable\', `last_update` = NOW() WHERE `site_id` = (SELECT `id` FROM `sites` WHERE `name` = %s)', site.name)
 
         if self.cycle_stop.is_set():
             return
@@ -350,7 +365,7 @@ class RLFSM(object):
         LOG.debug('Filtering out transfers to unavailable destinations.')
         if not self._read_only:
             for site in self.sites_in_downtime:
-                self.db.query('UPDATE `file_subscriptions` SET `status` = \'held\', `hold_reason` = \'site_unavailable\' WHERE `site_id` = (SELECT `id` FROM `sites` WHERE `name` = %s)', site.name)
+                self.db.query('UPDATE `file_subscriptions` SET `status` = \'held\', `hold_reason` = \'site_unavailable\', `last_update` = NOW() WHERE `site_id` = (SELECT `id` FROM `sites` WHERE `name` = %s)', site.name)
 
         if self.cycle_stop.is_set():
             return
@@ -474,7 +489,7 @@ class RLFSM(object):
         self._subscribe(site, lfile, 1)
 
     def cancel_subscription(self, site = None, lfile = None, sub_id = None):
-        sql = 'UPDATE `file_subscriptions` SET `status` = \'cancelled\' WHERE '
+        sql = 'UPDATE `file_subscriptions` SET `status` = \'cancelled\', `last_update` = NOW() WHERE '
 
         if sub_id is None:
             if site is None or lfile is None:
@@ -522,7 +537,8 @@ class RLFSM(object):
 
     def get_subscriptions(self, inventory, op = None, status = None):
         """
-        Return a list containing Subscription and Desubscription objects ordered by the id.
+        Return a list containing Subscription and Desubscription objects grouped by the destination and block.
+        Schedulable (new and retry) subscriptions of one operation type are taken from the subscription index.
         @param inventory   Dynamo inventory
         @param op          If set to 'transfer' or 'deletion', limit to the operation type.
         @param status      If not None, set to list of status strings to limit the query.
@@ -533,26 +549,44 @@ class RLFSM(object):
 
         subscriptions = []
 
-        get_all = 'SELECT u.`id`, u.`status`, u.`delete`, f.`block_id`, f.`name`, s.`name`, u.`hold_reason` FROM `file_subscriptions` AS u'
-        get_all += ' INNER JOIN `files` AS f ON f.`id` = u.`file_id`'
-        get_all += ' INNER JOIN `sites` AS s ON s.`id` = u.`site_id`'
-
-        constraints = []
-        if op == 'transfer':
-            constraints.append('u.`delete` = 0')
-        elif op == 'deletion':
-            constraints.append('u.`delete` = 1')
-        if status is not None:
-            constraints.append('u.`status` IN ' + MySQL.stringify_sequence(status))
-
-        if len(constraints) != 0:
-            get_all += ' WHERE ' + ' AND '.join(constraints)
+        if op in ('transfer', 'deletion') and status is not None and set(status) <= set(SubscriptionIndex.statuses):
+            # rows grouped by destination and block from the in-memory index
+            self.subscription_index.sync(self.db)
+            rows = self.subscription_index.get(0 if op == 'transfer' else 1, status)
 
-        get_all += ' ORDER BY s.`id`, f.`block_id`'
-
-        get_tried_sites = 'SELECT s.`name`, f.`exitcode` FROM `failed_transfers` AS f'
-        get_tried_sites += ' INNER JOIN `sites` AS s ON s.`id` = f.`source_id`'
-        get_tried_sites += ' WHERE f.`subscription_id` = %s'
+        else:
+            get_all = 'SELECT u.`id`, u.`status`, u.`delete`, f.`block_id`, f.`name`, s.`name`, u.`hold_reason` FROM `file_subscriptions` AS u'
+            get_all += ' INNER JOIN `files` AS f ON f.`id` = u.`file_id`'
+            get_all += ' INNER JOIN `sites` AS s ON s.`id` = u.`site_id`'
+
+            constraints = []
+            if op == 'transfer':
+                constraints.append('u.`delete` = 0')
+            elif op == 'deletion':
+                constraints.append('u.`delete` = 1')
+            if status is not None:
+                constraints.append('u.`status` IN ' + MySQL.stringify_sequence(status))
+
+            if len(constraints) != 0:
+                get_all += ' WHERE ' + ' AND '.join(constraints)
+
+            get_all += ' ORDER BY s.`id`, f.`block_id`'
+
+            rows = self.db.query(get_all)
+
+        if op != 'deletion' and (status is None or 'retry' in status):
+            # sources tried by all retry subscriptions in one query, in the order of the attempts
+            get_tried_sites = 'SELECT f.`subscription_id`, s.`name`, f.`exitcode` FROM `failed_transfers` AS f'
+            get_tried_sites += ' INNER JOIN `sites` AS s ON s.`id` = f.`source_id`'
+            get_tried_sites += ' INNER JOIN `file_subscriptions` AS u ON u.`id` = f.`subscription_id`'
+            get_tried_sites += ' WHERE u.`status` = \'retry\' AND u.`delete` = 0'
+            get_tried_sites += ' ORDER BY f.`subscription_id`, f.`id`'
+
+            tried_sites = collections.defaultdict(list)
+            for sub_id, source_name, exitcode in self.db.xquery(get_tried_sites):
+                tried_sites[sub_id].append((source_name, exitcode))
+        else:
+            tried_sites = {}
 
         _destination_name = ''
         _block_id = -1
@@ -560,11 +594,12 @@ class RLFSM(object):
         no_source = []
         all_failed = []
         to_done = []
+        cancelled = []
 
         COPY = 0
         DELETE = 1
 
-        for row in self.db.query(get_all):
+        for row in rows:
             sub_id, st, optype, block_id, file_name, site_name, hold_reason = row
 
             if site_name != _destination_name:
@@ -599,11 +634,13 @@ class RLFSM(object):
             if dest_replica is None and st != 'cancelled':
                 LOG.debug('Destination replica for %s does not exist. Canceling the subscription.', file_name)
                 # Replica was invalidated
-                sql = 'UPDATE `file_subscriptions` SET `status` = \'cancelled\''
+                sql = 'UPDATE `file_subscriptions` SET `status` = \'cancelled\', `last_update` = NOW()'
                 sql += ' WHERE `id` = %s'
                 if not self._read_only:
                     self.db.query(sql, sub_id)
 
+                cancelled.append(sub_id)
+
                 if status is not None and 'cancelled' not in status:
                     # We are not asked to return cancelled subscriptions
                     continue
@@ -643,7 +680,7 @@ class RLFSM(object):
 
                 if st == 'retry':
                     failed_sources = {}
-                    for source_name, exitcode in self.db.query(get_tried_sites, sub_id):
+                    for source_name, exitcode in tried_sites.get(sub_id, []):
                         try:
                             source = inventory.sites[source_name]
                         except KeyError:
@@ -702,6 +739,8 @@ class RLFSM(object):
             self.db.execute_many('UPDATE `file_subscriptions` SET `status` = \'held\', `hold_reason` = \'no_source\', `last_update` = NOW()', 'id', no_source)
             self.db.execute_many('UPDATE `file_subscriptions` SET `status` = \'held\', `hold_reason` = \'all_failed\', `last_update` = NOW()', 'id', all_failed)
 
+            self.subscription_index.discard(to_done + no_source + all_failed + cancelled)
+
             # Clean up subscriptions for deleted files / sites
             sql = 'DELETE FROM u USING `file_subscriptions` AS u'
             sql += ' LEFT JOIN `files` AS f ON f.`id` = u.`file_id`'
@@ -736,7 +775,7 @@ class RLFSM(object):
             return
 
         self.db.query('DELETE FROM `failed_transfers` WHERE `subscription_id` = %s', subscription.id)
-        self.db.query('UPDATE `file_subscriptions` SET `status` = \'retry\' WHERE `id` = %s', subscription.id)
+        self.db.query('UPDATE `file_subscriptions` SET `status` = \'retry\', `last_update` = NOW() WHERE `id` = %s', subscription.id)
 
     def _run_cycle(self, inventory):
         while True:
@@ -792,7 +831,7 @@ class RLFSM(object):
                 op.cleanup()
 
         # Reset inbatch subscriptions with no task to new state
-        sql = 'UPDATE `file_subscriptions` SET `status` = \'new\' WHERE `status` = \'inbatch\' AND `id` NOT IN (SELECT `subscription_id` FROM `transfer_tasks`) AND `id` NOT IN (SELECT `subscription_id` FROM `deletion_tasks`)'
+        sql = 'UPDATE `file_subscriptions` SET `status` = \'new\', `last_update` = NOW() WHERE `status` = \'inbatch\' AND `id` NOT IN (SELECT `subscription_id` FROM `transfer_tasks`) AND `id` NOT IN (SELECT `subscription_id` FROM `deletion_tasks`)'
         self.db.query(sql)
 
         # Delete canceled subscriptions with no task (ones with task need to be archived in update_status)
@@ -826,7 +865,7 @@ class RLFSM(object):
             self.db.lock_tables(write = ['file_subscriptions'])
 
         try:
-            sql = 'UPDATE `file_subscriptions` SET `status` = \'cancelled\''
+            sql = 'UPDATE `file_subscriptions` SET `status` = \'cancelled\', `last_update` = NOW()'
             sql += ' WHERE `file_id` = %s AND `site_id` = %s AND `delete` = %s'
             sql += ' AND `status` IN (\'new\', \'inbatch\', \'retry\', \'held\')'
             if not self._read_only:
@@ -835,7 +874,8 @@ class RLFSM(object):
             fields = ('file_id', 'site_id', 'status', 'delete', 'created', 'last_update')
 
             if not self._read_only:
-                self.db.insert_update('file_subscriptions', fields, lfile.id, site.id, 'new', delete, now, now, update_columns = ('status', 'last_update'))
+                # last_update is compared with the DB clock by the subscription index
+                self.db.insert_update('file_subscriptions', fields, lfile.id, site.id, 'new', delete, now, MySQL.bare('NOW()'), update_columns = ('status', 'last_update'))
 
         finally:
             if not self._read_only:
@@ -900,7 +940,16 @@ class RLFSM(object):
 
         # Collect completed tasks
 
-        for batch_id in self.db.query('SELECT `id` FROM `{op}_batches`'.format(op = optype)):
+        batch_ids = self.db.query('SELECT `id` FROM `{op}_batches`'.format(op = optype))
+
+        if optype == 'transfer':
+            for _, query in self.transfer_queries:
+                query.prepare_transfer_status(batch_ids)
+        else:
+            for _, query in self.deletion_queries:
+                query.prepare_deletion_status(batch_ids)
+
+        for batch_id in batch_ids:
             results = []
 
             if optype == 'transfer':
@@ -1055,13 +1104,15 @@ class RLFSM(object):
 
     def _select_source(self, subscriptions):
         """
-        Intelligently select the best source for each subscription.
+        Select the source for each subscription with the source selector.
         @param subscriptions  List of Subscription objects
 
         @return  List of TransferTask objects
         """
 
-        def find_site_to_try(sources, failed_sources):
+        def find_site_to_try(subscription, sources):
+            failed_sources = subscription.failed_sources
+
             not_tried = set(sources)
             if failed_sources is not None:
                 not_tried -= set(failed_sources.iterkeys())
@@ -1084,23 +1135,22 @@ class RLFSM(object):
                 if len(sites_to_retry) == 0:
                     return None
                 else:
-                    # select the least failed site
-                    by_failure = sorted(sites_to_retry, key = lambda s: len(failed_sources[s]))
-                    LOG.debug('%s has the least failures', by_failure[0].name)
-                    return by_failure[0]
+                    return self.source_selector.select(subscription, sites_to_retry)
 
             else:
-                LOG.debug('Selecting randomly')
-                return random.choice(list(not_tried))
+                return self.source_selector.select(subscription, list(not_tried))
+
+        if len(subscriptions) != 0:
+            self.source_selector.start_cycle(self.db, self.history_db)
 
         tasks = []
 
         for subscription in subscriptions:
             LOG.debug('Selecting a disk source for subscription %d (%s to %s)', subscription.id, subscription.file.lfn, subscription.destination.name)
-            source = find_site_to_try(subscription.disk_sources, subscription.failed_sources)
+            source = find_site_to_try(subscription, subscription.disk_sources)
             if source is None:
                 LOG.debug('Selecting a tape source for subscription %d', subscription.id)
-                source = find_site_to_try(subscription.tape_sources, subscription.failed_sources)
+                source = find_site_to_try(subscription, subscription.tape_sources)
 
             if source is None:
                 # If both disk and tape failed irrecoveably, the subscription must be placed in held queue in get_subscriptions.
@@ -1114,39 +1164,14 @@ class RLFSM(object):
         return tasks
 
     def _start_transfers(self, transfer_operation, tasks):
-        # start the transfer of tasks. If batch submission fails, make progressively smaller batches until failing tasks are identified.
-        if self._read_only:
-            batch_id = 0
-        else:
-            self.db.query('INSERT INTO `transfer_batches` (`id`) VALUES (0)')
-            batch_id = self.db.last_insert_id
-
-        LOG.debug('New transfer batch %d for %d files.', batch_id, len(tasks))
-
-        # local time
-        now = time.strftime('%Y-%m-%d %H:%M:%S')
-
-        # need to create the transfer tasks first to have ids assigned
-        fields = ('subscription_id', 'source_id', 'batch_id', 'created')
-        mapping = lambda t: (t.subscription.id, t.source.id, batch_id, now)
-
-        if not self._read_only:
-            self.db.insert_many('transfer_tasks', fields, mapping, tasks)
-        
-        # set the task ids
-        tasks_by_sub = dict((t.subscription.id, t) for t in tasks)
-        for task_id, subscription_id in self.db.xquery('SELECT `id`, `subscription_id` FROM `transfer_tasks` WHERE `batch_id` = %s', batch_id):
-            tasks_by_sub[subscription_id].id = task_id
-
-        result = transfer_operation.start_transfers(batch_id, tasks)
-
-        successful = [task for task, success in result.iteritems() if success]
+        # start the transfer of tasks. Batches rejected as a whole are bisected until the failing tasks are identified.
+        successful, failed = self._submit_tasks('transfer', transfer_operation, tasks)
 
         if not self._read_only:
             self.db.execute_many('UPDATE `file_subscriptions` SET `status` = \'inbatch\', `last_update` = NOW()', 'id', [t.subscription.id for t in successful])
+            self.subscription_index.discard([t.subscription.id for t in successful])
 
-            if len(successful) != len(result):
-                failed = [task for task, success in result.iteritems() if not success]
+            if len(failed) != 0:
                 for task in failed:
                     LOG.error('Cannot issue transfer of %s from %s to %s',
                               task.subscription.file.lfn, task.source.name, task.subscription.destination.name)
@@ -1161,49 +1186,177 @@ class RLFSM(object):
 
                 self.db.execute_many('UPDATE `file_subscriptions` SET `status` = \'retry\', `last_update` = NOW()', 'id', [t.subscription.id for t in failed])
 
-        return len(successful), len(result) - len(successful)
+        return len(successful), len(failed)
 
     def _start_deletions(self, deletion_operation, tasks):
+        successful, failed = self._submit_tasks('deletion', deletion_operation, tasks)
+
+        if not self._read_only:
+            self.db.execute_many('UPDATE `file_subscriptions` SET `status` = \'inbatch\', `last_update` = NOW()', 'id', [t.desubscription.id for t in successful])
+            self.subscription_index.discard([t.desubscription.id for t in successful])
+
+            if len(failed) != 0:
+                for task in failed:
+                    LOG.error('Cannot delete %s at %s',
+                              task.desubscription.file.lfn, task.desubscription.site.name)
+
+                self.db.delete_many('deletion_tasks', 'id', [t.id for t in failed])
+
+                self.db.execute_many('UPDATE `file_subscriptions` SET `status` = \'held\', `last_update` = NOW()', 'id', [t.desubscription.id for t in failed])
+
+        return len(successful), len(failed)
+
+    def _submit_tasks(self, optype, operation, tasks):
+        """
+        Submit the tasks to the backend in batches of at most the learned batch size of the backend. A batch of more
+        than one task rejected as a whole is split in halves and the rejected halves are split again, so that k bad
+        tasks among n are isolated in about 2 * k * log2(n) submissions. After 2 * log2(n) + 2 rejections in a row,
+        the backend may be rejecting everything: the undecided batches are then submitted once each without splitting.
+        The rejected ones are split again in passes, which continue as long as each pass has an accepted batch. The
+        tasks of the batches still rejected after a pass without acceptance fail.
+        @param optype     'transfer' or 'deletion'
+        @param operation  FileTransferOperation or FileDeletionOperation
+        @param tasks      List of TransferTask or DeletionTask objects
+
+        @return  (list of submitted tasks, list of failed tasks)
+        """
+        try:
+            learner = self._batch_learners[operation]
+        except KeyError:
+            learner = self._batch_learners[operation] = BatchSizeLearner()
+
+        batch_size = learner.get_size()
+        if batch_size is None or batch_size >= len(tasks):
+            batch_size = max(len(tasks), 1)
+        else:
+            LOG.debug('Splitting %d %s tasks into batches of %d.', len(tasks), optype, batch_size)
+
+        successful = []
+        failed = []
+
+        max_rejections = 2 * int(math.ceil(math.log(max(len(tasks), 2), 2))) + 2
+        # number of rejections in a row and number of accepted batches (lists to be modified in submit)
+        rejections = [0]
+        num_accepted = [0]
+        # rejected batches not split yet
+        deferred = []
+
+        def submit(batch_tasks):
+            # return True if the batch was rejected as a whole
+            start = time.time()
+            batch_id, result = self._submit_batch(optype, operation, batch_tasks)
+            latency = time.time() - start
+
+            if len(result) != 0 and not any(result.itervalues()):
+                rejections[0] += 1
+
+                if len(batch_tasks) > 1:
+                    LOG.info('%s batch %d of %d tasks was rejected.', optype.capitalize(), batch_id, len(batch_tasks))
+                    if not self._read_only:
+                        # tasks are moved to new batches or deleted
+                        self.db.query('DELETE FROM `{op}_batches` WHERE `id` = %s'.format(op = optype), batch_id)
+
+                    return True
+            else:
+                rejections[0] = 0
+                num_accepted[0] += 1
+                learner.record(len(batch_tasks), latency)
+
+            for task, success in result.iteritems():
+                if success:
+                    successful.append(task)
+                else:
+                    failed.append(task)
+
+            return False
+
+        def resolve(batch_tasks):
+            if rejections[0] > max_rejections:
+                # A long run of adjacent bad tasks also gives many rejections in a row. Only an accepted batch tells
+                # the two cases apart, so the rejected batch is split in the next pass.
+                if submit(batch_tasks):
+                    deferred.append(batch_tasks)
+            elif submit(batch_tasks):
+                isolate(batch_tasks)
+
+        def isolate(batch_tasks):
+            half = len(batch_tasks) / 2
+            resolve(batch_tasks[:half])
+            resolve(batch_tasks[half:])
+
+        for offset in xrange(0, len(tasks), batch_size):
+            resolve(tasks[offset:offset + batch_size])
+
+        while len(deferred) != 0:
+            # deferred batches are split into ever smaller halves, so this terminates
+            last_accepted = num_accepted[0]
+            batches = list(deferred)
+            del deferred[:]
+            for batch_tasks in batches:
+                isolate(batch_tasks)
+
+            if num_accepted[0] == last_accepted:
+                break
+
+        if len(deferred) != 0:
+            num_tasks = sum(len(batch_tasks) for batch_tasks in deferred)
+            LOG.warning('%d %s batches were rejected in a row. Failed the %d remaining tasks without further submission.', rejections[0], optype, num_tasks)
+
+            for batch_tasks in deferred:
+                failed.extend(batch_tasks)
+
+        learner.record_tasks(len(tasks), len(failed))
+
+        return successful, failed
+
+    def _submit_batch(self, optype, operation, batch_tasks):
+        """
+        Create a batch, assign the tasks to it (new tasks are created), and submit it to the backend.
+        @return  (batch id, {task: boolean} from the backend)
+        """
         if self._read_only:
             batch_id = 0
         else:
-            self.db.query('INSERT INTO `deletion_batches` (`id`) VALUES (0)')
+            self.db.query('INSERT INTO `{op}_batches` (`id`) VALUES (0)'.format(op = optype))
             batch_id = self.db.last_insert_id
 
+        LOG.debug('New %s batch %d for %d files.', optype, batch_id, len(batch_tasks))
+
         # local time
         now = time.strftime('%Y-%m-%d %H:%M:%S')
-        
-        fields = ('subscription_id', 'batch_id', 'created')
-        mapping = lambda t: (t.desubscription.id, batch_id, now)
 
-        if not self._read_only:
-            self.db.insert_many('deletion_tasks', fields, mapping, tasks)
-
-        # set the task ids
-        tasks_by_sub = dict((t.desubscription.id, t) for t in tasks)
-        for task_id, desubscription_id in self.db.xquery('SELECT `id`, `subscription_id` FROM `deletion_tasks` WHERE `batch_id` = %s', batch_id):
-            tasks_by_sub[desubscription_id].id = task_id
-        
-        result = deletion_operation.start_deletions(batch_id, tasks)
+        if optype == 'transfer':
+            fields = ('subscription_id', 'source_id', 'batch_id', 'created')
+            mapping = lambda t: (t.subscription.id, t.source.id, batch_id, now)
+            tasks_by_sub = dict((t.subscription.id, t) for t in batch_tasks if t.id is None)
+        else:
+            fields = ('subscription_id', 'batch_id', 'created')
+            mapping = lambda t: (t.desubscription.id, batch_id, now)
+            tasks_by_sub = dict((t.desubscription.id, t) for t in batch_tasks if t.id is None)
 
-        successful = [task for task, success in result.iteritems() if success]
+        # tasks of a rejected batch already exist
+        existing_ids = [t.id for t in batch_tasks if t.id is not None]
 
         if not self._read_only:
-            self.db.execute_many('UPDATE `file_subscriptions` SET `status` = \'inbatch\', `last_update` = NOW()', 'id', [t.desubscription.id for t in successful])
-
-            if len(successful) != len(result):
-                failed = [task for task, success in result.iteritems() if not success]
+            # need to create the tasks first to have ids assigned
+            self.db.insert_many('{op}_tasks'.format(op = optype), fields, mapping, tasks_by_sub.itervalues())
+            self.db.execute_many('UPDATE `{op}_tasks` SET `batch_id` = {batch}'.format(op = optype, batch = batch_id), 'id', existing_ids)
 
-                for task in failed:
-                    LOG.error('Cannot delete %s at %s',
-                              task.desubscription.file.lfn, task.desubscription.site.name)
+        # set the task ids
+        if len(tasks_by_sub) != 0:
+            for task_id, subscription_id in self.db.xquery('SELECT `id`, `subscription_id` FROM `{op}_tasks` WHERE `batch_id` = %s'.format(op = optype), batch_id):
+                try:
+                    tasks_by_sub[subscription_id].id = task_id
+                except KeyError:
+                    pass
 
-                self.db.delete_many('deletion_tasks', 'id', [t.id for t in failed])
+        if optype == 'transfer':
+            result = operation.start_transfers(batch_id, batch_tasks)
+        else:
+            result = operation.start_deletions(batch_id, batch_tasks)
 
-                self.db.execute_many('UPDATE `file_subscriptions` SET `status` = \'held\', `last_update` = NOW()', 'id', [t.desubscription.id for t in failed])
+        return batch_id, result
 
-        return len(successful), len(result) - len(successful)
-    
     def _set_dirclean_candidates(self, subscription_ids, inventory):
         site_dirs = {}
 
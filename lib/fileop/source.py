@@ -0,0 +1,31 @@
+from dynamo.utils.classutil import get_instance
+
+class SourceSelector(object):
+    """
+    Policy choosing the source site of each transfer in RLFSM._select_source. RLFSM narrows the sources of a
+    subscription down to the candidates (sites not tried yet, or if all were tried, sites whose last failure was
+    recoverable); the selector picks one of them.
+    """
+
+    @staticmethod
+    def get_instance(module, config):
+        return get_instance(SourceSelector, module, config)
+
+    def __init__(self, config):
+        pass
+
+    def start_cycle(self, db, history_db):
+        """
+        Called once per cycle before the selections. Load whatever state the policy needs.
+        @param db          MySQL interface to the inventory DB (transfer_tasks etc.)
+        @param history_db  HistoryDatabase
+        """
+        pass
+
+    def select(self, subscription, candidates):
+        """
+        @param subscription  RLFSM.Subscription
+        @param candidates    Non-empty list of Site objects
+        @return  One of the candidates
+        """
+        raise NotImplementedError('select')
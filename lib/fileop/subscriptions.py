@@ -0,0 +1,171 @@
+import time
+import heapq
+import logging
+
+LOG = logging.getLogger(__name__)
+
+class SubscriptionIndex(object):
+    """
+    In-memory copy of the schedulable (new and retry) rows of file_subscriptions, grouped by operation type,
+    status, destination site, and block. Rows are read in full once and then only when their last_update changes,
+    so that a cycle does not scan the whole table. A retry subscription becomes eligible retry_delay seconds after
+    its last update; until then it is held in a heap ordered by the eligible time.
+    The index is reloaded in full every full_sync_interval seconds, or when the number of schedulable rows in the
+    table differs from the index (rows deleted without passing through a non-schedulable status).
+    """
+
+    statuses = ('new', 'retry')
+    _status_condition = 'u.`status` IN (\'new\', \'retry\')'
+
+    # Rows of subscriptions whose file or site is gone are not indexed; the count query uses the same joins
+    _joins = ' INNER JOIN `files` AS f ON f.`id` = u.`file_id`'
+    _joins += ' INNER JOIN `sites` AS s ON s.`id` = u.`site_id`'
+
+    _columns = 'SELECT u.`id`, u.`status`, u.`delete`, f.`block_id`, f.`name`, s.`name`, u.`hold_reason`, UNIX_TIMESTAMP(u.`last_update`) FROM `file_subscriptions` AS u'
+    _columns += _joins
+
+    def __init__(self, retry_delay = 0., full_sync_interval = 3600.):
+        self.retry_delay = retry_delay
+        self.full_sync_interval = full_sync_interval
+
+        # {sub_id: (row, eligible time)} where row is (id, status, delete, block_id, file_name, site_name, hold_reason)
+        self._rows = {}
+        # {(delete, status): {site_name: {block_id: set(sub_ids)}}} of eligible rows
+        self._groups = {}
+        # [(eligible time, sub_id)] of rows not eligible yet
+        self._deferred = []
+
+        # DB clock at the last sync (UNIX time)
+        self._last_sync = None
+        self._last_full_sync = 0.
+
+    def __len__(self):
+        return len(self._rows)
+
+    def sync(self, db):
+        """
+        Bring the index up to date with the table.
+        @param db  MySQL interface to the inventory DB.
+        """
+        # use the clock of the DB server, which sets last_update
+        db_now = db.query('SELECT UNIX_TIMESTAMP()')[0]
+
+        if self._last_sync is None or time.time() - self._last_full_sync > self.full_sync_interval:
+            self._full_sync(db)
+        else:
+            # last_update has a granularity of one second; rows of the second of the last sync are read again
+            sql = SubscriptionIndex._columns + ' WHERE u.`last_update` >= FROM_UNIXTIME(%s)'
+            num_changed = 0
+            for row in db.xquery(sql, self._last_sync):
+                self._set(row)
+                num_changed += 1
+
+            sql = 'SELECT COUNT(*) FROM `file_subscriptions` AS u' + SubscriptionIndex._joins + ' WHERE ' + SubscriptionIndex._status_condition
+            num_rows = db.query(sql)[0]
+            if num_rows != len(self._rows):
+                LOG.info('Subscription index has %d entries while the table has %d. Reloading.', len(self._rows), num_rows)
+                self._full_sync(db)
+            else:
+                LOG.debug('Read %d changed subscriptions.', num_changed)
+
+        self._last_sync = db_now
+
+        while len(self._deferred) != 0 and self._deferred[0][0] <= db_now:
+            eligible, sub_id = heapq.heappop(self._deferred)
+            try:
+                row, current = self._rows[sub_id]
+            except KeyError:
+                continue
+
+            if current == eligible:
+                self._group_add(row)
+
+    def get(self, delete, statuses):
+        """
+        Generator of the eligible rows of the operation type and statuses, grouped by destination and block.
+        @param delete    0 for transfer, 1 for deletion.
+        @param statuses  List of status strings (subset of SubscriptionIndex.statuses).
+        """
+        for status in statuses:
+            by_site = self._groups.get((delete, status), {})
+            # copy the keys - the caller may discard rows while iterating
+            for site_name in sorted(by_site.keys()):
+                by_block = by_site.get(site_name, {})
+                for block_id in sorted(by_block.keys()):
+                    for sub_id in list(by_block.get(block_id, ())):
+                        try:
+                            yield self._rows[sub_id][0]
+                        except KeyError:
+                            pass
+
+    def discard(self, sub_ids):
+        """
+        Remove subscriptions that left the schedulable statuses in this process.
+        """
+        for sub_id in sub_ids:
+            try:
+                row, _ = self._rows.pop(sub_id)
+            except KeyError:
+                continue
+
+            self._group_remove(row)
+
+    def _full_sync(self, db):
+        self._rows = {}
+        self._groups = {}
+        self._deferred = []
+
+        sql = SubscriptionIndex._columns + ' WHERE ' + SubscriptionIndex._status_condition
+        for row in db.xquery(sql):
+            self._set(row)
+
+        self._last_full_sync = time.time()
+
+        LOG.info('Loaded %d schedulable subscriptions.', len(self._rows))
+
+    def _set(self, dbrow):
+        sub_id, status = dbrow[:2]
+        last_update = dbrow[7]
+        row = dbrow[:7]
+
+        self.discard([sub_id])
+
+        if status not in SubscriptionIndex.statuses:
+            return
+
+        if status == 'retry' and self.retry_delay != 0 and last_update is not None:
+            eligible = last_update + self.retry_delay
+        else:
+            eligible = 0
+
+        self._rows[sub_id] = (row, eligible)
+
+        if eligible != 0:
+            # grouped at the end of sync if already eligible
+            heapq.heappush(self._deferred, (eligible, sub_id))
+        else:
+            self._group_add(row)
+
+    def _group_add(self, row):
+        sub_id, status, delete, block_id, _, site_name, _ = row
+
+        by_site = self._groups.setdefault((delete, status), {})
+        by_block = by_site.setdefault(site_name, {})
+        by_block.setdefault(block_id, set()).add(sub_id)
+
+    def _group_remove(self, row):
+        sub_id, status, delete, block_id, _, site_name, _ = row
+
+        try:
+            by_site = self._groups[(delete, status)]
+            by_block = by_site[site_name]
+            sub_ids = by_block[block_id]
+        except KeyError:
+            # deferred row
+            return
+
+        sub_ids.discard(sub_id)
+        if len(sub_ids) == 0:
+            by_block.pop(block_id)
+            if len(by_block) == 0:
+                by_site.pop(site_name)
@@ -58,6 +58,14 @@ class FileTransferQuery(FileQuery):
     def __init__(self, config):
         FileQuery.__init__(self, config)
 
+    def prepare_transfer_status(self, batch_ids):
+        """
+        Called before a sweep of get_transfer_status over the batches. Plugins can fetch the statuses of all
+        batches at once here. Default implementation does nothing.
+        @param batch_ids  List of integer ids of the transfer task batches.
+        """
+        pass
+
     def get_transfer_status(self, batch_id):
         """
         Query the external agent about tasks in the given batch id.
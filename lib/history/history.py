@@ -1,6 +1,62 @@
+import threading
+
 from dynamo.utils.interface.mysql import MySQL
 from dynamo.dataformat import Configuration
 
+class IdCache(object):
+    """
+    Bounded map from the unique key of a history table row to a value (see HistoryDatabase._save_entries). Entries are kept in two
+    generations of at most max_size / 2 entries each; when the recent generation is full, the older one is
+    dropped. Entries found in the old generation are moved to the recent one, so that the eviction is
+    approximately least-recently-used. Rows of these tables are never deleted, so cached ids stay valid.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+
+        self._recent = {}
+        self._old = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, keys):
+        """
+        @param keys  Iterable of keys
+        @return ({key: value} for cached keys, [uncached key])
+        """
+        found = {}
+        missing = []
+
+        with self._lock:
+            recent = self._recent
+            old = self._old
+
+            for key in keys:
+                try:
+                    found[key] = recent[key]
+                except KeyError:
+                    try:
+                        found[key] = recent[key] = old[key]
+                    except KeyError:
+                        missing.append(key)
+
+            self._rotate()
+
+        return found, missing
+
+    def update(self, ids):
+        with self._lock:
+            self._recent.update(ids)
+            self._rotate()
+
+    def __len__(self):
+        return len(self._recent) + len(self._old)
+
+    def _rotate(self):
+        if len(self._recent) >= self.max_size / 2:
+            self._old = self._recent
+            self._recent = {}
+
+
 class HistoryDatabase(object):
     """
     Interface to the history database. This is a MySQL-specific implementation, and we actually
@@ -13,6 +69,10 @@ class HistoryDatabase(object):
     # default configuration
     _config = Configuration()
 
+    # {(connection parameters, table): IdCache} shared by all instances in the process
+    _id_caches = {}
+    _id_caches_lock = threading.Lock()
+
     @staticmethod
     def set_default(config):
         HistoryDatabase._config = Configuration(config)
@@ -25,6 +85,9 @@ class HistoryDatabase(object):
 
         self.set_read_only(config.get('read_only', False))
 
+        # Maximum number of ids cached per table
+        self.id_cache_size = config.get('id_cache_size', 1000000)
+
     def set_read_only(self, value = True):
         self._read_only = value
 
@@ -32,76 +95,22 @@ class HistoryDatabase(object):
         """
         @param user_list  [(name, dn)]
         """
-        if self._read_only:
-            if get_ids:
-                return [0] * len(user_list)
-            else:
-                return
-
-        self.db.insert_many('users', ('name', 'dn'), None, user_list, do_update = True)
-
-        if get_ids:
-            return self.db.select_many('users', ('id',), 'dn', [u[1] for u in user_list])
+        return self._save_entries('users', ('name', 'dn'), 1, user_list, get_ids)
 
     def save_user_services(self, service_names, get_ids = False):
-        if self._read_only:
-            if get_ids:
-                return [0] * len(service_names)
-            else:
-                return
-
-        self.db.insert_many('user_services', ('name',), MySQL.make_tuple, service_names, do_update = True)
-
-        if get_ids:
-            return self.db.select_many('user_services', ('id',), 'name', service_names)
+        return self._save_names('user_services', service_names, get_ids)
 
     def save_partitions(self, partition_names, get_ids = False):
-        if self._read_only:
-            if get_ids:
-                return [0] * len(partition_names)
-            else:
-                return
-
-        self.db.insert_many('partitions', ('name',), MySQL.make_tuple, partition_names, do_update = True)
-
-        if get_ids:
-            return self.db.select_many('partitions', ('id',), 'name', partition_names)
+        return self._save_names('partitions', partition_names, get_ids)
 
     def save_sites(self, site_names, get_ids = False):
-        if self._read_only:
-            if get_ids:
-                return [0] * len(site_names)
-            else:
-                return
-
-        self.db.insert_many('sites', ('name',), MySQL.make_tuple, site_names, do_update = True)
-
-        if get_ids:
-            return self.db.select_many('sites', ('id',), 'name', site_names)
+        return self._save_names('sites', site_names, get_ids)
 
     def save_groups(self, group_names, get_ids = False):
-        if self._read_only:
-            if get_ids:
-                return [0] * len(group_names)
-            else:
-                return
-
-        self.db.insert_many('groups', ('name',), MySQL.make_tuple, group_names, do_update = True)
-
-        if get_ids:
-            return self.db.select_many('groups', ('id',), 'name', group_names)
+        return self._save_names('groups', group_names, get_ids)
 
     def save_datasets(self, dataset_names, get_ids = False):
-        if self._read_only:
-            if get_ids:
-                return [0] * len(dataset_names)
-            else:
-                return
-
-        self.db.insert_many('datasets', ('name',), MySQL.make_tuple, dataset_names, do_update = True)
-
-        if get_ids:
-            return self.db.select_many('datasets', ('id',), 'name', dataset_names)
+        return self._save_names('datasets', dataset_names, get_ids)
 
     def save_blocks(self, block_list, get_ids = False):
         """
@@ -113,46 +122,101 @@ class HistoryDatabase(object):
             else:
                 return
 
-        reuse_orig = self.db.reuse_connection
-        self.db.reuse_connection = True
-
-        datasets = set(b[0] for b in block_list)
-
-        self.save_datasets(datasets)
+        block_list = list(block_list)
 
-        columns = [
-            '`dataset` varchar(512) CHARACTER SET latin1 COLLATE latin1_general_cs NOT NULL',
-            '`block` varchar(128) CHARACTER SET latin1 COLLATE latin1_general_cs NOT NULL'
-        ]
-        self.db.create_tmp_table('blocks_tmp', columns)
-        self.db.insert_many('blocks_tmp', ('dataset', 'block'), None, block_list, db = self.db.scratch_db)
+        dataset_names = list(set(b[0] for b in block_list))
+        dataset_ids = dict(zip(dataset_names, self.save_datasets(dataset_names, get_ids = True)))
 
-        sql = 'INSERT INTO `blocks` (`dataset_id`, `name`)'
-        sql += ' SELECT d.`id`, b.`block` FROM `{scratch}`.`blocks_tmp` AS b'.format(scratch = self.db.scratch_db)
-        sql += ' INNER JOIN `datasets` AS d ON d.`name` = b.`dataset`'
-        self.db.query(sql)
-
-        if get_ids:
-            sql = 'SELECT b.`id` FROM `blocks` AS b'
-            sql += ' INNER JOIN (SELECT d.`id` dataset_id, t.`block` block_name FROM `{scratch}`.`blocks_tmp` AS t'.format(scratch = self.db.scratch_db)
-            sql += ' INNER JOIN `datasets` AS d ON d.`name` = t.`dataset`) AS j ON (j.`dataset_id`, j.`block_name`) = (b.`dataset_id`, b.`name`)'
+        entries = [(dataset_ids[dataset_name], block_name) for dataset_name, block_name in block_list]
 
-            ids = self.db.query(sql)
+        return self._save_entries('blocks', ('dataset_id', 'name'), None, entries, get_ids)
 
-        self.db.drop_tmp_table('blocks_tmp')
-        self.db.reuse_connection = reuse_orig
+    def save_files(self, file_data, get_ids = False):
+        """
+        @param file_data  [(name, size)]
+        """
+        return self._save_entries('files', ('name', 'size'), 0, file_data, get_ids)
 
-        if get_ids:
-            return ids
+    def _save_names(self, table, names, get_ids):
+        names = list(names)
+        return self._save_entries(table, ('name',), 0, [(name,) for name in names], get_ids)
 
-    def save_files(self, file_data, get_ids = False):
+    def _save_entries(self, table, fields, key_index, entries, get_ids):
+        """
+        Write the rows missing from the process-wide id cache and return the ids of all rows in the order of
+        entries. The cache maps the unique key to (id, row as last written); rows found in the cache with the same
+        values cost no query, rows whose non-key values differ are written again.
+
+        @param table      Table name.
+        @param fields     Names of the columns given in entries.
+        @param key_index  Index of the column with the unique key in fields. If None, the key is all fields.
+        @param entries    List of tuples of values of fields.
+        @param get_ids    If False, return None.
+        """
         if self._read_only:
             if get_ids:
-                return [0] * len(file_data)
+                return [0] * len(entries)
             else:
                 return
 
-        self.db.insert_many('files', ('name', 'size'), None, file_data, do_update = True)
+        entries = list(entries)
+
+        cache = self._id_cache(table)
+
+        if key_index is None:
+            key_of = lambda entry: entry
+        else:
+            key_of = lambda entry: entry[key_index]
+
+        unique_entries = set(entries)
+        cached, _ = cache.lookup(set(key_of(entry) for entry in unique_entries))
+
+        ids = {}
+        missing = []
+        for entry in unique_entries:
+            try:
+                row_id, cached_entry = cached[key_of(entry)]
+            except KeyError:
+                missing.append(entry)
+            else:
+                if cached_entry == entry:
+                    ids[entry] = row_id
+                else:
+                    missing.append(entry)
+
+        if len(missing) != 0:
+            # ON DUPLICATE KEY UPDATE: the row may exist already, and the non-key columns (users.name, files.size)
+            # are overwritten with the given values
+            self.db.insert_many(table, fields, None, missing, do_update = True)
+
+            if key_index is None:
+                key = fields
+                pool = missing
+                key_ids = dict((row[:-1], row[-1]) for row in self.db.select_many(table, fields + ('id',), key, pool))
+            else:
+                key = fields[key_index]
+                pool = [entry[key_index] for entry in missing]
+                key_ids = dict(self.db.select_many(table, (key, 'id'), key, pool))
+
+            # {key: (id, entry)}; if several entries have the same key, the last one was written last
+            found = {}
+            for entry, key_value in zip(missing, pool):
+                row_id = key_ids[key_value]
+                ids[entry] = row_id
+                found[key_of(entry)] = (row_id, entry)
+
+            cache.update(found)
 
         if get_ids:
-            return self.db.select_many('files', ('id',), 'name', [f[0] for f in file_data])
+            return [ids[entry] for entry in entries]
+
+    def _id_cache(self, table):
+        conf = self.db.config()
+        key = (conf.get('host', None), conf.get('config_file', None), conf.get('config_group', None), conf.get('db', None), table)
+
+        with HistoryDatabase._id_caches_lock:
+            try:
+                return HistoryDatabase._id_caches[key]
+            except KeyError:
+                cache = HistoryDatabase._id_caches[key] = IdCache(self.id_cache_size)
+                return cache
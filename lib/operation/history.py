@@ -23,9 +23,7 @@ class DeletionHistoryDatabase(HistoryDatabase):
             return
 
         dataset_names = [r.dataset_name for r in deletion_record.replicas]
-        self.save_datasets(dataset_names)
-
-        dataset_id_map = dict(self.db.select_many('datasets', ('name', 'id'), 'name', dataset_names))
+        dataset_id_map = dict(zip(dataset_names, self.save_datasets(dataset_names, get_ids = True)))
 
         fields = ('deletion_id', 'dataset_id', 'size')
         mapping = lambda replica: (deletion_record.operation_id, dataset_id_map[replica.dataset_name], replica.size)
@@ -60,9 +58,7 @@ class CopyHistoryDatabase(HistoryDatabase):
             return
 
         dataset_names = [r.dataset_name for r in copy_record.replicas]
-        self.save_datasets(dataset_names)
-
-        dataset_id_map = dict(self.db.select_many('datasets', ('name', 'id'), 'name', dataset_names))
+        dataset_id_map = dict(zip(dataset_names, self.save_datasets(dataset_names, get_ids = True)))
 
         fields = ('copy_id', 'dataset_id', 'size', 'status')
         mapping = lambda replica: (copy_record.operation_id, dataset_id_map[replica.dataset_name], replica.size, replica.status)
@@ -4,6 +4,10 @@ import logging
 import time
 import re
 import multiprocessing
+import threading
+import itertools
+import datetime
+import tempfile
 from ConfigParser import ConfigParser
 
 import MySQLdb
@@ -29,12 +33,196 @@ from dynamo.dataformat import Configuration
 
 LOG = logging.getLogger(__name__)
 
+class ConnectionPool(object):
+    """
+    Thread-safe pool of MySQL connections keyed by the full set of connection parameters. Used by MySQL instances
+    with reuse_connection = False, which would otherwise open a new connection for every query.
+    """
+
+    def __init__(self, max_size = 10, lease_timeout = 60., check_interval = 60.):
+        """
+        @param max_size        Maximum number of connections (leased + idle) per key.
+        @param lease_timeout   Seconds to wait for a free connection before raising a RuntimeError.
+        @param check_interval  Connections idle for longer than this are pinged before being leased.
+        """
+
+        self.max_size = max_size
+        self.lease_timeout = lease_timeout
+        self.check_interval = check_interval
+
+        self._lock = threading.Condition(threading.Lock())
+        # {key: [(connection, last_used)]}
+        self._idle = {}
+        # {key: number of open connections}
+        self._num_open = {}
+        # {key: user@host/db}
+        self._labels = {}
+        # Connections inherited from the parent process. They are never used nor closed (closing would
+        # terminate the session of the parent).
+        self._orphans = []
+        self._pid = os.getpid()
+
+        # Lease wait-time metrics
+        self.num_leases = 0
+        self.num_waits = 0
+        self.total_wait_time = 0.
+        self.max_wait_time = 0.
+
+    def lease(self, parameters):
+        """
+        Return an open connection. Connections must be given back with release() or discard().
+        @param parameters  Connection parameters passed to MySQLdb.connect.
+        """
+
+        key = ConnectionPool._key(parameters)
+
+        with self._lock:
+            self._check_fork()
+
+            start = time.time()
+            waited = False
+
+            while True:
+                idle = self._idle.get(key)
+                if idle:
+                    connection, last_used = idle.pop()
+                    break
+
+                if self._num_open.get(key, 0) < self.max_size:
+                    connection = None
+                    self._num_open[key] = self._num_open.get(key, 0) + 1
+                    self._labels[key] = ConnectionPool._label(parameters)
+                    break
+
+                remaining = start + self.lease_timeout - time.time()
+                if remaining <= 0.:
+                    raise RuntimeError('Timed out waiting for a MySQL connection to %s' % ConnectionPool._label(parameters))
+
+                waited = True
+                self._lock.wait(remaining)
+
+            wait_time = time.time() - start
+            self.num_leases += 1
+            if waited:
+                self.num_waits += 1
+            self.total_wait_time += wait_time
+            if wait_time > self.max_wait_time:
+                self.max_wait_time = wait_time
+
+        if connection is not None and time.time() - last_used > self.check_interval:
+            # health check
+            try:
+                connection.ping()
+            except MySQLdb.Error:
+                LOG.info('Discarding a stale MySQL connection to %s', ConnectionPool._label(parameters))
+                try:
+                    connection.close()
+                except MySQLdb.Error:
+                    pass
+
+                connection = None
+
+        if connection is None:
+            try:
+                connection = MySQLdb.connect(**parameters)
+            except:
+                with self._lock:
+                    self._num_open[key] -= 1
+                    self._lock.notify()
+                raise
+
+        return connection
+
+    def release(self, parameters, connection):
+        """
+        Return a healthy connection to the pool.
+        """
+
+        key = ConnectionPool._key(parameters)
+
+        with self._lock:
+            if self._check_fork():
+                # connection was leased in the parent process
+                self._orphans.append(connection)
+                return
+
+            self._idle.setdefault(key, []).append((connection, time.time()))
+            self._lock.notify()
+
+    def discard(self, parameters, connection):
+        """
+        Close a connection that is broken or in an unknown state instead of returning it to the pool.
+        """
+
+        key = ConnectionPool._key(parameters)
+
+        with self._lock:
+            if self._check_fork():
+                self._orphans.append(connection)
+                return
+
+            self._num_open[key] -= 1
+            self._lock.notify()
+
+        try:
+            connection.close()
+        except MySQLdb.Error:
+            pass
+
+    def stats(self):
+        """
+        @return {'leases': N, 'waits': N, 'total_wait': seconds, 'max_wait': seconds, 'open': {user@host/db: N}}
+        """
+
+        with self._lock:
+            num_open = {}
+            for key, num in self._num_open.iteritems():
+                label = self._labels[key]
+                num_open[label] = num_open.get(label, 0) + num
+
+            return {
+                'leases': self.num_leases,
+                'waits': self.num_waits,
+                'total_wait': self.total_wait_time,
+                'max_wait': self.max_wait_time,
+                'open': num_open
+            }
+
+    def _check_fork(self):
+        # Call with the lock held. Returns True if this is a forked child and the pool was reset.
+        if os.getpid() == self._pid:
+            return False
+
+        for idle in self._idle.itervalues():
+            self._orphans.extend(c for c, _ in idle)
+
+        self._idle.clear()
+        self._num_open.clear()
+        self._pid = os.getpid()
+
+        return True
+
+    @staticmethod
+    def _key(parameters):
+        # Connections are interchangeable only if all parameters (port, socket, password, charset, local_infile, ..)
+        # are identical
+        return tuple(sorted((key, repr(value)) for key, value in parameters.iteritems()))
+
+    @staticmethod
+    def _label(parameters):
+        # For messages; the key contains the password
+        return '%s@%s/%s' % (parameters.get('user'), parameters.get('host'), parameters.get('db'))
+
+
 class MySQL(object):
     """Generic thread-safe MySQL interface (for an interface)."""
 
     _default_config = Configuration()
     _default_parameters = {'': {}} # {user: config}
 
+    # Shared by all instances with reuse_connection = False
+    _pool = ConnectionPool()
+
     @staticmethod
     def set_default(config):
         MySQL._default_config = Configuration(config)
@@ -44,6 +232,17 @@ class MySQL(object):
             MySQL._default_parameters[user] = dict(params)
             MySQL._default_parameters[user]['user'] = user
 
+        MySQL._pool.max_size = MySQL._default_config.get('pool_max_size', MySQL._pool.max_size)
+        MySQL._pool.lease_timeout = MySQL._default_config.get('pool_lease_timeout', MySQL._pool.lease_timeout)
+        MySQL._pool.check_interval = MySQL._default_config.get('pool_check_interval', MySQL._pool.check_interval)
+
+    @staticmethod
+    def pool_stats():
+        """
+        Return the lease count and wait-time metrics of the connection pool.
+        """
+        return MySQL._pool.stats()
+
     @staticmethod
     def escape_string(string):
         """
@@ -74,6 +273,12 @@ class MySQL(object):
         def __init__(self, value):
             self.value = value
 
+    # Error code of duplicate keys (ER_DUP_ENTRY)
+    _dup_entry_code = 1062
+
+    # Input file format of LOAD DATA used by load_many (see tsv_escape)
+    _load_data_format = ' CHARACTER SET binary FIELDS TERMINATED BY \'\\t\' ESCAPED BY \'\\\\\' LINES TERMINATED BY \'\\n\''
+
     @staticmethod
     def make_tuple(obj):
         return (obj,)
@@ -127,10 +332,30 @@ class MySQL(object):
         # Default database for CREATE TEMPORARY TABLE
         self.scratch_db = config.get('scratch_db', MySQL._default_config.get('scratch_db', ''))
 
-        # Row id of the last insertion. Will be nonzero if the table has an auto-increment primary key.
-        # **NOTE** While core execution of query() and xquery() are locked and thread-safe, last_insert_id is not.
-        # Use insert_and_get_id() in a threaded environment.
-        self.last_insert_id = 0
+        # insert_many switches to LOAD DATA LOCAL INFILE at this number of rows (0 = never)
+        self.load_data_threshold = config.get('load_data_threshold', MySQL._default_config.get('load_data_threshold', 0))
+        # Directory for the temporary data files (None = system default)
+        self.load_data_dir = config.get('load_data_dir', MySQL._default_config.get('load_data_dir', None))
+        if self.load_data_threshold > 0:
+            # A connection with local_infile lets the server read any file of the client; enable only when used
+            self._connection_parameters['local_infile'] = 1
+
+        # Whether the server accepts LOAD DATA LOCAL (None = not checked yet)
+        self._local_infile = None
+
+        # Row id of the last insertion is kept per thread (see the last_insert_id property)
+        self._thread_data = threading.local()
+
+    @property
+    def last_insert_id(self):
+        """
+        Row id of the last insertion by the current thread. Will be nonzero if the table has an auto-increment primary key.
+        """
+        return getattr(self._thread_data, 'last_insert_id', 0)
+
+    @last_insert_id.setter
+    def last_insert_id(self, value):
+        self._thread_data.last_insert_id = value
 
     def db_name(self):
         return self._connection_parameters['db']
@@ -172,9 +397,57 @@ class MySQL(object):
         conf['reuse_connection'] = self.reuse_connection
         conf['max_query_len'] = self.max_query_len
         conf['scratch_db'] = self.scratch_db
+        conf['load_data_threshold'] = self.load_data_threshold
+        if self.load_data_dir is not None:
+            conf['load_data_dir'] = self.load_data_dir
 
         return conf
 
+    def get_connection(self):
+        """
+        Return the dedicated connection if reuse_connection is True, otherwise lease a connection from the pool.
+        """
+
+        if self.reuse_connection:
+            if self._connection is None:
+                self._connection = MySQLdb.connect(**self._connection_parameters)
+
+            return self._connection
+        else:
+            return MySQL._pool.lease(self._connection_parameters)
+
+    def release_connection(self, connection, cursor = None, broken = False):
+        """
+        Close the cursor and give back the connection obtained from get_connection.
+        @param connection  Connection returned by get_connection.
+        @param cursor      Cursor to close.
+        @param broken      If True, the connection is closed instead of being reused.
+        """
+
+        if cursor is not None:
+            try:
+                cursor.close()
+            except MySQLdb.Error:
+                broken = True
+
+        if connection is None:
+            return
+
+        if connection is self._connection:
+            if broken or not self.reuse_connection:
+                # not reusing any more (reuse_connection was flipped) or lost the connection
+                try:
+                    self._connection.close()
+                except MySQLdb.Error:
+                    pass
+
+                self._connection = None
+        else:
+            if broken:
+                MySQL._pool.discard(self._connection_parameters, connection)
+            else:
+                MySQL._pool.release(self._connection_parameters, connection)
+
     def get_cursor(self, cursor_cls = MySQLdb.connections.Connection.default_cursor):
         if self._connection is None:
             self._connection = MySQLdb.connect(**self._connection_parameters)
@@ -182,12 +455,7 @@ class MySQL(object):
         return self._connection.cursor(cursor_cls)
 
     def close_cursor(self, cursor):
-        if cursor is not None:
-            cursor.close()
-    
-        if not self.reuse_connection and self._connection is not None:
-            self._connection.close()
-            self._connection = None
+        self.release_connection(self._connection, cursor)
 
     def query(self, sql, *args, **kwd):
         """
@@ -209,11 +477,16 @@ class MySQL(object):
         except KeyError:
             silent = False
 
-        self._connection_lock.acquire()
+        # Pooled connections are not shared between threads; the lock is only needed for the dedicated connection
+        use_lock = self.reuse_connection
+        if use_lock:
+            self._connection_lock.acquire()
 
+        connection = None
         cursor = None
         try:
-            cursor = self.get_cursor()
+            connection = self.get_connection()
+            cursor = connection.cursor()
     
             self.last_insert_id = 0
 
@@ -227,13 +500,13 @@ class MySQL(object):
                 for _ in range(num_attempts):
                     try:
                         cursor.execute(sql, args)
-                        self._connection.commit()
+                        connection.commit()
                         break
                     except MySQLdb.OperationalError as err:
-                        if not (self.reuse_connection and err.args[0] == 2006):
+                        if err.args[0] != 2006:
                             raise
                             #2006 = MySQL server has gone away
-                            #If we are reusing connections, this type of error is to be ignored
+                            #If we are reusing connections (dedicated or pooled), this type of error is to be ignored
 
                         if not silent:
                             LOG.error(str(sys.exc_info()[1]))
@@ -241,9 +514,11 @@ class MySQL(object):
                         last_except = sys.exc_info()[1]
 
                         # reconnect to server
-                        cursor.close()
-                        self._connection = None
-                        cursor = self.get_cursor()
+                        self.release_connection(connection, cursor, broken = True)
+                        connection = None
+                        cursor = None
+                        connection = self.get_connection()
+                        cursor = connection.cursor()
         
                 else: # 10 failures
                     if not silent:
@@ -267,13 +542,17 @@ class MySQL(object):
                     # insert query on an auto-increment column
                     self.last_insert_id = cursor.lastrowid
 
-                self.close_cursor(cursor)
-                self._connection_lock.release()
+                rowcount = cursor.rowcount
 
-                return cursor.rowcount
+                self.release_connection(connection, cursor)
+                if use_lock:
+                    self._connection_lock.release()
 
-            self.close_cursor(cursor)
-            self._connection_lock.release()
+                return rowcount
+
+            self.release_connection(connection, cursor)
+            if use_lock:
+                self._connection_lock.release()
     
             if len(result) != 0 and len(result[0]) == 1:
                 # single column requested
@@ -283,7 +562,8 @@ class MySQL(object):
                 return list(result)
 
         except:
-            self.close_cursor(cursor)
+            # connection may be in an undefined state
+            self.release_connection(connection, cursor, broken = not self.reuse_connection)
             self._fully_unlock()
             raise
 
@@ -318,7 +598,10 @@ class MySQL(object):
         elif select is not None:
             sql += ' ' + select
 
-        self._connection_lock.acquire()
+        # last_insert_id is per thread; the lock is only needed for the dedicated connection
+        use_lock = self.reuse_connection
+        if use_lock:
+            self._connection_lock.acquire()
 
         try:
             inserted = self.query(sql, *tuple(args), **kwd)
@@ -327,7 +610,8 @@ class MySQL(object):
             elif inserted != 1:
                 raise RuntimeError('More than one row inserted in insert_get_id')
 
-            self._connection_lock.release()
+            if use_lock:
+                self._connection_lock.release()
             return self.last_insert_id
 
         except:
@@ -342,11 +626,15 @@ class MySQL(object):
          - values if one column is called
         """
 
-        self._connection_lock.acquire()
+        use_lock = self.reuse_connection
+        if use_lock:
+            self._connection_lock.acquire()
 
+        connection = None
         cursor = None
         try:
-            cursor = self.get_cursor(MySQLdb.cursors.SSCursor)
+            connection = self.get_connection()
+            cursor = connection.cursor(MySQLdb.cursors.SSCursor)
     
             self.last_insert_id = 0
 
@@ -365,9 +653,11 @@ class MySQL(object):
                         LOG.error(str(sys.exc_info()[1]))
                         last_except = sys.exc_info()[1]
                         # reconnect to server
-                        cursor.close()
-                        self._connection = None
-                        cursor = self.get_cursor(MySQLdb.cursors.SSCursor)
+                        self.release_connection(connection, cursor, broken = True)
+                        connection = None
+                        cursor = None
+                        connection = self.get_connection()
+                        cursor = connection.cursor(MySQLdb.cursors.SSCursor)
         
                 else: # 10 failures
                     LOG.error('Too many OperationalErrors. Last exception:')
@@ -394,11 +684,13 @@ class MySQL(object):
         
                     row = cursor.fetchone()
 
-            self.close_cursor(cursor)
-            self._connection_lock.release()
+            self.release_connection(connection, cursor)
+            if use_lock:
+                self._connection_lock.release()
 
         except:
-            self.close_cursor(cursor)
+            # includes GeneratorExit when the caller stops iterating - unread rows leave the connection unusable
+            self.release_connection(connection, cursor, broken = not self.reuse_connection)
             self._fully_unlock()
             raise
 
@@ -442,10 +734,14 @@ class MySQL(object):
                 result_sum += vals
 
         # executing in batches - we may issue multiple queries
-        self._connection_lock.acquire()
+        # Each batch leases its own connection if reuse_connection is False
+        use_lock = self.reuse_connection
+        if use_lock:
+            self._connection_lock.acquire()
         try:
             self._execute_in_batches(execute, pool)
-            self._connection_lock.release()
+            if use_lock:
+                self._connection_lock.release()
         except:
             self._fully_unlock()
             raise
@@ -493,6 +789,19 @@ class MySQL(object):
         # iter() of iterator returns the iterator itself
         itr = iter(objects)
 
+        # LOAD DATA into a temporary copy of the table is not possible under LOCK TABLES
+        if self.load_data_threshold > 0 and len(self._locked_tables) == 0:
+            try:
+                use_load_data = len(objects) >= self.load_data_threshold
+            except TypeError:
+                # look ahead up to the threshold
+                head = list(itertools.islice(itr, self.load_data_threshold))
+                use_load_data = len(head) == self.load_data_threshold
+                itr = itertools.chain(head, itr)
+
+            if use_load_data and self.local_infile_enabled():
+                return self.load_many(table, fields, mapping, itr, do_update = do_update, db = db, update_columns = update_columns)
+
         try:
             # we'll need to have the first element ready below anyway; do it here
             obj = itr.next()
@@ -550,6 +859,215 @@ class MySQL(object):
 
         return num_inserted
 
+    def load_many(self, table, fields, mapping, objects, do_update = True, db = '', update_columns = None):
+        """
+        Same as insert_many, but writes the rows to a temporary tab-separated file and loads it with LOAD DATA LOCAL INFILE.
+        Much faster than insert_many for large numbers of rows. With do_update, the rows are first loaded into a temporary
+        table with the columns of the target table (without keys and auto-increment) and then merged with
+        INSERT .. SELECT .. ON DUPLICATE KEY UPDATE. Rows with 0 in an auto-increment column thus get new ids as in
+        insert_many. LOAD DATA LOCAL skips rows with duplicate keys and stores invalid values with only a warning. A
+        RuntimeError is raised instead where INSERT would fail: for duplicate keys, and for invalid values if the session
+        is in strict SQL mode. As with insert_many, rows written before the failure stay in non-transactional (MyISAM)
+        tables; only transactional tables are rolled back. The connection must allow LOAD DATA LOCAL, which is the case
+        only if load_data_threshold is set in the configuration.
+        Arguments are identical to insert_many.
+
+        @return  total number of inserted rows.
+        """
+
+        if db == '':
+            db = self.db_name()
+
+        if fields:
+            columns = ' (%s)' % ','.join('`%s`' % f for f in fields)
+        else:
+            columns = ''
+
+        data_file = tempfile.NamedTemporaryFile(prefix = 'mysql_load_', suffix = '.tsv', dir = self.load_data_dir)
+
+        try:
+            num_rows = 0
+            for obj in objects:
+                if mapping is not None:
+                    obj = mapping(obj)
+
+                data_file.write('\t'.join(MySQL.tsv_escape(v) for v in obj))
+                data_file.write('\n')
+                num_rows += 1
+
+            if num_rows == 0:
+                return 0
+
+            data_file.flush()
+
+            load_sql = 'LOAD DATA LOCAL INFILE %s' % MySQL.escape(data_file.name)
+
+            sqls = []
+            if fields and do_update:
+                if update_columns is None:
+                    update_columns = fields
+
+                # Temporary tables are bound to the connection; all statements below are executed on one connection
+                tmp_db = self.scratch_db if self.scratch_db else db
+                tmp_table = '%s_load' % table
+
+                field_list = ','.join('`%s`' % f for f in fields)
+
+                # CREATE .. SELECT copies the column types but not the keys and the auto-increment attribute. A table
+                # created LIKE the target would assign ids 1, 2, .. to rows with id 0, which then overwrite existing rows.
+                # The rows are merged in the order of the file so that the last of duplicate rows wins, as in insert_many.
+                create_sql = 'CREATE TEMPORARY TABLE `%s`.`%s` (`load_order` INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY)' % (tmp_db, tmp_table)
+                create_sql += ' SELECT %s FROM `%s`.`%s` LIMIT 0' % (field_list, db, table)
+
+                load_sql += ' INTO TABLE `%s`.`%s`' % (tmp_db, tmp_table)
+                load_sql += MySQL._load_data_format
+                load_sql += columns
+
+                insert_sql = 'INSERT INTO `%s`.`%s`%s' % (db, table, columns)
+                insert_sql += ' SELECT %s FROM `%s`.`%s` ORDER BY `load_order`' % (field_list, tmp_db, tmp_table)
+                insert_sql += ' ON DUPLICATE KEY UPDATE ' + ','.join('`{f}`=VALUES(`{f}`)'.format(f = f) for f in update_columns)
+
+                sqls.append('DROP TEMPORARY TABLE IF EXISTS `%s`.`%s`' % (tmp_db, tmp_table))
+                sqls.append(create_sql)
+                sqls.append(load_sql)
+                sqls.append(insert_sql)
+                sqls.append('DROP TEMPORARY TABLE `%s`.`%s`' % (tmp_db, tmp_table))
+                load_index = 2
+                # return the rowcount of the INSERT
+                result_index = 3
+            else:
+                load_sql += ' INTO TABLE `%s`.`%s`' % (db, table)
+                load_sql += MySQL._load_data_format
+                load_sql += columns
+
+                sqls.append(load_sql)
+                load_index = 0
+                result_index = 0
+
+            return self._execute_sequence(sqls, check_warnings = [load_index])[result_index]
+
+        finally:
+            # deletes the file
+            data_file.close()
+
+    def local_infile_enabled(self):
+        """
+        Check (once) whether the server allows LOAD DATA LOCAL INFILE.
+        """
+
+        if self._local_infile is None:
+            try:
+                self._local_infile = (int(self.query('SELECT @@local_infile')[0]) == 1)
+            except MySQLdb.Error:
+                self._local_infile = False
+
+            if not self._local_infile:
+                LOG.info('LOAD DATA LOCAL INFILE is disabled on the server. Using INSERT for all insertions.')
+
+        return self._local_infile
+
+    @staticmethod
+    def tsv_escape(value):
+        """
+        Format a value as a field of a LOAD DATA input file (tab-separated, backslash-escaped, \\N for NULL).
+        Unicode strings are encoded in UTF-8; the file is loaded with CHARACTER SET binary, i.e. bytes are stored as they are.
+        """
+
+        if value is None:
+            return '\\N'
+
+        vtype = type(value)
+
+        if vtype is str:
+            pass
+        elif vtype is unicode:
+            value = value.encode('utf-8')
+        elif vtype is bool:
+            return '1' if value else '0'
+        elif vtype is int or vtype is long:
+            return str(value)
+        elif vtype is float:
+            return repr(value)
+        elif vtype is datetime.datetime:
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            value = str(value)
+
+        if '\\' in value:
+            value = value.replace('\\', '\\\\')
+
+        return value.replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r').replace('\0', '\\0')
+
+    def _execute_sequence(self, sqls, check_warnings = []):
+        """
+        Execute multiple statements on a single connection (needed when the statements use a temporary table).
+        @param sqls            List of statements.
+        @param check_warnings  Indices of the statements (LOAD DATA) whose warnings are checked. Warnings that would be
+                               errors for INSERT (duplicate key, or any warning in strict SQL mode) raise a RuntimeError.
+                               The transaction is then rolled back, which has no effect on MyISAM tables.
+        @return  List of row counts of the statements.
+        """
+
+        use_lock = self.reuse_connection
+        if use_lock:
+            self._connection_lock.acquire()
+
+        connection = None
+        cursor = None
+        try:
+            connection = self.get_connection()
+            cursor = connection.cursor()
+
+            rowcounts = []
+            # whether invalid values are errors for INSERT (None = not checked yet)
+            strict_mode = None
+            for sql in sqls:
+                LOG.debug(sql)
+
+                try:
+                    cursor.execute(sql)
+                except:
+                    LOG.error('There was an error executing the following statement:')
+                    LOG.error(sql[:10000])
+                    LOG.error(sys.exc_info()[1])
+                    raise
+
+                rowcounts.append(cursor.rowcount)
+
+                if len(rowcounts) - 1 in check_warnings:
+                    cursor.execute('SHOW WARNINGS LIMIT 5')
+                    warnings = [row for row in cursor.fetchall() if row[0] != 'Note']
+                    if len(warnings) != 0 and strict_mode is None:
+                        cursor.execute('SELECT @@SESSION.sql_mode')
+                        strict_mode = 'STRICT_' in cursor.fetchall()[0][0]
+
+                    if not strict_mode:
+                        warnings = [row for row in warnings if row[1] == MySQL._dup_entry_code]
+
+                    if len(warnings) != 0:
+                        LOG.error('Warnings from the following statement:')
+                        LOG.error(sql[:10000])
+                        raise RuntimeError('Rows were rejected: ' + '; '.join('%s (%s)' % (row[2], row[1]) for row in warnings))
+
+            connection.commit()
+
+            self.release_connection(connection, cursor)
+            if use_lock:
+                self._connection_lock.release()
+
+            return rowcounts
+
+        except:
+            if connection is not None:
+                try:
+                    connection.rollback()
+                except MySQLdb.Error:
+                    pass
+
+            self.release_connection(connection, cursor, broken = not self.reuse_connection)
+            self._fully_unlock()
+            raise
+
     def insert_select_many(self, insert_table, insert_fields, select_table, select_fields, key, pool, do_update = True, db = '', update_columns = None, additional_conditions = [], order_by = ''):
         """
         INSERT INTO insert_table (insert_fields) SELECT select_fields FROM select_table WHERE key IN pool
@@ -587,7 +1105,7 @@ class MySQL(object):
         A shortcut function to perform one INSERT ON DUPLICATE KEY UPDATE.
         @param table          Table name
         @param fields         A tuple of field names
-        @param values         A tuple of values to insert.
+        @param values         A tuple of values to insert. Values of type MySQL.bare are inserted as they are.
         @param update_columns Optional list of columns to update.
         """
 
@@ -596,15 +1114,81 @@ class MySQL(object):
         else:
             update_columns = fields
 
-        placeholders = ', '.join(['%s'] * len(fields))
+        placeholders = []
+        args = []
+        for v in values:
+            if type(v) is MySQL.bare:
+                placeholders.append(v.value)
+            else:
+                placeholders.append('%s')
+                args.append(v)
 
         sql = 'INSERT INTO `%s` (' % table
         sql += ', '.join('`%s`' % f for f in fields)
-        sql += ') VALUES (' + placeholders + ')'
+        sql += ') VALUES (' + ', '.join(placeholders) + ')'
         sql += ' ON DUPLICATE KEY UPDATE '
         sql += ', '.join('`%s`=VALUES(`%s`)' % (f, f) for f in update_columns)
 
-        return self.query(sql, *values, **kwd)
+        return self.query(sql, *args, **kwd)
+
+    def update_many(self, table, key, fields, rows, db = ''):
+        """
+        UPDATE table SET field = CASE key WHEN k1 THEN v1 WHEN k2 THEN v2 ... END, ... WHERE key IN (k1, k2, ...).
+        Sets different values to different rows with one query per max_query_len characters.
+        @param table   Table name.
+        @param key     Name of the key column.
+        @param fields  Tuple of names of the columns to update.
+        @param rows    List or iterator of tuples (key value, value of fields[0], value of fields[1], ...). Values
+                       of type MySQL.bare are inserted verbatim (e.g. bare('NOW()')).
+        @param db      DB name.
+
+        @return  total number of updated rows.
+        """
+
+        if db == '':
+            db = self.db_name()
+
+        def expr(value, args):
+            if type(value) is MySQL.bare:
+                return value.value
+            else:
+                args.append(value)
+                return '%s'
+
+        def execute(keys, cases, args):
+            sql = 'UPDATE `%s`.`%s` SET ' % (db, table)
+            sql += ', '.join('`%s` = CASE `%s` %s END' % (field, key, ' '.join(case)) for field, case in zip(fields, cases))
+            sql += ' WHERE `%s` IN (%s)' % (key, ','.join(['%s'] * len(keys)))
+
+            return self.query(sql, *(args + keys))
+
+        num_updated = 0
+
+        keys = []
+        cases = [[] for _ in fields]
+        case_args = [[] for _ in fields]
+        length = 0
+
+        for row in rows:
+            keys.append(row[0])
+
+            for case, args, value in zip(cases, case_args, row[1:]):
+                args.append(row[0])
+                case.append('WHEN %s THEN ' + expr(value, args))
+                length += len(str(row[0])) + len(str(value)) + 20
+
+            # MySQL allows queries up to 1M characters
+            if self.max_query_len > 0 and length > self.max_query_len:
+                num_updated += execute(keys, cases, sum(case_args, []))
+                keys = []
+                cases = [[] for _ in fields]
+                case_args = [[] for _ in fields]
+                length = 0
+
+        if len(keys) != 0:
+            num_updated += execute(keys, cases, sum(case_args, []))
+
+        return num_updated
 
     def lock_tables(self, read = [], write = [], **kwd):
         """
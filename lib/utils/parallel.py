@@ -1,6 +1,8 @@
 import time
 import multiprocessing
 import threading
+import traceback
+import cPickle as pickle
 import Queue
 
 from dynamo.dataformat import Configuration
@@ -199,6 +201,129 @@ class ThreadController(object):
         return True
 
 
+class ProcessController(object):
+    """
+    Runs the function in forked worker processes. Workers inherit the function, its closure, and the argument list
+    (and any inventory they refer to) copy-on-write at fork, so only index ranges of the argument list are sent
+    to them and only the outputs are pickled back. Outputs are collected chunk by chunk as the workers finish them.
+    Side effects of the function on objects in memory stay in the workers.
+    """
+
+    def __init__(self, function, num_workers):
+        self.num_workers = num_workers
+        self.chunk_size = 0
+        self.timeout = 0
+        self.repeat_on_exception = False
+        self.logger = None
+        self.ntotal = 0
+
+        self._target_function = function
+
+    def iterate(self, arguments):
+        """
+        Fork the workers and yield the outputs as the chunks are completed.
+        @param arguments  List of argument tuples.
+        """
+        chunk_size = self.chunk_size
+        if chunk_size <= 0:
+            # a few chunks per worker to balance the load
+            chunk_size = max(1, len(arguments) / (self.num_workers * 4))
+
+        chunks = [(start, min(start + chunk_size, len(arguments))) for start in xrange(0, len(arguments), chunk_size)]
+
+        task_queue = multiprocessing.Queue()
+        for chunk in chunks:
+            task_queue.put(chunk)
+        for _ in xrange(self.num_workers):
+            task_queue.put(None)
+
+        done_queue = multiprocessing.Queue()
+
+        function = self._target_function
+
+        def run_worker():
+            while True:
+                chunk = task_queue.get()
+                if chunk is None:
+                    break
+
+                start, end = chunk
+                try:
+                    outputs = [function(*args) for args in arguments[start:end]]
+                    # pickle here so that unpicklable outputs are reported
+                    message = (chunk, pickle.dumps(outputs, pickle.HIGHEST_PROTOCOL), None)
+                except:
+                    message = (chunk, None, traceback.format_exc())
+
+                done_queue.put(message)
+
+        workers = []
+        try:
+            for _ in xrange(min(self.num_workers, len(chunks))):
+                proc = multiprocessing.Process(target = run_worker, name = 'map_worker_%d' % len(workers))
+                proc.daemon = True
+                proc.start()
+                workers.append(proc)
+
+            start_time = time.time()
+            ndone = 0
+            watermark = 0
+
+            for _ in xrange(len(chunks)):
+                wait_start = time.time()
+                while True:
+                    try:
+                        (start, end), outputs, error = done_queue.get(timeout = 5)
+                        break
+                    except Queue.Empty:
+                        for proc in workers:
+                            if proc.exitcode is not None and proc.exitcode != 0:
+                                raise RuntimeError('Worker %s died with exit code %d' % (proc.name, proc.exitcode))
+
+                        if self.timeout > 0 and time.time() - wait_start > self.timeout:
+                            if self.logger:
+                                self.logger.error('No worker output in %d seconds.', self.timeout)
+
+                            raise ThreadTimeout('map_worker')
+
+                if error is not None:
+                    if self.logger:
+                        self.logger.error('Exception in worker process:\n%s', error)
+                        self.logger.error('Inputs: ' + str([str(i) for i in arguments[start:end]]))
+
+                    if self.repeat_on_exception:
+                        if self.logger:
+                            self.logger.error('Repeating execution')
+
+                        for args in arguments[start:end]:
+                            self._target_function(*args) # no catch
+
+                        if self.logger:
+                            self.logger.error('No exception was thrown during the repeat.')
+
+                    raise RuntimeError('Exception in worker process:\n%s' % error)
+
+                if self.ntotal != 0 and self.logger: # progress report requested
+                    ndone += end - start
+                    if ndone == self.ntotal or ndone > watermark:
+                        self.logger.info('Processed %.1f%% of input (%ds elapsed).', 100. * ndone / self.ntotal, int(time.time() - start_time))
+                        watermark += max(1, self.ntotal / 20)
+
+                for output in pickle.loads(outputs):
+                    yield output
+
+        finally:
+            for proc in workers:
+                if proc.is_alive():
+                    proc.terminate()
+                proc.join()
+
+    def execute(self, arguments):
+        """Run the workers and return the full list of outputs."""
+
+        return list(self.iterate(arguments))
+
+
 class AutoStarter(object):
     def __init__(self, function, start_sem, task_per_thread):
         self.inputs = []
@@ -229,12 +354,17 @@ class Map(object):
     """
     Similar to multiprocessing.Pool.map but with threads. At each execute() call, instantiate a ThreadController
     object to do the real work. Output list can be out of order.
+    With processes = True in execute(), the function runs in forked worker processes instead (ProcessController),
+    which is faster for CPU-bound functions whose only effect is the returned value.
     """
 
     def __init__(self, config = Configuration()):
-        ncpu_max = multiprocessing.cpu_count() - 1
-        self.start_sem = threading.Semaphore(min(config.get('num_threads', ncpu_max), ncpu_max))
+        ncpu_max = max(multiprocessing.cpu_count() - 1, 1)
+        self.num_threads = min(config.get('num_threads', ncpu_max), ncpu_max)
+        self.start_sem = threading.Semaphore(self.num_threads)
         self.task_per_thread = config.get('task_per_thread', 1)
+        # number of arguments sent to a worker process at once (0: a few chunks per process)
+        self.chunk_size = config.get('chunk_size', 0)
 
         self.print_progress = config.get('print_progress', False)
         self.timeout = config.get('timeout', 0)
@@ -242,7 +372,7 @@ class Map(object):
 
         self.logger = None
 
-    def execute(self, function, arguments, async = False):
+    def execute(self, function, arguments, async = False, processes = False):
         """
         Execute function on each argument and return the function outputs in a list.
         The output is not ordered.
@@ -250,12 +380,31 @@ class Map(object):
         @param arguments  List of arguments. Each element corresponds to a single function call.
                           Each element can be a single object or a tuple which gets unpacked.
         @param async      If True, use the iterate function of ThreadController.
+        @param processes  If True, run the function in num_threads forked processes. Outputs must be picklable, and
+                          changes the function makes to objects in memory are not seen by the caller.
         @return Unordered list of function outputs.
         """
 
         if len(arguments) == 0:
             return []
 
+        if processes:
+            controller = ProcessController(function, self.num_threads)
+            controller.chunk_size = self.chunk_size
+            controller.timeout = self.timeout
+            controller.repeat_on_exception = self.repeat_on_exception
+            controller.logger = self.logger
+
+            if self.print_progress:
+                controller.ntotal = len(arguments)
+
+            arguments = [args if type(args) is tuple else (args,) for args in arguments]
+
+            if async:
+                return controller.iterate(arguments)
+            else:
+                return controller.execute(arguments)
+
         controller = ThreadController(function, self.start_sem)
        
         controller.print_progress = self.print_progress
@@ -0,0 +1,35 @@
+from dynamo.web.modules._base import WebModule
+from dynamo.fileop.rlfsm import RLFSM
+
+class LinkConcurrency(WebModule):
+    """
+    Return the concurrency limits of the transfer links set by the file operations daemon.
+    """
+
+    def __init__(self, config):
+        WebModule.__init__(self, config)
+
+        self.rlfsm = RLFSM()
+        self.rlfsm.set_read_only(True)
+
+    def run(self, caller, request, inventory):
+        sql = 'SELECT `source_site`, `destination_site`, `concurrency`, `active`, `rate`, `error_rate`, `last_action`, `last_update`'
+        sql += ' FROM `standalone_link_concurrency` ORDER BY `source_site`, `destination_site`'
+
+        data = []
+        for source, destination, concurrency, active, rate, error_rate, last_action, last_update in self.rlfsm.db.query(sql):
+            data.append({
+                    'from': source,
+                    'to': destination,
+                    'concurrency': concurrency,
+                    'active': active,
+                    'rate': rate,
+                    'error_rate': error_rate,
+                    'last_action': last_action,
+                    'last_update': last_update.strftime('%Y-%m-%d %H:%M:%S')})
+
+        return data
+
+export_data = {
+    'link_concurrency': LinkConcurrency
+}
@@ -178,10 +178,48 @@ class HistoryFileTransferListStatic(WebModule, HTMLMixin):
 
         return self.form_html()
 
+from dynamo.web.modules.transfers.concurrency import LinkConcurrency
+
+class LinkConcurrencyStatic(WebModule, HTMLMixin):
+    """
+    Concurrency limits of the transfer links set by the file operations daemon, formatted in python.
+    """
+
+    def __init__(self, config):
+        WebModule.__init__(self, config)
+        HTMLMixin.__init__(self, 'Transfer link concurrency', 'transfers/concurrency.html')
+
+        self.stylesheets = ['/css/transfers/monitor.css']
+
+        # Instantiate the JSON producer
+        self.concurrency = LinkConcurrency(config)
+
+    def run(self, caller, request, inventory):
+        data = self.concurrency.run(caller, request, inventory)
+
+        rows = ''
+        for link in data:
+            rows += '<tr>'
+            rows += '<td>%s</td>' % link['from']
+            rows += '<td>%s</td>' % link['to']
+            rows += '<td>%d</td>' % link['concurrency']
+            rows += '<td>%d</td>' % link['active']
+            rows += '<td>%.3f</td>' % link['rate']
+            rows += '<td>%.1f</td>' % (link['error_rate'] * 100.)
+            rows += '<td>%s</td>' % link['last_action']
+            rows += '<td>%s</td>' % link['last_update']
+            rows += '</tr>'
+
+        # body_html is already set to the contents of concurrency.html
+        self.body_html = self.body_html.format(_ROWS_ = rows)
+
+        return self.form_html()
+
 export_web = {
     'list': FileTransferList,
     'activity': FileTransferActivity,
     'current_list': CurrentFileTransferListStatic,
     'history_list': HistoryFileTransferListStatic,
-    'held': HeldTransferList
+    'held': HeldTransferList,
+    'concurrency': LinkConcurrencyStatic
 }
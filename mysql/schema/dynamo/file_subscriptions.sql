@@ -10,5 +10,6 @@ CREATE TABLE `file_subscriptions` (
   PRIMARY KEY (`id`),
   UNIQUE KEY `subscription` (`file_id`,`site_id`,`delete`),
   KEY `delete` (`delete`),
-  KEY `status` (`status`)
+  KEY `status` (`status`),
+  KEY `last_update` (`last_update`)
 ) ENGINE=MyISAM DEFAULT CHARSET=latin1 CHECKSUM=1;
@@ -0,0 +1,11 @@
+CREATE TABLE `standalone_link_concurrency` (
+  `source_site` varchar(32) CHARACTER SET latin1 COLLATE latin1_general_ci NOT NULL,
+  `destination_site` varchar(32) CHARACTER SET latin1 COLLATE latin1_general_ci NOT NULL,
+  `concurrency` smallint(5) unsigned NOT NULL,
+  `active` smallint(5) unsigned NOT NULL,
+  `rate` float NOT NULL DEFAULT '0',
+  `error_rate` float NOT NULL DEFAULT '0',
+  `last_action` enum('','increase','decrease','saturated') CHARACTER SET latin1 COLLATE latin1_general_ci NOT NULL DEFAULT '',
+  `last_update` datetime NOT NULL,
+  PRIMARY KEY (`source_site`,`destination_site`)
+) ENGINE=MyISAM DEFAULT CHARSET=latin1 COLLATE=latin1_general_cs;
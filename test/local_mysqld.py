@@ -0,0 +1,120 @@
+# MySQL server for the tests of the MySQL interface: mysqld (or mariadbd) on a temporary data directory, reachable
+# only through a unix socket. The server is started by the first test that asks for it and stopped at exit. Tests
+# are skipped if no server binary is installed.
+
+import os
+import time
+import shutil
+import atexit
+import tempfile
+import unittest
+import subprocess
+
+from dynamo.utils.interface.mysql import MySQL
+
+# Test database and user (the user is a key of MySQL._default_parameters)
+DB_NAME = 'dynamo_test'
+DB_USER = 'root'
+
+SEARCH_PATH = os.environ.get('PATH', '').split(os.pathsep) + ['/usr/sbin', '/usr/libexec', '/usr/local/mysql/bin']
+
+_server = None
+
+def find_executable(names):
+    for name in names:
+        for directory in SEARCH_PATH:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                return path
+
+    return None
+
+class LocalMySQLServer(object):
+    def __init__(self, mysqld):
+        self.mysqld = mysqld
+        self.workdir = tempfile.mkdtemp(prefix = 'dynamo_mysqld_')
+        self.datadir = os.path.join(self.workdir, 'data')
+        self.socket = os.path.join(self.workdir, 'mysql.sock')
+        self.log = os.path.join(self.workdir, 'error.log')
+        self.process = None
+
+    def start(self, timeout = 60.):
+        version = subprocess.check_output([self.mysqld, '--version'])
+
+        common = ['--no-defaults', '--datadir=' + self.datadir]
+        if os.getuid() == 0:
+            # mysqld refuses to run as root without --user
+            common.append('--user=root')
+
+        with open(self.log, 'w') as log:
+            if 'MariaDB' in version:
+                install_db = find_executable(['mariadb-install-db', 'mysql_install_db'])
+                if install_db is None:
+                    raise unittest.SkipTest('mariadb-install-db not found')
+
+                # MariaDB 10.4+ gives root unix_socket authentication by default; older versions do not know the option
+                command = [install_db] + common
+                try:
+                    subprocess.check_call(command + ['--auth-root-authentication-method=normal'], stdout = log, stderr = log)
+                except subprocess.CalledProcessError:
+                    shutil.rmtree(self.datadir, ignore_errors = True)
+                    subprocess.check_call(command, stdout = log, stderr = log)
+            else:
+                subprocess.check_call([self.mysqld] + common + ['--initialize-insecure'], stdout = log, stderr = log)
+
+            self.process = subprocess.Popen([self.mysqld] + common + ['--socket=' + self.socket, '--skip-networking', '--pid-file=' + os.path.join(self.workdir, 'mysqld.pid'), '--local-infile=1', '--log-error=' + self.log], stdout = log, stderr = log)
+
+        parameters = {'user': DB_USER, 'unix_socket': self.socket}
+
+        import MySQLdb
+
+        start = time.time()
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError('mysqld exited with code %d; see %s' % (self.process.returncode, self.log))
+
+            try:
+                connection = MySQLdb.connect(**parameters)
+            except MySQLdb.Error:
+                if time.time() - start > timeout:
+                    raise RuntimeError('mysqld did not start in %.0f s; see %s' % (timeout, self.log))
+
+                time.sleep(0.2)
+            else:
+                break
+
+        cursor = connection.cursor()
+        cursor.execute('CREATE DATABASE IF NOT EXISTS `%s`' % DB_NAME)
+        cursor.close()
+        connection.close()
+
+        # MySQL instances with user DB_USER connect through the socket
+        parameters['db'] = DB_NAME
+        MySQL._default_parameters[DB_USER] = parameters
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+
+        shutil.rmtree(self.workdir, ignore_errors = True)
+
+def db_params():
+    """
+    Start the server if not running yet and return the configuration of a MySQL instance connecting to the test
+    database. Raises unittest.SkipTest if there is no server binary.
+    """
+
+    global _server
+
+    if _server is None:
+        mysqld = find_executable(['mysqld', 'mariadbd'])
+        if mysqld is None:
+            raise unittest.SkipTest('mysqld is not installed')
+
+        server = LocalMySQLServer(mysqld)
+        atexit.register(server.stop)
+        server.start()
+        _server = server
+
+    return {'user': DB_USER, 'db': DB_NAME}
@@ -0,0 +1,240 @@
+#! /usr/bin/env python
+
+# Task submission of RLFSM with a stand-in FileTransferOperation that rejects every batch containing one of the
+# chosen bad tasks, and the task tables replaced by an in-memory stand-in. Run with the argument "benchmark" to
+# compare the number of submissions and of healthy tasks failed with the whole batch failing (before bisection),
+# resubmission of the failed tasks in progressively smaller batches, and bisection.
+
+import sys
+import math
+import unittest
+
+from dynamo.dataformat import Configuration
+from dynamo.fileop.rlfsm import RLFSM
+from dynamo.fileop.transfer import FileTransferOperation
+from dynamo.fileop.subscriptions import SubscriptionIndex
+from dynamo.fileop.batchsize import BatchSizeLearner
+
+class RejectingTransferOperation(FileTransferOperation):
+    """
+    Rejects the whole batch if it contains a task of a bad subscription (as FTS does with a malformed job).
+    """
+
+    def __init__(self, bad_ids, reject_all = False):
+        FileTransferOperation.__init__(self, Configuration())
+        self.bad_ids = set(bad_ids)
+        self.reject_all = reject_all
+        self.num_submissions = 0
+        self.batch_sizes = []
+
+    def start_transfers(self, batch_id, batch_tasks): #override
+        self.num_submissions += 1
+        self.batch_sizes.append(len(batch_tasks))
+
+        success = not self.reject_all and all(task.subscription.id not in self.bad_ids for task in batch_tasks)
+        return dict((task, success) for task in batch_tasks)
+
+
+class MemoryTaskDB(object):
+    """
+    Stand-in for the MySQL interface with the transfer_batches and transfer_tasks tables.
+    """
+
+    def __init__(self):
+        self.batches = set()
+        # {task_id: [subscription_id, batch_id]}
+        self.tasks = {}
+        self.last_insert_id = 0
+        self._next_task_id = 1
+
+    def query(self, sql, *args):
+        if sql.startswith('INSERT INTO `transfer_batches`'):
+            self.last_insert_id += 1
+            self.batches.add(self.last_insert_id)
+        elif sql.startswith('DELETE FROM `transfer_batches`'):
+            self.batches.remove(args[0])
+        else:
+            raise NotImplementedError(sql)
+
+    def insert_many(self, table, fields, mapping, objects):
+        for obj in objects:
+            subscription_id, source_id, batch_id, created = mapping(obj)
+            self.tasks[self._next_task_id] = [subscription_id, batch_id]
+            self._next_task_id += 1
+
+    def execute_many(self, sql, key, pool):
+        if sql.startswith('UPDATE `transfer_tasks` SET `batch_id` = '):
+            batch_id = int(sql.split('=')[1])
+            for task_id in pool:
+                self.tasks[task_id][1] = batch_id
+        elif 'file_subscriptions' in sql or 'failed_transfers' in sql:
+            pass
+        else:
+            raise NotImplementedError(sql)
+
+    def delete_many(self, table, key, pool):
+        for task_id in pool:
+            self.tasks.pop(task_id)
+
+    def xquery(self, sql, *args):
+        return [(task_id, sub_id) for task_id, (sub_id, batch_id) in self.tasks.items() if batch_id == args[0]]
+
+
+class Named(object):
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+class File(object):
+    def __init__(self, id, lfn):
+        self.id = id
+        self.lfn = lfn
+
+def make_rlfsm():
+    # RLFSM without the DB connections of __init__
+    rlfsm = RLFSM.__new__(RLFSM)
+    rlfsm.db = MemoryTaskDB()
+    rlfsm.subscription_index = SubscriptionIndex()
+    rlfsm._batch_learners = {}
+    rlfsm._read_only = False
+    return rlfsm
+
+def make_tasks(num):
+    source = Named(1, 'T2_A')
+    destination = Named(2, 'T2_B')
+    tasks = []
+    for sub_id in xrange(num):
+        subscription = RLFSM.Subscription(sub_id, 'new', File(sub_id, '/store/%d' % sub_id), destination, [source], [])
+        tasks.append(RLFSM.TransferTask(subscription, source))
+
+    return tasks
+
+def progressive_submit(operation, tasks):
+    """
+    Resubmit all failed tasks in batches of half the previous size until batches of one task.
+    @return Tasks that failed in the end.
+    """
+    size = len(tasks)
+    failed = tasks
+    while True:
+        batches = [failed[i:i + size] for i in xrange(0, len(failed), size)]
+        failed = []
+        for batch in batches:
+            result = operation.start_transfers(0, batch)
+            failed.extend(task for task, success in result.iteritems() if not success)
+
+        if size == 1 or len(failed) == 0:
+            return failed
+
+        size = int(math.ceil(size / 2.))
+
+
+class TestBisection(unittest.TestCase):
+    def test_one_bad(self):
+        rlfsm = make_rlfsm()
+        operation = RejectingTransferOperation([37])
+        tasks = make_tasks(256)
+
+        num_success, num_failure = rlfsm._start_transfers(operation, tasks)
+
+        self.assertEqual((num_success, num_failure), (255, 1))
+        self.assertLessEqual(operation.num_submissions, 1 + 2 * 8)
+
+        # the task rows of the successful tasks are in live batches; the failed task row and rejected batches are gone
+        self.assertEqual(sorted(sub_id for sub_id, _ in rlfsm.db.tasks.itervalues()), [i for i in range(256) if i != 37])
+        self.assertTrue(all(batch_id in rlfsm.db.batches for _, batch_id in rlfsm.db.tasks.itervalues()))
+        self.assertEqual(len(rlfsm.db.batches), operation.num_submissions - 8)
+
+    def test_several_bad(self):
+        rlfsm = make_rlfsm()
+        bad_ids = [3, 4, 100, 201]
+        operation = RejectingTransferOperation(bad_ids)
+        tasks = make_tasks(256)
+
+        successful, failed = rlfsm._submit_tasks('transfer', operation, tasks)
+
+        self.assertEqual(sorted(t.subscription.id for t in failed), bad_ids)
+        self.assertEqual(len(successful), 252)
+
+    def test_adjacent_bad(self):
+        # runs of adjacent bad tasks give long runs of rejections with a healthy backend
+        for num_tasks, bad_ids in [(1000, range(500, 508)), (64, range(0, 16)), (64, range(20, 36)), (64, range(48, 64))]:
+            rlfsm = make_rlfsm()
+            operation = RejectingTransferOperation(bad_ids)
+
+            successful, failed = rlfsm._submit_tasks('transfer', operation, make_tasks(num_tasks))
+
+            self.assertEqual(sorted(t.subscription.id for t in failed), bad_ids)
+            self.assertEqual(len(successful), num_tasks - len(bad_ids))
+            self.assertLessEqual(operation.num_submissions, 2 * len(bad_ids) * int(math.log(num_tasks, 2)))
+
+    def test_backend_down(self):
+        rlfsm = make_rlfsm()
+        operation = RejectingTransferOperation([], reject_all = True)
+
+        num_success, num_failure = rlfsm._start_transfers(operation, make_tasks(100))
+
+        # bisection stops after 2 * log2(100) + 2 rejections in a row; the undecided batches are submitted once and
+        # split once more
+        self.assertEqual((num_success, num_failure), (0, 100))
+        self.assertLessEqual(operation.num_submissions, 2 * (1 + 2 * 7 + 2))
+        # batches of more than one task are deleted; empty batches of single failed tasks are left to the cleanup
+        self.assertEqual(len(rlfsm.db.tasks), 0)
+        self.assertTrue(all(operation.batch_sizes[batch_id - 1] == 1 for batch_id in rlfsm.db.batches))
+
+
+class TestBatchSizeLearner(unittest.TestCase):
+    def test_no_data(self):
+        learner = BatchSizeLearner()
+        self.assertIsNone(learner.get_size())
+
+        for _ in range(10):
+            learner.record(100, 1.)
+        # all samples at one size - no slope
+        self.assertIsNone(learner.get_size())
+
+    def test_optimum(self):
+        # latency 2 s + 10 ms per task
+        learner = BatchSizeLearner()
+        for n in [50, 100, 200, 400, 800]:
+            learner.record(n, 2. + 0.01 * n)
+
+        # no bad tasks: largest size explored
+        learner.record_tasks(10000, 0)
+        self.assertEqual(learner.get_size(), 1600)
+
+        # 1% bad tasks: beyond one bad task per batch, the per-task cost is ~ 2 / n + 0.01 log2(n) + const,
+        # minimal at n = 2 ln2 / 0.01 ~ 140
+        learner.record_tasks(0, 100)
+        size = learner.get_size()
+        self.assertGreater(size, 60)
+        self.assertLess(size, 200)
+
+        # 10% bad tasks: smaller batches
+        learner.record_tasks(0, 900)
+        self.assertLess(learner.get_size(), size / 4)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        num_tasks = 1000
+        print 'Submissions (healthy tasks failed) for %d tasks' % num_tasks
+        for num_bad in [1, 5, 20]:
+            bad_ids = range(7, num_tasks, num_tasks / num_bad)[:num_bad]
+
+            operation = RejectingTransferOperation(bad_ids)
+            result = operation.start_transfers(0, make_tasks(num_tasks))
+            whole = (operation.num_submissions, sum(1 for success in result.itervalues() if not success) - num_bad)
+
+            operation = RejectingTransferOperation(bad_ids)
+            failed = progressive_submit(operation, make_tasks(num_tasks))
+            progressive = (operation.num_submissions, len(failed) - num_bad, sum(operation.batch_sizes))
+
+            operation = RejectingTransferOperation(bad_ids)
+            successful, failed = make_rlfsm()._submit_tasks('transfer', operation, make_tasks(num_tasks))
+            bisection = (operation.num_submissions, len(failed) - num_bad, sum(operation.batch_sizes))
+
+            print '%2d bad  whole batch %4d (%4d)  progressive %4d (%d, %5d tasks sent)  bisection %4d (%d, %5d tasks sent)' % \
+                ((num_bad,) + whole + progressive + bisection)
+    else:
+        unittest.main()
@@ -0,0 +1,83 @@
+#! /usr/bin/env python
+
+import unittest
+from array import array
+
+from dynamo.dataformat import Site, Group, Dataset, Block, BlockReplica, File
+
+class TestFileIds(unittest.TestCase):
+    def setUp(self):
+        self.dataset = Dataset('/A/B/C')
+        self.block = Block(Block.to_internal_name('0123abcd-0000-0000-0000-000000000000'), self.dataset, size = 50, num_files = 5)
+        self.block._files = set(File('/store/f%d' % i, self.block, 10, fid = 100 - i) for i in range(5))
+        self.dataset.blocks.add(self.block)
+        self.site = Site('T2_XX_Test')
+        self.group = Group('test')
+
+    def _replica(self, file_ids, site = None):
+        if site is None:
+            site = self.site
+
+        replica = BlockReplica(self.block, site, self.group, size = 10 * len(file_ids), file_ids = file_ids)
+        self.block.replicas.add(replica)
+        return replica
+
+    def test_packing(self):
+        replica = self._replica((99, 100, 97))
+        self.assertIs(type(replica.file_ids), array)
+        self.assertEqual(list(replica.file_ids), [97, 99, 100])
+        self.assertEqual(replica.num_files, 3)
+
+        # unregistered files keep the tuple form
+        replica.file_ids = [97, '/store/new']
+        self.assertEqual(replica.file_ids, (97, '/store/new'))
+        replica.file_ids = [100, 97, 99]
+
+        # repr stays evaluable without the array module
+        self.assertIn('(97, 99, 100)', repr(replica))
+
+    def test_eq(self):
+        replica = self._replica((99, 100, 97))
+        other = BlockReplica(self.block, self.site, self.group, size = 30, file_ids = [100, 97, 99])
+        self.assertEqual(replica, other)
+
+        other.file_ids = (100, 97, 98)
+        self.assertNotEqual(replica, other)
+
+        other.file_ids = None
+        self.assertNotEqual(replica, other)
+
+    def test_add_delete(self):
+        replica = self._replica((99, 100))
+        files = dict((f.id, f) for f in self.block.files)
+
+        self.assertTrue(replica.has_file(files[100]))
+        self.assertFalse(replica.has_file(files[98]))
+
+        shared = replica.file_ids
+        replica.add_file(files[98])
+        self.assertEqual(list(replica.file_ids), [98, 99, 100])
+        self.assertEqual(list(shared), [99, 100])
+        self.assertEqual(replica.size, 30)
+
+        self.assertTrue(replica.delete_file(files[99]))
+        self.assertFalse(replica.delete_file(files[99]))
+        self.assertEqual(list(replica.file_ids), [98, 100])
+        self.assertEqual(replica.size, 20)
+
+        replica.add_file(files[96])
+        replica.add_file(files[97])
+        replica.add_file(files[99])
+        self.assertIsNone(replica.file_ids)
+        self.assertTrue(replica.is_complete())
+
+    def test_covers_block(self):
+        first = self._replica((96, 97, 98))
+        second = self._replica((98, 99), site = Site('T2_XX_Other'))
+        self.assertFalse(BlockReplica.covers_block(self.block, [first, second]))
+
+        second.file_ids = (99, 100)
+        self.assertTrue(BlockReplica.covers_block(self.block, [first, second]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,394 @@
+#! /usr/bin/env python
+
+import random
+import tempfile
+import unittest
+
+from dynamo.core.inventory import ObjectRepository
+from dynamo.dataformat import Configuration, Group, Site, SitePartition, Partition, Dataset, Block, DatasetReplica, BlockReplica
+from dynamo.detox.main import Detox
+from dynamo.detox.detoxpolicy import DetoxPolicy
+
+POLICY = '''
+Partition Physics
+On site.name !=~ T1_*_Disk
+When site.occupancy > 0.6
+Until site.occupancy < 0.5
+DeleteBlock blockreplica.owner == Junk
+Protect dataset.num_full_disk_copy == 1
+ProtectBlock blockreplica.last_update newer_than 2018-01-01 00:00:00
+Dismiss replica.incomplete
+Dismiss
+Order increasing replica.last_block_created decreasing replica.size
+'''
+
+class GroupCondition(object):
+    def __init__(self, groups):
+        self.groups = groups
+
+    def match(self, block_replica):
+        return block_replica.group.name in self.groups
+
+class ClonedPartition(ObjectRepository):
+    """
+    Reference implementation: full clone of the partition, as Detox built it before PartitionOverlay.
+    """
+
+    def __init__(self, inventory, partition, target_sites):
+        ObjectRepository.__init__(self)
+
+        partition.embed_tree(self)
+
+        for group in inventory.groups.itervalues():
+            group.embed_into(self)
+
+        block_to_clone = {}
+        for site in target_sites:
+            site_clone = site.embed_into(self)
+            site_partition_clone = site.partitions[partition].embed_tree(self)
+
+            for dataset_replica, block_replica_set in site.partitions[partition].replicas.iteritems():
+                dataset = dataset_replica.dataset
+
+                try:
+                    dataset_clone = self.datasets[dataset.name]
+                except KeyError:
+                    dataset_clone = dataset.embed_into(self)
+                    for block in dataset.blocks:
+                        block_clone = Block(block.name, dataset_clone, size = block.size, num_files = block.num_files, is_open = block.is_open, last_update = block.last_update, bid = block.id)
+                        dataset_clone.blocks.add(block_clone)
+                        block_to_clone[block] = block_clone
+
+                group = None if dataset_replica.group is None else self.groups[dataset_replica.group.name]
+                replica_clone = DatasetReplica(dataset_clone, site_clone, growing = dataset_replica.growing, group = group)
+                dataset_clone.replicas.add(replica_clone)
+                site_clone.add_dataset_replica(replica_clone, add_block_replicas = False)
+
+                if block_replica_set is None:
+                    block_replica_set = dataset_replica.block_replicas
+                    site_partition_clone.replicas[replica_clone] = None
+                    clone_set = None
+                else:
+                    clone_set = site_partition_clone.replicas[replica_clone] = set()
+
+                for block_replica in block_replica_set:
+                    size = -1 if block_replica.is_complete() else block_replica.size
+                    block_replica_clone = BlockReplica(block_to_clone[block_replica.block], site_clone, self.groups[block_replica.group.name], is_custodial = block_replica.is_custodial, size = size, last_update = block_replica.last_update, file_ids = block_replica.file_ids)
+                    replica_clone.block_replicas.add(block_replica_clone)
+                    block_to_clone[block_replica.block].replicas.add(block_replica_clone)
+                    if clone_set is not None:
+                        clone_set.add(block_replica_clone)
+
+    def unlink_block_replica(self, block_replica):
+        block_replica.unlink_from(self)
+
+    def unlink_dataset_replica(self, dataset_replica):
+        dataset_replica.unlink_from(self)
+
+    def set_group(self, block_replica, group):
+        block_replica.group = group
+
+    def set_growing(self, dataset_replica, growing):
+        dataset_replica.growing = growing
+
+    def restore(self):
+        pass
+
+
+class RecordingInventory(object):
+    """
+    Stand-in for the global inventory in the commit functions of Detox, recording the updated objects.
+    """
+
+    def __init__(self, inventory):
+        self.groups = inventory.groups
+        self.updated = []
+
+    def update(self, obj):
+        self.updated.append((obj, getattr(obj, 'growing', None)))
+
+    def register_update(self, obj):
+        self.updated.append((obj, getattr(obj, 'growing', None)))
+
+class RecordingDeletionOp(object):
+    def __init__(self):
+        self.deletions = []
+        self.reassignments = []
+
+    def schedule_deletions(self, replica_list, operation_id, comments = ''):
+        self.deletions.extend(replica_list)
+        return replica_list
+
+    def schedule_reassignments(self, replica_list, comments = ''):
+        self.reassignments.extend(replica_list)
+
+class RecordingHistory(object):
+    class Record(object):
+        def __init__(self):
+            self.operation_id = 0
+            self.replicas = []
+
+    def make_cycle_entry(self, cycle_number, site):
+        return RecordingHistory.Record()
+
+    def update_entry(self, record):
+        pass
+
+def make_inventory(seed, num_datasets = 300, num_sites = 8):
+    """
+    Synthetic inventory with a Physics partition made of the AnalysisOps, DataOps, and Junk groups, partial replicas,
+    replicas of other groups, incomplete block replicas, and a tape site.
+    """
+
+    rng = random.Random(seed)
+
+    inventory = ObjectRepository()
+
+    for name, olevel in [('AnalysisOps', Group.OL_BLOCK), ('DataOps', Group.OL_DATASET), ('Junk', Group.OL_BLOCK), ('Other', Group.OL_BLOCK)]:
+        inventory.groups.add(Group(name, olevel = olevel))
+
+    physics = Partition('Physics', GroupCondition(['AnalysisOps', 'DataOps', 'Junk']))
+    other = Partition('Other', GroupCondition(['Other']))
+    inventory.partitions.add(physics)
+    inventory.partitions.add(other)
+
+    sites = []
+    for isite in range(num_sites):
+        if isite == 0:
+            site = Site('T1_US_FNAL_MSS', storage_type = Site.TYPE_MSS, status = Site.STAT_READY)
+        elif isite == 1:
+            site = Site('T1_US_FNAL_Disk', status = Site.STAT_READY)
+        else:
+            site = Site('T2_XX_Site%d' % isite, status = Site.STAT_READY)
+
+        inventory.sites.add(site)
+        for partition in (physics, other):
+            site.partitions[partition] = SitePartition(site, partition)
+
+        sites.append(site)
+
+    groups = [inventory.groups[n] for n in ['AnalysisOps', 'AnalysisOps', 'DataOps', 'Junk', 'Other']]
+
+    for idataset in range(num_datasets):
+        dataset = Dataset('/Primary%d/Processed-v1/AOD' % idataset, status = Dataset.STAT_VALID)
+        inventory.datasets.add(dataset)
+
+        for iblock in range(rng.randint(1, 6)):
+            block = Block(Block.to_internal_name('%08x-0000-0000-0000-%012x' % (idataset, iblock)), dataset, size = rng.randint(1, 100) * 10 ** 11, num_files = 10, last_update = 1500000000 + rng.randint(0, 10 ** 8))
+            dataset.blocks.add(block)
+
+        for site in rng.sample(sites, rng.randint(1, 4)):
+            replica = DatasetReplica(dataset, site, growing = rng.random() < 0.3)
+            dataset.replicas.add(replica)
+            site.add_dataset_replica(replica, add_block_replicas = False)
+
+            # no empty replicas (Detox would add placeholder block replicas to the tape site)
+            blocks = sorted(dataset.blocks, key = lambda b: b.name)
+            blocks = blocks[:1] + [b for b in blocks[1:] if rng.random() > 0.15]
+
+            # Junk block replicas (deleted block by block) only in replicas that are not full, so that deleting them
+            # does not change the copy counts seen by other replicas within an iteration. Otherwise the decisions
+            # would depend on the order of evaluation, which is not defined.
+            if len(blocks) == len(dataset.blocks):
+                replica_groups = [g for g in groups if g.name != 'Junk']
+            else:
+                replica_groups = groups
+
+            for block in blocks:
+                group = rng.choice(replica_groups)
+                if rng.random() < 0.9:
+                    block_replica = BlockReplica(block, site, group, last_update = block.last_update)
+                else:
+                    block_replica = BlockReplica(block, site, group, size = block.size / 2, last_update = block.last_update, file_ids = tuple(range(5)))
+
+                replica.block_replicas.add(block_replica)
+                block.replicas.add(block_replica)
+
+            for partition in (physics, other):
+                in_partition = set(br for br in replica.block_replicas if partition.contains(br))
+                if len(in_partition) == 0:
+                    continue
+                elif len(in_partition) == len(replica.block_replicas):
+                    site.partitions[partition].replicas[replica] = None
+                else:
+                    site.partitions[partition].replicas[replica] = in_partition
+
+    for site in sites:
+        # some sites below the deletion threshold (float quota, as Detox divides sizes by it)
+        site.partitions[physics].set_quota(sum(r.size() for r in site.dataset_replicas()) / rng.uniform(0.4, 0.9) + 1.)
+
+    return inventory
+
+def inventory_state(inventory):
+    """Hashable summary of all links and mutable attributes in the inventory."""
+
+    state = []
+    for dataset in inventory.datasets.itervalues():
+        state.append(('D', dataset.name, tuple(sorted(r.site.name for r in dataset.replicas)), tuple(sorted(dataset.attr.items()))))
+        for block in dataset.blocks:
+            state.append(('B', block.full_name(), tuple(sorted(r.site.name for r in block.replicas))))
+        for replica in dataset.replicas:
+            state.append(('R', dataset.name, replica.site.name, replica.growing, tuple(sorted((br.block.full_name(), br.group.name) for br in replica.block_replicas))))
+
+    for site in inventory.sites.itervalues():
+        state.append(('S', site.name, tuple(sorted(r.dataset.name for r in site.dataset_replicas()))))
+        for partition, site_partition in site.partitions.iteritems():
+            for replica, block_replicas in site_partition.replicas.iteritems():
+                if block_replicas is not None:
+                    block_replicas = tuple(sorted(br.block.full_name() for br in block_replicas))
+                state.append(('P', site.name, partition.name, replica.dataset.name, block_replicas))
+
+    return sorted(state)
+
+def by_name(decisions):
+    result = {}
+    for replica, matches in decisions.iteritems():
+        if type(matches) is dict:
+            result[(replica.site.name, replica.dataset.name)] = dict((cid, set(br.block.full_name() for br in brs)) for cid, brs in matches.iteritems())
+        else:
+            result[(replica.site.name, replica.dataset.name)] = set(br.block.full_name() for br in matches)
+
+    return result
+
+
+class TestPartitionOverlay(unittest.TestCase):
+    def setUp(self):
+        self.policy_file = tempfile.NamedTemporaryFile(suffix = '.txt')
+        self.policy_file.write(POLICY)
+        self.policy_file.flush()
+
+    def tearDown(self):
+        self.policy_file.close()
+
+    def make_detox(self):
+        detox = Detox.__new__(Detox)
+        detox.policy = DetoxPolicy(Configuration(policy_file = self.policy_file.name, attrs = {}))
+        detox.deletion_per_iteration = 0.05
+        return detox
+
+    def run_policy(self, seed, use_overlay):
+        inventory = make_inventory(seed)
+        detox = self.make_detox()
+
+        overlay = detox._build_partition(inventory)
+        if not use_overlay:
+            overlay.restore()
+            partition = inventory.partitions['Physics']
+            repository = ClonedPartition(inventory, partition, set(overlay.sites.itervalues()))
+        else:
+            repository = overlay
+
+        try:
+            deleted, kept, protected, reowned = detox._execute_policy(repository)
+        finally:
+            repository.restore()
+
+        return inventory, repository, deleted, kept, protected, reowned
+
+    def test_decisions(self):
+        for seed in range(5):
+            clone_result = self.run_policy(seed, False)
+            overlay_result = self.run_policy(seed, True)
+
+            for clone_decisions, overlay_decisions in zip(clone_result[2:], overlay_result[2:]):
+                self.assertEqual(by_name(clone_decisions), by_name(overlay_decisions))
+
+            for decisions in overlay_result[2:]:
+                self.assertNotEqual(len(decisions), 0)
+
+            # ownership changes in the delta match the groups in the clone
+            reowned_clone = dict(((r.site.name, br.block.full_name()), br.group.name) for r, brs in clone_result[5].iteritems() for br in brs)
+            reowned_overlay = dict(((r.site.name, br.block.full_name()), overlay_result[1].group_changes[br].name) for r, brs in overlay_result[5].iteritems() for br in brs)
+            self.assertEqual(reowned_clone, reowned_overlay)
+
+    def test_restore(self):
+        for seed in range(5):
+            reference = inventory_state(make_inventory(seed))
+            inventory = self.run_policy(seed, True)[0]
+
+            self.assertEqual(inventory_state(inventory), reference)
+
+
+class TestCommit(unittest.TestCase):
+    """
+    The commit functions take the decisions on the restored inventory objects and the delta of the overlay.
+    """
+
+    def setUp(self):
+        self.policy_file = tempfile.NamedTemporaryFile(suffix = '.txt')
+        self.policy_file.write(POLICY)
+        self.policy_file.flush()
+
+    def tearDown(self):
+        self.policy_file.close()
+
+    def make_detox(self):
+        detox = TestPartitionOverlay.make_detox.im_func(self)
+        detox.deletion_op = RecordingDeletionOp()
+        detox.history = RecordingHistory()
+        return detox
+
+    def test_reassignments(self):
+        inventory = make_inventory(0)
+        detox = self.make_detox()
+        overlay = detox._build_partition(inventory)
+
+        # growing replicas fully in the partition
+        growing = []
+        for site in overlay.sites.itervalues():
+            for replica, block_replicas in site.partitions[overlay.partition].replicas.iteritems():
+                if replica.growing and block_replicas is None:
+                    growing.append(replica)
+
+        growing.sort(key = lambda r: (r.site.name, r.dataset.name))
+        handed_over, kept = growing[:2]
+
+        # all blocks of handed_over are handed over to Other; the policy then marks the replica as not growing
+        reowned = {}
+        for replica in [handed_over, kept]:
+            reowned[replica] = set(replica.block_replicas)
+            for block_replica in replica.block_replicas:
+                overlay.set_group(block_replica, inventory.groups['Other'])
+
+        overlay.set_growing(handed_over, False)
+        overlay.restore()
+
+        recorder = RecordingInventory(inventory)
+        detox._commit_reassignments(recorder, overlay, reowned, '')
+
+        self.assertFalse(handed_over.growing)
+        self.assertIn((handed_over, False), recorder.updated)
+        self.assertTrue(kept.growing)
+        self.assertTrue(all(br.group.name == 'Other' for r in reowned for br in r.block_replicas))
+
+        reassignments = dict(detox.deletion_op.reassignments)
+        self.assertEqual(reassignments[handed_over], handed_over.block_replicas)
+        self.assertIsNone(reassignments[kept])
+
+    def test_deletions(self):
+        inventory = make_inventory(0)
+        detox = self.make_detox()
+        overlay = detox._build_partition(inventory)
+
+        try:
+            deleted = detox._execute_policy(overlay)[0]
+        finally:
+            overlay.restore()
+
+        # policy flags before the commit
+        growing = dict((r, overlay.growing_changes.get(r, r.growing)) for r in deleted)
+
+        recorder = RecordingInventory(inventory)
+        detox._commit_deletions(0, recorder, overlay, deleted, '')
+
+        self.assertEqual(len(detox.deletion_op.deletions), len(deleted))
+        for replica, block_replicas in detox.deletion_op.deletions:
+            if block_replicas is None:
+                self.assertFalse(growing[replica])
+                self.assertIn((replica, False), recorder.updated)
+            else:
+                self.assertTrue(growing[replica] or set(block_replicas) != replica.block_replicas)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#! /usr/bin/env python
+
+# Run with the argument "benchmark" to measure the submission-to-start latency of a scripted load of short
+# applications, with the server loop waiting on the event pipe and with the loop sleeping for a fixed interval.
+
+import os
+import sys
+import time
+import multiprocessing
+import unittest
+
+from dynamo.core.components.eventpipe import EventPipe
+
+class TestEventPipe(unittest.TestCase):
+    def setUp(self):
+        self.pipe = EventPipe()
+
+    def tearDown(self):
+        self.pipe.close()
+
+    def test_timeout(self):
+        start = time.time()
+        self.assertEqual(self.pipe.wait(0.1), [])
+        self.assertGreaterEqual(time.time() - start, 0.09)
+
+    def test_order(self):
+        self.pipe.notify(EventPipe.APP_SCHEDULED, 3)
+        self.pipe.notify(EventPipe.APP_EXITED, 2 ** 40)
+        self.assertEqual(self.pipe.wait(1), [(EventPipe.APP_SCHEDULED, 3), (EventPipe.APP_EXITED, 2 ** 40)])
+        self.assertEqual(self.pipe.wait(0), [])
+
+    def test_fork(self):
+        proc = multiprocessing.Process(target = lambda: (time.sleep(0.2), self.pipe.notify(EventPipe.UPDATES_SENT)))
+        proc.start()
+
+        start = time.time()
+        events = self.pipe.wait(10)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(events, [(EventPipe.UPDATES_SENT, 0)])
+
+        proc.join()
+
+    def test_full(self):
+        # notify never blocks; events beyond the pipe capacity are dropped
+        for i in xrange(100000):
+            self.pipe.notify(EventPipe.APP_SCHEDULED, i)
+
+        events = self.pipe.wait(1)
+        self.assertGreater(len(events), 0)
+        self.assertEqual(events[:3], [(EventPipe.APP_SCHEDULED, 0), (EventPipe.APP_SCHEDULED, 1), (EventPipe.APP_SCHEDULED, 2)])
+
+
+def run_load(num_apps, poll_interval, use_pipe, mean_gap = 0.005):
+    """
+    Stand-in for DynamoServer._run_application_cycles. A submitter process schedules num_apps applications
+    (the queue plays the master server application table) and notifies the pipe like AppServer._schedule_app.
+    The server loop starts each application as a child process that exits immediately.
+    @return List of submission-to-start latencies in seconds.
+    """
+    import random
+    import Queue
+
+    pipe = EventPipe()
+    applications = multiprocessing.Queue()
+
+    def submit():
+        rng = random.Random(1)
+        for app_id in xrange(num_apps):
+            time.sleep(rng.expovariate(1. / mean_gap))
+            applications.put((app_id, time.time()))
+            pipe.notify(EventPipe.APP_SCHEDULED, app_id)
+
+    def run_app(app_id):
+        pipe.notify(EventPipe.APP_EXITED, app_id)
+
+    submitter = multiprocessing.Process(target = submit)
+    submitter.start()
+
+    latencies = []
+    children = []
+    do_sleep = False
+
+    while len(latencies) != num_apps:
+        for proc in list(children):
+            if not proc.is_alive():
+                proc.join()
+                children.remove(proc)
+
+        if do_sleep:
+            if use_pipe:
+                pipe.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+
+        try:
+            app_id, submitted = applications.get_nowait()
+        except Queue.Empty:
+            do_sleep = True
+            continue
+
+        do_sleep = False
+
+        proc = multiprocessing.Process(target = run_app, args = (app_id,))
+        proc.daemon = True
+        proc.start()
+        children.append(proc)
+
+        latencies.append(time.time() - submitted)
+
+    submitter.join()
+    for proc in children:
+        proc.join()
+
+    pipe.close()
+
+    return latencies
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        for use_pipe in [False, True]:
+            start = time.time()
+            latencies = sorted(run_load(1000, 1., use_pipe))
+            print '%-6s total %5.1f s  latency mean %6.1f ms  median %6.1f ms  p99 %6.1f ms' % \
+                ('pipe' if use_pipe else 'sleep', time.time() - start, sum(latencies) / len(latencies) * 1.e+3,
+                latencies[len(latencies) / 2] * 1.e+3, latencies[int(len(latencies) * 0.99)] * 1.e+3)
+    else:
+        unittest.main()
@@ -0,0 +1,229 @@
+#! /usr/bin/env python
+
+# File operations daemon pools with a dummy gfal2 module and the task tables replaced by an in-memory stand-in
+# that counts the queries. Run with the argument "benchmark" to measure the time from the completion of a deletion
+# to its status write-back and the number of DB queries per 1000 deletions, with the results collected on pool
+# callbacks and written in bulk, and with the results collected every 5 seconds and written one by one.
+
+import os
+import sys
+import time
+import types
+import signal
+import threading
+import multiprocessing
+import unittest
+
+## Dummy gfal2: every operation takes op_time seconds and records its completion time
+gfal2 = types.ModuleType('gfal2')
+
+class GError(Exception):
+    def __init__(self, msg, code):
+        Exception.__init__(self, msg)
+        self.code = code
+
+class Gfal2Context(object):
+    op_time = 0.
+    # Shared array of completion times indexed by the PFN number (set by the tests)
+    completed = None
+
+    @staticmethod
+    def unlink(context, pfn):
+        time.sleep(Gfal2Context.op_time)
+        if 'missing' in pfn:
+            raise GError('No such file', 2)
+
+        if Gfal2Context.completed is not None:
+            Gfal2Context.completed[int(pfn.split('/')[-1])] = time.time()
+
+gfal2.GError = GError
+gfal2.Gfal2Context = Gfal2Context
+gfal2.creat_context = lambda: None
+gfal2.set_verbose = lambda level: None
+gfal2.verbose_level = types.ModuleType('verbose_level')
+gfal2.verbose_level.verbose = 0
+
+sys.modules['gfal2'] = gfal2
+
+from dynamo.fileop.daemon.manager import PoolManager, StatefulPoolManager
+from dynamo.fileop.daemon.delete import DeletionPoolManager
+from dynamo.fileop.daemon.wakeup import WakeupSocket, notify
+from dynamo.utils.signaling import SignalConverter
+
+class MemoryTaskDB(object):
+    """
+    Stand-in for the MySQL interface used by the pool managers. Only knows the task status updates. Queries issued
+    in the pool worker processes are counted in shared memory.
+    """
+
+    def __init__(self):
+        self.statuses = {}
+        self.written = {}
+        self._num_queries = multiprocessing.Value('i', 0)
+
+    @property
+    def num_queries(self):
+        return self._num_queries.value
+
+    def _count(self):
+        with self._num_queries.get_lock():
+            self._num_queries.value += 1
+
+    def query(self, sql, *args):
+        self._count()
+
+        if 'SET `status` = \'active\'' in sql and self.statuses.get(args[-1]) == 'broken':
+            raise RuntimeError('Lost connection')
+
+        if 'SET `status` = \'queued\'' in sql or 'SET `status` = \'active\'' in sql:
+            # cancelled tasks are not in the table
+            return 0 if self.statuses.get(args[-1]) == 'cancelled' else 1
+
+        if sql.startswith('UPDATE') and 'WHERE `id` = %s' in sql:
+            # one-by-one result write-back
+            status, exitcode, msg, start_time, finish_time, tid = args
+            self._write([(tid, status, exitcode, msg)])
+            return 1
+
+        raise NotImplementedError(sql)
+
+    def update_many(self, table, key, fields, rows):
+        self._count()
+        self._write([row[:4] for row in rows])
+        return len(rows)
+
+    def _write(self, rows):
+        now = time.time()
+        for tid, status, exitcode, msg in rows:
+            self.statuses[tid] = status
+            self.written[tid] = now
+
+
+class SweepingDeletionPoolManager(DeletionPoolManager):
+    """
+    Result collection before the pools woke up their collectors: a sweep every collect_interval seconds and one
+    UPDATE per task.
+    """
+
+    def _set_ready(self, result):
+        pass
+
+    def process_results(self, result_tuples):
+        sql = 'UPDATE `standalone_{op}_tasks` SET `status` = %s, `exitcode` = %s, `message` = %s, `start_time` = FROM_UNIXTIME(%s), `finish_time` = FROM_UNIXTIME(%s) WHERE `id` = %s'.format(op = self.optype)
+
+        for tid, result, pfn in result_tuples:
+            exitcode, start_time, finish_time, msg, log = result.get()
+            status = 'done' if exitcode == 0 else 'failed'
+            PoolManager.db.query(sql, status, exitcode, msg, start_time, finish_time, tid)
+
+
+def setup_statics():
+    PoolManager.db = MemoryTaskDB()
+    PoolManager.stop_flag = threading.Event()
+    PoolManager.signal_converter = SignalConverter()
+    PoolManager.signal_converter.set(signal.SIGTERM)
+    PoolManager.signal_converter.set(signal.SIGHUP)
+
+def teardown_statics():
+    PoolManager.signal_converter.unset(signal.SIGTERM)
+    PoolManager.signal_converter.unset(signal.SIGHUP)
+    PoolManager.collect_interval = 5
+
+def run_deletions(manager_cls, num_tasks, num_procs, op_time):
+    """
+    Run num_tasks deletions through one pool manager.
+    @return (list of completion-to-write-back latencies, number of DB queries)
+    """
+    Gfal2Context.op_time = op_time
+    Gfal2Context.completed = multiprocessing.Array('d', num_tasks, lock = False)
+
+    db = PoolManager.db
+    manager = manager_cls('T2_XX_Test', num_procs, '')
+
+    for tid in xrange(num_tasks):
+        manager.add_task(tid, 'srm://fake/store/%d' % tid)
+
+    while not manager.ready_for_recycle():
+        time.sleep(0.01)
+
+    latencies = [db.written[tid] - Gfal2Context.completed[tid] for tid in xrange(num_tasks)]
+    Gfal2Context.completed = None
+
+    return latencies, db.num_queries
+
+
+class TestPoolManager(unittest.TestCase):
+    def setUp(self):
+        setup_statics()
+
+    def tearDown(self):
+        teardown_statics()
+
+    def test_results(self):
+        # tasks that end with an exception only wake the collector at the interval
+        PoolManager.collect_interval = 0.5
+
+        db = PoolManager.db
+        db.statuses[3] = 'cancelled'
+        db.statuses[5] = 'broken'
+
+        manager = DeletionPoolManager('T2_XX_Test', 4, '')
+        for tid in range(4):
+            manager.add_task(tid, 'srm://fake/store/%d' % tid)
+        manager.add_task(4, 'srm://fake/missing/4')
+        # exception in the task function
+        manager.add_task(5, 'srm://fake/store/5')
+
+        start = time.time()
+        while not manager.ready_for_recycle():
+            time.sleep(0.01)
+
+        self.assertLess(time.time() - start, 3.)
+        self.assertEqual([db.statuses[tid] for tid in range(6)], ['done', 'done', 'done', 'cancelled', 'done', 'failed'])
+
+    def test_latency(self):
+        latencies, num_queries = run_deletions(DeletionPoolManager, 200, 8, 0.005)
+
+        # queued + active for each task, and bulk result writes
+        self.assertLess(num_queries, 200 * 2 + 100)
+        self.assertLess(max(latencies), 1.)
+
+
+class TestWakeupSocket(unittest.TestCase):
+    def setUp(self):
+        self.path = '/tmp/dynamo_test_wakeup_%d.sock' % os.getpid()
+        self.socket = WakeupSocket(self.path)
+
+    def tearDown(self):
+        self.socket.close()
+
+    def test_notify(self):
+        self.assertEqual(self.socket.wait(0.05), [])
+
+        proc = multiprocessing.Process(target = lambda: (time.sleep(0.2), notify('transfer', self.path), notify('deletion', self.path)))
+        proc.start()
+
+        start = time.time()
+        messages = self.socket.wait(10)
+        self.assertLess(time.time() - start, 5)
+
+        proc.join()
+        messages += self.socket.wait(0)
+        self.assertEqual(messages, ['transfer', 'deletion'])
+
+    def test_no_daemon(self):
+        self.assertFalse(notify('transfer', self.path + '.none'))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        # 1000 deletions of 20 ms on 10 processes
+        for name, manager_cls in [('sweep', SweepingDeletionPoolManager), ('event', DeletionPoolManager)]:
+            setup_statics()
+            start = time.time()
+            latencies, num_queries = run_deletions(manager_cls, 1000, 10, 0.02)
+            latencies.sort()
+            print '%-5s  total %5.2f s  write-back latency mean %7.1f ms  p99 %7.1f ms  DB queries %d' % \
+                (name, time.time() - start, sum(latencies) / len(latencies) * 1.e+3, latencies[int(len(latencies) * 0.99)] * 1.e+3, num_queries)
+            teardown_statics()
+    else:
+        unittest.main()
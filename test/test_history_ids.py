@@ -0,0 +1,194 @@
+#! /usr/bin/env python
+
+# HistoryDatabase id caching, with the MySQL interface replaced by in-memory tables that count the queries.
+# Run with the argument "benchmark" to record a 1M-file history in the way RLFSM does (one file per call).
+
+import sys
+import time
+import unittest
+
+from dynamo.history.history import HistoryDatabase, IdCache
+from dynamo.dataformat import Configuration
+
+class MemoryDB(object):
+    """
+    Stand-in for the MySQL interface supporting what HistoryDatabase.save_* use. Every table has an auto-increment
+    id and one unique key. Each select_many or insert_many call counts as queries of max_query_len characters.
+    """
+
+    unique_keys = {'users': ('dn',), 'blocks': ('dataset_id', 'name')}
+
+    def __init__(self):
+        self.tables = {}
+        self.num_queries = 0
+        self.max_query_len = 1000000
+        self.reuse_connection = True
+
+    def config(self):
+        return Configuration({'host': 'memory', 'db': 'history_%d' % id(self)})
+
+    def _count(self, values):
+        self.num_queries += 1 + sum(len(str(v)) + 3 for v in values) / self.max_query_len
+
+    def _table(self, table):
+        return self.tables.setdefault(table, {})
+
+    def insert_many(self, table, fields, mapping, objects, do_update = True, db = '', update_columns = None):
+        if mapping is None:
+            mapping = lambda obj: obj
+
+        rows = [dict(zip(fields, mapping(obj))) for obj in objects]
+        self._count(rows)
+
+        key_fields = MemoryDB.unique_keys.get(table, ('name',))
+        content = self._table(table)
+        for row in rows:
+            key = tuple(row[f] for f in key_fields)
+            try:
+                existing = content[key]
+            except KeyError:
+                row['id'] = len(content) + 1
+                content[key] = row
+            else:
+                if do_update:
+                    existing.update(row)
+                else:
+                    raise RuntimeError('Duplicate entry %s' % str(key))
+
+        return len(rows)
+
+    def select_many(self, table, fields, key, pool, additional_conditions = [], order_by = ''):
+        pool = list(pool)
+        self._count(pool)
+
+        if type(key) is not tuple:
+            key = (key,)
+            pool = [(v,) for v in pool]
+
+        content = self._table(table)
+        if key == MemoryDB.unique_keys.get(table, ('name',)):
+            rows = [content[k] for k in set(pool) if k in content]
+        else:
+            pool = set(pool)
+            rows = [row for row in content.itervalues() if tuple(row[k] for k in key) in pool]
+
+        if len(fields) == 1:
+            return [row[fields[0]] for row in rows]
+        else:
+            return [tuple(row[f] for f in fields) for row in rows]
+
+
+def make_history(db, cache_size = 1000000):
+    history = object.__new__(HistoryDatabase)
+    history.db = db
+    history.set_read_only(False)
+    history.id_cache_size = cache_size
+    return history
+
+
+class TestIdCache(unittest.TestCase):
+    def test_eviction(self):
+        cache = IdCache(4)
+        cache.update({'a': 1, 'b': 2})
+        # recent generation is full: a and b become old
+        self.assertEqual(cache.lookup(['a', 'x']), ({'a': 1}, ['x']))
+        cache.update({'c': 3})
+        # a was used and moved back to the recent generation; b is dropped
+        self.assertEqual(cache.lookup(['a', 'b', 'c']), ({'a': 1, 'c': 3}, ['b']))
+        self.assertLessEqual(len(cache), 4)
+
+
+class TestSaveIds(unittest.TestCase):
+    def setUp(self):
+        self.db = MemoryDB()
+        self.history = make_history(self.db)
+
+    def test_names(self):
+        ids = self.history.save_sites(['T2_A', 'T2_B', 'T2_A'], get_ids = True)
+        self.assertEqual(ids[0], ids[2])
+        self.assertNotEqual(ids[0], ids[1])
+
+        num_queries = self.db.num_queries
+        self.assertEqual(self.history.save_sites(['T2_B', 'T2_A'], get_ids = True), [ids[1], ids[0]])
+        self.assertEqual(self.db.num_queries, num_queries)
+
+        # another instance shares the cache
+        other = make_history(self.db)
+        self.assertEqual(other.save_sites(['T2_A'], get_ids = True), [ids[0]])
+        self.assertEqual(self.db.num_queries, num_queries)
+
+    def test_existing_rows(self):
+        # rows written by another process
+        self.db.insert_many('datasets', ('name',), lambda n: (n,), ['/A/B/C'])
+        num_queries = self.db.num_queries
+
+        ids = self.history.save_datasets(['/X/Y/Z', '/A/B/C'], get_ids = True)
+        self.assertEqual(ids, [2, 1])
+        self.assertEqual(self.db.num_queries, num_queries + 2)
+
+    def test_values(self):
+        file_id = self.history.save_files([('/store/a', 10)], get_ids = True)[0]
+
+        # a different size is written even though the name is known
+        self.assertEqual(self.history.save_files([('/store/a', 20)], get_ids = True), [file_id])
+        self.assertEqual(self.db.tables['files'][('/store/a',)]['size'], 20)
+
+        self.history.save_users([('alice', '/DN=alice')])
+        self.history.save_users([('alice2', '/DN=alice')])
+        self.assertEqual(self.db.tables['users'][('/DN=alice',)]['name'], 'alice2')
+
+        # back to the first value: the cache holds the last written row, not every row seen
+        self.assertEqual(self.history.save_files([('/store/a', 10)], get_ids = True), [file_id])
+        self.assertEqual(self.db.tables['files'][('/store/a',)]['size'], 10)
+        self.history.save_users([('alice', '/DN=alice')])
+        self.assertEqual(self.db.tables['users'][('/DN=alice',)]['name'], 'alice')
+
+        # unchanged rows cost no query
+        num_queries = self.db.num_queries
+        self.history.save_files([('/store/a', 10)])
+        self.history.save_users([('alice', '/DN=alice')])
+        self.assertEqual(self.db.num_queries, num_queries)
+
+    def test_blocks(self):
+        blocks = [('/A/B/C', 'b1'), ('/A/B/C', 'b2'), ('/D/E/F', 'b1')]
+        ids = self.history.save_blocks(blocks, get_ids = True)
+        self.assertEqual(len(set(ids)), 3)
+
+        num_queries = self.db.num_queries
+        self.assertEqual(self.history.save_blocks(blocks[::-1], get_ids = True), ids[::-1])
+        self.assertEqual(self.db.num_queries, num_queries)
+
+        # the same block name in another dataset is another row
+        dataset_ids = dict(zip(['/A/B/C', '/D/E/F'], self.history.save_datasets(['/A/B/C', '/D/E/F'], get_ids = True)))
+        self.assertEqual(self.db.tables['blocks'][(dataset_ids['/D/E/F'], 'b1')]['id'], ids[2])
+
+    def test_read_only(self):
+        self.history.set_read_only(True)
+        self.assertEqual(self.history.save_blocks([('/A/B/C', 'b1')], get_ids = True), [0])
+        self.assertEqual(self.db.num_queries, 0)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        db = MemoryDB()
+        history = make_history(db)
+        sites = ['T2_XX_Site%d' % i for i in range(50)]
+
+        # 1M transfers of 250k distinct files, as recorded by RLFSM (sites and file of one transfer per call)
+        start = time.time()
+        for itransfer in xrange(1000000):
+            history.save_sites([sites[itransfer % 50]], get_ids = True)
+            history.save_sites([sites[(itransfer * 7) % 50]], get_ids = True)
+            history.save_files([('/store/data/file%d.root' % (itransfer % 250000), 1000)], get_ids = True)
+
+        print 'per-transfer saves: %d queries, %.1f s' % (db.num_queries, time.time() - start)
+
+        # Detox-style bulk save of 1M file names, twice
+        db = MemoryDB()
+        history = make_history(db)
+        files = [('/store/data/bulk%d.root' % i, 1000) for i in xrange(1000000)]
+        start = time.time()
+        history.save_files(files)
+        history.save_files(files)
+        print 'bulk saves: %d queries, %.1f s' % (db.num_queries, time.time() - start)
+    else:
+        unittest.main()
@@ -0,0 +1,234 @@
+#! /usr/bin/env python
+
+# JobStatusPoller against a local HTTP stand-in for the FTS REST API (GET /jobs/<job_id> returns the job and its
+# files). Each job is submitted at server start and its files finish one after another every file_time seconds.
+# Run with the argument "benchmark" to compare a concurrent, adaptive poller with a serial fetch of every job.
+
+import sys
+import time
+import json
+import threading
+import urllib2
+import BaseHTTPServer
+import SocketServer
+import unittest
+
+from dynamo.fileop.poller import JobStatusPoller
+
+class FTSStandIn(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, jobs, latency = 0., file_time = 1.):
+        """
+        @param jobs       {job_id: number of files}
+        @param latency    Response time of each request in seconds.
+        @param file_time  Time to complete one file in seconds.
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), FTSHandler)
+
+        self.jobs = jobs
+        self.latency = latency
+        self.file_time = file_time
+        self.start_time = time.time()
+
+        self.num_requests = 0
+        self.requests = {}
+        self._lock = threading.Lock()
+
+        self.thread = threading.Thread(target = self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def job_status(self, job_id):
+        num_done = int((time.time() - self.start_time) / self.file_time)
+        num_files = self.jobs[job_id]
+
+        files = []
+        for ifile in range(num_files):
+            if ifile < num_done:
+                files.append({'file_id': ifile, 'file_state': 'FINISHED'})
+            elif ifile == num_done:
+                files.append({'file_id': ifile, 'file_state': 'ACTIVE'})
+            else:
+                files.append({'file_id': ifile, 'file_state': 'SUBMITTED'})
+
+        if num_done >= num_files:
+            job_state = 'FINISHED'
+        else:
+            job_state = 'ACTIVE'
+
+        return {'job_id': job_id, 'job_state': job_state, 'files': files}
+
+    def count(self, job_id):
+        with self._lock:
+            self.num_requests += 1
+            self.requests[job_id] = self.requests.get(job_id, 0) + 1
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FTSHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        job_id = self.path.split('/')[-1]
+        self.server.count(job_id)
+
+        if not self.path.startswith('/jobs/') or job_id not in self.server.jobs:
+            self.send_error(404)
+            return
+
+        time.sleep(self.server.latency)
+
+        body = json.dumps(self.server.job_status(job_id))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_poller(server, **kwd):
+    def fetch(job_id):
+        return json.loads(urllib2.urlopen('%s/jobs/%s' % (server.url, job_id)).read())
+
+    return JobStatusPoller(
+        fetch,
+        lambda result: (result['job_state'], tuple(f['file_state'] for f in result['files'])),
+        lambda result: result['job_state'] == 'FINISHED',
+        **kwd
+    )
+
+
+class TestJobStatusPoller(unittest.TestCase):
+    def tearDown(self):
+        self.server.close()
+
+    def test_concurrent(self):
+        self.server = FTSStandIn(dict(('job%d' % i, 1) for i in range(16)), latency = 0.2, file_time = 100.)
+        poller = make_poller(self.server, num_threads = 8)
+
+        start = time.time()
+        results = poller.poll(self.server.jobs.keys())
+        elapsed = time.time() - start
+
+        # 16 requests x 0.2 s serially
+        self.assertLess(elapsed, 16 * 0.2 / 2)
+        self.assertEqual(sorted(results.keys()), sorted(self.server.jobs.keys()))
+        self.assertTrue(all(r['job_state'] == 'ACTIVE' for r in results.itervalues()))
+
+    def test_terminal(self):
+        self.server = FTSStandIn({'done': 1, 'running': 1000}, file_time = 0.1)
+        poller = make_poller(self.server, min_interval = 0., max_interval = 0.)
+
+        time.sleep(0.15)
+
+        for _ in range(5):
+            results = poller.poll(['done', 'running'])
+
+        self.assertEqual(results['done']['job_state'], 'FINISHED')
+        self.assertEqual(self.server.requests['done'], 1)
+        self.assertEqual(self.server.requests['running'], 5)
+
+    def test_backoff(self):
+        self.server = FTSStandIn({'job': 2}, file_time = 1000.)
+        poller = make_poller(self.server, min_interval = 10., max_interval = 100.)
+
+        now = time.time()
+        # first poll and a poll right after the job was first seen: state is unchanged at the second fetch
+        poller.poll(['job'], now = now)
+        poller.poll(['job'], now = now)
+        self.assertEqual(self.server.requests['job'], 2)
+
+        # interval is limited by the job age (0 s) and raised to min_interval
+        poller.poll(['job'], now = now + 5.)
+        self.assertEqual(self.server.requests['job'], 2)
+        poller.poll(['job'], now = now + 10.)
+        self.assertEqual(self.server.requests['job'], 3)
+
+        # job is 10 s old: interval stays at min_interval
+        poller.poll(['job'], now = now + 19.)
+        self.assertEqual(self.server.requests['job'], 3)
+        poller.poll(['job'], now = now + 20.)
+        self.assertEqual(self.server.requests['job'], 4)
+
+        # job is 100 s old: interval doubles to 20 s
+        poller.poll(['job'], now = now + 100.)
+        poller.poll(['job'], now = now + 115.)
+        self.assertEqual(self.server.requests['job'], 5)
+        poller.poll(['job'], now = now + 120.)
+        self.assertEqual(self.server.requests['job'], 6)
+
+        # forgotten job starts over
+        poller.poll([], now = now + 121.)
+        result = poller.poll(['job'], now = now + 121.)['job']
+        self.assertEqual(self.server.requests['job'], 7)
+        self.assertEqual(result['files'][0]['file_state'], 'ACTIVE')
+
+    def test_error(self):
+        self.server = FTSStandIn({'job': 1}, file_time = 1000.)
+        poller = make_poller(self.server, min_interval = 10.)
+
+        results = poller.poll(['job', 'unknown'])
+        self.assertIsNone(results['unknown'])
+        self.assertIsNotNone(results['job'])
+
+        # failed job is retried at the next poll
+        results = poller.poll(['job', 'unknown'])
+        self.assertIsNone(results['unknown'])
+        self.assertEqual(self.server.requests['unknown'], 2)
+
+
+def run_sweeps(poller, server, duration, sweep_interval):
+    """
+    Stand-in for RLFSM status sweeps, repeated for duration seconds. Returns (time spent polling, number of
+    requests, number of sweeps, time until all jobs were seen as finished).
+    """
+    job_ids = server.jobs.keys()
+    spent = 0.
+    num_sweeps = 0
+    finished_at = None
+
+    while time.time() < server.start_time + duration:
+        start = time.time()
+        if poller is None:
+            results = dict((job_id, json.loads(urllib2.urlopen('%s/jobs/%s' % (server.url, job_id)).read())) for job_id in job_ids)
+        else:
+            results = poller.poll(job_ids)
+        spent += time.time() - start
+        num_sweeps += 1
+
+        if finished_at is None and all(r['job_state'] == 'FINISHED' for r in results.itervalues()):
+            finished_at = time.time() - server.start_time
+
+        time.sleep(max(0., sweep_interval - (time.time() - start)))
+
+    return spent, server.num_requests, num_sweeps, finished_at
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        # 200 jobs of 1 to 5 files, 20 ms per request, a file every 5 s, a sweep every 0.5 s for 30 s
+        jobs = dict(('job%d' % i, 1 + i % 5) for i in range(200))
+
+        for name in ['serial', 'poller']:
+            server = FTSStandIn(jobs, latency = 0.02, file_time = 5.)
+            if name == 'serial':
+                poller = None
+            else:
+                poller = make_poller(server, num_threads = 8, min_interval = 0.5, max_interval = 5.)
+
+            spent, num_requests, num_sweeps, finished_at = run_sweeps(poller, server, 30., 0.5)
+            print '%-6s  %3d sweeps  polling %5.1f s (%4.2f s per sweep)  %5d requests (%5.1f per sweep)  all finished seen after %4.1f s' % \
+                (name, num_sweeps, spent, spent / num_sweeps, num_requests, float(num_requests) / num_sweeps, finished_at)
+
+            server.close()
+    else:
+        unittest.main()
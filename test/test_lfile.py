@@ -0,0 +1,128 @@
+#! /usr/bin/env python
+
+# File LFN storage in the shared prefix table. Run with the argument "benchmark" to measure the memory of 1M files in
+# 20k blocks (one directory per block) and the time of find_file and File.lfn, with the prefix table and with the
+# table full (whole LFNs stored).
+
+import sys
+import gc
+import time
+import uuid
+import random
+import unittest
+
+from dynamo.dataformat import Dataset, Block, File, Site, Group
+
+class TestLFN(unittest.TestCase):
+    def setUp(self):
+        self.dataset = Dataset('/A/B/C')
+        self.block = Block(Block.to_internal_name('0123abcd-0000-0000-0000-000000000000'), self.dataset, size = 30, num_files = 3)
+        self.block._files = set(File('/store/data/A/B/C/0000/f%d.root' % i, self.block, 10, fid = i + 1) for i in range(3))
+
+    def test_split(self):
+        lfile = File('/store/data/A/B/C/0000/x.root')
+        other = File('/store/data/A/B/C/0000/y.root')
+
+        self.assertEqual(lfile.lfn, '/store/data/A/B/C/0000/x.root')
+        self.assertEqual(lfile._lfn_prefix_id, other._lfn_prefix_id)
+        self.assertEqual(lfile._lfn_suffix, 'x.root')
+        self.assertEqual(File('noslash').lfn, 'noslash')
+
+        self.assertEqual(File.split_lfn('/not/registered/z.root', register = False), (None, 'z.root'))
+        self.assertNotIn('/not/registered/', File._lfn_prefixes_byvalue)
+
+    def test_full_table(self):
+        max_prefixes = File.max_lfn_prefixes
+        File.max_lfn_prefixes = len(File._lfn_prefixes_byid) + 1
+        try:
+            registered = File('/store/full/A/x.root')
+            self.assertNotEqual(registered._lfn_prefix_id, 0)
+
+            # no room for another prefix: the whole LFN is kept
+            lfile = File('/store/full/B/x.root', self.block, 10, fid = 9)
+            self.assertEqual((lfile._lfn_prefix_id, lfile._lfn_suffix), (0, '/store/full/B/x.root'))
+            self.assertEqual(lfile.lfn, '/store/full/B/x.root')
+            self.assertEqual(len(File._lfn_prefixes_byid), File.max_lfn_prefixes)
+
+            self.assertEqual(File('/store/full/B/x.root', self.block, 10, fid = 9), lfile)
+            self.assertEqual(File('/store/full/A/y.root')._lfn_prefix_id, registered._lfn_prefix_id)
+
+            self.block._files.add(lfile)
+            self.assertIs(self.block.find_file('/store/full/B/x.root'), lfile)
+            self.assertIsNone(self.block.find_file('/store/full/C/x.root'))
+        finally:
+            File.max_lfn_prefixes = max_prefixes
+
+    def test_find_file(self):
+        lfile = self.block.find_file('/store/data/A/B/C/0000/f1.root')
+        self.assertEqual(lfile.id, 2)
+        self.assertIsNone(self.block.find_file('/store/data/A/B/C/0000/f9.root'))
+        self.assertIsNone(self.block.find_file('/store/other/f1.root'))
+
+    def test_repr(self):
+        lfile = self.block.find_file('/store/data/A/B/C/0000/f0.root')
+        clone = eval(repr(lfile))
+        self.assertEqual(clone, lfile)
+        self.assertEqual(clone.lfn, lfile.lfn)
+
+    def test_intern(self):
+        name = ''.join(['T2_XX', '_Test'])
+        self.assertIs(Site(name).name, Site('T2_XX_Test').name)
+        self.assertIs(Group(''.join(['gr', 'oup'])).name, Group('group').name)
+        self.assertIs(Dataset(''.join(['/A/B', '/C'])).name, self.dataset.name)
+
+def rss():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * 4096
+
+def benchmark(num_datasets = 1000, blocks_per_dataset = 20, files_per_block = 50):
+    rng = random.Random(1)
+    uuids = [rng.getrandbits(128) for _ in xrange(num_datasets * blocks_per_dataset * files_per_block)]
+
+    def lfn(ifile):
+        # a new string for every file, as read from the database
+        iblock = ifile / files_per_block
+        return '/store/data/Run2018A/Primary%d/AOD/17Sep2018-v1/%05d/%s.root' % (iblock / blocks_per_dataset, iblock % blocks_per_dataset, str(uuid.UUID(int = uuids[ifile])).upper())
+
+    blocks = []
+
+    gc.collect()
+    start = rss()
+    for idataset in xrange(num_datasets):
+        dataset = Dataset('/Primary%d/Run2018A-17Sep2018-v1/AOD' % idataset)
+        for iblock in xrange(blocks_per_dataset):
+            block = Block(Block.to_internal_name('%08x-0000-0000-0000-%012x' % (idataset, iblock)), dataset, size = 0, num_files = files_per_block)
+            first = len(blocks) * files_per_block
+            block._files = set(File(lfn(ifile), block, 1000) for ifile in xrange(first, first + files_per_block))
+            blocks.append(block)
+
+    gc.collect()
+    memory = rss() - start
+
+    queries = [lfn(iblock * files_per_block + files_per_block / 2) for iblock in xrange(len(blocks))]
+    start = time.time()
+    for block, query in zip(blocks, queries):
+        block.find_file(query, must_find = True)
+    find_time = time.time() - start
+
+    start = time.time()
+    for block in blocks:
+        for lfile in block._files:
+            lfile.lfn
+    lfn_time = time.time() - start
+
+    return memory, find_time, lfn_time
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        if len(sys.argv) > 2 and sys.argv[2] == 'full':
+            File.max_lfn_prefixes = len(File._lfn_prefixes_byid)
+            label = 'whole LFNs'
+        else:
+            label = 'prefix table'
+
+        memory, find_time, lfn_time = benchmark()
+        print '%s: +%d MB, 20k find_file %.2f s, File.lfn of all files %.2f s' % (label, memory / 1000000, find_time, lfn_time)
+    else:
+        unittest.main()
@@ -0,0 +1,264 @@
+#! /usr/bin/env python
+
+# LinkConcurrencyController in a simulation of links with limited bandwidth: the completion rate of a link grows
+# with the number of concurrent transfers up to a saturation point and degrades beyond it, and transfers that take
+# longer than the timeout fail with ETIMEDOUT. Run with the argument "benchmark" to compare the throughput with
+# fixed and adaptive concurrency.
+
+import sys
+import time
+import heapq
+import errno
+import types
+import signal
+import threading
+import multiprocessing
+import unittest
+
+from dynamo.dataformat import Configuration
+from dynamo.fileop.daemon.concurrency import LinkConcurrencyController
+
+class SimLink(object):
+    def __init__(self, bandwidth, saturation, overload = 0.5, timeout = 0.):
+        """
+        @param bandwidth   Maximum completion rate (files/s).
+        @param saturation  Number of concurrent transfers at which the bandwidth is reached.
+        @param overload    Fractional loss of bandwidth per saturation-worth of excess transfers.
+        @param timeout     Transfers longer than this fail (0 = no timeout).
+        """
+        self.bandwidth = bandwidth
+        self.saturation = saturation
+        self.overload = overload
+        self.timeout = timeout
+        self.active = 0
+
+    def throughput(self, n):
+        if n <= self.saturation:
+            return self.bandwidth * n / self.saturation
+        else:
+            return self.bandwidth * max(0.1, 1. - self.overload * (n - self.saturation) / self.saturation)
+
+    def duration(self):
+        # duration of a transfer started now, assuming the concurrency does not change
+        return self.active / self.throughput(self.active)
+
+
+def simulate(controller, links, duration, check = None):
+    """
+    Run transfers on the links with unlimited backlogs for duration simulated seconds.
+    @param controller  LinkConcurrencyController
+    @param links       {(source, destination): SimLink}
+    @param check       Function called with the controller after every event.
+    @return {(source, destination): (number of completed transfers in the second half, list of (time, limit))}
+    """
+    events = []
+    completed = dict((link, 0) for link in links)
+    limits = dict((link, []) for link in links)
+
+    def dispatch(now):
+        for link, sim in links.iteritems():
+            while controller.acquire(link, now = now):
+                sim.active += 1
+                length = sim.duration()
+                if sim.timeout != 0. and length > sim.timeout:
+                    heapq.heappush(events, (now + sim.timeout, link, errno.ETIMEDOUT))
+                else:
+                    heapq.heappush(events, (now + length, link, 0))
+
+            limits[link].append((now, controller.get_limit(link)))
+
+    now = 0.
+    dispatch(now)
+
+    while len(events) != 0:
+        now, link, exitcode = heapq.heappop(events)
+        if now > duration:
+            break
+
+        links[link].active -= 1
+        controller.release(link, exitcode, now = now)
+
+        if exitcode == 0 and now > duration / 2.:
+            completed[link] += 1
+
+        dispatch(now)
+
+        if check is not None:
+            check(controller)
+
+    return dict((link, (completed[link], limits[link])) for link in links)
+
+def make_controller(**kwd):
+    config = {'initial': 2, 'max_per_link': 100, 'interval': 10.}
+    config.update(kwd)
+    return LinkConcurrencyController(Configuration(config))
+
+def time_average(limits, start):
+    values = [limit for t, limit in limits if t > start]
+    return float(sum(values)) / len(values)
+
+
+class TestLinkConcurrencyController(unittest.TestCase):
+    def test_converge(self):
+        link = ('T1_A', 'T2_B')
+        sim = SimLink(bandwidth = 5., saturation = 20)
+
+        result = simulate(make_controller(), {link: sim}, 4000.)
+        completed, limits = result[link]
+
+        # completion rate in the second half close to the bandwidth, limit close to the saturation point
+        self.assertGreater(completed / 2000., 0.85 * sim.bandwidth)
+        self.assertGreater(time_average(limits, 2000.), 0.75 * sim.saturation)
+        self.assertLess(time_average(limits, 2000.), 1.25 * sim.saturation)
+
+    def test_congestion(self):
+        link = ('T1_A', 'T2_B')
+        # transfers time out at concurrency above ~30
+        sim = SimLink(bandwidth = 5., saturation = 20, overload = 1., timeout = 10.)
+
+        result = simulate(make_controller(initial = 80), {link: sim}, 2000.)
+        completed, limits = result[link]
+
+        self.assertLess(time_average(limits, 1000.), 30)
+        self.assertGreater(completed / 1000., 0.7 * sim.bandwidth)
+
+    def test_caps(self):
+        links = {
+            ('T1_A', 'T2_B'): SimLink(5., 20),
+            ('T1_A', 'T2_C'): SimLink(5., 20),
+            ('T2_D', 'T2_C'): SimLink(5., 20)
+        }
+
+        def check(controller):
+            active = dict((link, sim.active) for link, sim in links.iteritems())
+            self.assertLessEqual(sum(active.values()), 40)
+            # T2_C has a specific cap
+            self.assertLessEqual(active[('T1_A', 'T2_C')] + active[('T2_D', 'T2_C')], 10)
+            self.assertLessEqual(active[('T1_A', 'T2_B')] + active[('T1_A', 'T2_C')], 25)
+
+        controller = make_controller(max_total = 40, max_per_site = 25, site_caps = {'T2_C': 10})
+        result = simulate(controller, links, 1000., check = check)
+
+        self.assertTrue(all(completed > 0 for completed, _ in result.itervalues()))
+
+    def test_waiter(self):
+        controller = make_controller(initial = 1)
+        link = ('T1_A', 'T2_B')
+        waiter = threading.Event()
+
+        self.assertTrue(controller.acquire(link, waiter))
+        self.assertFalse(controller.acquire(link, waiter))
+        self.assertFalse(waiter.is_set())
+
+        controller.release(link, 0)
+        self.assertTrue(waiter.is_set())
+        self.assertTrue(controller.acquire(link, waiter))
+
+
+## PoolManager with a dummy gfal2 module: each copy takes copy_time seconds and counts the concurrent copies
+gfal2 = types.ModuleType('gfal2')
+
+class Gfal2Context(object):
+    copy_time = 0.
+    running = None
+    peak = None
+
+    class transfer_parameters(object):
+        pass
+
+    @staticmethod
+    def filecopy(context, params, src_pfn, dest_pfn):
+        with Gfal2Context.running.get_lock():
+            Gfal2Context.running.value += 1
+            Gfal2Context.peak.value = max(Gfal2Context.peak.value, Gfal2Context.running.value)
+
+        time.sleep(Gfal2Context.copy_time)
+
+        with Gfal2Context.running.get_lock():
+            Gfal2Context.running.value -= 1
+
+gfal2.GError = type('GError', (Exception,), {})
+gfal2.Gfal2Context = Gfal2Context
+gfal2.creat_context = lambda: None
+gfal2.set_verbose = lambda level: None
+gfal2.verbose_level = types.ModuleType('verbose_level')
+gfal2.verbose_level.verbose = 0
+
+class TaskDB(object):
+    def __init__(self):
+        self.statuses = {}
+
+    def query(self, sql, *args):
+        return 1
+
+    def update_many(self, table, key, fields, rows):
+        for row in rows:
+            self.statuses[row[0]] = row[1]
+
+class TestControlledPool(unittest.TestCase):
+    def setUp(self):
+        sys.modules['gfal2'] = gfal2
+        from dynamo.fileop.daemon.manager import PoolManager
+        from dynamo.utils.signaling import SignalConverter
+
+        PoolManager.db = TaskDB()
+        PoolManager.stop_flag = threading.Event()
+        PoolManager.signal_converter = SignalConverter()
+        PoolManager.signal_converter.set(signal.SIGTERM)
+        PoolManager.signal_converter.set(signal.SIGHUP)
+        PoolManager.controller = make_controller(initial = 3, max_per_link = 3)
+
+        Gfal2Context.copy_time = 0.05
+        Gfal2Context.running = multiprocessing.Value('i', 0)
+        Gfal2Context.peak = multiprocessing.Value('i', 0)
+
+    def tearDown(self):
+        from dynamo.fileop.daemon.manager import PoolManager
+
+        PoolManager.signal_converter.unset(signal.SIGTERM)
+        PoolManager.signal_converter.unset(signal.SIGHUP)
+        PoolManager.controller = None
+        sys.modules.pop('gfal2')
+
+    def test_limit(self):
+        from dynamo.fileop.daemon.manager import PoolManager
+        from dynamo.fileop.daemon.transfer import TransferPoolManager
+
+        # pool has 8 processes but the controller allows 3 transfers on the link
+        manager = TransferPoolManager('T1_A', 'T2_B', 8, '')
+        params_config = {'transfer_nstreams': 1, 'transfer_timeout': 10, 'overwrite': True}
+        for tid in range(30):
+            manager.add_task(tid, 'src/%d' % tid, 'dest/%d' % tid, params_config)
+
+        while not manager.ready_for_recycle():
+            time.sleep(0.01)
+
+        self.assertEqual(Gfal2Context.peak.value, 3)
+        self.assertEqual([PoolManager.db.statuses[tid] for tid in range(30)], ['done'] * 30)
+        self.assertEqual(PoolManager.controller.snapshot()[0][3], 0)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        # four links of different capacity; transfers time out at 30 s
+        def make_links():
+            return {
+                ('T1_A', 'T2_B'): SimLink(2., 5, overload = 1., timeout = 30.),
+                ('T1_A', 'T2_C'): SimLink(5., 15, overload = 1., timeout = 30.),
+                ('T2_D', 'T2_C'): SimLink(10., 40, overload = 1., timeout = 30.),
+                ('T2_E', 'T2_B'): SimLink(1., 3, overload = 1., timeout = 30.)
+            }
+
+        for name, controller in [
+                ('fixed 10', make_controller(initial = 10, min_per_link = 10, max_per_link = 10)),
+                ('fixed 50', make_controller(initial = 50, min_per_link = 50, max_per_link = 50)),
+                ('AIMD', make_controller(initial = 10, max_per_link = 50))
+            ]:
+            links = make_links()
+            result = simulate(controller, links, 20000.)
+            print '%-8s' % name,
+            for link in sorted(links):
+                completed, limits = result[link]
+                print ' %s->%s %5.2f/%5.2f files/s (limit %4.1f, saturation %2d)' % (link[0], link[1], completed / 10000., links[link].bandwidth, time_average(limits, 10000.), links[link].saturation),
+            print ''
+    else:
+        unittest.main()
@@ -0,0 +1,351 @@
+#! /usr/bin/env python
+
+# Multi-server harness for ServerManager.send_updates. The master server and the update boards are replaced by
+# stand-ins backed by files in a temporary directory, and each peer server is a separate process that reads its
+# board, applies the updates, and sets itself back online. Run directly to print the convergence times.
+
+import os
+import sys
+import time
+import fcntl
+import marshal
+import shutil
+import tempfile
+import multiprocessing
+import unittest
+
+import dynamo.core.manager as manager_module
+from dynamo.core.manager import ServerManager
+from dynamo.core.components.host import ServerHost
+
+class FileMaster(object):
+    """
+    Stand-in for MasterServer. Server statuses are files <workdir>/status/<hostname>.
+    """
+
+    def __init__(self, workdir):
+        self.workdir = workdir
+        self._lock_file = None
+
+    def lock(self):
+        self._lock_file = open(self.workdir + '/lock', 'w')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+
+    def unlock(self):
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+        self._lock_file = None
+
+    def add_host(self, hostname, board_config):
+        with open('%s/board_config/%s' % (self.workdir, hostname), 'w') as out:
+            marshal.dump(board_config, out)
+
+        self.set_status(ServerHost.STAT_ONLINE, hostname)
+
+    def set_status(self, status, hostname):
+        path = '%s/status/%s' % (self.workdir, hostname)
+        with open(path + '.tmp', 'w') as out:
+            out.write(ServerHost.status_name(status))
+        os.rename(path + '.tmp', path)
+
+    def get_status(self, hostname):
+        with open('%s/status/%s' % (self.workdir, hostname)) as source:
+            return source.read()
+
+    def get_host_list(self):
+        return [(hostname, self.get_status(hostname), 0) for hostname in sorted(os.listdir(self.workdir + '/board_config'))]
+
+    def get_board_config(self, hostname):
+        with open('%s/board_config/%s' % (self.workdir, hostname)) as source:
+            return ('file', marshal.load(source))
+
+
+class FileBoard(object):
+    """
+    Stand-in for UpdateBoard. Commands are appended to a file under a file lock, one marshal record each.
+    Writing takes latency seconds; the first num_failures writes raise after writing half of the commands.
+    """
+
+    def __init__(self, config):
+        self.path = config['path']
+        self.latency = config.get('latency', 0.)
+        self.num_failures = config.get('num_failures', 0)
+        self._lock_file = None
+        self._lock_depth = 0
+
+    def lock(self):
+        if self._lock_depth == 0:
+            self._lock_file = open(self.path + '.lock', 'w')
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+
+        self._lock_depth += 1
+
+    def unlock(self):
+        self._lock_depth -= 1
+        if self._lock_depth == 0:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    def get_updates(self):
+        try:
+            with open(self.path, 'rb') as source:
+                while True:
+                    try:
+                        yield marshal.load(source)
+                    except EOFError:
+                        break
+        except IOError:
+            pass
+
+    def flush(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def write_updates(self, update_commands):
+        time.sleep(self.latency)
+
+        self.lock()
+        try:
+            with open(self.path, 'ab') as out:
+                if self.num_failures > 0:
+                    self.num_failures -= 1
+                    for command in update_commands[:len(update_commands) / 2]:
+                        marshal.dump(command, out)
+                    raise RuntimeError('Board write failed')
+
+                for command in update_commands:
+                    marshal.dump(command, out)
+        finally:
+            self.unlock()
+
+
+class FileUpdateBoard(object):
+    @staticmethod
+    def get_instance(module, config):
+        return FileBoard(config)
+
+
+def run_peer(workdir, hostname, apply_time):
+    """
+    Body of a stand-in peer server process: wait for updates on the board, apply them, report back as online.
+    """
+    master = FileMaster(workdir)
+    board = FileBoard({'path': '%s/board/%s' % (workdir, hostname)})
+
+    while True:
+        if not os.path.exists(board.path):
+            time.sleep(0.01)
+            continue
+
+        board.lock()
+        try:
+            update_commands = list(board.get_updates())
+            board.flush()
+        finally:
+            board.unlock()
+
+        if len(update_commands) == 0:
+            # as in the server, an empty board is not an update
+            continue
+
+        time.sleep(apply_time * len(update_commands))
+
+        with open('%s/applied/%s' % (workdir, hostname), 'a') as out:
+            out.write('%d\n' % len(update_commands))
+
+        master.lock()
+        try:
+            master.set_status(ServerHost.STAT_ONLINE, hostname)
+        finally:
+            master.unlock()
+
+
+class MultiServer(object):
+    def __init__(self):
+        self.workdir = tempfile.mkdtemp(prefix = 'dynamo_fanout_')
+        for subdir in ['status', 'board_config', 'board', 'applied']:
+            os.mkdir(self.workdir + '/' + subdir)
+
+        self.master = FileMaster(self.workdir)
+        self.peers = []
+
+    def add_peer(self, hostname, latency = 0., num_failures = 0, apply_time = 0., run = True):
+        self.master.add_host(hostname, {'path': '%s/board/%s' % (self.workdir, hostname), 'latency': latency, 'num_failures': num_failures})
+
+        if run:
+            proc = multiprocessing.Process(target = run_peer, args = (self.workdir, hostname, apply_time))
+            proc.daemon = True
+            proc.start()
+            self.peers.append(proc)
+
+    def make_manager(self, timeout = 600, retries = 2):
+        # ServerManager.__init__ connects to the master and starts the heartbeat thread
+        manager = object.__new__(ServerManager)
+        manager.master = self.master
+        manager.other_servers = {}
+        manager.hostname = 'writer'
+        manager.status = ServerHost.STAT_ONLINE
+        manager.update_send_timeout = timeout
+        manager.update_send_retries = retries
+        manager._abandoned_writes = {}
+        return manager
+
+    def applied(self, hostname):
+        try:
+            with open('%s/applied/%s' % (self.workdir, hostname)) as source:
+                return [int(line) for line in source]
+        except IOError:
+            return []
+
+    def status(self, hostname):
+        return ServerHost.status_val(self.master.get_status(hostname))
+
+    def close(self):
+        for proc in self.peers:
+            proc.terminate()
+            proc.join()
+
+        shutil.rmtree(self.workdir)
+
+
+def measure_convergence(num_peers, num_rounds = 2, latency = 0.05, apply_time = 0.):
+    """
+    Send num_rounds consecutive updates to num_peers peers and return the time until all peers are online
+    with all updates applied.
+    """
+    cluster = MultiServer()
+    try:
+        hostnames = ['peer%02d' % i for i in range(num_peers)]
+        for hostname in hostnames:
+            cluster.add_peer(hostname, latency = latency, apply_time = apply_time)
+
+        manager = cluster.make_manager()
+        update_commands = [(1, 'obj%d' % i) for i in range(100)]
+
+        start = time.time()
+        for _ in range(num_rounds):
+            manager.send_updates(update_commands)
+
+        while True:
+            if all(len(cluster.applied(h)) == num_rounds and cluster.status(h) == ServerHost.STAT_ONLINE for h in hostnames):
+                return time.time() - start
+
+            time.sleep(0.005)
+
+    finally:
+        cluster.close()
+
+
+class TestSendUpdates(unittest.TestCase):
+    def setUp(self):
+        self._board_class = manager_module.UpdateBoard
+        manager_module.UpdateBoard = FileUpdateBoard
+        self.cluster = MultiServer()
+
+    def tearDown(self):
+        self.cluster.close()
+        manager_module.UpdateBoard = self._board_class
+
+    def test_fanout(self):
+        hostnames = ['peer%d' % i for i in range(6)]
+        for hostname in hostnames:
+            self.cluster.add_peer(hostname, latency = 0.3, apply_time = 0.001)
+
+        manager = self.cluster.make_manager()
+
+        start = time.time()
+        manager.send_updates([(1, 'a')] * 50)
+        # second round has to wait for all peers to finish the first
+        manager.send_updates([(1, 'b')] * 20)
+        elapsed = time.time() - start
+
+        # sequential writes would take at least 12 x 0.3 s
+        self.assertLess(elapsed, 6 * 0.3)
+
+        for hostname in hostnames:
+            while self.cluster.status(hostname) != ServerHost.STAT_ONLINE:
+                time.sleep(0.01)
+
+            self.assertEqual(self.cluster.applied(hostname), [50, 20])
+
+    def test_retry(self):
+        self.cluster.add_peer('flaky', num_failures = 2)
+        self.cluster.add_peer('broken', num_failures = 3)
+        self.cluster.add_peer('down', run = False)
+        self.cluster.master.set_status(ServerHost.STAT_OUTOFSYNC, 'down')
+
+        manager = self.cluster.make_manager(retries = 2)
+        manager.send_updates([(1, 'a')])
+
+        while self.cluster.status('flaky') != ServerHost.STAT_ONLINE:
+            time.sleep(0.01)
+
+        self.assertEqual(self.cluster.applied('flaky'), [1])
+        self.assertEqual(self.cluster.status('broken'), ServerHost.STAT_OUTOFSYNC)
+        self.assertEqual(self.cluster.applied('broken'), [])
+        self.assertEqual(self.cluster.status('down'), ServerHost.STAT_OUTOFSYNC)
+        self.assertFalse(os.path.exists(self.cluster.workdir + '/board/down'))
+
+    def test_partial_write(self):
+        # the failed writes leave half of the commands on the board; no peer process, the board is read directly
+        self.cluster.add_peer('flaky', num_failures = 2, run = False)
+        board = FileBoard({'path': self.cluster.workdir + '/board/flaky'})
+
+        update_commands = [(1, 'obj%d' % i) for i in range(10)]
+
+        manager = self.cluster.make_manager(retries = 2)
+        manager.send_updates(update_commands)
+
+        self.assertEqual(self.cluster.status('flaky'), ServerHost.STAT_UPDATING)
+        self.assertEqual(list(board.get_updates()), update_commands)
+
+    def test_abandoned_write(self):
+        # no peer process; the board content is read directly
+        self.cluster.add_peer('slow', latency = 1., run = False)
+        board = FileBoard({'path': self.cluster.workdir + '/board/slow'})
+
+        manager = self.cluster.make_manager(timeout = 0.2)
+        manager.send_updates([(1, 'a')])
+        self.assertEqual(self.cluster.status('slow'), ServerHost.STAT_OUTOFSYNC)
+
+        # the server resynchronizes while the first write is still running
+        self.cluster.master.set_status(ServerHost.STAT_ONLINE, 'slow')
+        manager.send_updates([(1, 'b')])
+        self.assertEqual(self.cluster.status('slow'), ServerHost.STAT_OUTOFSYNC)
+
+        # the first write lands after the timeout
+        time.sleep(1.)
+        self.assertEqual(list(board.get_updates()), [(1, 'a')])
+
+        # next write replaces the stale content, through a new board handle
+        self.cluster.master.set_status(ServerHost.STAT_ONLINE, 'slow')
+        manager.update_send_timeout = 10.
+        manager.send_updates([(1, 'c')])
+        self.assertEqual(self.cluster.status('slow'), ServerHost.STAT_UPDATING)
+        self.assertEqual(list(board.get_updates()), [(1, 'c')])
+
+    def test_timeout(self):
+        self.cluster.add_peer('fast')
+        self.cluster.add_peer('slow', latency = 5.)
+
+        manager = self.cluster.make_manager(timeout = 0.5)
+
+        start = time.time()
+        manager.send_updates([(1, 'a')])
+        self.assertLess(time.time() - start, 2.)
+
+        self.assertEqual(self.cluster.status('slow'), ServerHost.STAT_OUTOFSYNC)
+
+        while self.cluster.status('fast') != ServerHost.STAT_ONLINE:
+            time.sleep(0.01)
+
+        self.assertEqual(self.cluster.applied('fast'), [1])
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        manager_module.UpdateBoard = FileUpdateBoard
+        for num_peers in [1, 4, 16]:
+            print '%2d peers: %.2f s' % (num_peers, measure_convergence(num_peers))
+    else:
+        unittest.main()
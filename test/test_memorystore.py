@@ -0,0 +1,142 @@
+#! /usr/bin/env python
+
+# MemoryInventoryStore on the synthetic inventories of the benchmarks package: generator determinism, round trip
+# through DynamoInventory.load, object-level saves and deletions, and a short run of the benchmark scenarios. Run
+# with the argument "benchmark" to run the benchmark suite (arguments after it are passed to benchmarks.run).
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+# benchmarks package at the top of the source tree
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dynamo.core.inventory import DynamoInventory
+from dynamo.dataformat import Configuration, Block, File, BlockReplica
+
+from benchmarks.generator import generate, make_store, write_partition_def
+from benchmarks.scenarios import SCENARIOS, BenchmarkContext
+
+PARAMETERS = {'num_sites': 6, 'num_datasets': 60, 'blocks_per_dataset': (1, 4), 'files_per_block': (1, 6)}
+
+class TestMemoryStore(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.partition_def_path = os.path.join(self.workdir, 'partitions.txt')
+        write_partition_def(self.partition_def_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def load(self, store):
+        snapshot = os.path.join(self.workdir, 'inventory.pkl')
+        store.write_snapshot(snapshot)
+
+        store_config = Configuration(module = 'memorystore:MemoryInventoryStore', config = Configuration(snapshot = snapshot))
+        inventory = DynamoInventory(Configuration(persistency = store_config, partition_def_path = self.partition_def_path))
+        inventory.load()
+        return inventory
+
+    def test_generator(self):
+        store = make_store(generate(seed = 3, **PARAMETERS))
+        self.assertEqual(store.version(), make_store(generate(seed = 3, **PARAMETERS)).version())
+        self.assertNotEqual(store.version(), make_store(generate(seed = 4, **PARAMETERS)).version())
+
+        inventory = generate(seed = 3, **PARAMETERS)
+        self.assertEqual(len(inventory.sites), 6)
+        self.assertEqual(len(inventory.datasets), 60)
+
+        block_replicas = [br for d in inventory.datasets.itervalues() for r in d.replicas for br in r.block_replicas]
+        self.assertTrue(any(not br.is_complete() for br in block_replicas))
+        self.assertTrue(any(not r.is_full() for d in inventory.datasets.itervalues() for r in d.replicas))
+
+    def test_round_trip(self):
+        store = make_store(generate(seed = 5, **PARAMETERS))
+        inventory = self.load(store)
+
+        self.assertEqual(make_store(inventory).version(), store.version())
+
+        # partition content is rebuilt at load
+        physics = inventory.partitions['Physics']
+        for site in inventory.sites.itervalues():
+            for replica, block_replicas in site.partitions[physics].replicas.iteritems():
+                if block_replicas is None:
+                    block_replicas = replica.block_replicas
+                self.assertTrue(all(br.group.name in ('AnalysisOps', 'DataOps', 'Junk') for br in block_replicas))
+
+        # files are read from the store
+        dataset = sorted(inventory.datasets.itervalues(), key = lambda d: d.name)[0]
+        block = min(dataset.blocks, key = lambda b: b.id)
+        lfile = min(block.files, key = lambda f: f.id)
+        self.assertEqual(inventory.find_file(lfile.lfn).id, lfile.id)
+        self.assertIsNone(inventory.find_file('/store/none.root'))
+
+    def test_save_delete(self):
+        store = make_store(generate(seed = 7, **PARAMETERS))
+        inventory = self.load(store)
+        store = inventory._store
+
+        dataset = sorted(inventory.datasets.itervalues(), key = lambda d: d.name)[0]
+        replica = sorted(dataset.replicas, key = lambda r: r.site.name)[0]
+
+        # new block with one file
+        block = Block(Block.to_internal_name('ffffffff-0000-0000-0000-000000000000'), dataset, size = 10, num_files = 1)
+        store.save_block(block)
+        self.assertNotEqual(block.id, 0)
+        self.assertEqual(store.find_block_containing('/store/new.root'), None)
+
+        lfile = File('/store/new.root', block = block, size = 10)
+        store.save_file(lfile)
+        self.assertEqual(store.find_block_containing('/store/new.root'), (dataset.name, block.name))
+        self.assertEqual(set(f.lfn for f in store.get_files(block)), set(['/store/new.root']))
+
+        block_replica = BlockReplica(block, replica.site, next(iter(replica.block_replicas)).group, size = 0)
+        store.save_blockreplica(block_replica)
+        self.assertIn((block.id, replica.site.id), store._db.block_replicas)
+
+        store.delete_file(lfile)
+        self.assertIsNone(store.get_file_id('/store/new.root'))
+
+        store.delete_block(block)
+        self.assertNotIn((block.id, replica.site.id), store._db.block_replicas)
+        self.assertNotIn(block.id, store._db.blocks)
+
+        # deleting all block replicas at a site removes the dataset replica
+        for br in list(replica.block_replicas):
+            store.delete_blockreplica(br)
+        self.assertNotIn((dataset.id, replica.site.id), store._db.dataset_replicas)
+
+        store.delete_dataset(dataset)
+        self.assertIsNone(store._db.ids['datasets'].get(dataset.name))
+        self.assertFalse(any(key[0] in [b.id for b in dataset.blocks] for key in store._db.block_replicas))
+
+        site = sorted(inventory.sites.itervalues(), key = lambda s: s.name)[-1]
+        store.delete_site(site)
+        self.assertNotIn(site.name, store.get_site_names())
+        self.assertFalse(any(key[1] == site.id for key in store._db.block_replicas))
+        self.assertFalse(any(key[0] == site.id for key in store._db.quotas))
+
+        # handles share the tables
+        self.assertEqual(store.new_handle().version(), store.version())
+
+
+class TestScenarios(unittest.TestCase):
+    def test_run(self):
+        workdir = tempfile.mkdtemp()
+        try:
+            context = BenchmarkContext(workdir, make_store(generate(seed = 1, **PARAMETERS)))
+            for name, scenario in SCENARIOS.iteritems():
+                metrics = scenario(context, 1)
+                self.assertGreater(metrics['seconds'], 0., name)
+        finally:
+            shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        from benchmarks.run import main
+        sys.exit(main(sys.argv[2:]))
+    else:
+        unittest.main()
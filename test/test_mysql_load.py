@@ -0,0 +1,268 @@
+#! /usr/bin/env python
+
+# LOAD DATA path of the MySQL interface. TestTSVEscape and TestWarnings run without a server. TestLoadData and
+# TestLoadDataThroughput run against a mysqld started on a temporary data directory (see local_mysqld) and are
+# skipped if mysqld is not installed.
+
+import time
+import unittest
+
+import MySQLdb
+
+from dynamo.utils.interface.mysql import MySQL
+
+import local_mysqld
+
+def server_db_params():
+    db_params = local_mysqld.db_params()
+    # LOAD DATA is off by default
+    db_params['load_data_threshold'] = 100
+    return db_params
+
+def tsv_unescape(field):
+    # What LOAD DATA does with a field written by MySQL.tsv_escape
+    if field == '\\N':
+        return None
+
+    special = {'0': '\0', 't': '\t', 'n': '\n', 'r': '\r', '\\': '\\'}
+
+    result = ''
+    itr = iter(field)
+    for char in itr:
+        if char == '\\':
+            result += special[itr.next()]
+        else:
+            result += char
+
+    return result
+
+class TestTSVEscape(unittest.TestCase):
+    def test_null(self):
+        self.assertEqual(MySQL.tsv_escape(None), '\\N')
+        # strings that look like NULL are not NULL
+        self.assertEqual(tsv_unescape(MySQL.tsv_escape('\\N')), '\\N')
+        self.assertEqual(tsv_unescape(MySQL.tsv_escape('NULL')), 'NULL')
+        self.assertEqual(tsv_unescape(MySQL.tsv_escape('')), '')
+
+    def test_binary(self):
+        data = ''.join(chr(i) for i in range(256)) * 2
+        escaped = MySQL.tsv_escape(data)
+
+        self.assertNotIn('\t', escaped)
+        self.assertNotIn('\n', escaped)
+        self.assertEqual(tsv_unescape(escaped), data)
+
+    def test_unicode(self):
+        text = u'caf\xe9\t\u65e5\u672c\n\U0001f600\\'
+        self.assertEqual(tsv_unescape(MySQL.tsv_escape(text)).decode('utf-8'), text)
+
+    def test_numbers(self):
+        self.assertEqual(MySQL.tsv_escape(True), '1')
+        self.assertEqual(MySQL.tsv_escape(12345678901234L), '12345678901234')
+        self.assertEqual(float(MySQL.tsv_escape(0.1 + 0.2)), 0.1 + 0.2)
+
+
+class ScriptedCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 0
+        self._result = []
+
+    def execute(self, sql):
+        self.connection.executed.append(sql)
+        if sql.startswith('SHOW WARNINGS'):
+            self._result = self.connection.warnings
+        elif sql == 'SELECT @@SESSION.sql_mode':
+            self._result = [(self.connection.sql_mode,)]
+        else:
+            self._result = []
+            self.rowcount = 1
+
+    def fetchall(self):
+        return self._result
+
+    def close(self):
+        pass
+
+class ScriptedConnection(object):
+    """
+    Stand-in for a MySQLdb connection returning the given warnings after every statement.
+    """
+
+    def __init__(self, warnings, sql_mode):
+        self.warnings = warnings
+        self.sql_mode = sql_mode
+        self.executed = []
+        self.rolled_back = False
+
+    def cursor(self):
+        return ScriptedCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.rolled_back = True
+
+class TestWarnings(unittest.TestCase):
+    """
+    Warnings of LOAD DATA fail the load where INSERT would fail.
+    """
+
+    duplicate = ('Warning', 1062, "Duplicate entry 'null' for key 'name'")
+    truncated = ('Warning', 1366, "Incorrect integer value: 'x' for column 'value' at row 1")
+    note = ('Note', 1051, "Unknown table 'load_test_load'")
+
+    def execute(self, warnings, sql_mode):
+        db = MySQL({'host': 'localhost', 'db': 'dynamo', 'user': 'dynamo'})
+        db._connection = ScriptedConnection(warnings, sql_mode)
+        return db._execute_sequence(['LOAD DATA', 'SELECT 1'], check_warnings = [0])
+
+    def test_duplicate(self):
+        # INSERT fails on duplicate keys in any SQL mode
+        for sql_mode in ['', 'STRICT_TRANS_TABLES']:
+            self.assertRaises(RuntimeError, self.execute, [self.duplicate], sql_mode)
+
+    def test_invalid_value(self):
+        # INSERT stores invalid values with a warning unless in strict mode
+        self.assertEqual(self.execute([self.truncated, self.note], 'NO_ENGINE_SUBSTITUTION'), [1, 1])
+        self.assertRaises(RuntimeError, self.execute, [self.truncated], 'STRICT_ALL_TABLES,NO_ENGINE_SUBSTITUTION')
+
+    def test_note(self):
+        self.assertEqual(self.execute([self.note], 'STRICT_TRANS_TABLES'), [1, 1])
+
+
+class TestLoadData(unittest.TestCase):
+    def setUp(self):
+        db_params = server_db_params()
+        self.db = MySQL(db_params)
+        self.db.query('DROP TABLE IF EXISTS `load_test`')
+        self.db.query('CREATE TABLE `load_test` (`id` INT NOT NULL AUTO_INCREMENT PRIMARY KEY, `name` VARCHAR(64) NOT NULL, `data` VARBINARY(600) NULL, `text` VARCHAR(64) CHARACTER SET utf8mb4 NULL, `value` INT NULL, UNIQUE KEY `name` (`name`)) DEFAULT CHARSET=latin1')
+
+        self.rows = [
+            ('null', None, None, None),
+            ('binary', ''.join(chr(i) for i in range(256)), None, 0),
+            ('unicode', None, u'caf\xe9 \u65e5\u672c \U0001f600', -1),
+            ('special', '\\N\t\n\r\\', 'NULL', 2 ** 31 - 1)
+        ]
+
+    def tearDown(self):
+        self.db.query('DROP TABLE `load_test`')
+
+    def _content(self):
+        # read text as bytes to be independent of the connection character set
+        return self.db.query('SELECT `name`, `data`, CAST(`text` AS BINARY), `value` FROM `load_test` ORDER BY `id`')
+
+    def test_load(self):
+        fields = ('name', 'data', 'text', 'value')
+
+        self.assertEqual(self.db.load_many('load_test', fields, None, self.rows, do_update = False), len(self.rows))
+
+        expected = []
+        for name, data, text, value in self.rows:
+            if type(text) is unicode:
+                text = text.encode('utf-8')
+            expected.append((name, data, text, value))
+
+        self.assertEqual(self._content(), expected)
+
+    def test_update(self):
+        fields = ('name', 'data', 'text', 'value')
+
+        self.db.load_many('load_test', fields, None, self.rows)
+        ids = dict(self.db.xquery('SELECT `name`, `id` FROM `load_test`'))
+
+        updated = [(name, data, text, 7) for name, data, text, _ in self.rows]
+        # last row wins
+        updated.append(('null', None, None, 8))
+
+        self.db.load_many('load_test', fields, None, updated, update_columns = ('value',))
+
+        self.assertEqual(dict(self.db.xquery('SELECT `name`, `id` FROM `load_test`')), ids)
+        self.assertEqual(dict(self.db.xquery('SELECT `name`, `value` FROM `load_test`')), {'null': 8, 'binary': 7, 'unicode': 7, 'special': 7})
+
+    def test_new_rows(self):
+        fields = ('id', 'name', 'data', 'text', 'value')
+
+        self.db.load_many('load_test', fields, None, [(i + 1,) + row for i, row in enumerate(self.rows)])
+        before = self.db.query('SELECT `id`, `name`, `value` FROM `load_test` ORDER BY `id`')
+
+        # rows with id 0 are new and must not take the ids of the existing rows
+        new_rows = [(0, 'new%d' % i, None, None, i) for i in range(len(self.rows))]
+        self.assertEqual(self.db.load_many('load_test', fields, None, new_rows), len(new_rows))
+
+        after = self.db.query('SELECT `id`, `name`, `value` FROM `load_test` ORDER BY `id`')
+        self.assertEqual(after[:len(before)], before)
+        self.assertEqual([row[1:] for row in after[len(before):]], [(name, value) for _, name, _, _, value in new_rows])
+        self.assertTrue(all(row[0] > len(self.rows) for row in after[len(before):]))
+
+    def test_rejected(self):
+        fields = ('name', 'data', 'text', 'value')
+
+        self.db.load_many('load_test', fields, None, self.rows[:1], do_update = False)
+
+        # duplicate key: LOAD DATA LOCAL would skip the row with a warning. The table is MyISAM-like in the worst
+        # case, so only the failure itself is checked, not the content.
+        rows = [('other', None, None, 1), self.rows[0]]
+        self.assertRaises(RuntimeError, self.db.load_many, 'load_test', fields, None, rows, do_update = False)
+        self.assertRaises(MySQLdb.Error, self.insert, rows)
+
+        # invalid value: fails in both paths only in strict mode
+        self.db.query('DELETE FROM `load_test` WHERE `name` != \'null\'')
+        rows = [('invalid', None, None, 'not a number')]
+        if 'STRICT_' in self.db.query('SELECT @@SESSION.sql_mode')[0]:
+            self.assertRaises(RuntimeError, self.db.load_many, 'load_test', fields, None, rows)
+            self.assertRaises(MySQLdb.Error, self.insert, rows)
+        else:
+            self.assertEqual(self.db.load_many('load_test', fields, None, rows), 1)
+            self.assertEqual(self.insert(rows), 2)
+
+    def insert(self, rows):
+        # same rows through the INSERT path of insert_many
+        self.db.load_data_threshold = 0
+        try:
+            return self.db.insert_many('load_test', ('name', 'data', 'text', 'value'), None, rows, do_update = False)
+        finally:
+            self.db.load_data_threshold = 100
+
+    def test_auto_select(self):
+        # generator input crossing the threshold
+        rows = (('row%d' % i, None, None, i) for i in xrange(150))
+        self.assertEqual(self.db.insert_many('load_test', ('name', 'data', 'text', 'value'), None, rows, do_update = False), 150)
+        self.assertEqual(self.db.query('SELECT COUNT(*) FROM `load_test`')[0], 150)
+
+
+class TestLoadDataThroughput(unittest.TestCase):
+    """
+    Compare the INSERT and LOAD DATA paths of insert_many. Prints rows per second of each.
+    """
+
+    num_rows = 500000
+
+    def setUp(self):
+        db_params = server_db_params()
+        self.db = MySQL(db_params)
+        self.db.query('DROP TABLE IF EXISTS `load_bench`')
+        self.db.query('CREATE TABLE `load_bench` (`id` INT NOT NULL PRIMARY KEY, `name` VARCHAR(512) NOT NULL, `size` BIGINT NOT NULL) DEFAULT CHARSET=latin1')
+
+    def tearDown(self):
+        self.db.query('DROP TABLE `load_bench`')
+
+    def test_throughput(self):
+        rows = [(i, '/store/data/Run2018A/SingleMuon/AOD/17Sep2018-v1/%08d/file.root' % i, i * 1000) for i in xrange(self.num_rows)]
+
+        for method, threshold in [('INSERT', 0), ('LOAD DATA', 1)]:
+            self.db.query('TRUNCATE TABLE `load_bench`')
+            self.db.load_data_threshold = threshold
+
+            start = time.time()
+            self.db.insert_many('load_bench', ('id', 'name', 'size'), None, rows)
+            elapsed = time.time() - start
+
+            self.assertEqual(self.db.query('SELECT COUNT(*) FROM `load_bench`')[0], self.num_rows)
+
+            print '\n%s: %d rows in %.1f s (%.0f rows/s)' % (method, self.num_rows, elapsed, self.num_rows / elapsed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+#! /usr/bin/env python
+
+# Connection pool of the MySQL interface. TestPoolKey runs without a server. TestConnectionPool runs against a
+# mysqld started on a temporary data directory (see local_mysqld) and is skipped if mysqld is not installed.
+
+import os
+import time
+import threading
+import unittest
+
+from dynamo.utils.interface.mysql import MySQL, ConnectionPool
+
+import local_mysqld
+
+class TestPoolKey(unittest.TestCase):
+    def test_parameters(self):
+        params = {'host': 'db.example.org', 'db': 'dynamo', 'user': 'dynamo', 'passwd': 'secret'}
+        key = ConnectionPool._key(params)
+
+        self.assertEqual(ConnectionPool._key(dict(params)), key)
+
+        for name, value in [('port', 3307), ('unix_socket', '/tmp/mysql.sock'), ('passwd', 'other'), ('charset', 'utf8mb4'), ('local_infile', 1)]:
+            other = dict(params)
+            other[name] = value
+            self.assertNotEqual(ConnectionPool._key(other), key, name)
+
+    def test_instances(self):
+        config = {'host': 'db.example.org', 'db': 'dynamo', 'user': 'dynamo', 'reuse_connection': False}
+        key = lambda db: ConnectionPool._key(db._connection_parameters)
+
+        # LOAD DATA sets local_infile per instance
+        self.assertNotEqual(key(MySQL(dict(config, load_data_threshold = 0))), key(MySQL(dict(config, load_data_threshold = 100))))
+        self.assertEqual(key(MySQL(config)), key(MySQL(config)))
+
+    def test_no_instance_lock(self):
+        # pooled instances do not serialize on the instance lock
+        db = MySQL({'host': 'db.example.org', 'db': 'dynamo', 'user': 'dynamo', 'reuse_connection': False})
+        db.query = lambda sql, *args, **kwd: [] if sql.startswith('SELECT') else 1
+
+        results = []
+        def run():
+            results.append(db.insert_get_id('test', columns = ('value',), values = (1,)))
+            results.append(db.select_many('test', ('value',), 'id', MySQL.bare('(1, 2)')))
+
+        db._connection_lock.acquire()
+        try:
+            thread = threading.Thread(target = run)
+            thread.daemon = True
+            thread.start()
+            thread.join(5.)
+        finally:
+            db._connection_lock.release()
+
+        self.assertEqual(results, [0, []])
+
+    def test_label(self):
+        params = {'host': 'db.example.org', 'db': 'dynamo', 'user': 'dynamo', 'passwd': 'secret'}
+        self.assertEqual(ConnectionPool._label(params), 'dynamo@db.example.org/dynamo')
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        # Use a private pool so that the limits do not affect other users in the process
+        self.orig_pool = MySQL._pool
+        MySQL._pool = ConnectionPool(max_size = 3, lease_timeout = 10.)
+
+        db_params = local_mysqld.db_params()
+        db_params['reuse_connection'] = False
+        self.db = MySQL(db_params)
+
+    def tearDown(self):
+        MySQL._pool = self.orig_pool
+
+    def _run_threads(self, target, num_threads):
+        errors = []
+        def run():
+            try:
+                target()
+            except Exception as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target = run) for _ in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return errors
+
+    def test_reuse(self):
+        for _ in range(10):
+            self.assertEqual(self.db.query('SELECT 1'), [1])
+
+        stats = MySQL.pool_stats()
+        self.assertEqual(stats['leases'], 10)
+        self.assertEqual(sum(stats['open'].values()), 1)
+
+    def test_concurrent(self):
+        def sleep():
+            self.db.query('SELECT SLEEP(0.5)')
+
+        errors = self._run_threads(sleep, 9)
+        self.assertEqual(errors, [])
+
+        stats = MySQL.pool_stats()
+        # never more than max_size connections
+        self.assertEqual(sum(stats['open'].values()), 3)
+        # 9 SLEEPs on 3 connections: some threads had to wait for at least one round
+        self.assertGreater(stats['waits'], 0)
+        self.assertGreaterEqual(stats['max_wait'], 0.4)
+
+    def test_timeout(self):
+        MySQL._pool.max_size = 1
+        MySQL._pool.lease_timeout = 0.2
+
+        errors = self._run_threads(lambda: self.db.query('SELECT SLEEP(1)'), 2)
+
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(type(errors[0]), RuntimeError)
+
+    def test_health_check(self):
+        # idle connections are pinged before every lease
+        MySQL._pool.check_interval = 0.
+
+        connection_id = self.db.query('SELECT CONNECTION_ID()')[0]
+
+        # the server closes the idle connection
+        admin = MySQL(local_mysqld.db_params())
+        admin.query('KILL %d' % connection_id)
+        admin.close()
+        time.sleep(0.1)
+
+        self.assertNotEqual(self.db.query('SELECT CONNECTION_ID()')[0], connection_id)
+        self.assertEqual(sum(MySQL.pool_stats()['open'].values()), 1)
+
+    def test_fork(self):
+        connection_id = self.db.query('SELECT CONNECTION_ID()')[0]
+
+        pid = os.fork()
+        if pid == 0:
+            # the child opens its own connection and leaves the inherited one alone
+            try:
+                child_id = self.db.query('SELECT CONNECTION_ID()')[0]
+                code = 0 if child_id != connection_id else 1
+            except:
+                code = 2
+
+            os._exit(code)
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+
+        # the connection of the parent is intact
+        self.assertEqual(self.db.query('SELECT CONNECTION_ID()')[0], connection_id)
+
+    def test_abandoned_xquery(self):
+        # stop iterating midway; the connection with unread rows must not go back to the pool
+        for row in self.db.xquery('SELECT 1 UNION SELECT 2'):
+            break
+
+        self.assertEqual(sum(MySQL.pool_stats()['open'].values()), 0)
+        self.assertEqual(self.db.query('SELECT 3'), [3])
+
+    def test_last_insert_id(self):
+        self.db.query('CREATE TABLE IF NOT EXISTS `pool_test` (`id` INT NOT NULL AUTO_INCREMENT PRIMARY KEY, `thread` INT NOT NULL)')
+        try:
+            results = {}
+            def insert():
+                tid = threading.current_thread().ident % 1000000
+                for _ in range(5):
+                    self.db.query('INSERT INTO `pool_test` (`thread`) VALUES (%s)', tid)
+                    results[self.db.last_insert_id] = tid
+                    time.sleep(0.01)
+
+            errors = self._run_threads(insert, 3)
+            self.assertEqual(errors, [])
+
+            for row_id, tid in self.db.xquery('SELECT `id`, `thread` FROM `pool_test`'):
+                self.assertEqual(results[row_id], tid)
+        finally:
+            self.db.query('DROP TABLE `pool_test`')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+
+# utils.parallel.Map in thread and process modes. Run with the argument "benchmark" to compare the modes on a
+# CPU-bound and an I/O-bound function.
+
+import sys
+import os
+import time
+import unittest
+
+from dynamo.dataformat import Configuration
+from dynamo.utils.parallel import Map
+
+def cpu_work(n):
+    total = 0
+    for i in xrange(n):
+        total += i * i % 7
+    return total
+
+def io_work(seconds):
+    time.sleep(seconds)
+    return seconds
+
+class TestMap(unittest.TestCase):
+    def setUp(self):
+        self.parallelizer = Map(Configuration(num_threads = 4))
+        self.parallelizer.repeat_on_exception = False
+
+    def test_outputs(self):
+        arguments = range(100)
+        for processes in [False, True]:
+            outputs = self.parallelizer.execute(lambda x: x * 2, arguments, processes = processes)
+            self.assertEqual(sorted(outputs), [x * 2 for x in arguments])
+
+        # tuples are unpacked
+        outputs = self.parallelizer.execute(lambda x, y: x + y, [(i, 1) for i in range(10)], processes = True)
+        self.assertEqual(sorted(outputs), range(1, 11))
+
+    def test_shared_memory(self):
+        # the workers read the inventory of the parent without it being sent
+        inventory = dict(('/store/%d' % i, i) for i in xrange(100000))
+        outputs = self.parallelizer.execute(lambda key: (os.getpid(), inventory[key]), inventory.keys()[:1000], processes = True)
+
+        self.assertEqual(sorted(value for _, value in outputs), sorted(inventory.values()[:1000]))
+        self.assertNotIn(os.getpid(), set(pid for pid, _ in outputs))
+
+    def test_streaming(self):
+        self.parallelizer.chunk_size = 1
+        outputs = self.parallelizer.execute(io_work, [0.01] * 20, async = True, processes = True)
+        self.assertFalse(isinstance(outputs, list))
+        self.assertEqual(list(outputs), [0.01] * 20)
+
+    def test_exception(self):
+        def fail(x):
+            if x == 13:
+                raise ValueError('bad input')
+            return x
+
+        self.assertRaises(RuntimeError, self.parallelizer.execute, fail, range(20), processes = True)
+
+        # with repeat, the exception of the function is raised in the caller
+        self.parallelizer.repeat_on_exception = True
+        self.assertRaises(ValueError, self.parallelizer.execute, fail, range(20), processes = True)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        num_threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+        parallelizer = Map(Configuration(num_threads = num_threads))
+        print 'Map with %d threads or processes (%d CPUs)' % (parallelizer.num_threads, os.sysconf('SC_NPROCESSORS_ONLN'))
+
+        for name, function, arguments in [('cpu', cpu_work, [200000] * 64), ('io', io_work, [0.05] * 64)]:
+            start = time.time()
+            for args in arguments:
+                function(args)
+            serial = time.time() - start
+
+            start = time.time()
+            parallelizer.execute(function, arguments)
+            threads = time.time() - start
+
+            start = time.time()
+            parallelizer.execute(function, arguments, processes = True)
+            processes = time.time() - start
+
+            print '%-4s  serial %5.2f s  threads %5.2f s  processes %5.2f s' % (name, serial, threads, processes)
+    else:
+        unittest.main()
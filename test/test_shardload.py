@@ -0,0 +1,164 @@
+#! /usr/bin/env python
+
+import random
+import unittest
+
+from dynamo.core.inventory import ObjectRepository
+from dynamo.core.components.shardload import ShardWriter, assemble_shard, load_shards, pack_file_ids
+from dynamo.dataformat import Group, Site, Dataset, Block, DatasetReplica, BlockReplica
+
+def make_inventory(seed, num_datasets = 200, num_sites = 6):
+    rng = random.Random(seed)
+
+    inventory = ObjectRepository()
+    for name in ['AnalysisOps', 'DataOps']:
+        inventory.groups.add(Group(name, gid = len(inventory.groups)))
+
+    sites = []
+    for isite in range(num_sites):
+        site = Site('T2_XX_Site%d' % isite, sid = isite + 1)
+        inventory.sites.add(site)
+        sites.append(site)
+
+    groups = [g for g in inventory.groups.itervalues() if g.name is not None]
+
+    fid = 1
+    bid = 1
+    first_file_ids = {}
+    for idataset in range(num_datasets):
+        dataset = Dataset('/Primary%d/Processed-v1/AOD' % idataset, status = Dataset.STAT_VALID, did = idataset + 1)
+        dataset.software_version = ('CMSSW_9_4_%d' % (idataset % 3),)
+        inventory.datasets.add(dataset)
+
+        for iblock in range(rng.randint(0, 5)):
+            block = Block(Block.to_internal_name('%08x-0000-0000-0000-%012x' % (idataset, iblock)), dataset, size = 100, num_files = 10, last_update = 1500000000 + iblock, bid = bid)
+            bid += 1
+            first_file_ids[block] = fid
+            fid += 10
+            dataset.blocks.add(block)
+
+        for site in rng.sample(sites, rng.randint(0, 3)):
+            growing = rng.random() < 0.3
+            dataset_replica = DatasetReplica(dataset, site, growing = growing, group = (groups[0] if growing else None))
+            dataset.replicas.add(dataset_replica)
+
+            for block in dataset.blocks:
+                if rng.random() < 0.2:
+                    continue
+
+                if rng.random() < 0.3:
+                    file_ids = [first_file_ids[block] + i for i in range(10) if rng.random() < 0.5]
+                    block_replica = BlockReplica(block, site, rng.choice(groups), size = 10 * len(file_ids), file_ids = file_ids, last_update = 10)
+                else:
+                    block_replica = BlockReplica(block, site, rng.choice(groups), is_custodial = True, last_update = 20)
+
+                dataset_replica.block_replicas.add(block_replica)
+                block.replicas.add(block_replica)
+
+            site.add_dataset_replica(dataset_replica, add_block_replicas = True)
+
+    return inventory
+
+def write_records(inventory, shard, writer):
+    # What MySQLInventoryStore._write_load_shard extracts from the database
+    datasets = sorted((d for d in inventory.datasets.itervalues() if d.id % shard[1] == shard[0]), key = lambda d: d.id)
+
+    for dataset in datasets:
+        writer.add(ShardWriter.DATASET, (dataset.id, dataset.name, dataset.status, dataset.data_type, dataset._software_version_id, dataset.last_update, int(dataset.is_open)))
+
+    for dataset in datasets:
+        for block in sorted(dataset.blocks, key = lambda b: b.id):
+            writer.add(ShardWriter.BLOCK, (block.id, dataset.id, block.real_name(), block.size, block.num_files, int(block.is_open), block.last_update))
+
+    for dataset in datasets:
+        for dataset_replica in sorted(dataset.replicas, key = lambda r: r.site.id):
+            block_replicas = []
+            for block_replica in sorted(dataset_replica.block_replicas, key = lambda r: r.block.id):
+                if block_replica.is_complete():
+                    size, file_ids = -1, None
+                else:
+                    size, file_ids = block_replica.size, pack_file_ids(block_replica.file_ids)
+
+                block_replicas.append((block_replica.block.id, block_replica.group.id, int(block_replica.is_custodial), block_replica.last_update, size, file_ids))
+
+            group_id = 0 if dataset_replica.group is None else dataset_replica.group.id
+            writer.add(ShardWriter.REPLICA, (dataset.id, dataset_replica.site.id, int(dataset_replica.growing), group_id, block_replicas))
+
+def copy_base(inventory):
+    copy = ObjectRepository()
+    id_group_map = {0: copy.groups[None]}
+    for group in inventory.groups.itervalues():
+        if group.name is not None:
+            clone = Group(group.name, olevel = group.olevel, gid = group.id)
+            copy.groups.add(clone)
+            id_group_map[group.id] = clone
+
+    id_site_map = {}
+    for site in inventory.sites.itervalues():
+        clone = Site(site.name, sid = site.id)
+        copy.sites.add(clone)
+        id_site_map[site.id] = clone
+
+    return copy, id_group_map, id_site_map
+
+class TestShardLoad(unittest.TestCase):
+    def check_identical(self, inventory, loaded):
+        self.assertEqual(sorted(inventory.datasets.iterkeys()), sorted(loaded.datasets.iterkeys()))
+
+        for dataset in inventory.datasets.itervalues():
+            other = loaded.datasets[dataset.name]
+            self.assertEqual(dataset, other)
+            self.assertEqual(dataset.software_version, other.software_version)
+            self.assertEqual(sorted(b.full_name() for b in dataset.blocks), sorted(b.full_name() for b in other.blocks))
+
+            for block in dataset.blocks:
+                other_block = other.find_block(block.name, must_find = True)
+                self.assertEqual(block, other_block)
+                self.assertEqual(len(block.replicas), len(other_block.replicas))
+
+            self.assertEqual(len(dataset.replicas), len(other.replicas))
+            for replica in dataset.replicas:
+                other_replica = other.find_replica(replica.site.name)
+                self.assertEqual(replica, other_replica)
+                self.assertIs(other_replica.site, loaded.sites[replica.site.name])
+                self.assertIn(other_replica, other_replica.site.dataset_replicas())
+
+                self.assertEqual(len(replica.block_replicas), len(other_replica.block_replicas))
+                for block_replica in replica.block_replicas:
+                    other_block_replica = other_replica.find_block_replica(block_replica.block.name)
+                    self.assertEqual(block_replica, other_block_replica)
+                    self.assertEqual(block_replica.is_complete(), other_block_replica.is_complete())
+
+    def test_identical(self):
+        for seed in range(3):
+            inventory = make_inventory(seed)
+            loaded, id_group_map, id_site_map = copy_base(inventory)
+
+            num_shards = 3
+            load_shards(num_shards, lambda index, writer: write_records(inventory, (index, num_shards), writer),
+                        lambda chunks: assemble_shard(loaded, chunks, id_group_map, id_site_map))
+
+            self.check_identical(inventory, loaded)
+
+    def test_small_chunks(self):
+        inventory = make_inventory(10, num_datasets = 30)
+        loaded, id_group_map, id_site_map = copy_base(inventory)
+
+        def write_shard(index, writer):
+            writer.chunk_size = 2
+            write_records(inventory, (index, 2), writer)
+
+        load_shards(2, write_shard, lambda chunks: assemble_shard(loaded, chunks, id_group_map, id_site_map))
+
+        self.check_identical(inventory, loaded)
+
+    def test_failure(self):
+        def write_shard(index, writer):
+            if index == 1:
+                raise ValueError('broken shard')
+
+        with self.assertRaises(RuntimeError):
+            load_shards(2, write_shard, lambda chunks: list(chunks))
+
+if __name__ == '__main__':
+    unittest.main()
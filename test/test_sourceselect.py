@@ -0,0 +1,296 @@
+#! /usr/bin/env python
+
+# Source selection policies of RLFSM in a discrete-event simulation of the transfer system: source sites have an
+# aggregate bandwidth shared by their active transfers, links have a per-transfer rate and a failure probability,
+# and the file operations manager runs a cycle every 30 seconds in which pending subscriptions get a source and
+# start (up to a maximum number in flight). Run with the argument "benchmark" to compare the policies on
+# throughput and completion times.
+
+import sys
+import random
+import unittest
+
+from dynamo.dataformat import Configuration
+from dynamo.fileop.impl.randomsource import RandomSourceSelector
+from dynamo.fileop.impl.costsource import CostSourceSelector, LinkStats
+
+class SimSite(object):
+    def __init__(self, name, bandwidth = 0.):
+        self.name = name
+        # aggregate bytes/s of all transfers from the site
+        self.bandwidth = bandwidth
+        self.active = []
+
+    def __repr__(self):
+        return self.name
+
+class SimFile(object):
+    def __init__(self, lfn, size):
+        self.lfn = lfn
+        self.size = size
+
+class SimSubscription(object):
+    def __init__(self, sid, lfile, destination, disk_sources):
+        self.id = sid
+        self.file = lfile
+        self.destination = destination
+        self.disk_sources = disk_sources
+        self.failed_sources = None
+
+class SimTransfer(object):
+    def __init__(self, subscription, source, rate, fails, now):
+        self.subscription = subscription
+        self.source = source
+        self.link_rate = rate
+        self.fails = fails
+        self.remaining = float(subscription.file.size)
+        self.started = now
+        self.rate = 0.
+
+
+class TransferSystem(object):
+    """
+    Discrete-event simulation. Events are the cycles of the file operations manager and the completions of
+    transfers; between events, every active transfer moves at min(link rate, source bandwidth / active transfers
+    of the source), and the next completion is computed again after each event.
+    """
+
+    cycle_interval = 30.
+
+    def __init__(self, sources, links, subscriptions, max_inflight):
+        """
+        @param sources        List of SimSite
+        @param links          {(source_name, destination_name): (bytes/s per transfer, failure probability)}
+        @param subscriptions  List of SimSubscription
+        @param max_inflight   Maximum number of transfers in flight
+        """
+        self.sources = sources
+        self.links = links
+        self.pending = list(subscriptions)
+        self.max_inflight = max_inflight
+
+        self.now = 0.
+        self.active = []
+        # [(created, source_name, destination_name, success, size, duration)]
+        self.history = []
+        # {subscription id: completion time}
+        self.completed = {}
+        self.num_failures = 0
+        self.random = random.Random(1)
+
+    # interfaces used by SimCostSourceSelector
+    def link_stats(self, window):
+        stats = {}
+        for created, source_name, dest_name, success, size, duration in self.history:
+            if created < self.now - window:
+                continue
+            try:
+                link = stats[(source_name, dest_name)]
+            except KeyError:
+                link = stats[(source_name, dest_name)] = LinkStats()
+
+            if success:
+                link.num_done += 1
+                link.bytes += size
+                link.seconds += duration
+            else:
+                link.num_failed += 1
+
+        return stats
+
+    def inflight(self):
+        inflight = {}
+        for transfer in self.active:
+            inflight[transfer.source.name] = inflight.get(transfer.source.name, 0) + transfer.subscription.file.size
+        return inflight
+
+    def run(self, selector):
+        next_cycle = 0.
+
+        while len(self.pending) + len(self.active) != 0:
+            # rates for the current set of active transfers
+            for source in self.sources:
+                if len(source.active) != 0:
+                    share = source.bandwidth / len(source.active)
+                    for transfer in source.active:
+                        transfer.rate = min(transfer.link_rate, share)
+
+            next_completion = None
+            for transfer in self.active:
+                end = self.now + transfer.remaining / transfer.rate
+                if next_completion is None or end < next_completion[0]:
+                    next_completion = (end, transfer)
+
+            if next_completion is None or next_cycle <= next_completion[0]:
+                self._advance(next_cycle)
+                self._cycle(selector)
+                next_cycle += TransferSystem.cycle_interval
+            else:
+                self._advance(next_completion[0])
+                self._finish(next_completion[1])
+
+        return self.completed
+
+    def _advance(self, time):
+        for transfer in self.active:
+            transfer.remaining -= transfer.rate * (time - self.now)
+        self.now = time
+
+    def _cycle(self, selector):
+        if len(self.active) >= self.max_inflight or len(self.pending) == 0:
+            return
+
+        selector.start_cycle(self, self)
+
+        num_start = self.max_inflight - len(self.active)
+        to_start = self.pending[:num_start]
+        self.pending = self.pending[num_start:]
+
+        for subscription in to_start:
+            source = selector.select(subscription, list(subscription.disk_sources))
+            rate, failure_prob = self.links[(source.name, subscription.destination.name)]
+            transfer = SimTransfer(subscription, source, rate, self.random.random() < failure_prob, self.now)
+            self.active.append(transfer)
+            source.active.append(transfer)
+
+    def _finish(self, transfer):
+        self.active.remove(transfer)
+        transfer.source.active.remove(transfer)
+
+        subscription = transfer.subscription
+        self.history.append((transfer.started, transfer.source.name, subscription.destination.name, not transfer.fails, subscription.file.size, self.now - transfer.started))
+
+        if transfer.fails:
+            self.num_failures += 1
+            if subscription.failed_sources is None:
+                subscription.failed_sources = {}
+            subscription.failed_sources.setdefault(transfer.source, []).append(110)
+            self.pending.append(subscription)
+        else:
+            self.completed[subscription.id] = self.now
+
+
+class SimCostSourceSelector(CostSourceSelector):
+    """
+    CostSourceSelector reading the statistics from the simulation instead of the DBs.
+    """
+
+    def _query_history(self, history_db): #override
+        return history_db.link_stats(self.history_window)
+
+    def _query_inflight(self, db): #override
+        return db.inflight()
+
+
+def make_system(num_files, max_inflight = 300):
+    """
+    Five source sites and two destinations. T1_A holds every file and is slow overall; T2_B is fast with few
+    files; T2_C has a bad link to T2_Y.
+    """
+    rnd = random.Random(2)
+
+    sources = [
+        SimSite('T1_A', 3.e+8),
+        SimSite('T2_B', 1.e+9),
+        SimSite('T2_C', 5.e+8),
+        SimSite('T2_D', 2.e+8),
+        SimSite('T2_E', 4.e+8)
+    ]
+    destinations = [SimSite('T2_X'), SimSite('T2_Y')]
+
+    links = {}
+    for source in sources:
+        for dest in destinations:
+            links[(source.name, dest.name)] = (rnd.choice([5.e+6, 1.e+7, 2.e+7, 4.e+7]), 0.02)
+
+    links[('T2_C', 'T2_Y')] = (2.e+7, 0.5)
+
+    subscriptions = []
+    for ifile in xrange(num_files):
+        lfile = SimFile('/store/sim/%d.root' % ifile, int(rnd.uniform(1.e+9, 4.e+9)))
+        holders = [sources[0]] + [s for s in sources[1:] if rnd.random() < (0.2 if s.name == 'T2_B' else 0.5)]
+        subscriptions.append(SimSubscription(ifile, lfile, rnd.choice(destinations), holders))
+
+    return TransferSystem(sources, links, subscriptions, max_inflight)
+
+def make_cost_selector(**kwd):
+    return SimCostSourceSelector(Configuration(kwd))
+
+
+class TestSourceSelectors(unittest.TestCase):
+    def setUp(self):
+        self.sites = [SimSite('T2_A'), SimSite('T2_B'), SimSite('T2_C')]
+        self.dest = SimSite('T2_X')
+
+    def make_subscription(self, size = 2000000000):
+        return SimSubscription(0, SimFile('/store/a.root', size), self.dest, self.sites)
+
+    def test_random_retry(self):
+        selector = RandomSourceSelector(Configuration())
+        subscription = self.make_subscription()
+        subscription.failed_sources = {self.sites[0]: [110, 110], self.sites[1]: [110]}
+
+        # all tried -> least failures
+        self.assertIs(selector.select(subscription, self.sites[:2]), self.sites[1])
+        # some not tried -> random among the candidates
+        self.assertIn(selector.select(subscription, self.sites), self.sites)
+
+    def test_cost_history(self):
+        system = TransferSystem([], {}, [], 0)
+        system.now = 1000.
+        # T2_B -> T2_X fast, T2_C -> T2_X failing
+        for i in range(20):
+            system.history.append((900., 'T2_A', 'T2_X', True, 1.e+9, 100.))
+            system.history.append((900., 'T2_B', 'T2_X', True, 1.e+9, 20.))
+            system.history.append((900., 'T2_C', 'T2_X', i % 2 == 0, 1.e+9, 10.))
+
+        selector = make_cost_selector()
+        selector.start_cycle(system, system)
+        self.assertIs(selector.select(self.make_subscription(), self.sites), self.sites[1])
+
+        # failures of the subscription from the source count against it
+        subscription = self.make_subscription()
+        subscription.failed_sources = {self.sites[1]: [110, 110, 110, 110, 110, 110]}
+        self.assertIsNot(selector.select(subscription, self.sites), self.sites[1])
+
+    def test_cost_load(self):
+        system = TransferSystem([], {}, [], 0)
+        selector = make_cost_selector()
+        selector.start_cycle(system, system)
+
+        # without history, selections spread over the sources as their load grows
+        counts = dict((site.name, 0) for site in self.sites)
+        for _ in range(300):
+            counts[selector.select(self.make_subscription(), self.sites).name] += 1
+
+        self.assertGreater(min(counts.values()), 80)
+
+    def test_simulation(self):
+        results = {}
+        for name, selector in [('random', RandomSourceSelector(Configuration())), ('cost', make_cost_selector())]:
+            system = make_system(600, max_inflight = 100)
+            system.run(selector)
+            self.assertEqual(len(system.completed), 600)
+            results[name] = max(system.completed.values())
+
+        self.assertLess(results['cost'], results['random'])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        num_files = 5000
+        for name, make_selector in [('random', lambda: RandomSourceSelector(Configuration())), ('cost', make_cost_selector)]:
+            system = make_system(num_files)
+            system.run(make_selector())
+
+            times = sorted(system.completed.values())
+            total_bytes = sum(sub.file.size for sub in system.pending) + sum(size for _, _, _, success, size, _ in system.history if success)
+            by_source = {}
+            for _, source_name, _, success, _, _ in system.history:
+                by_source[source_name] = by_source.get(source_name, 0) + 1
+
+            print '%-6s  makespan %6.0f s  throughput %5.2f GB/s  completion mean %6.0f s  median %6.0f s  failures %4d  transfers by source %s' % \
+                (name, times[-1], total_bytes / times[-1] * 1.e-9, sum(times) / len(times), times[len(times) / 2], system.num_failures,
+                ' '.join('%s:%d' % item for item in sorted(by_source.items())))
+    else:
+        unittest.main()
@@ -0,0 +1,298 @@
+#! /usr/bin/env python
+
+# SubscriptionIndex with the MySQL interface replaced by an in-memory file_subscriptions table.
+# Run with the argument "benchmark" to populate a scratch database on the local MySQL server (parameters from
+# /etc/dynamo/server_config.json) with 1M pending subscriptions and compare the DB side of one get_subscriptions
+# cycle: the full scan with one tried-sites query per retry subscription, against the index sync and the grouped
+# tried-sites query.
+
+import sys
+import time
+import random
+import unittest
+
+from dynamo.fileop.subscriptions import SubscriptionIndex
+from dynamo.fileop.rlfsm import RLFSM
+from dynamo.dataformat import Site, File
+from dynamo.utils.interface.mysql import MySQL
+
+class MemorySubscriptionDB(object):
+    """
+    Stand-in for the MySQL interface answering the queries of SubscriptionIndex. Rows are
+    {id: [status, delete, block_id, file_name, site_name, last_update]}. Subscriptions in deleted_files have no
+    matching row in the files table.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.deleted_files = set()
+        self.now = 1000
+        self.num_full = 0
+        self.num_incremental = 0
+
+    def add(self, sub_id, status, delete, block_id, site_name):
+        self.rows[sub_id] = [status, delete, block_id, '/store/%d/%d' % (block_id, sub_id), site_name, self.now]
+
+    def set_status(self, sub_id, status):
+        self.rows[sub_id][0] = status
+        self.rows[sub_id][5] = self.now
+
+    def query(self, sql, *args):
+        if sql == 'SELECT UNIX_TIMESTAMP()':
+            return [self.now]
+        elif sql.startswith('SELECT COUNT(*)'):
+            if 'JOIN `files`' in sql:
+                sub_ids = set(self.rows.iterkeys()) - self.deleted_files
+            else:
+                sub_ids = self.rows.iterkeys()
+
+            return [sum(1 for sub_id in sub_ids if self.rows[sub_id][0] in SubscriptionIndex.statuses)]
+
+        raise NotImplementedError(sql)
+
+    def xquery(self, sql, *args):
+        if 'u.`last_update` >= ' in sql:
+            self.num_incremental += 1
+            match = lambda row: row[5] >= args[0]
+        elif 'u.`status` IN ' in sql:
+            self.num_full += 1
+            match = lambda row: row[0] in SubscriptionIndex.statuses
+        else:
+            raise NotImplementedError(sql)
+
+        for sub_id, row in sorted(self.rows.iteritems()):
+            if sub_id in self.deleted_files:
+                continue
+
+            if match(row):
+                status, delete, block_id, file_name, site_name, last_update = row
+                yield (sub_id, status, delete, block_id, file_name, site_name, None, last_update)
+
+
+def get_ids(index, delete, statuses = SubscriptionIndex.statuses):
+    return [row[0] for row in index.get(delete, statuses)]
+
+
+class TestSubscriptionIndex(unittest.TestCase):
+    def setUp(self):
+        self.db = MemorySubscriptionDB()
+        self.db.add(1, 'new', 0, 20, 'T2_B')
+        self.db.add(2, 'new', 0, 10, 'T2_B')
+        self.db.add(3, 'new', 0, 20, 'T2_A')
+        self.db.add(4, 'retry', 0, 10, 'T2_B')
+        self.db.add(5, 'new', 1, 10, 'T2_A')
+        self.db.add(6, 'inbatch', 0, 10, 'T2_A')
+
+    def test_groups(self):
+        index = SubscriptionIndex()
+        index.sync(self.db)
+
+        self.assertEqual(len(index), 5)
+        # grouped by status, destination, and block
+        self.assertEqual(get_ids(index, 0), [3, 2, 1, 4])
+        self.assertEqual(get_ids(index, 0, ['retry']), [4])
+        self.assertEqual(get_ids(index, 1), [5])
+
+    def test_incremental(self):
+        index = SubscriptionIndex()
+        index.sync(self.db)
+
+        self.db.now += 30
+        self.db.set_status(2, 'inbatch')
+        self.db.set_status(6, 'retry')
+        self.db.add(7, 'new', 0, 30, 'T2_A')
+
+        index.sync(self.db)
+
+        self.assertEqual(get_ids(index, 0), [3, 7, 1, 6, 4])
+        self.assertEqual((self.db.num_full, self.db.num_incremental), (1, 1))
+
+    def test_deleted_rows(self):
+        index = SubscriptionIndex()
+        index.sync(self.db)
+
+        # rows deleted without a status change are found by the count check
+        self.db.now += 30
+        self.db.rows.pop(1)
+        index.sync(self.db)
+
+        self.assertEqual(get_ids(index, 0), [3, 2, 4])
+        self.assertEqual(self.db.num_full, 2)
+
+    def test_deleted_files(self):
+        # subscription rows whose file is gone are not indexed and must not trigger a reload every cycle
+        self.db.deleted_files.add(2)
+
+        index = SubscriptionIndex()
+        index.sync(self.db)
+        self.assertEqual(get_ids(index, 0), [3, 1, 4])
+
+        for _ in range(3):
+            self.db.now += 30
+            index.sync(self.db)
+
+        self.assertEqual((self.db.num_full, self.db.num_incremental), (1, 3))
+
+    def test_subscribe_clock(self):
+        # last_update of new subscriptions is set by the DB clock, which the incremental sync compares against
+        queries = []
+
+        rlfsm = RLFSM.__new__(RLFSM)
+        rlfsm._read_only = False
+        rlfsm.db = MySQL({'host': 'localhost', 'db': 'dynamo', 'user': 'dynamo'})
+        rlfsm.db.query = lambda sql, *args, **kwd: queries.append((sql, args))
+        rlfsm.db.lock_tables = lambda **kwd: None
+        rlfsm.db.unlock_tables = lambda: None
+
+        site = Site('T2_A', sid = 1)
+        lfile = File('/store/a.root', size = 1, fid = 2)
+        rlfsm._subscribe(site, lfile, 0)
+
+        sql, args = queries[-1]
+        self.assertTrue(sql.startswith('INSERT INTO `file_subscriptions`'))
+        self.assertIn('VALUES (%s, %s, %s, %s, %s, NOW())', sql)
+        self.assertEqual(args[:4], (2, 1, 'new', 0))
+
+    def test_retry_delay(self):
+        index = SubscriptionIndex(retry_delay = 600)
+        index.sync(self.db)
+
+        self.assertEqual(get_ids(index, 0, ['retry']), [])
+
+        self.db.now += 300
+        self.db.set_status(1, 'retry')
+        index.sync(self.db)
+        self.assertEqual(get_ids(index, 0, ['retry']), [])
+
+        self.db.now += 300
+        index.sync(self.db)
+        self.assertEqual(get_ids(index, 0, ['retry']), [4])
+
+        self.db.now += 300
+        index.sync(self.db)
+        self.assertEqual(get_ids(index, 0, ['retry']), [4, 1])
+
+    def test_discard(self):
+        index = SubscriptionIndex()
+        index.sync(self.db)
+
+        # rows can be discarded while iterating
+        ids = []
+        for row in index.get(0, ['new']):
+            ids.append(row[0])
+            index.discard([row[0]])
+
+        self.assertEqual(ids, [3, 2, 1])
+        self.assertEqual(get_ids(index, 0), [4])
+        self.assertEqual(len(index), 2)
+
+
+## Benchmark on a live MySQL server
+
+def populate(db, num_subscriptions, retry_fraction = 0.1, files_per_block = 100, num_sites = 50):
+    """
+    Generate sites, files, and pending subscriptions with failed transfers of the retry subscriptions.
+    """
+    for table, columns in [
+            ('sites', '`id` int(11) unsigned NOT NULL AUTO_INCREMENT, `name` varchar(32) NOT NULL, PRIMARY KEY (`id`)'),
+            ('files', '`id` bigint(20) unsigned NOT NULL AUTO_INCREMENT, `block_id` bigint(20) unsigned NOT NULL, `name` varchar(512) NOT NULL, PRIMARY KEY (`id`), KEY `block` (`block_id`)'),
+            ('failed_transfers', '`id` bigint(20) unsigned NOT NULL, `subscription_id` int(10) unsigned NOT NULL, `source_id` int(11) unsigned NOT NULL, `exitcode` smallint(5) DEFAULT NULL, PRIMARY KEY (`id`), KEY `transfer` (`subscription_id`,`source_id`)')]:
+        db.query('DROP TABLE IF EXISTS `%s`' % table)
+        db.query('CREATE TABLE `%s` (%s) ENGINE=MyISAM DEFAULT CHARSET=latin1' % (table, columns))
+
+    db.query('DROP TABLE IF EXISTS `file_subscriptions`')
+    with open(sys.path[0] + '/../mysql/schema/dynamo/file_subscriptions.sql') as source:
+        db.query(source.read())
+
+    db.insert_many('sites', ('id', 'name'), None, [(i + 1, 'T2_SITE_%d' % i) for i in xrange(num_sites)])
+    db.insert_many('files', ('id', 'block_id', 'name'), None,
+        ((i + 1, i / files_per_block, '/store/data/Run2018A/Bench/AOD/v1/%08d/%d.root' % (i / files_per_block, i)) for i in xrange(num_subscriptions)))
+
+    now = time.strftime('%Y-%m-%d %H:%M:%S')
+    random.seed(1)
+
+    def subscriptions():
+        for i in xrange(num_subscriptions):
+            status = 'retry' if random.random() < retry_fraction else 'new'
+            yield (i + 1, i + 1, (i / files_per_block) % num_sites + 1, status, 0, now, now)
+
+    db.insert_many('file_subscriptions', ('id', 'file_id', 'site_id', 'status', 'delete', 'created', 'last_update'), None, subscriptions())
+
+    sql = 'INSERT INTO `failed_transfers` SELECT `id` * 4 + s.`n`, `id`, (`site_id` + s.`n`) %% %d + 1, 110 FROM `file_subscriptions`' % num_sites
+    sql += ' INNER JOIN (SELECT 1 AS n UNION SELECT 2) AS s WHERE `status` = \'retry\''
+    db.query(sql)
+
+def scan_cycle(db):
+    # DB side of get_subscriptions before the index
+    get_all = 'SELECT u.`id`, u.`status`, u.`delete`, f.`block_id`, f.`name`, s.`name`, u.`hold_reason` FROM `file_subscriptions` AS u'
+    get_all += ' INNER JOIN `files` AS f ON f.`id` = u.`file_id`'
+    get_all += ' INNER JOIN `sites` AS s ON s.`id` = u.`site_id`'
+    get_all += ' WHERE u.`delete` = 0 AND u.`status` IN (\'new\', \'retry\') ORDER BY s.`id`, f.`block_id`'
+
+    get_tried_sites = 'SELECT s.`name`, f.`exitcode` FROM `failed_transfers` AS f'
+    get_tried_sites += ' INNER JOIN `sites` AS s ON s.`id` = f.`source_id`'
+    get_tried_sites += ' WHERE f.`subscription_id` = %s'
+
+    num_queries = 1
+    for row in db.query(get_all):
+        if row[1] == 'retry':
+            db.query(get_tried_sites, row[0])
+            num_queries += 1
+
+    return num_queries
+
+def index_cycle(db, index):
+    index.sync(db)
+    rows = list(index.get(0, ['new', 'retry']))
+
+    get_tried_sites = 'SELECT f.`subscription_id`, s.`name`, f.`exitcode` FROM `failed_transfers` AS f'
+    get_tried_sites += ' INNER JOIN `sites` AS s ON s.`id` = f.`source_id`'
+    get_tried_sites += ' INNER JOIN `file_subscriptions` AS u ON u.`id` = f.`subscription_id`'
+    get_tried_sites += ' WHERE u.`status` = \'retry\' AND u.`delete` = 0'
+    get_tried_sites += ' ORDER BY f.`subscription_id`, f.`id`'
+    tried_sites = {}
+    for sub_id, source_name, exitcode in db.xquery(get_tried_sites):
+        tried_sites.setdefault(sub_id, []).append((source_name, exitcode))
+
+    return len(rows)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        from dynamo import dataformat
+        from dynamo.utils.interface.mysql import MySQL
+
+        num_subscriptions = 1000000
+
+        CONF = dataformat.Configuration('/etc/dynamo/server_config.json')
+        db_params = dict(CONF.inventory.persistency.config.db_params)
+        db_params.pop('db', None)
+        db = MySQL(db_params)
+        db.query('CREATE DATABASE IF NOT EXISTS `dynamo_subscription_bench`')
+        db_params['db'] = 'dynamo_subscription_bench'
+        db = MySQL(db_params)
+
+        start = time.time()
+        populate(db, num_subscriptions)
+        print 'Generated %d subscriptions in %.1f s' % (num_subscriptions, time.time() - start)
+
+        start = time.time()
+        num_queries = scan_cycle(db)
+        print 'scan         %6.1f s  %d queries' % (time.time() - start, num_queries)
+
+        index = SubscriptionIndex()
+        start = time.time()
+        num_rows = index_cycle(db, index)
+        print 'index load   %6.1f s  %d rows' % (time.time() - start, num_rows)
+
+        # next cycle: 1000 subscriptions went into batches, 1000 new ones
+        time.sleep(1)
+        db.query('UPDATE `file_subscriptions` SET `status` = \'inbatch\', `last_update` = NOW() WHERE `id` <= 1000')
+        db.query('UPDATE `file_subscriptions` SET `status` = \'new\', `last_update` = NOW() WHERE `id` <= 2000 AND `id` > 1000')
+
+        start = time.time()
+        num_rows = index_cycle(db, index)
+        print 'index cycle  %6.1f s  %d rows' % (time.time() - start, num_rows)
+
+        db.query('DROP DATABASE `dynamo_subscription_bench`')
+    else:
+        unittest.main()
@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+
+import os
+import time
+import Queue
+import multiprocessing
+import unittest
+
+from dynamo.dataformat import Configuration
+from dynamo.core.components.updatechannel import UpdateChannel, SharedRingBuffer
+
+EOM = -1
+
+def make_commands(num):
+    return [(i % 2, 'BlockReplica(%s)' % ('x' * (i % 300))) for i in xrange(num)]
+
+class TestUpdateChannel(unittest.TestCase):
+    def transfer(self, channel, commands):
+        proc = multiprocessing.Process(target = channel.send, args = (commands, EOM))
+        proc.start()
+
+        received = []
+        while True:
+            try:
+                for chunk in channel.receive(EOM, block = False, timeout = 10):
+                    received.extend(chunk)
+                break
+            except Queue.Empty:
+                self.assertEqual(len(received), 0)
+                time.sleep(0.01)
+
+        proc.join()
+        self.assertEqual(proc.exitcode, 0)
+
+        return received
+
+    def test_chunks(self):
+        channel = UpdateChannel(Configuration(chunk_size = 7, max_queued_chunks = 2))
+        for num in [0, 1, 7, 50]:
+            commands = make_commands(num)
+            self.assertEqual(self.transfer(channel, commands), commands + [(EOM, None)])
+
+    def test_ring(self):
+        channel = UpdateChannel(Configuration(chunk_size = 50, ring_buffer_size = 0.01, ring_slot_size = 1024, ring_threshold = 100))
+        for num in [10, 100, 3000]:
+            commands = make_commands(num)
+            self.assertEqual(self.transfer(channel, commands), commands + [(EOM, None)])
+
+    def test_sender_dies(self):
+        channel = UpdateChannel(Configuration(chunk_size = 10, ring_buffer_size = 0.01, ring_slot_size = 256, ring_threshold = 1))
+
+        def send_partial():
+            # marker and a message larger than the ring - blocks with the ring full
+            channel._queue.put(UpdateChannel.RING_MARKER)
+            channel._ring.put('x' * 20000)
+
+        proc = multiprocessing.Process(target = send_partial)
+        proc.start()
+        time.sleep(1)
+        proc.terminate()
+        proc.join()
+
+        with self.assertRaises(Queue.Empty):
+            for chunk in channel.receive(EOM, block = True, timeout = 1):
+                pass
+
+        # the channel is usable again
+        commands = make_commands(20)
+        self.assertEqual(self.transfer(channel, commands), commands + [(EOM, None)])
+
+class TestSharedRingBuffer(unittest.TestCase):
+    def test_wraparound(self):
+        ring = SharedRingBuffer(4, 64)
+        for size in [0, 10, 59, 60, 200, 500]:
+            data = os.urandom(size)
+            proc = multiprocessing.Process(target = ring.put, args = (data,))
+            proc.start()
+            self.assertEqual(ring.get(timeout = 5), data)
+            proc.join()
+
+        self.assertIsNone(ring.get(timeout = 0.1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+#! /usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from dynamo import dataformat
+from dynamo.core.inventory import ObjectRepository
+from dynamo.core.components.persistency import InventoryStore
+from dynamo.core.components.writebehind import WriteBehindQueue
+
+class FileStore(InventoryStore):
+    """
+    Minimal store keeping site names in a text file, so that writes survive the writer process.
+    Calls os._exit after crash_after writes to simulate a crash.
+    """
+
+    def __init__(self, path, crash_after = -1):
+        InventoryStore.__init__(self, None)
+        self.path = path
+        self.crash_after = crash_after
+        self.num_writes = 0
+
+    def sites(self):
+        if not os.path.exists(self.path):
+            return set()
+
+        with open(self.path) as source:
+            return set(line.strip() for line in source)
+
+    def _write(self, names):
+        if self.num_writes == self.crash_after:
+            os._exit(1)
+
+        self.num_writes += 1
+
+        with open(self.path, 'w') as out:
+            for name in sorted(names):
+                out.write(name + '\n')
+
+    def save_site(self, site):
+        self._write(self.sites() | set([site.name]))
+
+    def delete_site(self, site):
+        self._write(self.sites() - set([site.name]))
+
+
+class TestWriteBehind(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.store_path = self.workdir + '/store'
+        self.config = dataformat.Configuration(journal_path = self.workdir + '/journal', max_pending = 100, max_delay = 1000.)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_coalesce(self):
+        store = FileStore(self.store_path)
+        queue = WriteBehindQueue(store, self.config)
+
+        inventory = ObjectRepository()
+        for name in ['A', 'B', 'A', 'B', 'C']:
+            queue.update(inventory.update(dataformat.Site(name)))
+
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(store.sites(), set())
+
+        queue.flush()
+
+        self.assertEqual(store.num_writes, 3)
+        self.assertEqual(store.sites(), set(['A', 'B', 'C']))
+        self.assertFalse(os.path.exists(self.config.journal_path))
+
+    def test_update_after_delete(self):
+        store = FileStore(self.store_path)
+        queue = WriteBehindQueue(store, self.config)
+
+        inventory = ObjectRepository()
+        site = inventory.update(dataformat.Site('A'))
+        queue.update(site)
+        queue.delete(inventory.delete(site))
+        # update after delete forces the deletion to be flushed
+        queue.update(inventory.update(dataformat.Site('A')))
+        queue.flush()
+
+        self.assertEqual(store.sites(), set(['A']))
+
+    def test_crash_recovery(self):
+        pid = os.fork()
+        if pid == 0:
+            # writer process: dies after writing one of the three sites
+            store = FileStore(self.store_path, crash_after = 1)
+            queue = WriteBehindQueue(store, self.config)
+            inventory = ObjectRepository()
+            for name in ['A', 'B', 'C']:
+                queue.update(inventory.update(dataformat.Site(name)))
+
+            queue.flush()
+            os._exit(0)
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 1)
+
+        store = FileStore(self.store_path)
+        self.assertEqual(len(store.sites()), 1)
+        self.assertTrue(os.path.exists(self.config.journal_path))
+
+        # "Load" the inventory from the store and replay
+        inventory = ObjectRepository()
+        for name in store.sites():
+            inventory.update(dataformat.Site(name))
+
+        queue = WriteBehindQueue(store, self.config)
+        self.assertEqual(queue.recover(inventory), 3)
+
+        self.assertEqual(store.sites(), set(['A', 'B', 'C']))
+        self.assertFalse(os.path.exists(self.config.journal_path))
+
+        # nothing to replay the second time
+        self.assertEqual(queue.recover(inventory), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,6 +14,8 @@ from argparse import ArgumentParser
 
 parser = ArgumentParser(description = 'Parse configuration files')
 parser.add_argument('source', metavar = 'HOST', help = 'Source host to copy the inventory from.')
+parser.add_argument('--incremental', '-i', action = 'store_true', dest = 'incremental', help = 'Only copy the table ranges that differ.')
+parser.add_argument('--verify', '-V', action = 'store_true', dest = 'verify', help = 'Compare the store versions (table checksums) after cloning.')
 
 args = parser.parse_args()
 sys.argv = []
@@ -53,6 +55,15 @@ remote = InventoryStore.get_instance(config.inventory.persistency.module, remote
 
 LOG.info('Cloning inventory store from %s', args.source)
 
-local.clone_from(remote)
+local.clone_from(remote, incremental = args.incremental)
+
+if args.verify:
+    local_version = local.version()
+    remote_version = remote.version()
+    if local_version != remote_version:
+        LOG.error('Store version mismatch after cloning: %s (local) != %s (source)', local_version, remote_version)
+        sys.exit(1)
+
+    LOG.info('Store version %s verified.', local_version)
 
 LOG.info('Done.')
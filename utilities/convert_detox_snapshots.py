@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+#######################################################################
+## Convert archived Detox snapshots (xz-compressed SQLite3 files) to
+## the block-compressed random-access format read by DetoxHistoryBase.
+## With --benchmark SITE, compare the latency of a single-site query
+## on the two formats instead.
+#######################################################################
+
+import os
+import sys
+import re
+import time
+import sqlite3
+import tempfile
+import lzma
+import logging
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description = 'Convert Detox snapshots')
+parser.add_argument('--cycle', '-c', metavar = 'ID', dest = 'cycles', nargs = '+', type = int, help = 'Cycle numbers. Default is all archived cycles.')
+parser.add_argument('--overwrite', '-f', action = 'store_true', dest = 'overwrite', help = 'Overwrite existing archives.')
+parser.add_argument('--chunk-size', '-s', metavar = 'N', dest = 'chunk_size', type = int, default = 4096, help = 'Number of replicas per compressed chunk.')
+parser.add_argument('--benchmark', '-b', metavar = 'SITE_ID', dest = 'benchmark', type = int, help = 'Time the query of decisions at one site (by site id) in both formats.')
+
+args = parser.parse_args()
+sys.argv = []
+
+logging.basicConfig(level = logging.INFO)
+LOG = logging.getLogger()
+
+from dynamo.detox.history import DetoxHistoryBase
+from dynamo.detox.snapshot import DetoxSnapshotArchive
+
+history = DetoxHistoryBase()
+
+if args.cycles:
+    cycles = args.cycles
+else:
+    cycles = []
+    for dirpath, dirnames, filenames in os.walk(history.snapshots_archive_dir):
+        for fname in filenames:
+            matches = re.match('snapshot_([0-9]{9}).db.xz$', fname)
+            if matches:
+                cycles.append(int(matches.group(1)))
+
+    cycles.sort()
+
+def xz_path(cycle):
+    scycle = '%09d' % cycle
+    return '%s/%s/%s/snapshot_%09d.db.xz' % (history.snapshots_archive_dir, scycle[:3], scycle[3:6], cycle)
+
+def decompress(cycle):
+    db_file = tempfile.NamedTemporaryFile(suffix = '.db')
+    with open(xz_path(cycle), 'rb') as xz_file:
+        db_file.write(lzma.decompress(xz_file.read()))
+    db_file.flush()
+
+    return db_file
+
+if args.benchmark is not None:
+    for cycle in cycles:
+        archive_path = history.snapshot_archive_path(cycle)
+        if not os.path.exists(archive_path):
+            LOG.warning('Cycle %d is not converted.', cycle)
+            continue
+
+        # Old: decompress the full snapshot and query SQLite (lower bound of the old path, which also fills the MySQL cache)
+        start = time.time()
+        db_file = decompress(cycle)
+        snapshot_db = sqlite3.connect(db_file.name)
+        sql = 'SELECT r.`dataset_id`, r.`size`, d.`value`, r.`condition` FROM `replicas` AS r'
+        sql += ' INNER JOIN `decisions` AS d ON d.`id` = r.`decision_id` WHERE r.`site_id` = ?'
+        num_old = len(snapshot_db.execute(sql, (args.benchmark,)).fetchall())
+        snapshot_db.close()
+        db_file.close()
+        time_old = time.time() - start
+
+        start = time.time()
+        archive = DetoxSnapshotArchive(archive_path)
+        num_new = len(list(archive.replicas(site_ids = [args.benchmark])))
+        num_chunks = archive.num_chunks_read
+        archive.close()
+        time_new = time.time() - start
+
+        if num_old != num_new:
+            LOG.error('Cycle %d: %d replicas in SQLite, %d in archive', cycle, num_old, num_new)
+
+        print 'Cycle %d: %d replicas; xz+SQLite %.3f s, archive %.3f s (%d chunks read)' % (cycle, num_new, time_old, time_new, num_chunks)
+
+    sys.exit(0)
+
+for cycle in cycles:
+    archive_path = history.snapshot_archive_path(cycle)
+    if os.path.exists(archive_path) and not args.overwrite:
+        continue
+
+    if not os.path.exists(xz_path(cycle)):
+        LOG.error('Snapshot %s does not exist.', xz_path(cycle))
+        continue
+
+    LOG.info('Converting cycle %d', cycle)
+
+    db_file = decompress(cycle)
+    try:
+        DetoxSnapshotArchive.convert(db_file.name, archive_path, chunk_size = args.chunk_size)
+    finally:
+        db_file.close()
+
+    LOG.info('%s: %d -> %d bytes', archive_path, os.path.getsize(xz_path(cycle)), os.path.getsize(archive_path))
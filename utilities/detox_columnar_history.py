@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+#######################################################################
+## Fill the columnar Detox decision history from the existing cycle
+## snapshots, and benchmark it against the snapshot archives or the
+## MySQL snapshot cache.
+#######################################################################
+
+import sys
+import time
+import logging
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description = 'Columnar Detox decision history')
+parser.add_argument('--path', '-p', metavar = 'PATH', dest = 'path', help = 'Columnar store directory. Default is columnar_dir of the Detox history configuration.')
+parser.add_argument('--partition', '-g', metavar = 'NAME', dest = 'partition', default = 'AnalysisOps', help = 'Partition name.')
+parser.add_argument('--days', '-d', metavar = 'N', dest = 'days', type = int, default = 90, help = 'Use the cycles of the last N days.')
+parser.add_argument('--import', '-i', action = 'store_true', dest = 'do_import', help = 'Add the cycles to the columnar store.')
+parser.add_argument('--benchmark', '-b', metavar = 'SITE', dest = 'benchmark', help = 'Time a site trend query and a full decision query in both formats.')
+
+args = parser.parse_args()
+sys.argv = []
+
+logging.basicConfig(level = logging.INFO)
+LOG = logging.getLogger()
+
+from dynamo.detox.history import DetoxHistoryBase
+from dynamo.detox.columnar import ColumnarDecisionHistory
+
+history = DetoxHistoryBase()
+
+path = args.path if args.path else history.columnar_dir
+if path is None:
+    sys.stderr.write('Columnar store path is not given\n')
+    sys.exit(1)
+
+store = ColumnarDecisionHistory(path)
+
+sql = 'SELECT c.`id` FROM `deletion_cycles` AS c INNER JOIN `partitions` AS p ON p.`id` = c.`partition_id`'
+sql += ' WHERE p.`name` = %s AND c.`operation` = \'deletion\' AND c.`time_end` NOT LIKE \'0000-00-00 00:00:00\''
+sql += ' AND c.`time_start` > DATE_SUB(NOW(), INTERVAL %s DAY) ORDER BY c.`id`'
+cycles = history.db.query(sql, args.partition, args.days)
+
+LOG.info('%d cycles in the last %d days', len(cycles), args.days)
+
+# Read the existing formats only
+history.columnar_dir = None
+
+if args.do_import:
+    for cycle in cycles:
+        if store.has_cycle(cycle):
+            continue
+
+        LOG.info('Importing cycle %d', cycle)
+
+        decisions = history.get_deletion_decisions(cycle, size_only = False)
+
+        conditions = {}
+        def replica_entries():
+            for site_name, site_decisions in decisions.iteritems():
+                for dataset_name, size, decision, condition_id, reason in site_decisions:
+                    conditions[condition_id] = reason
+                    yield (site_name, dataset_name, size, decision, condition_id)
+
+        store.append_cycle(cycle, args.partition, replica_entries(), conditions)
+
+if args.benchmark:
+    stored_cycles = [c for c in cycles if store.has_cycle(c)]
+    if len(stored_cycles) != len(cycles):
+        LOG.warning('%d cycles are not in the columnar store', len(cycles) - len(stored_cycles))
+
+    start = time.time()
+    trend = store.site_trend(args.benchmark, stored_cycles)
+    time_columnar = time.time() - start
+
+    start = time.time()
+    for cycle in stored_cycles:
+        history.get_deletion_decisions(cycle, size_only = True).get(args.benchmark)
+    time_cache = time.time() - start
+
+    print 'Site trend over %d cycles: columnar %.2f s, snapshot archive or MySQL cache %.2f s' % (len(stored_cycles), time_columnar, time_cache)
+
+    if len(stored_cycles) != 0:
+        latest = stored_cycles[-1]
+
+        start = time.time()
+        store.deletion_decisions(latest, size_only = False)
+        time_columnar = time.time() - start
+
+        start = time.time()
+        history.get_deletion_decisions(latest, size_only = False)
+        time_cache = time.time() - start
+
+        print 'All decisions of cycle %d: columnar %.2f s, snapshot archive or MySQL cache %.2f s' % (latest, time_columnar, time_cache)